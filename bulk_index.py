@@ -1,18 +1,18 @@
 """Use this to populate a search index for testing."""
 
+import asyncio
 import json
 import os
 import tempfile
 import click
-from itertools import islice, groupby
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
 import re
 from search.factory import create_ui_web_app
 from search.agent import MetadataRecordProcessor, DocumentFailed, \
     IndexingFailed
-from search.domain import asdict, DocMeta, Document
-from search.services import metadata, index
-from search.process import transform
+from search.domain import shallow_asdict, DocMeta, Document, Fulltext
+from search.services import aio, metadata, index
+from search.process import enrich, transform
 
 app = create_ui_web_app()
 
@@ -29,11 +29,24 @@ app = create_ui_web_app()
                    " preempt checking for new versions of papers that are"
                    " in the cache.")
 @click.option('--cache-dir', '-c', help="Specify the cache directory.")
+@click.option('--in-flight', '-n', type=int, default=0,
+              help="Retrieve metadata with asyncio, with up to this many"
+                   " requests at a time.")
+@click.option('--fulltext', '-f', is_flag=True,
+              help="Add fulltext to the documents, where it is available.")
 def populate(print_indexable: bool, paper_id: str, id_list: str,
-             load_cache: bool, cache_dir: str) -> None:
+             load_cache: bool, cache_dir: str, in_flight: int,
+             fulltext: bool) -> None:
     """Populate the search index with some test data."""
     cache_dir = init_cache(cache_dir)
+    # Metadata are cached by the metadata service.
+    app.config['METADATA_CACHE_DIR'] = cache_dir
+    app.config['FULLTEXT_CACHE_DIR'] = os.path.join(cache_dir, 'fulltext')
+    if load_cache:
+        app.config['METADATA_CACHE_MAX_AGE'] = 'inf'
+        app.config['FULLTEXT_CACHE_MAX_AGE'] = 'inf'
     index_count = 0
+    skip_count = 0
     if paper_id:    # Index a single paper.
         TO_INDEX = [paper_id]
     elif id_list:   # Index a list of papers.
@@ -42,62 +55,112 @@ def populate(print_indexable: bool, paper_id: str, id_list: str,
         TO_INDEX = load_id_sample()
     approx_size = len(TO_INDEX)
 
-    retrieve_chunk_size = 50
+    # The metadata service splits these into requests of a safe size, and
+    # the metadata are decoded as the responses are read.
+    retrieve_chunk_size = 1000
+    session = metadata.current_session()
+    cache = session.cache
+    retrieve: Callable[[List[str]], Iterable[DocMeta]] = \
+        session.iter_bulk_retrieve
+    client = None
+    if in_flight:
+        loop = asyncio.get_event_loop()
+        client = loop.run_until_complete(aio.connect(limit=in_flight))
+        async_session = metadata.get_async_session(app, client=client)
+        cache = async_session.cache
+
+        def bulk_retrieve_async(document_ids: List[str]) \
+                -> Iterator[DocMeta]:
+            try:
+                retrieved = loop.run_until_complete(
+                    async_session.bulk_retrieve(document_ids)
+                )
+            except metadata.MetadataError as e:
+                # Index what was retrieved, as the streaming session would.
+                yield from e.retrieved
+                raise
+            yield from retrieved
+        retrieve = bulk_retrieve_async
+        # Keep enough requests for all of the connections.
+        retrieve_chunk_size = max(retrieve_chunk_size, in_flight * 50)
     index_chunk_size = 250
+    max_attempts = 3
     chunk: List[str] = []
     meta: List[DocMeta] = []
     index.current_session().create_index()
+    enricher = enrich.get_enricher(app) if fulltext else None
+    fulltext_stats = enrich.FetchStats()
+
+    def index_meta() -> None:
+        nonlocal meta, index_count, skip_count
+        texts: Dict[str, Fulltext] = {}
+        if enricher is not None:
+            fetches = enricher.enrich(meta)
+            fulltext_stats.add(fetches)
+            texts = enrich.by_version(fetches)
+        # Transform to Document.
+        documents = transform.to_search_documents(meta, fulltext=texts)
+        meta = []
+        # Add to index, skipping documents that are unchanged.
+        sent = index.bulk_add_documents(documents, skip_unchanged=True)
+        skip_count += len(documents) - sent
+        if print_indexable:
+            for document in documents:
+                click.echo(json.dumps(shallow_asdict(document)))
+        index_count += len(documents)
+
+    def retrieve_and_index(document_ids: List[str]) -> None:
+        # Index papers on a different chunk cycle, as they are retrieved.
+        # If the connection is lost, the papers that failed are requested
+        # again; versions that were already queued for indexing are skipped.
+        queued: Set[Tuple[str, int]] = set()
+        for attempt in range(1, max_attempts + 1):
+            try:
+                for docmeta in retrieve(document_ids):
+                    key = (docmeta.paper_id, docmeta.version)
+                    if key in queued:
+                        continue
+                    queued.add(key)
+                    meta.append(docmeta)
+                    if len(meta) >= index_chunk_size:
+                        index_meta()
+                return
+            except metadata.ConnectionFailed as e:
+                if attempt == max_attempts:
+                    raise
+                document_ids = e.failed or document_ids
+
     try:
         with click.progressbar(length=approx_size,
                                label='Papers indexed') as index_bar:
             last = len(TO_INDEX) - 1
             for i, paper_id in enumerate(TO_INDEX):
-                this_meta = []
-                if load_cache:
-                    try:
-                        this_meta = from_cache(cache_dir, paper_id)
-                    except RuntimeError as e:    # No document.
-                        pass
-
-                if this_meta:
-                    meta += this_meta
-                else:
-                    chunk.append(paper_id)
-
+                chunk.append(paper_id)
                 if len(chunk) == retrieve_chunk_size or i == last:
-                    try:
-                        new_meta = metadata.bulk_retrieve(chunk)
-                    except metadata.ConnectionFailed as e:  # Try again.
-                        new_meta = metadata.bulk_retrieve(chunk)
-                    # Add metadata to the cache.
-                    key = lambda dm: dm.paper_id
-                    new_meta_srt = sorted(new_meta, key=key)
-                    for paper_id, grp in groupby(new_meta_srt, key):
-                        to_cache(cache_dir, paper_id, [dm for dm in grp])
-                    meta += new_meta
+                    retrieve_and_index(chunk)
                     chunk = []
-
-                # Index papers on a different chunk cycle, and at the very end.
-                if len(meta) >= index_chunk_size or i == last:
-                    # Transform to Document.
-                    documents = [
-                        transform.to_search_document(dm) for dm in meta
-                    ]
-                    # Add to index.
-                    index.bulk_add_documents(documents)
-
-                    if print_indexable:
-                        for document in documents:
-                            click.echo(json.dumps(asdict(document)))
-                    index_count += len(documents)
-                    meta = []
                     index_bar.update(i)
+            # ...and at the very end.
+            if meta:
+                index_meta()
 
     except Exception as e:
         raise RuntimeError('Populate failed: %s' % str(e)) from e
 
     finally:
-        click.echo(f"Indexed {index_count} documents in total")
+        if client is not None:
+            loop.run_until_complete(client.close())
+        click.echo(f"Indexed {index_count} documents in total"
+                   f" ({skip_count} unchanged documents were skipped)")
+        if cache is not None:
+            click.echo(f"Metadata cache: {cache.cache.summary()}")
+        if enricher is not None:
+            enricher.close()
+            click.echo(f"Fulltext: {fulltext_stats.summary()}")
+            downloads = enricher.session.stats
+            click.echo(f"Fulltext cache: {downloads['downloaded']}"
+                       f" downloaded, {downloads['not_modified']} not"
+                       f" modified, {downloads['cached']} cached")
         click.echo(f"Cache path: {cache_dir}; use `-c {cache_dir}` to reuse in"
                    f" subsequent calls")
 
@@ -111,61 +174,6 @@ def init_cache(cache_dir: str) -> None:
     return cache_dir
 
 
-def from_cache(cache_dir: str, arxiv_id: str) -> List[DocMeta]:
-    """
-    Get the docmeta document from a local cache, if available.
-
-    Parameters
-    ----------
-    arxiv_id : str
-
-    Returns
-    -------
-    :class:`.DocMeta`
-
-    Raises
-    ------
-    RuntimeError
-        Raised when the cache is not available, or the document could not
-        be found in the cache.
-
-    """
-    fname = '%s.json' % arxiv_id.replace('/', '_')
-    cache_path = os.path.join(cache_dir, fname)
-    if not os.path.exists(cache_path):
-        raise RuntimeError('No cached document')
-
-    with open(cache_path) as f:
-        data: dict = json.load(f)
-        return [DocMeta(**datum) for datum in data]  # type: ignore
-        # See https://github.com/python/mypy/issues/3937
-
-
-def to_cache(cache_dir: str, arxiv_id: str, docmeta: List[DocMeta]) -> None:
-    """
-    Add a document to the local cache, if available.
-
-    Parameters
-    ----------
-    arxiv_id : str
-    docmeta : :class:`.DocMeta`
-
-    Raises
-    ------
-    RuntimeError
-        Raised when the cache is not available, or the document could not
-        be added to the cache.
-
-    """
-    fname = '%s.json' % arxiv_id.replace('/', '_')
-    cache_path = os.path.join(cache_dir, fname)
-    try:
-        with open(cache_path, 'w') as f:
-            json.dump([asdict(dm) for dm in docmeta], f)
-    except Exception as e:
-        raise RuntimeError(str(e)) from e
-
-
 def load_id_list(path: str) -> List[str]:
     """Load a list of paper IDs from ``path``."""
     if not os.path.exists(path):
@@ -14,18 +14,25 @@ app = create_ui_web_app()
 @app.cli.command()
 @click.argument('old_index', nargs=1)
 @click.argument('new_index', nargs=1)
-def reindex(old_index: str, new_index: str):
+@click.option('--current-only', is_flag=True,
+              help='Copy only the current version of each paper, e.g. to'
+                   ' fill ELASTICSEARCH_CURRENT_INDEX.')
+def reindex(old_index: str, new_index: str, current_only: bool):
     """
     Reindex the documents in `old_index` to `new_index`.
 
     This will create `new_index` with the current configured mappings if it
-    does not already exist.
+    does not already exist. If it does exist, its mapping must agree with the
+    current configured mappings.
     """
     click.echo(f"Reindex papers in `{old_index}` to `{new_index}`")
     if not index.index_exists(old_index):
         click.echo(f"Source index `{old_index}` does not exist.")
 
-    r = index.reindex(old_index, new_index)
+    try:
+        r = index.reindex(old_index, new_index, current_only=current_only)
+    except index.MappingError as e:
+        raise click.ClickException(str(e)) from e
     if not r:
         raise click.ClickException("Failed to get or create new index")
 
@@ -0,0 +1,67 @@
+"""Index papers that the agent gave up on, from its dead-letter file."""
+
+from itertools import islice
+from typing import Iterator, List, Optional
+
+import click
+
+from search.factory import create_ui_web_app
+from search.agent import MetadataRecordProcessor, IndexingFailed
+from search.agent.retry import DeadLetters
+
+app = create_ui_web_app()
+
+
+@app.cli.command()
+@click.option('--path', '-p', help='Path to the dead-letter file. Defaults to'
+                                   ' AGENT_DEAD_LETTER_PATH.')
+@click.option('--chunk-size', '-c', default=50,
+              help='Number of papers to index at a time.')
+@click.option('--dry-run', '-n', is_flag=True,
+              help='List the papers in the dead-letter file, and exit.')
+def replay(path: Optional[str], chunk_size: int, dry_run: bool) -> None:
+    """
+    Index the papers in the agent's dead-letter file.
+
+    Papers that fail again are written back to the dead-letter file, so this
+    can be run repeatedly until it is empty.
+    """
+    dead_letters = DeadLetters(path or app.config['AGENT_DEAD_LETTER_PATH'])
+    if dry_run:
+        for entry in dead_letters.read():
+            click.echo(f"{entry['arxiv_id']}\t{entry['attempts']}"
+                       f"\t{entry['failed']}\t{entry['reason']}")
+        return
+
+    arxiv_ids = dead_letters.take()
+    click.echo(f'Replaying {len(arxiv_ids)} papers from {dead_letters.path}')
+    processor = MetadataRecordProcessor()
+    indexed = 0
+    failed = 0
+    with app.app_context():
+        for chunk in _chunks(arxiv_ids, chunk_size):
+            try:
+                failures = {arxiv_id: f'{type(e).__name__}: {e}'
+                            for arxiv_id, e in processor.replay(chunk).items()}
+            except IndexingFailed as e:
+                failures = {arxiv_id: f'{type(e).__name__}: {e}'
+                            for arxiv_id in chunk}
+            for arxiv_id, reason in failures.items():
+                dead_letters.add(arxiv_id, reason)
+            indexed += len(chunk) - len(failures)
+            failed += len(failures)
+    dead_letters.done()
+    click.echo(f'Indexed {indexed} papers; {failed} papers failed again')
+
+
+def _chunks(arxiv_ids: List[str], size: int) -> Iterator[List[str]]:
+    iterator = iter(arxiv_ids)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+if __name__ == '__main__':
+    replay()
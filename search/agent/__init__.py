@@ -8,17 +8,25 @@ also retrieves metadata for earlier versions, if there are multiple versions
 available. Each version is passed to the :mod:`search.services.index` service,
 and becomes available for discovery via :mod:`search.routes.ui`.
 """
+from datetime import datetime
+import threading
 from typing import Optional
 
 from flask import current_app as app
 
-from arxiv.base import agent
-from .consumer import MetadataRecordProcessor, DocumentFailed, IndexingFailed
+from search.process import enrich
+from search.services import metadata, index
+from .checkpoint import AtomicCheckpointManager
+from .consumer import MetadataRecordProcessor, DocumentFailed, \
+    IndexingFailed, SHARD_END
+from .metrics import AgentMetrics, MetricsServer
+from .shards import ShardCoordinator, connect, read_legacy_checkpoint
+from .stream import FileStream
 
 
 def process_stream(duration: Optional[int] = None) -> None:
     """
-    Configure and run the record processor.
+    Configure and run a record processor for each shard of the stream.
 
     Parameters
     ----------
@@ -27,8 +35,87 @@ def process_stream(duration: Optional[int] = None) -> None:
         run "forever".
 
     """
-    # We use the Flask application instance for configuration, and to manage
-    # integrations with metadata service, search index.
-    agent.process_stream(MetadataRecordProcessor, app.config,
-                         duration=duration)
+    config = app.config
+    # Metrics are kept for the life of the process, and are served over HTTP
+    # if a port is configured.
+    metrics = AgentMetrics()
+    server: Optional[MetricsServer] = None
+    if config.get('AGENT_METRICS_PORT'):
+        server = MetricsServer(
+            metrics, host=config.get('AGENT_METRICS_HOST', '127.0.0.1'),
+            port=int(config['AGENT_METRICS_PORT'])
+        ).start()
 
+    # The consumers for all of the shards share one client for each of the
+    # stream, the metadata service, and the search index.
+    stream_name = config['KINESIS_STREAM']
+    if config.get('AGENT_STREAM_FILE'):
+        client = FileStream(config['AGENT_STREAM_FILE'], name=stream_name)
+    else:
+        client = connect(config)
+    metadata_session = metadata.get_session(app)
+    index_session = index.get_session(app)
+    # Fulltext is optional; its requests are bounded across all shards.
+    enricher: Optional[enrich.FulltextEnricher] = None
+    if config.get('AGENT_FULLTEXT', 'false') == 'true':
+        enricher = enrich.get_enricher(app)
+
+    volume = config['KINESIS_CHECKPOINT_VOLUME']
+    start_type = config.get('KINESIS_START_TYPE') or 'AT_TIMESTAMP'
+    start_at = config.get('KINESIS_START_AT')
+    if start_type == 'AT_TIMESTAMP' and not start_at:
+        start_at = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+    def make_consumer(shard_id: str,
+                      from_start: bool) -> MetadataRecordProcessor:
+        checkpointer = AtomicCheckpointManager(volume, stream_name, shard_id)
+        if checkpointer.position is None:
+            legacy = read_legacy_checkpoint(volume, stream_name, shard_id)
+            if legacy is not None:
+                checkpointer.checkpoint(legacy)
+        return MetadataRecordProcessor(
+            stream_name, shard_id,
+            checkpointer=checkpointer,
+            client=client,
+            metadata_session=metadata_session,
+            index_session=index_session,
+            enricher=enricher,
+            # Child shards only have records that came after their parents.
+            start_type='TRIM_HORIZON' if from_start else start_type,
+            start_at=start_at,
+            sleep=float(config.get('KINESIS_SLEEP', 0.1)),
+            max_batch_size=int(config.get('AGENT_BATCH_SIZE', 100)),
+            max_batch_latency=float(config.get('AGENT_BATCH_LATENCY', 10)),
+            pipeline_depth=int(config.get('AGENT_PIPELINE_DEPTH', 2)),
+            max_backlog=int(config.get('AGENT_BACKFILL_BACKLOG', 10000)),
+            max_delay=float(config.get('AGENT_MAX_DELAY', 30)),
+            target_latency=float(config.get('AGENT_TARGET_LATENCY', 10)),
+            max_attempts=int(config.get('AGENT_RETRY_ATTEMPTS', 5)),
+            retry_delay=float(config.get('AGENT_RETRY_DELAY', 1)),
+            max_retry_delay=float(config.get('AGENT_RETRY_MAX_DELAY', 300)),
+            dead_letter_path=config.get('AGENT_DEAD_LETTER_PATH',
+                                        'dead-letters.ndjson'),
+            checkpoint_every=int(config.get('AGENT_CHECKPOINT_RECORDS', 1000)),
+            checkpoint_interval=float(
+                config.get('AGENT_CHECKPOINT_INTERVAL', 10)
+            ),
+            metrics=metrics
+        )
+
+    shard_id = config.get('KINESIS_SHARD_ID')
+    coordinator = ShardCoordinator(
+        client, stream_name, make_consumer, metrics=metrics,
+        shard_ids=[shard_id] if shard_id else None,
+        discovery_interval=float(
+            config.get('AGENT_SHARD_DISCOVERY_INTERVAL', 60)
+        )
+    )
+    if threading.current_thread() is threading.main_thread():
+        coordinator.handle_signals()
+    try:
+        coordinator.run(duration)
+    finally:
+        if server is not None:
+            server.stop()
+        if enricher is not None:
+            enricher.close()
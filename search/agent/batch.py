@@ -0,0 +1,117 @@
+"""Micro-batches of stream records, for processing by the indexing agent."""
+
+import time
+from typing import Dict, List, Optional
+
+from search.domain import DocMeta, Document, Fulltext
+
+
+class RecordBatch:
+    """
+    A group of stream records that are processed together.
+
+    Several notifications are often received for the same paper (e.g. when
+    the metadata for a paper are corrected several times in quick
+    succession), so each paper is only indexed once per batch regardless of
+    how many records refer to it. The batch also keeps track of which papers
+    failed, so that failures can be attributed to the records that requested
+    them.
+    """
+
+    def __init__(self) -> None:
+        """Start an empty batch."""
+        self.records: List[dict] = []
+        self.requested: Dict[str, List[dict]] = {}
+        """Records that refer to each paper, in the order first seen."""
+
+        self.metadata: List[DocMeta] = []
+        self.fulltext: Dict[str, Fulltext] = {}
+        """Fulltext that was retrieved, by versioned arXiv ID."""
+
+        self.documents: List[Document] = []
+        self.skipped = 0
+        """Number of unchanged documents that were not sent to the index."""
+        self.failed: Dict[str, Exception] = {}
+        """Papers that could not be indexed, and why."""
+
+        self.error: Optional[Exception] = None
+        """An exception that prevented the whole batch from being processed."""
+
+        self.lane: Optional[str] = None
+        """The priority lane from which the records came, if any."""
+
+        self.started: Optional[float] = None
+        self.timings: Dict[str, float] = {}
+        """Time (seconds) spent in each stage of processing."""
+
+    @classmethod
+    def from_ids(cls, arxiv_ids: List[str]) -> 'RecordBatch':
+        """Create a batch of papers that were not requested by records."""
+        batch = cls()
+        for arxiv_id in arxiv_ids:
+            batch.requested.setdefault(arxiv_id, [])
+        return batch
+
+    def __len__(self) -> int:
+        """Get the number of records in the batch."""
+        return len(self.records)
+
+    def add(self, record: dict, arxiv_id: Optional[str] = None) -> None:
+        """
+        Add a stream record to the batch.
+
+        Parameters
+        ----------
+        record : dict
+            A record from the stream.
+        arxiv_id : str or None
+            The paper to which the record refers. If None (e.g. because the
+            record could not be decoded), the record only affects the
+            position of the batch in the stream.
+
+        """
+        if self.started is None:
+            self.started = time.monotonic()
+        self.records.append(record)
+        if arxiv_id is not None:
+            self.requested.setdefault(arxiv_id, []).append(record)
+
+    def retry(self, arxiv_id: str) -> None:
+        """Add a paper that is being retried after an earlier failure."""
+        if self.started is None:
+            self.started = time.monotonic()
+        self.requested.setdefault(arxiv_id, [])
+
+    @property
+    def arxiv_ids(self) -> List[str]:
+        """Get the unique identifiers of the papers in this batch."""
+        return list(self.requested)
+
+    @property
+    def age(self) -> float:
+        """Get the time (seconds) since the first record was added."""
+        if self.started is None:
+            return 0.
+        return time.monotonic() - self.started
+
+    @property
+    def latency(self) -> float:
+        """Get the total time (seconds) spent processing the batch."""
+        return sum(self.timings.values())
+
+    @property
+    def position(self) -> Optional[str]:
+        """Get the sequence number of the last record in the batch."""
+        for record in reversed(self.records):
+            if record.get('SequenceNumber'):
+                return str(record['SequenceNumber'])
+        return None
+
+    def fail(self, arxiv_id: str, reason: Exception) -> None:
+        """Mark a paper as failed."""
+        self.failed.setdefault(arxiv_id, reason)
+
+    def failed_records(self) -> List[dict]:
+        """Get the records that requested papers that failed."""
+        return [record for arxiv_id in self.failed
+                for record in self.requested.get(arxiv_id, [])]
@@ -0,0 +1,117 @@
+"""
+Durable checkpoints for the indexing agent.
+
+A checkpoint is the sequence number of the last record whose papers have
+been indexed (i.e. the bulk requests for its batch were acknowledged). After
+a restart, the agent resumes after the checkpoint, so anything processed
+since the last checkpoint is processed again. Checkpointing after every batch
+keeps that to a minimum, but costs a synchronous disk write per batch; the
+agent instead checkpoints every ``every_records`` records or
+``every_seconds`` seconds, whichever comes first (see
+:class:`.CheckpointPolicy`), and whenever it stops.
+
+:class:`.AtomicCheckpointManager` is a drop-in replacement for
+:class:`arxiv.base.agent.DiskCheckpointManager` that uses the same files,
+but never leaves a partially written checkpoint behind: each checkpoint is
+written to a temporary file, flushed to disk, and renamed over the previous
+one.
+"""
+
+import os
+import tempfile
+import time
+from typing import Optional
+
+from arxiv.base import logging
+from arxiv.base.agent import CheckpointError
+
+logger = logging.getLogger(__name__)
+
+
+class AtomicCheckpointManager:
+    """Loads and atomically updates a consumer checkpoint on disk."""
+
+    def __init__(self, base_path: str, stream_name: str,
+                 shard_id: str) -> None:
+        """Load the checkpoint for a shard, if there is one."""
+        if not os.path.exists(base_path):
+            raise ValueError(f'Path does not exist: {base_path}')
+        self.base_path = base_path
+        self.file_path = os.path.join(base_path,
+                                      f'{stream_name}__{shard_id}.json')
+        self.position: Optional[str] = None
+        if os.path.exists(self.file_path):
+            with open(self.file_path) as f:
+                self.position = f.read().strip() or None
+
+    def checkpoint(self, position: str) -> None:
+        """Durably checkpoint at ``position``."""
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.base_path,
+                                             prefix='.checkpoint-')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(position)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.file_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            # Make sure that the rename itself survives a crash.
+            dir_fd = os.open(self.base_path, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError as e:
+            raise CheckpointError('Could not checkpoint') from e
+        self.position = position
+
+
+class CheckpointPolicy:
+    """Decides when the agent should checkpoint its position."""
+
+    def __init__(self, every_records: int = 1000,
+                 every_seconds: float = 10.) -> None:
+        """
+        Set the maximum amount of work between checkpoints.
+
+        Parameters
+        ----------
+        every_records : int
+            Checkpoint once this many records have been processed since the
+            last checkpoint. If 0, only ``every_seconds`` applies.
+        every_seconds : float
+            Checkpoint once this much time (seconds) has passed since the
+            last checkpoint, if any records have been processed. If 0, only
+            ``every_records`` applies.
+
+        """
+        self.every_records = every_records
+        self.every_seconds = every_seconds
+        self.pending = 0
+        """Records processed since the last checkpoint."""
+
+        self.last = time.monotonic()
+
+    def processed(self, records: int) -> None:
+        """Count records that have been processed."""
+        self.pending += records
+
+    @property
+    def due(self) -> bool:
+        """Determine whether it is time to checkpoint."""
+        if not self.pending:
+            return False
+        if not self.every_records and not self.every_seconds:
+            return True     # Checkpoint after every batch.
+        if self.every_records and self.pending >= self.every_records:
+            return True
+        return bool(self.every_seconds) \
+            and time.monotonic() - self.last >= self.every_seconds
+
+    def reset(self) -> None:
+        """Start counting again, after a checkpoint."""
+        self.pending = 0
+        self.last = time.monotonic()
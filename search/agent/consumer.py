@@ -2,21 +2,41 @@
 
 import json
 import os
+import re
+import threading
 import time
-from typing import List, Any, Optional, Dict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from arxiv.base import logging
 from search.services import metadata, index
-from search.process import transform
-from search.domain import DocMeta, Document, asdict
-from arxiv.base.agent import BaseConsumer
+from search.services.index.exceptions import BulkIndexingError
+from search.process import enrich, transform
+from search.domain import DocMeta, Document, Fulltext, asdict
+from arxiv.base.agent import BaseConsumer, StopProcessing, retry
+
+from .batch import RecordBatch
+from .checkpoint import CheckpointPolicy
+from .lanes import BACKFILL, LANES, NEW, Lane, Watermark, classify
+from .metrics import AgentMetrics
+from .pipeline import Pipeline
+from .rate import RateController, is_throttled
+from .retry import DeadLetters, RetryQueue, is_transient
 
 logger = logging.getLogger(__name__)
 logger.propagate = False
 
+SHARD_END = 'SHARD_END'
+"""Position of a consumer that has processed every record in a closed shard."""
+
 
 class DocumentFailed(RuntimeError):
     """Raised when an arXiv paper could not be added to the search index."""
 
+    def __init__(self, message: str = '',
+                 status_code: Optional[int] = None) -> None:
+        """Keep track of the status code, if there was a response."""
+        super(DocumentFailed, self).__init__(message)
+        self.status_code = status_code
+
 
 class IndexingFailed(RuntimeError):
     """Raised when indexing failed such that future success is unlikely."""
@@ -25,14 +45,103 @@ class IndexingFailed(RuntimeError):
 class MetadataRecordProcessor(BaseConsumer):
     """Consumes ``MetadataIsAvailable`` notifications, updates the index."""
 
-    MAX_ERRORS = 5
-    """Max number of individual document failures before aborting entirely."""
+    MAX_BATCH_SIZE = 100
+    """Default max number of records to process together."""
+
+    MAX_BATCH_LATENCY = 10.
+    """Default max time (seconds) a record waits for its batch to fill up."""
+
+    STATS_INTERVAL = 60.
+    """Time (seconds) between logging throughput stats."""
+
+    MAX_DELAY = 30.
+    """Default max time (seconds) to wait before a batch, when backing off."""
+
+    TARGET_LATENCY = 10.
+    """Default max time (seconds) to process a batch before backing off."""
+
+    MAX_ATTEMPTS = 5
+    """Default max number of times to try indexing a paper."""
+
+    DEAD_LETTER_PATH = 'dead-letters.ndjson'
+    """Default file for papers that could not be indexed."""
+
+    MAX_BACKLOG = 10000
+    """Default max number of backfill records to read ahead."""
+
+    CHECKPOINT_RECORDS = 1000
+    """Default max number of records to process between checkpoints."""
+
+    CHECKPOINT_INTERVAL = 10.
+    """Default max time (seconds) between checkpoints, if there is work."""
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
-        """Initialize exception counter."""
-        self.sleep: float = kwargs.pop('sleep', 0.1)
+        """Initialize exception counter and the first batch."""
+        self.rate = RateController(
+            delay=kwargs.pop('sleep', 0.1),
+            max_delay=kwargs.pop('max_delay', self.MAX_DELAY),
+            target_latency=kwargs.pop('target_latency', self.TARGET_LATENCY)
+        )
+        self.max_batch_size: int = \
+            kwargs.pop('max_batch_size', self.MAX_BATCH_SIZE)
+        self.max_batch_latency: float = \
+            kwargs.pop('max_batch_latency', self.MAX_BATCH_LATENCY)
+        self.pipeline_depth: int = kwargs.pop('pipeline_depth', 0)
+        self.max_backlog: int = kwargs.pop('max_backlog', self.MAX_BACKLOG)
+        self.retries = RetryQueue(
+            DeadLetters(kwargs.pop('dead_letter_path',
+                                   self.DEAD_LETTER_PATH)),
+            max_attempts=kwargs.pop('max_attempts', self.MAX_ATTEMPTS),
+            base_delay=kwargs.pop('retry_delay', 1.),
+            max_delay=kwargs.pop('max_retry_delay', 300.)
+        )
+        self.checkpoints = CheckpointPolicy(
+            every_records=kwargs.pop('checkpoint_every',
+                                     self.CHECKPOINT_RECORDS),
+            every_seconds=kwargs.pop('checkpoint_interval',
+                                     self.CHECKPOINT_INTERVAL)
+        )
+        self.metrics: AgentMetrics = kwargs.pop('metrics', None) \
+            or AgentMetrics()
+        self.metadata_session: Optional[metadata.DocMetaSession] = \
+            kwargs.pop('metadata_session', None)
+        self.index_session: Optional[index.SearchSession] = \
+            kwargs.pop('index_session', None)
+        self.enricher: Optional[enrich.FulltextEnricher] = \
+            kwargs.pop('enricher', None)
+        client = kwargs.pop('client', None)
+        if client is not None:
+            # We were given a client (e.g. one shared by the consumers of
+            # several shards, or a FileStream), so we don't connect.
+            names = list(args[:2]) + ['', '']
+            stream_name = kwargs.pop('stream_name', names[0]) \
+                or getattr(client, 'name', '')
+            shard_id = kwargs.pop('shard_id', names[1]) \
+                or getattr(client, 'shard_id', '')
+            args = ('', '') + args[2:]
         super(MetadataRecordProcessor, self).__init__(*args, **kwargs)  # type: ignore
+        if client is not None:
+            self.client = client
+            self.stream_name = stream_name
+            self.shard_id = shard_id
+        self.stopping = threading.Event()
+        self._labels = {'shard': self.shard_id} if self.shard_id else {}
         self._error_count = 0
+        self._lanes: Dict[str, Lane] = {lane: Lane(lane) for lane in LANES}
+        self._watermark = Watermark()
+        self._checkpointed = self.position
+        self._pipeline: Optional[Pipeline] = None
+        self._stats_logged = time.monotonic()
+
+    @property
+    def _metadata(self) -> Any:
+        """Get the session with the metadata service for this consumer."""
+        return self.metadata_session or metadata
+
+    @property
+    def _index(self) -> Any:
+        """Get the session with the search index for this consumer."""
+        return self.index_session or index
 
     # TODO: bring McCabe index down.
     def _get_metadata(self, arxiv_id: str) -> DocMeta:
@@ -63,13 +172,13 @@ class MetadataRecordProcessor(BaseConsumer):
 
         try:
             logger.debug(f'{arxiv_id}: requesting metadata')
-            docmeta: DocMeta = metadata.retrieve(arxiv_id)
+            docmeta: DocMeta = self._metadata.retrieve(arxiv_id)
         except metadata.ConnectionFailed as e:
             # The metadata service will retry bad responses, but not connection
             # errors. Sometimes it just takes another try, so why not.
             logger.warning(f'{arxiv_id}: first attempt failed, retrying')
             try:
-                docmeta = metadata.retrieve(arxiv_id)
+                docmeta = self._metadata.retrieve(arxiv_id)
             except metadata.ConnectionFailed as e:
                 # Things really are looking bad. There is no need to keep
                 # trying with subsequent records, so let's abort entirely.
@@ -117,19 +226,22 @@ class MetadataRecordProcessor(BaseConsumer):
         meta: List[DocMeta]
         try:
             logger.debug(f'{arxiv_ids}: requesting bulk metadata')
-            meta = metadata.bulk_retrieve(arxiv_ids)
+            meta = self._metadata.bulk_retrieve(arxiv_ids)
             return meta
         except metadata.ConnectionFailed as e:
             # The metadata service will retry bad responses, but not connection
-            # errors. Sometimes it just takes another try, so why not.
+            # errors. Sometimes it just takes another try, so why not. Only
+            # the papers that were not retrieved need to be tried again.
             logger.warning(f'{arxiv_ids}: first attempt failed, retrying')
+            retrieved = list(e.retrieved)
             try:
-                meta = metadata.bulk_retrieve(arxiv_ids)
-                return meta
+                meta = self._metadata.bulk_retrieve(e.failed or arxiv_ids)
+                return retrieved + meta
             except metadata.ConnectionFailed as e:
                 # Things really are looking bad. There is no need to keep
                 # trying with subsequent records, so let's abort entirely.
                 logger.error(f'{arxiv_ids}: second attempt failed, giving up')
+                e.retrieved = retrieved + e.retrieved
                 raise IndexingFailed(
                     'Indexing failed; metadata endpoint could not be reached.'
                 ) from e
@@ -144,7 +256,9 @@ class MetadataRecordProcessor(BaseConsumer):
             raise IndexingFailed('Unhandled exception') from e
 
     @staticmethod
-    def _transform_to_document(docmeta: DocMeta) -> Document:
+    def _transform_to_document(docmeta: DocMeta,
+                               fulltext: Optional[Fulltext] = None) \
+            -> Document:
         """
         Transform paper :class:`.DocMeta` to a search :class:`.Document`.
 
@@ -152,6 +266,8 @@ class MetadataRecordProcessor(BaseConsumer):
         ----------
         docmeta : :class:`DocMeta`
             Metadata for an arXiv paper.
+        fulltext : :class:`.Fulltext`
+            Fulltext for the paper, if available.
 
         Returns
         -------
@@ -166,7 +282,7 @@ class MetadataRecordProcessor(BaseConsumer):
 
         """
         try:
-            document = transform.to_search_document(docmeta)
+            document = transform.to_search_document(docmeta, fulltext)
         except Exception as e:
             # At the moment we don't have any special exceptions.
             logger.error('unhandled exception during transform: %s', e)
@@ -174,8 +290,7 @@ class MetadataRecordProcessor(BaseConsumer):
 
         return document
 
-    @staticmethod
-    def _add_to_index(document: Document) -> None:
+    def _add_to_index(self, document: Document) -> None:
         """
         Add a :class:`.Document` to the search index.
 
@@ -191,26 +306,33 @@ class MetadataRecordProcessor(BaseConsumer):
 
         """
         try:
-            index.add_document(document)
+            self._index.add_document(document)
         except index.IndexConnectionError as e:
             # Let's try once more before giving up entirely.
             try:
-                index.add_document(document)
+                self._index.add_document(document)
             except index.IndexConnectionError as e:   # Nope, not happening.
                 raise IndexingFailed('Could not index document') from e
         except Exception as e:
             logger.error(f'Unhandled exception from index service: {e}')
             raise IndexingFailed('Unhandled exception') from e
 
-    @staticmethod
-    def _bulk_add_to_index(documents: List[Document]) -> None:
+    def _bulk_add_to_index(self, documents: List[Document]) -> int:
         """
         Add :class:`.Document` to the search index.
 
+        Documents that have not changed since they were last indexed are
+        skipped.
+
         Parameters
         ----------
         documents : :class:`.Document`
 
+        Returns
+        -------
+        int
+            The number of documents that were (re)indexed.
+
         Raises
         ------
         IndexingFailed
@@ -219,17 +341,25 @@ class MetadataRecordProcessor(BaseConsumer):
 
         """
         try:
-            index.bulk_add_documents(documents)
+            sent: int = self._index.bulk_add_documents(documents,
+                                                       skip_unchanged=True)
         except index.IndexConnectionError as e:
             # Let's try once more before giving up entirely.
             try:
-                index.bulk_add_documents(documents)
+                sent = self._index.bulk_add_documents(documents,
+                                                      skip_unchanged=True)
             except index.IndexConnectionError as e:   # Nope, not happening.
                 logger.error(f'Could not bulk index documents: {e}')
                 raise IndexingFailed('Could not bulk index documents') from e
+        except BulkIndexingError as e:
+            # Some of the documents were indexed; the caller can figure out
+            # what to do about the rest.
+            logger.error(f'Could not index some documents: {e.failed}')
+            raise
         except Exception as e:
             logger.error(f'Unhandled exception from index service: {e}')
             raise IndexingFailed('Unhandled exception') from e
+        return sent
 
     def index_paper(self, arxiv_id: str) -> None:
         """
@@ -255,66 +385,535 @@ class MetadataRecordProcessor(BaseConsumer):
         Raises
         ------
         DocumentFailed
-            Indexing of the documents failed. This may have no bearing on the
-            success of subsequent papers.
+            Indexing of at least one of the papers failed. This may have no
+            bearing on the success of subsequent papers. Papers that did not
+            fail are still indexed.
         IndexingFailed
             Indexing of the documents failed in a way that indicates recovery
             is unlikely for subsequent papers.
 
+        """
+        batch = RecordBatch.from_ids(arxiv_ids)
+        self._process_batch(batch)
+        for arxiv_id, reason in batch.failed.items():
+            # We just pass these along so that the caller can keep track.
+            logger.debug(f'{arxiv_id}: Document failed: {reason}')
+            raise reason
+
+    @property
+    def _stages(self) -> List[Tuple[str, Callable[[RecordBatch], None]]]:
+        """Get the stages of processing a batch, in order."""
+        stages = [('fetch', self._fetch_batch)]
+        if self.enricher is not None:
+            stages.append(('enrich', self._enrich_batch))
+        return stages + [('transform', self._transform_batch),
+                         ('index', self._index_batch)]
+
+    def _process_batch(self, batch: RecordBatch) -> None:
+        """Fetch metadata, transform, and index the papers in ``batch``."""
+        for stage, func in self._stages:
+            started = time.monotonic()
+            func(batch)
+            batch.timings[stage] = time.monotonic() - started
+
+    def _fetch_batch(self, batch: RecordBatch) -> None:
+        """
+        Retrieve metadata for all of the papers in ``batch``.
+
+        All of the papers are requested at once (the metadata service may
+        split them into chunks). If that fails for a reason that might be
+        specific to one of the papers, each paper that was not retrieved is
+        requested separately so that we can tell which paper(s) caused the
+        failure. If the metadata service is unavailable, the papers that were
+        not retrieved fail (and can be retried later).
         """
         try:
-            documents = []
-            for docmeta in self._get_bulk_metadata(arxiv_ids):
-                logger.debug(f'{docmeta.paper_id}: transform to Document')
-                document = MetadataRecordProcessor._transform_to_document(
-                    docmeta
-                )
-                documents.append(document)
-            logger.debug('add to index in bulk')
-            MetadataRecordProcessor._bulk_add_to_index(documents)
+            batch.metadata = self._get_bulk_metadata(batch.arxiv_ids)
         except (DocumentFailed, IndexingFailed) as e:
-            # We just pass these along so that process_record() can keep track.
-            logger.debug(f'{arxiv_ids}: Document failed: {e}')
-            raise e
+            if isinstance(e, IndexingFailed) and not is_transient(e):
+                raise
+            # Chunks of the request that succeeded need not be retried.
+            batch.metadata = list(getattr(e.__cause__, 'retrieved', []))
+            retrieved = {docmeta.paper_id for docmeta in batch.metadata}
+            remaining = [arxiv_id for arxiv_id in batch.arxiv_ids
+                         if arxiv_id not in retrieved]
+            if len(remaining) == 1 or is_transient(e):
+                for arxiv_id in remaining:
+                    batch.fail(arxiv_id, e)
+                return
+            logger.warning('bulk metadata request failed; retrieving'
+                           ' %i papers separately', len(remaining))
+            for arxiv_id in remaining:
+                try:
+                    batch.metadata += self._get_bulk_metadata([arxiv_id])
+                except (DocumentFailed, IndexingFailed) as e:
+                    if isinstance(e, IndexingFailed) and not is_transient(e):
+                        raise
+                    batch.fail(arxiv_id, e)
+
+        retrieved = {docmeta.paper_id for docmeta in batch.metadata}
+        for arxiv_id in batch.arxiv_ids:
+            if arxiv_id not in retrieved and arxiv_id not in batch.failed:
+                logger.error(f'{arxiv_id}: no metadata retrieved')
+                batch.fail(arxiv_id, DocumentFailed('No metadata retrieved'))
+
+    def _enrich_batch(self, batch: RecordBatch) -> None:
+        """
+        Retrieve fulltext for the papers in ``batch``, where there is any.
 
-    def process_record(self, record: dict) -> None:
+        Papers for which there is no fulltext (yet) are indexed without it.
+        """
+        if self.enricher is None:
+            return
+        fetches = self.enricher.enrich(
+            docmeta for docmeta in batch.metadata
+            if docmeta.paper_id not in batch.failed
+        )
+        batch.fulltext = enrich.by_version(fetches)
+        self.metrics.record_fulltext(fetches)
+
+    def _transform_batch(self, batch: RecordBatch) -> None:
+        """Transform the metadata in ``batch`` into search documents."""
+        # Let go of the metadata as it is transformed, rather than holding on
+        # to it while the documents are indexed.
+        metadata, batch.metadata = batch.metadata[::-1], []
+        while metadata:
+            docmeta = metadata.pop()
+            if docmeta.paper_id in batch.failed:
+                continue
+            logger.debug(f'{docmeta.paper_id}: transform to Document')
+            fulltext = batch.fulltext.pop(
+                f'{docmeta.paper_id}v{docmeta.version}', None
+            )
+            try:
+                batch.documents.append(
+                    MetadataRecordProcessor._transform_to_document(docmeta,
+                                                                   fulltext)
+                )
+            except DocumentFailed as e:
+                batch.fail(docmeta.paper_id, e)
+        batch.fulltext = {}
+        # All of the versions of a paper are indexed together, or not at all.
+        batch.documents = [document for document in batch.documents
+                           if document.paper_id not in batch.failed]
+
+    def _index_batch(self, batch: RecordBatch) -> None:
+        """Add the documents in ``batch`` to the index, in bulk."""
+        if not batch.documents:
+            return
+        logger.debug('add to index in bulk')
+        try:
+            sent = self._bulk_add_to_index(batch.documents)
+            batch.skipped = len(batch.documents) - sent
+        except IndexingFailed as e:
+            if not is_transient(e):
+                raise
+            for document in batch.documents:   # Try again later.
+                batch.fail(document.paper_id, e)
+        except BulkIndexingError as e:
+            papers = {document.id: document.paper_id
+                      for document in batch.documents}
+            statuses = dict(zip(e.failed, e.status_codes))
+            for document_id in e.failed:
+                reason = DocumentFailed(f'{document_id} was not indexed',
+                                        statuses.get(document_id))
+                batch.fail(papers.get(document_id, document_id), reason)
+
+    def replay(self, arxiv_ids: List[str]) -> Dict[str, Exception]:
         """
-        Call for each record that is passed to process_records.
+        Index papers that were not requested by records, e.g. dead letters.
 
         Parameters
         ----------
-        data : bytes
-        partition_key : bytes
-        sequence_number : int
-        sub_sequence_number : int
+        arxiv_ids : List[str]
+            A list of **versionless** arXiv e-print identifiers.
+
+        Returns
+        -------
+        dict
+            The papers that could not be indexed, and why.
 
         Raises
         ------
         IndexingFailed
-            Indexing of the document failed in a way that indicates recovery
-            is unlikely for subsequent papers, or too many individual
-            documents failed.
+            Indexing of the documents failed in a way that indicates recovery
+            is unlikely for subsequent papers.
 
         """
-        time.sleep(self.sleep)
-        logger.info(f'Processing record {record["SequenceNumber"]}')
-        if self._error_count > self.MAX_ERRORS:
-            raise IndexingFailed('Too many errors')
+        batch = RecordBatch.from_ids(arxiv_ids)
+        self._process_batch(batch)
+        return batch.failed
 
+    def _get_arxiv_id(self, record: dict) -> Optional[str]:
+        """Get the (versionless) arXiv ID requested by a stream record."""
+        arxiv_id, _ = self._read_record(record)
+        return arxiv_id
+
+    def _read_record(self, record: dict) -> Tuple[Optional[str], str]:
+        """Get the (versionless) arXiv ID and the lane for a stream record."""
         try:
             deserialized = json.loads(record['Data'].decode('utf-8'))
         except json.decoder.JSONDecodeError as e:
             logger.error("Error while deserializing data %s", e)
             logger.error("Data payload: %s", record['Data'])
-            raise DocumentFailed('Could not deserialize record data')
-            # return   # Don't bring down the whole batch.
+            self._error_count += 1
+            self.metrics.record_error(type(e).__name__)
+            return None, NEW
+        lane = classify(deserialized)
+        arxiv_id: Optional[str] = deserialized.get('document_id')
+        if arxiv_id is None:
+            logger.error('No document_id in record %s',
+                         record['SequenceNumber'])
+            self._error_count += 1
+            self.metrics.record_error('MissingDocumentId')
+            return None, lane
+        return re.sub(r'v[0-9]+$', '', arxiv_id), lane
 
+    def process_batch(self, batch: RecordBatch) -> None:
+        """
+        Index the papers requested by a batch of stream records.
+
+        Parameters
+        ----------
+        batch : :class:`.RecordBatch`
+
+        Raises
+        ------
+        IndexingFailed
+            Indexing of the documents failed in a way that indicates recovery
+            is unlikely for subsequent papers.
+
+        """
+        self._start_batch(batch)
         try:
-            arxiv_id: str = deserialized.get('document_id')
-            self.index_paper(arxiv_id)
-        except DocumentFailed as e:
-            logger.debug(f'{arxiv_id}: failed to index document')
-            self._error_count += 1
+            self._process_batch(batch)
         except IndexingFailed as e:
             logger.error(f'Indexing failed: {e}')
             raise
+        self._finish_batch(batch)
+
+    def _start_batch(self, batch: RecordBatch) -> None:
+        """Wait until we are ready to process ``batch``."""
+        self.rate.wait()
+        logger.info(f'Processing {len(batch)} records'
+                    f' ({len(batch.arxiv_ids)} papers) up to {batch.position}'
+                    f' (max {self.rate.rate:.1f} batches/s)')
+
+    def _finish_batch(self, batch: RecordBatch) -> None:
+        """
+        Attribute failures back to the records that requested them.
+
+        Papers that failed for transient reasons are scheduled for retry, and
+        the rest go to the dead-letter file. Also lets the rate controller
+        know how the batch went, so that it can slow down if the metadata
+        service or the index are under pressure: if the batch was slow, or
+        either of them asked us to slow down. Other failures, even transient
+        ones, are no reason to slow down the rest of the stream.
+        """
+        throttled = any(is_throttled(reason)
+                        for reason in batch.failed.values())
+        self.rate.update(batch.latency, throttled)
+        for arxiv_id in batch.arxiv_ids:
+            if arxiv_id in batch.failed:
+                self.retries.failed(arxiv_id, batch.failed[arxiv_id])
+            else:
+                self.retries.succeeded(arxiv_id)
+        for arxiv_id, reason in batch.failed.items():
+            for record in batch.requested.get(arxiv_id, []):
+                logger.debug(f'{arxiv_id}: failed to index document for'
+                             f' record {record["SequenceNumber"]}: {reason}')
+                self._error_count += 1
+        self.metrics.record_batch(batch, **self._labels)
+        self.metrics.delay.set(self.rate.delay, **self._labels)
+        self.metrics.retries.set(len(self.retries), **self._labels)
+        if batch.skipped:
+            logger.debug(f'Skipped {batch.skipped} unchanged documents')
+
+    def process_record(self, record: dict) -> None:
+        """
+        Process a single record, as a batch of one.
+
+        Parameters
+        ----------
+        record : dict
+
+        Raises
+        ------
+        IndexingFailed
+            Indexing of the document failed in a way that indicates recovery
+            is unlikely for subsequent papers.
+
+        """
+        batch = RecordBatch()
+        batch.add(record, self._get_arxiv_id(record))
+        self.process_batch(batch)
+
+    def process_records(self, start: str) -> Tuple[str, int]:
+        """
+        Retrieve records starting at ``start``, and process them in batches.
+
+        Records are sorted into priority lanes (see :mod:`.lanes`), and
+        gathered into a batch until there are :attr:`.max_batch_size` records
+        in the lane, or until the oldest record has waited for
+        :attr:`.max_batch_latency` seconds. Records for new papers are
+        processed first; backfill records are read ahead (up to
+        :attr:`.max_backlog` of them), and processed for up to
+        :attr:`.max_batch_latency` seconds before we look for new papers
+        again. The position in the stream only advances past a record once
+        it and every record before it have been processed, so records that
+        have not yet been processed are replayed after a restart. Papers that
+        are due to be retried are added to the new lane.
+
+        Parameters
+        ----------
+        start : str
+            Shard iterator from which to retrieve records.
+
+        Returns
+        -------
+        str
+            Shard iterator from which to retrieve the next records.
+        int
+            Number of records processed.
+
+        """
+        logger.debug(f'Get more records, starting at {start}')
+        processed = 0
+        try:
+            # Don't get carried away, unless we are falling behind.
+            time.sleep(self.rate.poll_interval(self.sleep_time))
+            # Read ahead of the backfill, but not too far.
+            room = self.max_backlog - len(self._lanes[BACKFILL])
+            next_start, response = self.get_records(
+                start, max(1, min(self.batch_size, room))
+            )
+            self.rate.lag = response.get('MillisBehindLatest')
+            if self.rate.lag is not None:
+                self.metrics.behind.set(self.rate.lag, **self._labels)
+        except Exception as e:
+            self._checkpoint()
+            raise StopProcessing('Unhandled exception: %s' % str(e)) from e
+
+        logger.debug('Got %i records', len(response['Records']))
+        for arxiv_id in self.retries.due():
+            self._lanes[NEW].retry(arxiv_id)
+        for record in response['Records']:
+            self._check_timeout()
+
+            # It is possible that Kinesis will replay the same message several
+            # times, especially at the end of the stream. There's no point in
+            # replaying the message, so we'll continue on.
+            sequence_number = record['SequenceNumber']
+            if sequence_number == self.position \
+                    or sequence_number in self._watermark:
+                continue
+
+            arxiv_id, lane = self._read_record(record)
+            self._watermark.read(sequence_number)
+            self._lanes[lane].add(record, arxiv_id)
+            if len(self._lanes[NEW]) >= self.max_batch_size:
+                processed += self._flush(NEW)
+        for lane in LANES:
+            self.metrics.waiting.set(len(self._lanes[lane]), lane=lane,
+                                     **self._labels)
+        if self._lanes[NEW].age >= self.max_batch_latency:
+            processed += self._flush(NEW)
+        processed += self._fill()
+        if self._pipeline is not None:
+            processed += self._complete(self._pipeline.completed())
+        if next_start is None:  # The shard is closed, and we have read it all.
+            processed += self.drain()
+        logger.debug(f'Next start is {next_start}')
+        return next_start, processed
+
+    def _fill(self) -> int:
+        """
+        Process backfill batches, while there is nothing more urgent to do.
+
+        Returns
+        -------
+        int
+            The number of records in batches that were completed.
+
+        """
+        backfill = self._lanes[BACKFILL]
+        processed = 0
+        started = time.monotonic()
+        while len(backfill) >= self.max_batch_size \
+                or (backfill and backfill.age >= self.max_batch_latency):
+            processed += self._flush(BACKFILL)
+            if time.monotonic() - started >= self.max_batch_latency:
+                break   # Time to look for new papers.
+        return processed
+
+    def _flush(self, lane: str = NEW) -> int:
+        """
+        Process the next batch from a lane.
+
+        If the pipeline is enabled, the batch is submitted to the pipeline and
+        any batches that have come out the other end are completed.
+
+        Returns
+        -------
+        int
+            The number of records in batches that were completed.
+
+        """
+        batch = self._lanes[lane].take(self.max_batch_size)
+        if not batch and not batch.arxiv_ids:
+            return 0
+        if not self.pipeline_depth:
+            self.process_batch(batch)
+            return self._complete([batch], finished=True)
+
+        if self._pipeline is None:
+            self._pipeline = Pipeline(self._stages,
+                                      depth=self.pipeline_depth)
+        self._start_batch(batch)
+        self._pipeline.submit(batch)    # Blocks if the pipeline is full.
+        return self._complete(self._pipeline.completed())
+
+    def _complete(self, batches: List[RecordBatch],
+                  finished: bool = False) -> int:
+        """Advance the position past batches that have been processed."""
+        for batch in batches:
+            if isinstance(batch.error, IndexingFailed):
+                logger.error(f'Indexing failed: {batch.error}')
+                raise batch.error
+            elif batch.error is not None:
+                logger.error(f'Unhandled exception: {batch.error}')
+                self.metrics.record_error(type(batch.error).__name__)
+                raise IndexingFailed('Unhandled exception') from batch.error
+            if not finished:
+                self._finish_batch(batch)
+            # Setting the position means that we have successfully processed
+            # these records, and all of the records before them.
+            position = self._watermark.processed(batch.records)
+            if position:
+                self.position = position
+                logger.debug(f'Updated position to {self.position}')
+        if time.monotonic() - self._stats_logged > self.STATS_INTERVAL:
+            self.log_stats()
+        return sum(len(batch) for batch in batches)
+
+    def log_stats(self) -> None:
+        """Log a summary of the work done since the last summary."""
+        logger.info(f'Metrics: {self.metrics.summary()}')
+        if self._pipeline is not None:
+            self._pipeline.log_stats()
+        self._stats_logged = time.monotonic()
+
+    @retry(retries=10, wait=5)
+    def get_records(self, iterator: str, limit: int) \
+            -> Tuple[Optional[str], dict]:
+        """
+        Get the next batch of ``limit`` or fewer records.
+
+        The next iterator is None if the shard has been closed (e.g. because
+        the stream was resharded), and there are no more records to read.
+        """
+        logger.debug(f'Get more records from {iterator}, limit {limit}')
+        response = self.client.get_records(ShardIterator=iterator,
+                                           Limit=limit)
+        return response.get('NextShardIterator'), response
+
+    def go(self) -> None:
+        """
+        Process records until the shard is closed, or we are asked to stop.
+
+        Once every record in a closed shard has been processed, the position
+        is set to :data:`SHARD_END`, so that the consumers of its child
+        shards know that they can start.
+
+        However we stop (even if an exception escapes), papers that are
+        waiting to be retried are spooled to the dead-letter file, since the
+        position may already be past the records that requested them.
+        """
+        if self.position == SHARD_END:
+            logger.info(f'Shard {self.shard_id} has already been processed')
+            return
+        self.start_time = time.time()
+        logger.info(f'Starting processing from position {self.position}'
+                    f' on stream {self.stream_name} and shard {self.shard_id}')
+        start: Optional[str] = self._get_iterator()
+        try:
+            while start is not None:
+                start, processed = self.process_records(start)
+                self.checkpoints.processed(processed)
+                if self.checkpoints.due:
+                    self._checkpoint()
+                self._check_timeout()
+        finally:
+            self.retries.spool()
+            if start is not None and self.position != self._checkpointed:
+                # The position is only past records that are done.
+                self._checkpoint()
+        logger.info(f'Shard {self.shard_id} is closed, and all of its records'
+                    ' have been processed')
+        self.position = SHARD_END
+        self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        """
+        Checkpoint at the current position.
+
+        The position only advances once the bulk requests for a batch have
+        been acknowledged by the index, so the checkpoint never gets ahead of
+        what has been indexed. While running, :meth:`.go` checkpoints
+        according to :attr:`.checkpoints`; we also checkpoint whenever we
+        stop.
+        """
+        if self.position is None or not self.checkpointer:
+            return
+        started = time.monotonic()
+        self.checkpointer.checkpoint(self.position)
+        self.metrics.record_checkpoint(time.monotonic() - started,
+                                       self.checkpoints.pending)
+        self.checkpoints.reset()
+        self._checkpointed = self.position
+        logger.debug(f'Set checkpoint at {self.position}')
+
+    def shutdown(self) -> None:
+        """Ask the consumer to stop, once it has processed what it has read."""
+        self.stopping.set()
+
+    def _check_timeout(self) -> None:
+        """Process any waiting records before exiting due to timeout."""
+        timed_out = self.start_time and self.duration \
+            and time.time() - self.start_time > self.duration
+        if timed_out or self.stopping.is_set():
+            # Backfill that we have read ahead can wait until we restart.
+            self.drain(backfill=False)
+            # Papers waiting to be retried would be lost on exit.
+            self.retries.spool()
+        if self.stopping.is_set():
+            self._checkpoint()
+            raise StopProcessing('Asked to stop')
+        super(MetadataRecordProcessor, self)._check_timeout()
+
+    def drain(self, backfill: bool = True) -> int:
+        """
+        Process the records that we have read, and wait for the pipeline.
+
+        Parameters
+        ----------
+        backfill : bool
+            Whether to process the backfill lane, too. If not, the position
+            does not advance past the first backfill record that is waiting.
+
+        Returns
+        -------
+        int
+            The number of records in batches that were completed.
+
+        """
+        processed = 0
+        for lane in LANES if backfill else (NEW,):
+            while self._lanes[lane]:
+                processed += self._flush(lane)
+        if self._pipeline is not None:
+            processed += self._complete(self._pipeline.drain())
+            self._pipeline.stop()
+            self._pipeline = None
+        self.log_stats()
+        return processed
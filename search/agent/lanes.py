@@ -0,0 +1,181 @@
+"""
+Priority lanes for stream records.
+
+During reindexing or backfill campaigns, the stream carries many more
+notifications than usual, and notifications for newly announced papers would
+otherwise wait behind all of them. The agent therefore reads ahead of what it
+has processed, and sorts records into lanes: records in the :data:`NEW` lane
+are processed as soon as a batch is ready, and records in the
+:data:`BACKFILL` lane fill the remaining capacity.
+
+The lane is worked out from the arXiv ID in the payload, which starts with
+the year and month in which the paper was first announced. Papers from this
+month or the last, and records that name a version (e.g.
+``"document_id": "1234.56789v2"``, as when a version is announced), are in
+the :data:`NEW` lane; other papers are being reindexed, and are in the
+:data:`BACKFILL` lane. Producers can override this with ``"lane": "new"`` or
+``"lane": "backfill"`` (or ``"backfill": true``) in the payload.
+
+Since records are processed out of order, the position in the stream can only
+advance past a record once it, and every record before it, has been
+processed. :class:`.Watermark` keeps track of that position.
+"""
+
+import re
+import time
+from collections import OrderedDict, deque
+from datetime import date
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from .batch import RecordBatch
+
+NEW = 'new'
+"""Newly announced papers and versions."""
+
+BACKFILL = 'backfill'
+"""Bulk backfill, and older versions of papers."""
+
+LANES = (NEW, BACKFILL)
+"""The lanes, in order of priority."""
+
+RECENT_MONTHS = 1
+"""Papers first announced this many months ago (or since) are new."""
+
+ARXIV_ID = re.compile(r'^(?:[a-z-]+(?:\.[A-Z]{2})?/)?(?P<year>[0-9]{2})'
+                      r'(?P<month>[0-9]{2})[.0-9]+(?P<version>v[0-9]+)?$')
+"""Matches old-style (``hep-th/9901001``) and new-style arXiv IDs."""
+
+
+def classify(payload: dict, today: Optional[date] = None) -> str:
+    """
+    Get the lane for a record, given its (decoded) payload.
+
+    Parameters
+    ----------
+    payload : dict
+    today : :class:`date`
+        The date from which the age of the paper is reckoned, if not today.
+
+    Returns
+    -------
+    str
+        :data:`NEW` or :data:`BACKFILL`. Records that we can't make sense of
+        are :data:`NEW`, so that their errors are not held up.
+
+    """
+    lane = payload.get('lane')
+    if lane in LANES:
+        return str(lane)
+    if payload.get('backfill'):
+        return BACKFILL
+    match = ARXIV_ID.match(str(payload.get('document_id') or ''))
+    if match is None or match.group('version') \
+            or not 1 <= int(match.group('month')) <= 12:
+        return NEW
+    today = today or date.today()
+    year, month = int(match.group('year')), int(match.group('month'))
+    year += 1900 if year > 90 else 2000     # arXiv started in 1991.
+    age = (today.year - year) * 12 + today.month - month
+    return NEW if age <= RECENT_MONTHS else BACKFILL
+
+
+class Lane:
+    """Records waiting to be processed, in the order that they were read."""
+
+    def __init__(self, name: str) -> None:
+        """Start an empty lane."""
+        self.name = name
+        self._waiting: Deque[Tuple[dict, Optional[str]]] = deque()
+        self._retries: List[str] = []
+        self._since: Optional[float] = None
+
+    def __len__(self) -> int:
+        """Get the number of records waiting in the lane."""
+        return len(self._waiting)
+
+    def __bool__(self) -> bool:
+        """Determine whether there is anything to process in the lane."""
+        return bool(self._waiting or self._retries)
+
+    @property
+    def age(self) -> float:
+        """Get the time (seconds) that the oldest record has been waiting."""
+        if self._since is None:
+            return 0.
+        return time.monotonic() - self._since
+
+    def add(self, record: dict, arxiv_id: Optional[str] = None) -> None:
+        """Add a record (see :meth:`.RecordBatch.add`) to the lane."""
+        if self._since is None:
+            self._since = time.monotonic()
+        self._waiting.append((record, arxiv_id))
+
+    def retry(self, arxiv_id: str) -> None:
+        """Add a paper that is being retried after an earlier failure."""
+        if self._since is None:
+            self._since = time.monotonic()
+        self._retries.append(arxiv_id)
+
+    def take(self, size: int) -> RecordBatch:
+        """
+        Get a batch of up to ``size`` of the oldest records in the lane.
+
+        Papers that are being retried go first, since they have been waiting
+        the longest, and count towards ``size``.
+        """
+        batch = RecordBatch()
+        batch.lane = self.name
+        retries, self._retries = self._retries[:size], self._retries[size:]
+        for arxiv_id in retries:
+            batch.retry(arxiv_id)
+        while self._waiting and len(batch) + len(retries) < size:
+            batch.add(*self._waiting.popleft())
+        # The rest of the records have been waiting since they were read,
+        # but we don't keep track of that; they are the next to go anyway.
+        self._since = time.monotonic() if self else None
+        return batch
+
+
+class Watermark:
+    """Keeps track of the position before which every record is processed."""
+
+    def __init__(self) -> None:
+        """Nothing has been read yet."""
+        self._read: Dict[str, bool] = OrderedDict()
+        """Whether each record that has been read has been processed."""
+
+    def __contains__(self, sequence_number: str) -> bool:
+        """Determine whether a record is waiting to be processed."""
+        return sequence_number in self._read
+
+    def __len__(self) -> int:
+        """Get the number of records that are waiting to be processed."""
+        return len(self._read)
+
+    def read(self, sequence_number: str) -> None:
+        """Note that a record has been read, in stream order."""
+        self._read.setdefault(sequence_number, False)
+
+    def processed(self, records: Iterable[dict]) -> Optional[str]:
+        """
+        Note that records have been processed, and advance the position.
+
+        Returns
+        -------
+        str or None
+            The sequence number of the latest record that has been processed
+            along with every record before it, if that has changed.
+
+        """
+        for record in records:
+            sequence_number = str(record.get('SequenceNumber') or '')
+            if sequence_number in self._read:
+                self._read[sequence_number] = True
+        position: Optional[str] = None
+        while self._read:
+            sequence_number, done = next(iter(self._read.items()))
+            if not done:
+                break
+            del self._read[sequence_number]
+            position = sequence_number
+        return position
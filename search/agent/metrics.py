@@ -0,0 +1,467 @@
+"""
+Throughput, latency, and lag metrics for the indexing agent.
+
+:class:`.AgentMetrics` keeps track of how many records the agent has
+processed, how big its batches are, how long each stage of processing takes,
+which errors it has encountered, and how far behind the stream it is. The
+metrics can be served in the Prometheus text exposition format by a
+:class:`.MetricsServer`, and are summarized in the agent's logs.
+
+The metrics are simple enough that we don't need a client library: each is a
+collection of values (or, for histograms, cumulative bucket counts) keyed by
+label values.
+"""
+
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, Iterable, List, Optional, Sequence, \
+    Tuple
+
+from arxiv.base import logging
+
+from search.process.enrich import Fetch
+from .batch import RecordBatch
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+"""Content type of the Prometheus text exposition format."""
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(name: str, labels: Labels, value: float) -> str:
+    if labels:
+        pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+        name = f'{name}{{{pairs}}}'
+    return f'{name} {_number(value)}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A named metric, with values for each combination of labels."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str) -> None:
+        """Set the name and description of the metric."""
+        self.name = name
+        self.description = description
+        self._values: Dict[Labels, float] = {}
+        # Metrics are updated by the consumers, and exposed by the server.
+        self._lock = threading.RLock()
+
+    def value(self, **labels: Any) -> float:
+        """Get the current value for a combination of labels."""
+        with self._lock:
+            return self._values.get(_labels(labels), 0.)
+
+    def values(self) -> List[Tuple[Labels, float]]:
+        """Get the values for all combinations of labels, in order."""
+        with self._lock:
+            return sorted(self._values.items())
+
+    def total(self, **labels: Any) -> float:
+        """Get the sum of the values for combinations that include labels."""
+        match = set(_labels(labels))
+        return sum(value for key, value in self.values()
+                   if match <= set(key))
+
+    def expose(self) -> List[str]:
+        """Get the lines of the text exposition format for this metric."""
+        return [f'# HELP {self.name} {self.description}',
+                f'# TYPE {self.name} {self.kind}'] + [
+            _format(self.name, labels, value)
+            for labels, value in self.values()
+        ]
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1., **labels: Any) -> None:
+        """Increment the counter."""
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        """Set the value of the gauge."""
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    def max(self, **labels: Any) -> float:
+        """Get the largest value for combinations that include ``labels``."""
+        match = set(_labels(labels))
+        return max((value for key, value in self.values()
+                    if match <= set(key)), default=0.)
+
+
+class Histogram(Metric):
+    """Counts of observed values, in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str,
+                 buckets: Sequence[float]) -> None:
+        """Set the upper bounds of the buckets."""
+        super(Histogram, self).__init__(name, description)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """Add an observation."""
+        key = _labels(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.) + value
+
+    def count(self, **labels: Any) -> int:
+        """Get the number of observations for a combination of labels."""
+        with self._lock:
+            counts = self._counts.get(_labels(labels))
+            return counts[-1] if counts else 0
+
+    def mean(self, **labels: Any) -> float:
+        """Get the mean of the observations for a combination of labels."""
+        with self._lock:
+            count = self.count(**labels)
+            return self._sums[_labels(labels)] / count if count else 0.
+
+    def quantile(self, q: float, **labels: Any) -> float:
+        """Estimate a quantile, as the upper bound of its bucket."""
+        with self._lock:
+            counts = list(self._counts.get(_labels(labels)) or [])
+        if not counts:
+            return 0.
+        for bound, count in zip(self.buckets, counts):
+            if count >= q * counts[-1]:
+                return bound
+        return self.buckets[-1]
+
+    def expose(self) -> List[str]:
+        """Get the lines of the text exposition format for this metric."""
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            histogram = [(labels, list(counts), self._sums[labels])
+                         for labels, counts in sorted(self._counts.items())]
+        for labels, counts, total in histogram:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(_format(f'{self.name}_bucket',
+                                     labels + (('le', _number(bound)),),
+                                     count))
+            lines.append(_format(f'{self.name}_sum', labels, total))
+            lines.append(_format(f'{self.name}_count', labels, counts[-1]))
+        return lines
+
+
+class AgentMetrics:
+    """Metrics for a :class:`.MetadataRecordProcessor`."""
+
+    def __init__(self) -> None:
+        """Define the metrics."""
+        # Each metric has its own lock; this one keeps the metrics for a
+        # batch (etc) consistent with each other.
+        self.lock = threading.Lock()
+        self.records = Counter('search_agent_records_total',
+                               'Stream records processed, by lane.')
+        self.documents = Counter('search_agent_documents_total',
+                                 'Documents by outcome (indexed, skipped).')
+        self.batch_records = Histogram(
+            'search_agent_batch_records', 'Stream records per batch.',
+            [1, 5, 10, 25, 50, 100, 250, 500, 1000]
+        )
+        self.batch_papers = Histogram(
+            'search_agent_batch_papers', 'Distinct papers per batch.',
+            [1, 5, 10, 25, 50, 100, 250, 500, 1000]
+        )
+        self.stage_seconds = Histogram(
+            'search_agent_stage_seconds',
+            'Time spent on each stage (fetch, transform, index) of a batch.',
+            [.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60]
+        )
+        self.errors = Counter('search_agent_errors_total',
+                              'Errors, by the class of the underlying error.')
+        self.record_latency = Histogram(
+            'search_agent_record_latency_seconds',
+            'Time from arrival of a record on the stream until it was'
+            ' processed, by lane.',
+            [1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 21600, 86400]
+        )
+        self.lag = Gauge('search_agent_lag_seconds',
+                         'Time since the most recently processed record'
+                         ' (in each lane) arrived on the stream.')
+        self.waiting = Gauge('search_agent_waiting_records',
+                             'Records that have been read, but are waiting'
+                             ' to be processed, by lane.')
+        self.behind = Gauge('search_agent_millis_behind_latest',
+                            'How far the agent is behind the tip of the'
+                            ' stream, according to Kinesis.')
+        self.delay = Gauge('search_agent_batch_delay_seconds',
+                           'Current delay before each batch.')
+        self.retries = Gauge('search_agent_retry_queue_papers',
+                             'Papers waiting to be retried.')
+        self.shards = Gauge('search_agent_shards',
+                            'Shards of the stream, by state (active,'
+                            ' waiting, finished).')
+        self.checkpoint_seconds = Histogram(
+            'search_agent_checkpoint_seconds',
+            'Time spent writing each checkpoint.',
+            [.0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1]
+        )
+        self.checkpoint_records = Histogram(
+            'search_agent_checkpoint_records',
+            'Stream records processed between checkpoints.',
+            [1, 10, 100, 250, 500, 1000, 2500, 5000, 10000]
+        )
+        self.fulltext = Counter('search_agent_fulltext_total',
+                                'Requests for fulltext, by outcome'
+                                ' (retrieved, missing).')
+        self.fulltext_seconds = Histogram(
+            'search_agent_fulltext_seconds',
+            'Time spent on each request for fulltext.',
+            [.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30]
+        )
+        self.fulltext_chars = Histogram(
+            'search_agent_fulltext_chars',
+            'Size (characters) of the fulltext retrieved for each paper,'
+            ' before it was normalized and truncated.',
+            [1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7]
+        )
+        self.fulltext_truncated = Counter(
+            'search_agent_fulltext_truncated_total',
+            'Fulltext that was truncated before it was indexed.'
+        )
+        self.started = time.time()
+        self._summarized: Tuple[float, float] = (time.monotonic(), 0.)
+
+    @property
+    def all(self) -> List[Metric]:
+        """Get all of the metrics."""
+        return [value for value in vars(self).values()
+                if isinstance(value, Metric)]
+
+    def record_batch(self, batch: RecordBatch, now: Optional[float] = None,
+                     **labels: Any) -> None:
+        """
+        Update the metrics for a batch that has been processed.
+
+        Parameters
+        ----------
+        batch : :class:`.RecordBatch`
+        now : float
+            The time (seconds since the epoch) at which the batch finished.
+        labels : str
+            Labels for the lag (e.g. the ``shard`` that the batch came from).
+            The lag, records, and record latency are also labelled with the
+            lane of the batch, if it has one.
+
+        """
+        now = time.time() if now is None else now
+        lane = {'lane': batch.lane} if batch.lane else {}
+        with self.lock:
+            self.records.inc(len(batch), **lane)
+            self.documents.inc(len(batch.documents) - batch.skipped,
+                               outcome='indexed')
+            self.documents.inc(batch.skipped, outcome='skipped')
+            self.batch_records.observe(len(batch))
+            self.batch_papers.observe(len(batch.arxiv_ids))
+            for stage, seconds in batch.timings.items():
+                self.stage_seconds.observe(seconds, stage=stage)
+            for reason in batch.failed.values():
+                self.errors.inc(error=_root_cause(reason))
+            arrivals = [arrival for arrival in map(_arrival, batch.records)
+                        if arrival is not None]
+            for arrival in arrivals:
+                self.record_latency.observe(now - arrival, **lane)
+            if arrivals:
+                self.lag.set(now - max(arrivals), **labels, **lane)
+
+    def record_fulltext(self, fetches: Iterable[Fetch]) -> None:
+        """Update the metrics for some requests for fulltext."""
+        with self.lock:
+            for fetch in fetches:
+                self.fulltext_seconds.observe(fetch.seconds)
+                if fetch.fulltext is None:
+                    self.fulltext.inc(outcome='missing')
+                    continue
+                self.fulltext.inc(outcome='retrieved')
+                self.fulltext_chars.observe(fetch.size)
+                if fetch.truncated:
+                    self.fulltext_truncated.inc()
+
+    def record_checkpoint(self, seconds: float, records: int) -> None:
+        """
+        Update the metrics for a checkpoint that has been written.
+
+        Parameters
+        ----------
+        seconds : float
+            Time spent writing the checkpoint.
+        records : int
+            Number of records processed since the previous checkpoint.
+
+        """
+        with self.lock:
+            self.checkpoint_seconds.observe(seconds)
+            self.checkpoint_records.observe(records)
+
+    def record_error(self, error: str) -> None:
+        """Count an error that is not associated with a paper."""
+        with self.lock:
+            self.errors.inc(error=error)
+
+    def expose(self) -> str:
+        """Get all of the metrics, in the Prometheus text format."""
+        with self.lock:
+            lines = [line for metric in self.all for line in metric.expose()]
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """Summarize the metrics since the last summary, for logging."""
+        with self.lock:
+            now = time.monotonic()
+            last, last_records = self._summarized
+            records = self.records.total()
+            rate = (records - last_records) / (now - last) if now > last \
+                else 0.
+            self._summarized = (now, records)
+            stages = ', '.join(
+                f'{stage} mean {self.stage_seconds.mean(stage=stage):.2f}s'
+                f' p95 <={self.stage_seconds.quantile(.95, stage=stage)}s'
+                for stage in ('fetch', 'enrich', 'transform', 'index')
+                if self.stage_seconds.count(stage=stage)
+            )
+            checkpoints = 'no checkpoints'
+            if self.checkpoint_seconds.count():
+                checkpoints = (
+                    f'{self.checkpoint_seconds.count()} checkpoints, mean'
+                    f' {self.checkpoint_seconds.mean() * 1000:.1f}ms and'
+                    f' {self.checkpoint_records.mean():.0f} records apart'
+                )
+            fulltext = ''
+            if self.fulltext_seconds.count():
+                retrieved = int(self.fulltext.value(outcome='retrieved'))
+                fulltext = (
+                    f' fulltext {retrieved} retrieved,'
+                    f' {int(self.fulltext.value(outcome="missing"))} missing'
+                    f' (mean {self.fulltext_seconds.mean() * 1000:.0f}ms,'
+                    f' {self.fulltext_chars.mean():.0f} characters);'
+                )
+            lanes = ', '.join(
+                f'{lane} {int(self.records.value(lane=lane))} records'
+                f' (lag {self.lag.max(lane=lane):.1f}s,'
+                f' {int(self.waiting.total(lane=lane))} waiting)'
+                for lane in sorted({dict(key).get('lane') for key, _
+                                    in self.records.values()} - {None})
+            )
+            errors = ', '.join(f'{dict(labels)["error"]}: {int(value)}'
+                               for labels, value in self.errors.values())
+            return (
+                f'{rate:.1f} records/s; {int(records)} records,'
+                f' {int(self.documents.value(outcome="indexed"))} indexed,'
+                f' {int(self.documents.value(outcome="skipped"))} skipped;'
+                f' mean batch {self.batch_records.mean():.1f} records'
+                f' ({self.batch_papers.mean():.1f} papers);'
+                f' {stages or "no batches"}; lag {self.lag.max():.1f}s'
+                f' ({int(self.behind.max())} ms behind latest);'
+                f' {lanes or "no lanes"};'
+                f'{fulltext}'
+                f' {checkpoints};'
+                f' errors: {errors or "none"}'
+            )
+
+
+def _root_cause(exc: BaseException) -> str:
+    """Get the name of the class of the error that started it all."""
+    while exc.__cause__ is not None:
+        exc = exc.__cause__
+    return type(exc).__name__
+
+
+def _arrival(record: dict) -> Optional[float]:
+    """Get the time at which a record arrived on the stream, if known."""
+    arrival = record.get('ApproximateArrivalTimestamp')
+    if arrival is None:
+        return None
+    if isinstance(arrival, (int, float)):
+        return float(arrival)
+    return float(arrival.timestamp())
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Serves :class:`.AgentMetrics` over HTTP, in a background thread."""
+
+    def __init__(self, metrics: AgentMetrics, host: str = '127.0.0.1',
+                 port: int = 9100) -> None:
+        """Bind to ``host`` and ``port``. Use port 0 for any free port."""
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.expose().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug('metrics: ' + format, *args)
+
+        self._server = _Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='metrics', daemon=True)
+
+    @property
+    def port(self) -> int:
+        """Get the port on which metrics are served."""
+        return int(self._server.server_address[1])
+
+    def start(self) -> 'MetricsServer':
+        """Start serving metrics."""
+        self._thread.start()
+        logger.info(f'Serving metrics on port {self.port}')
+        return self
+
+    def stop(self) -> None:
+        """Stop serving metrics."""
+        self._server.shutdown()
+        self._server.server_close()
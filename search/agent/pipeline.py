@@ -0,0 +1,181 @@
+"""
+Runs the stages of batch processing concurrently.
+
+Retrieving metadata, transforming it, and adding documents to the index are
+done by separate worker threads, connected by bounded queues. While one batch
+is being indexed the next can be transformed, and the one after that can be
+retrieved, so the agent spends much less time waiting on the network.
+
+Each stage has a single worker, so batches leave the pipeline in the same
+order in which they entered it. This means that the stream position can be
+advanced (and checkpointed) as batches come out the other end, just as if
+they had been processed one at a time. When the pipeline is full,
+:meth:`.Pipeline.submit` blocks, which stops the consumer from reading more
+records until there is room.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from queue import Queue, Empty
+from typing import Any, Callable, Generator, List, Optional, Sequence, \
+    Tuple
+
+from flask import current_app
+
+from arxiv.base import logging
+
+from .batch import RecordBatch
+
+logger = logging.getLogger(__name__)
+
+StageFunc = Callable[[RecordBatch], None]
+
+
+class StageStats:
+    """Throughput statistics for a single stage of a :class:`.Pipeline`."""
+
+    def __init__(self, name: str) -> None:
+        """Start with no batches."""
+        self.name = name
+        self.batches = 0
+        self.papers = 0
+        self.busy = 0.
+        """Total time (seconds) spent processing batches."""
+
+        self.blocked = 0.
+        """Total time (seconds) spent waiting for room in the next stage."""
+
+    @property
+    def throughput(self) -> float:
+        """Get the number of papers processed per second of work."""
+        return self.papers / self.busy if self.busy else 0.
+
+    def __str__(self) -> str:
+        """Summarize the stats for logging."""
+        return (f'{self.name}: {self.batches} batches, {self.papers} papers,'
+                f' {self.throughput:.1f} papers/s, busy {self.busy:.1f}s,'
+                f' blocked {self.blocked:.1f}s')
+
+
+class Pipeline:
+    """
+    Passes batches through a series of stages, each in its own thread.
+
+    If a stage raises an exception, it is stored on the batch (see
+    :attr:`.RecordBatch.error`) and the batch skips the remaining stages. It
+    is up to the caller to decide what to do about it when the batch is
+    collected with :meth:`.completed` or :meth:`.drain`.
+    """
+
+    def __init__(self, stages: Sequence[Tuple[str, StageFunc]],
+                 depth: int = 2) -> None:
+        """
+        Start a worker thread for each stage.
+
+        Parameters
+        ----------
+        stages : list
+            A sequence of (name, callable) tuples. Each callable is passed a
+            :class:`.RecordBatch`, and updates it in place.
+        depth : int
+            Max number of batches that can wait in front of each stage.
+
+        """
+        self._queues: List[Queue] = [Queue(maxsize=depth) for _ in stages]
+        self._done: Queue = Queue()
+        self._pending = 0
+        self.stats = [StageStats(name) for name, _ in stages]
+
+        try:
+            app: Optional[Any] = current_app._get_current_object()
+        except RuntimeError:    # Not in an application context.
+            app = None
+
+        self._threads = []
+        for i, (name, func) in enumerate(stages):
+            last = i + 1 == len(stages)
+            out = self._done if last else self._queues[i + 1]
+            thread = threading.Thread(
+                target=self._work, name=f'pipeline-{name}', daemon=True,
+                args=(func, self._queues[i], out, not last, self.stats[i],
+                      app)
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def __len__(self) -> int:
+        """Get the number of batches that are still in the pipeline."""
+        return self._pending
+
+    def submit(self, batch: RecordBatch) -> None:
+        """Add a batch to the pipeline, waiting if it is full."""
+        self._pending += 1
+        self._queues[0].put(batch)
+
+    def completed(self) -> List[RecordBatch]:
+        """Get batches that have passed through the pipeline, in order."""
+        batches = []
+        while True:
+            try:
+                batches.append(self._collect(block=False))
+            except Empty:
+                return batches
+
+    def drain(self) -> List[RecordBatch]:
+        """Wait for all of the batches in the pipeline, in order."""
+        return [self._collect(block=True) for _ in range(self._pending)]
+
+    def stop(self) -> None:
+        """Stop the worker threads, once they have finished their batches."""
+        self._queues[0].put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def log_stats(self) -> None:
+        """Log a summary of the throughput of each stage."""
+        for stats in self.stats:
+            logger.info(f'Pipeline {stats}')
+
+    def _collect(self, block: bool) -> RecordBatch:
+        batch: RecordBatch = self._done.get(block=block)
+        self._pending -= 1
+        return batch
+
+    @staticmethod
+    def _work(func: StageFunc, inbox: Queue, outbox: Queue, forward: bool,
+              stats: StageStats, app: Optional[Any]) -> None:
+        with _app_context(app):
+            while True:
+                item = inbox.get()
+                if item is None:    # Pass the signal to stop downstream.
+                    if forward:
+                        outbox.put(None)
+                    return
+                batch: RecordBatch = item
+                if batch.error is None:
+                    started = time.monotonic()
+                    try:
+                        func(batch)
+                    except Exception as e:
+                        logger.error(f'Pipeline stage {stats.name}'
+                                     f' failed: {e}')
+                        batch.error = e
+                    elapsed = time.monotonic() - started
+                    batch.timings[stats.name] = elapsed
+                    stats.busy += elapsed
+                    stats.batches += 1
+                    stats.papers += len(batch.arxiv_ids)
+                started = time.monotonic()
+                outbox.put(batch)
+                stats.blocked += time.monotonic() - started
+
+
+@contextmanager
+def _app_context(app: Optional[Any]) -> Generator:
+    """Use the application context (if any) of the consumer's thread."""
+    if app is None:
+        yield
+    else:
+        with app.app_context():
+            yield
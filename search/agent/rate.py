@@ -0,0 +1,126 @@
+"""
+Controls the rate at which the indexing agent processes records.
+
+Rather than waiting a fixed amount of time between batches, the agent adjusts
+the delay based on how things are going downstream and how far behind the
+stream it is. This is an additive-increase/multiplicative-decrease (AIMD)
+scheme: while the agent is behind and the metadata service and index are
+healthy, the delay shrinks by a small fixed step; as soon as there are signs
+of pressure (slow batches, or 429/503 responses) the delay is multiplied.
+"""
+
+import time
+from typing import Optional
+
+from arxiv.base import logging
+
+logger = logging.getLogger(__name__)
+
+THROTTLED = {429, 503}
+"""Status codes that indicate that a service wants us to slow down."""
+
+
+def is_throttled(exc: Optional[BaseException]) -> bool:
+    """
+    Determine whether an exception was caused by a service throttling us.
+
+    Looks for a ``status_code`` (or ``status_codes``) attribute on the
+    exception, and on the exceptions that caused it.
+    """
+    while exc is not None:
+        codes = getattr(exc, 'status_codes', None) \
+            or [getattr(exc, 'status_code', None)]
+        if THROTTLED & set(codes):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class RateController:
+    """Adapts the delay between batches to downstream health and lag."""
+
+    MIN_POLL_INTERVAL = 0.2
+    """Kinesis allows up to five reads per second from each shard."""
+
+    def __init__(self, delay: float = 0.1, min_delay: float = 0.,
+                 max_delay: float = 30., step: float = 0.05,
+                 backoff: float = 2., target_latency: float = 10.,
+                 max_lag: int = 1000) -> None:
+        """
+        Set the initial delay, and the parameters for adjusting it.
+
+        Parameters
+        ----------
+        delay : float
+            Initial delay (seconds) before each batch.
+        min_delay : float
+            Lower bound for the delay.
+        max_delay : float
+            Upper bound for the delay.
+        step : float
+            Amount (seconds) by which to decrease the delay when there is
+            headroom.
+        backoff : float
+            Factor by which to increase the delay when there is pressure.
+        target_latency : float
+            Batches that take longer than this (seconds) to process are
+            treated as a sign of pressure.
+        max_lag : int
+            If the agent is more than this many milliseconds behind the tip of
+            the stream, it will try to speed up.
+
+        """
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.step = step
+        self.backoff = backoff
+        self.target_latency = target_latency
+        self.max_lag = max_lag
+        self.lag: Optional[int] = None
+        """How far (milliseconds) the agent is behind the tip of the stream."""
+
+    @property
+    def rate(self) -> float:
+        """Get the max number of batches per second currently allowed."""
+        return 1. / self.delay if self.delay else float('inf')
+
+    @property
+    def behind(self) -> bool:
+        """Determine whether the agent is falling behind the stream."""
+        return self.lag is not None and self.lag > self.max_lag
+
+    def wait(self) -> None:
+        """Wait before processing the next batch."""
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+    def poll_interval(self, default: float) -> float:
+        """Get the time to wait before reading more records."""
+        return self.MIN_POLL_INTERVAL if self.behind else default
+
+    def update(self, latency: float, throttled: bool = False) -> None:
+        """
+        Adjust the delay based on the outcome of a batch.
+
+        Parameters
+        ----------
+        latency : float
+            Time (seconds) that it took to process the batch.
+        throttled : bool
+            Whether a service asked us to slow down.
+
+        """
+        previous = self.delay
+        if throttled or latency > self.target_latency:
+            self.delay = min(self.max_delay,
+                             max(self.delay * self.backoff, self.step))
+            reason = 'throttled' if throttled else f'took {latency:.1f}s'
+            logger.warning(f'Backing off ({reason}): delay is now'
+                           f' {self.delay:.2f}s')
+        elif self.behind:
+            self.delay = max(self.min_delay, self.delay - self.step)
+        if self.delay != previous:
+            logger.info(f'Delay between batches {previous:.2f}s ->'
+                        f' {self.delay:.2f}s ({self.rate:.1f} batches/s,'
+                        f' {self.lag} ms behind)')
@@ -0,0 +1,247 @@
+"""
+Retries papers that could not be indexed because of transient failures.
+
+When the metadata service or the index are slow or briefly unavailable, the
+agent should not stop processing the stream. Instead, papers that failed for
+reasons that are likely to go away (e.g. connection errors, or 429/5xx
+responses) are put in a :class:`.RetryQueue`, and are added to a later batch
+once their delay has elapsed. The delay grows exponentially with each attempt,
+with random jitter so that papers that failed together are not all retried
+together.
+
+Papers that run out of attempts, or that failed for reasons that retrying will
+not fix, are written to a :class:`.DeadLetters` file. Once the underlying
+problem has been fixed, the papers in that file can be indexed with
+``replay.py``.
+"""
+
+import heapq
+import json
+import os
+import random
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from arxiv.base import logging
+
+from search.services import metadata, index
+
+from .rate import is_throttled
+
+logger = logging.getLogger(__name__)
+
+
+def is_transient(exc: Optional[BaseException]) -> bool:
+    """
+    Determine whether an exception was caused by a transient failure.
+
+    Connection errors, throttling, and server errors are likely to go away if
+    we try again later. Anything else (e.g. a bad response from the metadata
+    service, or a document that the index rejected) is not.
+    """
+    if is_throttled(exc):
+        return True
+    while exc is not None:
+        if isinstance(exc, (metadata.ConnectionFailed,
+                            index.IndexConnectionError)):
+            return True
+        codes = getattr(exc, 'status_codes', None) \
+            or [getattr(exc, 'status_code', None)]
+        if any(isinstance(code, int) and code >= 500 for code in codes):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class DeadLetters:
+    """
+    A local file of papers that could not be indexed.
+
+    Each line is a JSON object with the ``arxiv_id`` of the paper, the number
+    of ``attempts`` that were made, the ``reason`` for the last failure, and
+    when it ``failed``.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Set the path to the dead-letter file."""
+        self.path = path
+
+    @property
+    def _replaying(self) -> str:
+        return self.path + '.replaying'
+
+    def add(self, arxiv_id: str, reason: str, attempts: int = 1) -> None:
+        """Append a paper to the dead-letter file."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps({'arxiv_id': arxiv_id, 'attempts': attempts,
+                           'reason': reason,
+                           'failed': datetime.utcnow().isoformat()})
+        with open(self.path, 'a') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        logger.error(f'{arxiv_id}: giving up after {attempts} attempt(s);'
+                     f' added to {self.path}: {reason}')
+
+    def read(self) -> List[dict]:
+        """Get the entries in the dead-letter file, without removing them."""
+        entries = []
+        for path in (self._replaying, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                entries += [json.loads(line) for line in f if line.strip()]
+        return entries
+
+    def take(self) -> List[str]:
+        """
+        Remove the papers from the dead-letter file, for replay.
+
+        The file is moved aside before it is read, so that papers added while
+        the replay is in progress are not lost. If an earlier replay did not
+        finish, its papers are included as well.
+
+        Returns
+        -------
+        list
+            Unique arXiv IDs, in the order in which they first failed.
+
+        """
+        if os.path.exists(self.path):
+            if os.path.exists(self._replaying):
+                with open(self.path) as src, open(self._replaying, 'a') as dst:
+                    dst.write(src.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self._replaying)
+        arxiv_ids = {entry['arxiv_id']: None for entry in self.read()}
+        return list(arxiv_ids)
+
+    def done(self) -> None:
+        """Discard the papers taken for replay, once they have been handled."""
+        if os.path.exists(self._replaying):
+            os.remove(self._replaying)
+
+
+class RetryQueue:
+    """
+    Papers waiting to be retried, ordered by when they are due.
+
+    The delay before attempt ``n`` is drawn uniformly from between half of
+    and the full ``base_delay * 2 ** (n - 1)`` (capped at ``max_delay``).
+    """
+
+    def __init__(self, dead_letters: DeadLetters, max_attempts: int = 5,
+                 base_delay: float = 1., max_delay: float = 300.) -> None:
+        """
+        Set the parameters for retrying papers.
+
+        Parameters
+        ----------
+        dead_letters : :class:`.DeadLetters`
+            Where to put papers that will not be retried.
+        max_attempts : int
+            Max number of times to try indexing each paper.
+        base_delay : float
+            Delay (seconds) before the first retry, before jitter.
+        max_delay : float
+            Max delay (seconds) before any retry.
+
+        """
+        self.dead_letters = dead_letters
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap: List[Tuple[float, int, str]] = []
+        self._scheduled: Dict[str, int] = {}
+        """Papers waiting to be retried, and their (current) heap entries."""
+
+        self._attempts: Dict[str, int] = {}
+        self._reasons: Dict[str, str] = {}
+        self._counter = 0
+
+    def __len__(self) -> int:
+        """Get the number of papers waiting to be retried."""
+        return len(self._scheduled)
+
+    def __contains__(self, arxiv_id: object) -> bool:
+        """Determine whether a paper is waiting to be retried."""
+        return arxiv_id in self._scheduled
+
+    def attempts(self, arxiv_id: str) -> int:
+        """Get the number of failed attempts to index a paper."""
+        return self._attempts.get(arxiv_id, 0)
+
+    def delay(self, attempts: int) -> float:
+        """Get a (jittered) delay before the next attempt."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    def failed(self, arxiv_id: str, reason: BaseException) -> bool:
+        """
+        Handle a failed attempt to index a paper.
+
+        Parameters
+        ----------
+        arxiv_id : str
+            The paper that failed.
+        reason : Exception
+            Why it failed.
+
+        Returns
+        -------
+        bool
+            True if the paper will be retried, or False if it was added to
+            the dead-letter file.
+
+        """
+        attempts = self._attempts.get(arxiv_id, 0) + 1
+        description = f'{type(reason).__name__}: {reason}'
+        if not is_transient(reason) or attempts >= self.max_attempts:
+            self._forget(arxiv_id)
+            self.dead_letters.add(arxiv_id, description, attempts)
+            return False
+        if arxiv_id in self:      # Already scheduled by an earlier batch.
+            return True
+        self._attempts[arxiv_id] = attempts
+        self._reasons[arxiv_id] = description
+        delay = self.delay(attempts)
+        self._counter += 1
+        self._scheduled[arxiv_id] = self._counter
+        heapq.heappush(self._heap,
+                       (time.monotonic() + delay, self._counter, arxiv_id))
+        logger.warning(f'{arxiv_id}: attempt {attempts} failed, retrying in'
+                       f' {delay:.1f}s: {description}')
+        return True
+
+    def succeeded(self, arxiv_id: str) -> None:
+        """Forget about a paper that was indexed, e.g. for a later record."""
+        self._forget(arxiv_id)
+
+    def due(self) -> List[str]:
+        """Get the papers that are ready to be retried."""
+        now = time.monotonic()
+        arxiv_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            _, counter, arxiv_id = heapq.heappop(self._heap)
+            # Papers that were indexed in the meantime leave stale entries.
+            if self._scheduled.get(arxiv_id) == counter:
+                del self._scheduled[arxiv_id]
+                arxiv_ids.append(arxiv_id)
+        return arxiv_ids
+
+    def spool(self) -> None:
+        """Move papers that are still waiting to the dead-letter file."""
+        for arxiv_id in list(self._scheduled):
+            self.dead_letters.add(arxiv_id, self._reasons.get(arxiv_id, ''),
+                                  self._attempts.get(arxiv_id, 0))
+            self._forget(arxiv_id)
+        self._heap.clear()
+
+    def _forget(self, arxiv_id: str) -> None:
+        self._scheduled.pop(arxiv_id, None)
+        self._attempts.pop(arxiv_id, None)
+        self._reasons.pop(arxiv_id, None)
@@ -0,0 +1,306 @@
+"""
+Consumes all of the shards of a stream, in a single process.
+
+:class:`.ShardCoordinator` discovers the shards of the stream, and runs a
+:class:`.MetadataRecordProcessor` for each one in its own thread. Each
+consumer keeps its own checkpoint, but they all share one Kinesis client and
+(via the consumer factory) one session with each of the metadata service and
+the search index.
+
+When a stream is resharded, the parent shards are closed, and new child
+shards are opened. Records for a paper should be processed in order, so a
+child shard is not consumed until every record in its parent(s) has been
+processed; consumers mark closed shards that they have finished with a
+:data:`.SHARD_END` checkpoint. Shards are rediscovered periodically, and
+whenever a consumer finishes a shard.
+"""
+
+import os
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set
+
+import boto3
+from botocore.exceptions import WaiterError
+
+from arxiv.base import logging
+from arxiv.base.agent import StopProcessing
+
+from .consumer import MetadataRecordProcessor, SHARD_END
+from .metrics import AgentMetrics
+
+logger = logging.getLogger(__name__)
+
+ConsumerFactory = Callable[[str, bool], MetadataRecordProcessor]
+
+
+def connect(config: Mapping[str, Any]) -> Any:
+    """
+    Get a Kinesis client, and wait for the stream to be available.
+
+    The stream is created (with one shard) if it does not exist, e.g. when
+    developing against localstack.
+    """
+    params = dict(endpoint_url=config.get('KINESIS_ENDPOINT') or None,
+                  verify=config.get('KINESIS_VERIFY', 'true') == 'true',
+                  region_name=config.get('AWS_REGION', 'us-east-1'))
+    # Only add these if they are set, so that we can use a shared
+    # credentials file via an environment variable.
+    access_key = config.get('AWS_ACCESS_KEY_ID')
+    secret_key = config.get('AWS_SECRET_ACCESS_KEY')
+    if access_key and secret_key:
+        params.update(aws_access_key_id=access_key,
+                      aws_secret_access_key=secret_key)
+    client = boto3.client('kinesis', **params)
+    stream_name = config['KINESIS_STREAM']
+    logger.info(f'Waiting for {stream_name} to be available')
+    try:
+        client.get_waiter('stream_exists').wait(StreamName=stream_name)
+    except WaiterError:
+        logger.info(f'Could not find {stream_name}; attempting to create it')
+        client.create_stream(StreamName=stream_name, ShardCount=1)
+        client.get_waiter('stream_exists').wait(StreamName=stream_name)
+    return client
+
+
+def legacy_shard_id(shard_id: str) -> Optional[str]:
+    """
+    Get the short form of a shard ID, e.g. ``0`` for ``shardId-000000000000``.
+
+    Before the agent consumed every shard, checkpoints were named with the
+    configured ``KINESIS_SHARD_ID``, which was usually the short form.
+    """
+    prefix, _, number = shard_id.rpartition('-')
+    if prefix != 'shardId' or not number.isdigit():
+        return None
+    return str(int(number))
+
+
+def read_legacy_checkpoint(volume: str, stream_name: str,
+                           shard_id: str) -> Optional[str]:
+    """Get the position from a checkpoint named with the short shard ID."""
+    short_id = legacy_shard_id(shard_id)
+    if short_id is None:
+        return None
+    path = os.path.join(volume, f'{stream_name}__{short_id}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+
+class ShardWorker:
+    """Runs the consumer for one shard, in a thread."""
+
+    def __init__(self, shard_id: str,
+                 consumer: MetadataRecordProcessor) -> None:
+        """Set up (but don't start) the thread for ``consumer``."""
+        self.shard_id = shard_id
+        self.consumer = consumer
+        self.error: Optional[Exception] = None
+        self.stopped: Optional[float] = None
+        """When the worker stopped (monotonic), if it has."""
+
+        self.on_exit: Callable[[], None] = lambda: None
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'shard-{shard_id}')
+
+    @property
+    def finished(self) -> bool:
+        """Determine whether every record in the (closed) shard is done."""
+        return self.consumer.position == SHARD_END
+
+    @property
+    def alive(self) -> bool:
+        """Determine whether the worker is still running."""
+        return self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start consuming the shard."""
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Ask the consumer to stop, and wait for it to finish."""
+        self.consumer.shutdown()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            self.consumer.go()
+        except StopProcessing as e:
+            if not self.consumer.stopping.is_set():
+                logger.error(f'Shard {self.shard_id}: stopped: {e}')
+                self.error = e
+        except Exception as e:
+            logger.error(f'Shard {self.shard_id}: failed: {e}')
+            self.error = e
+        finally:
+            self.stopped = time.monotonic()
+            self.on_exit()
+
+
+class ShardCoordinator:
+    """Runs a consumer for each shard of a stream."""
+
+    DISCOVERY_INTERVAL = 60.
+    """Default time (seconds) between looking for new shards."""
+
+    RESTART_DELAY = 30.
+    """Default time (seconds) to wait before restarting a failed consumer."""
+
+    def __init__(self, client: Any, stream_name: str,
+                 make_consumer: ConsumerFactory,
+                 metrics: Optional[AgentMetrics] = None,
+                 shard_ids: Optional[List[str]] = None,
+                 discovery_interval: float = DISCOVERY_INTERVAL,
+                 restart_delay: float = RESTART_DELAY) -> None:
+        """
+        Configure the coordinator.
+
+        Parameters
+        ----------
+        client : object
+            A Kinesis client, shared by all of the consumers.
+        stream_name : str
+            The stream to consume.
+        make_consumer : callable
+            Creates a consumer for a shard, given the shard ID and whether
+            to start from the beginning of the shard if there is no
+            checkpoint (as for the children of a shard that we consumed).
+            The consumer should load its checkpoint for that shard.
+        metrics : :class:`.AgentMetrics`
+            Metrics shared by all of the consumers.
+        shard_ids : list
+            If given, only these shards are consumed.
+        discovery_interval : float
+            Time (seconds) between looking for new shards.
+        restart_delay : float
+            Time (seconds) to wait before restarting a consumer that failed.
+
+        """
+        self.client = client
+        self.stream_name = stream_name
+        self.make_consumer = make_consumer
+        self.metrics = metrics
+        self.shard_ids = shard_ids
+        self.discovery_interval = discovery_interval
+        self.restart_delay = restart_delay
+        self.workers: Dict[str, ShardWorker] = {}
+        self.finished: Set[str] = set()
+        self._changed = threading.Event()
+        self._stopping = threading.Event()
+
+    def list_shards(self) -> List[dict]:
+        """Get all of the shards of the stream (open, or not yet expired)."""
+        shards: List[dict] = []
+        params: Dict[str, Any] = {'StreamName': self.stream_name}
+        while True:
+            description = \
+                self.client.describe_stream(**params)['StreamDescription']
+            shards += description['Shards']
+            if not description.get('HasMoreShards') or not shards:
+                return shards
+            params['ExclusiveStartShardId'] = shards[-1]['ShardId']
+
+    def _ready(self, shard: dict, known: Set[str]) -> bool:
+        """Determine whether the parents of ``shard`` have been processed."""
+        parents = [shard.get('ParentShardId'),
+                   shard.get('AdjacentParentShardId')]
+        # Parents that have expired from the stream can't hold us up.
+        return all(parent in self.finished for parent in parents
+                   if parent and parent in known)
+
+    def rebalance(self) -> None:
+        """Start consumers for shards that are ready, and restart failures."""
+        for shard_id, worker in list(self.workers.items()):
+            if worker.alive:
+                continue
+            if worker.finished:
+                logger.info(f'Shard {shard_id}: finished')
+                self.finished.add(shard_id)
+                del self.workers[shard_id]
+            elif worker.stopped is not None and time.monotonic() \
+                    - worker.stopped >= self.restart_delay:
+                logger.warning(f'Shard {shard_id}: restarting consumer')
+                del self.workers[shard_id]
+
+        try:
+            shards = self.list_shards()
+        except Exception as e:  # We'll try again later.
+            logger.error(f'Could not list the shards of {self.stream_name}:'
+                         f' {e}')
+            return
+        if self.shard_ids:
+            shards = [shard for shard in shards
+                      if shard['ShardId'] in self.shard_ids
+                      or legacy_shard_id(shard['ShardId']) in self.shard_ids]
+        known = {shard['ShardId'] for shard in shards}
+        waiting = 0
+        for shard in shards:
+            shard_id = shard['ShardId']
+            if shard_id in self.finished or shard_id in self.workers:
+                continue
+            if not self._ready(shard, known):
+                waiting += 1
+                continue
+            has_parent = any(shard.get(key) in known for key
+                             in ('ParentShardId', 'AdjacentParentShardId'))
+            worker = ShardWorker(shard_id,
+                                 self.make_consumer(shard_id, has_parent))
+            if worker.finished:     # According to its checkpoint.
+                self.finished.add(shard_id)
+                continue
+            logger.info(f'Shard {shard_id}: starting consumer')
+            worker.on_exit = self._changed.set
+            self.workers[shard_id] = worker
+            worker.start()
+        if self.metrics is not None:
+            self.metrics.shards.set(len(self.workers), state='active')
+            self.metrics.shards.set(waiting, state='waiting')
+            self.metrics.shards.set(len(self.finished), state='finished')
+
+    def run(self, duration: Optional[int] = None) -> None:
+        """
+        Consume the stream until we are asked to stop.
+
+        Parameters
+        ----------
+        duration : int
+            Time (in seconds) to consume records. If None (default), will
+            run "forever".
+
+        """
+        started = time.monotonic()
+        try:
+            while not self._stopping.is_set():
+                self._changed.clear()
+                self.rebalance()
+                if duration is not None \
+                        and time.monotonic() - started > duration:
+                    break
+                timeout = self.discovery_interval
+                if duration is not None:
+                    timeout = min(timeout, max(0., started + duration
+                                               - time.monotonic()))
+                self._changed.wait(timeout)
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """Stop all of the consumers, once they have checkpointed."""
+        self._stopping.set()
+        self._changed.set()
+        for shard_id, worker in list(self.workers.items()):
+            logger.info(f'Shard {shard_id}: stopping consumer')
+            worker.stop()
+
+    def handle_signals(self) -> None:
+        """Stop gracefully on SIGINT or SIGTERM (from the main thread)."""
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        logger.error(f'Received signal {signum}')
+        self._stopping.set()
+        self._changed.set()
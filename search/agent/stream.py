@@ -0,0 +1,164 @@
+"""
+A local, file-backed stand-in for a Kinesis stream.
+
+:class:`.FileStream` serves ``MetadataIsAvailable`` records from an NDJSON
+file, through the subset of the boto3 Kinesis client that the agent uses
+(:meth:`.FileStream.describe_stream`, :meth:`.FileStream.get_shard_iterator`
+and :meth:`.FileStream.get_records`). Passing one to
+:class:`.MetadataRecordProcessor` as its ``client`` replaces the connection
+to Kinesis, so that the agent can be run and measured without localstack.
+
+Each line of the file is the payload of one record, e.g.
+``{"document_id": "1712.04442"}``. Records are numbered from 1, and the
+number is used as the sequence number so that checkpoints work as usual.
+By default all of the records arrive when the stream is opened; if a
+``rate`` is given, records arrive at that many per second instead, and are
+not served before they arrive.
+"""
+
+import time
+from typing import Any, List, Optional
+
+from arxiv.base import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidArgumentException(ValueError):
+    """A shard iterator or sequence number is not valid for the stream."""
+
+
+class _Exceptions:
+    """Mimics the ``exceptions`` attribute of a boto3 client."""
+
+    InvalidArgumentException = InvalidArgumentException
+
+
+class FileStream:
+    """Serves stream records from a local NDJSON file."""
+
+    exceptions = _Exceptions
+
+    def __init__(self, path: str, rate: Optional[float] = None,
+                 name: str = 'MetadataIsAvailable',
+                 shard_id: str = 'shardId-000000000000') -> None:
+        """
+        Load the records in the file at ``path``.
+
+        Parameters
+        ----------
+        path : str
+            Path to an NDJSON file, with the payload of one record per line.
+        rate : float
+            Number of records that arrive per second. If None (default), all
+            of the records arrive when the stream is opened.
+        name : str
+            Name of the stream, for logging and checkpoints.
+        shard_id : str
+            ID of the (only) shard, for logging and checkpoints.
+
+        """
+        self.path = path
+        self.rate = rate
+        self.name = name
+        self.shard_id = shard_id
+        with open(path, 'rb') as f:
+            self._data: List[bytes] = [line.strip() for line in f
+                                       if line.strip()]
+        self.opened = time.time()
+        self._served = 0
+        logger.info(f'Serving {len(self._data)} records from {path}')
+
+    def __len__(self) -> int:
+        """Get the number of records in the stream."""
+        return len(self._data)
+
+    @property
+    def exhausted(self) -> bool:
+        """Determine whether every record has been served at least once."""
+        return self._served >= len(self._data)
+
+    def arrival(self, offset: int) -> float:
+        """Get the time at which the record at ``offset`` arrives."""
+        if not self.rate:
+            return self.opened
+        return self.opened + offset / self.rate
+
+    def _arrived(self) -> int:
+        """Get the number of records that have arrived so far."""
+        if not self.rate:
+            return len(self._data)
+        count = int((time.time() - self.opened) * self.rate) + 1
+        return max(0, min(len(self._data), count))
+
+    def describe_stream(self, StreamName: str = '', **extra: Any) -> dict:
+        """Describe the stream, which has a single shard that never closes."""
+        return {'StreamDescription': {
+            'StreamName': self.name,
+            'StreamStatus': 'ACTIVE',
+            'Shards': [{'ShardId': self.shard_id,
+                        'SequenceNumberRange': {
+                            'StartingSequenceNumber': '1'
+                        }}],
+            'HasMoreShards': False
+        }}
+
+    def get_shard_iterator(self, StreamName: str = '', ShardId: str = '',
+                           ShardIteratorType: str = 'TRIM_HORIZON',
+                           StartingSequenceNumber: Optional[str] = None,
+                           Timestamp: Optional[float] = None,
+                           **extra: Any) -> dict:
+        """
+        Get an iterator from which to start reading records.
+
+        Supports the ``TRIM_HORIZON``, ``LATEST``, ``AT_TIMESTAMP``,
+        ``AT_SEQUENCE_NUMBER`` and ``AFTER_SEQUENCE_NUMBER`` iterator types.
+        """
+        if ShardIteratorType in ('AT_SEQUENCE_NUMBER',
+                                 'AFTER_SEQUENCE_NUMBER'):
+            try:
+                offset = int(StartingSequenceNumber or '')
+            except ValueError as e:
+                raise InvalidArgumentException(
+                    f'Invalid sequence number: {StartingSequenceNumber}'
+                ) from e
+            if not 0 < offset <= len(self._data):
+                raise InvalidArgumentException(
+                    f'No such sequence number: {StartingSequenceNumber}'
+                )
+            if ShardIteratorType == 'AT_SEQUENCE_NUMBER':
+                offset -= 1
+        elif ShardIteratorType == 'AT_TIMESTAMP' and Timestamp is not None:
+            offset = 0
+            while offset < len(self._data) \
+                    and self.arrival(offset) < float(Timestamp):
+                offset += 1
+        elif ShardIteratorType == 'LATEST':
+            offset = self._arrived()
+        else:
+            offset = 0
+        return {'ShardIterator': str(offset)}
+
+    def get_records(self, ShardIterator: str, Limit: int = 10000,
+                    **extra: Any) -> dict:
+        """Get up to ``Limit`` records that have arrived, from an iterator."""
+        try:
+            offset = int(ShardIterator)
+        except ValueError as e:
+            raise InvalidArgumentException(
+                f'Invalid shard iterator: {ShardIterator}'
+            ) from e
+        end = min(offset + Limit, self._arrived())
+        records = [{
+            'SequenceNumber': str(i + 1),
+            'ApproximateArrivalTimestamp': self.arrival(i),
+            'Data': self._data[i],
+            'PartitionKey': '0'
+        } for i in range(offset, end)]
+        self._served = max(self._served, end)
+        arrived = self._arrived()
+        behind = 0.
+        if arrived > end:    # Time from the last record served to the tip.
+            behind = self.arrival(arrived - 1) - self.arrival(max(0, end - 1))
+        return {'Records': records, 'NextShardIterator': str(max(offset, end)),
+                'MillisBehindLatest': int(behind * 1000)}
@@ -0,0 +1,168 @@
+"""Tests for :mod:`search.agent.checkpoint`."""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from arxiv.base.agent import CheckpointError
+
+from search.domain import DocMeta
+from search.services import metadata
+from search.agent import consumer
+from search.agent.checkpoint import AtomicCheckpointManager, \
+    CheckpointPolicy
+
+from .util import _record
+
+
+class TestAtomicCheckpointManager(TestCase):
+    """:class:`.AtomicCheckpointManager` durably stores the position."""
+
+    def setUp(self):
+        """Create a checkpoint volume."""
+        self.volume = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the checkpoint volume."""
+        shutil.rmtree(self.volume)
+
+    def test_checkpoint(self):
+        """The position is written to the same file as before."""
+        checkpointer = AtomicCheckpointManager(self.volume, 'stream', '0')
+        self.assertIsNone(checkpointer.position)
+        checkpointer.checkpoint('12345')
+        checkpointer.checkpoint('12346')
+        self.assertEqual(checkpointer.position, '12346')
+        self.assertEqual(os.listdir(self.volume), ['stream__0.json'],
+                         'No temporary files are left behind')
+        self.assertEqual(
+            AtomicCheckpointManager(self.volume, 'stream', '0').position,
+            '12346'
+        )
+
+    @mock.patch('search.agent.checkpoint.os.fsync')
+    def test_failed_write(self, mock_fsync):
+        """The previous checkpoint survives a failed write."""
+        checkpointer = AtomicCheckpointManager(self.volume, 'stream', '0')
+        checkpointer.checkpoint('12345')
+        mock_fsync.side_effect = OSError('disk full')
+        with self.assertRaises(CheckpointError):
+            checkpointer.checkpoint('12346')
+        self.assertEqual(checkpointer.position, '12345')
+        self.assertEqual(os.listdir(self.volume), ['stream__0.json'])
+        with open(os.path.join(self.volume, 'stream__0.json')) as f:
+            self.assertEqual(f.read(), '12345')
+
+    def test_no_volume(self):
+        """The checkpoint volume must exist."""
+        with self.assertRaises(ValueError):
+            AtomicCheckpointManager(os.path.join(self.volume, 'nope'),
+                                    'stream', '0')
+
+
+class TestCheckpointPolicy(TestCase):
+    """:class:`.CheckpointPolicy` decides when to checkpoint."""
+
+    def test_every_records(self):
+        """A checkpoint is due once enough records have been processed."""
+        policy = CheckpointPolicy(every_records=10, every_seconds=0)
+        self.assertFalse(policy.due)
+        policy.processed(6)
+        self.assertFalse(policy.due)
+        policy.processed(4)
+        self.assertTrue(policy.due)
+        policy.reset()
+        self.assertFalse(policy.due)
+
+    @mock.patch('search.agent.checkpoint.time.monotonic')
+    def test_every_seconds(self, mock_monotonic):
+        """A checkpoint is due after an interval, if there is work."""
+        mock_monotonic.return_value = 100.
+        policy = CheckpointPolicy(every_records=0, every_seconds=5)
+        mock_monotonic.return_value = 106.
+        self.assertFalse(policy.due, 'Nothing to checkpoint')
+        policy.processed(1)
+        self.assertTrue(policy.due)
+
+    def test_every_batch(self):
+        """With no limits, a checkpoint is due whenever there is work."""
+        policy = CheckpointPolicy(every_records=0, every_seconds=0)
+        self.assertFalse(policy.due)
+        policy.processed(1)
+        self.assertTrue(policy.due)
+
+
+class TestConsumerCheckpoints(TestCase):
+    """The consumer checkpoints according to its policy."""
+
+    def setUp(self):
+        """Create a consumer for a shard with five records."""
+        self.workdir = tempfile.mkdtemp()
+        self.client = mock.MagicMock()
+        self.client.get_shard_iterator.return_value = {'ShardIterator': '0'}
+        self.client.get_records.side_effect = [
+            {'Records': [_record(i, '1234.56789')],
+             'NextShardIterator': str(i)} for i in range(1, 5)
+        ] + [{'Records': [_record(5, '1234.56789')]}]
+        self.checkpointer = mock.MagicMock(position=None)
+        metadata_session = mock.MagicMock()
+        metadata_session.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1)
+        ]
+        index_session = mock.MagicMock()
+        index_session.bulk_add_documents.return_value = 1
+        self.processor = consumer.MetadataRecordProcessor(
+            'stream', 'shardId-0', checkpointer=self.checkpointer,
+            client=self.client, sleep=0, max_batch_size=1,
+            metadata_session=metadata_session, index_session=index_session,
+            checkpoint_every=2, checkpoint_interval=0,
+            dead_letter_path=os.path.join(self.workdir, 'dead.ndjson')
+        )
+        self.processor.sleep_time = 0
+
+    def tearDown(self):
+        """Remove the dead-letter file."""
+        shutil.rmtree(self.workdir)
+
+    def test_checkpoint_every_records(self):
+        """Checkpoints are written every two records, and at the end."""
+        self.processor.go()
+        self.assertEqual(self.checkpointer.checkpoint.call_args_list,
+                         [mock.call('2'), mock.call('4'),
+                          mock.call(consumer.SHARD_END)])
+        self.assertEqual(
+            self.processor.metrics.checkpoint_seconds.count(), 3
+        )
+        self.assertEqual(self.processor.metrics.checkpoint_records.mean(),
+                         5 / 3)
+
+    def test_failure_spools_retries(self):
+        """If processing fails, papers waiting to be retried are not lost."""
+        self.processor.retries.base_delay = 60
+        self.processor.retries.failed('2345.67890',
+                                      metadata.ConnectionFailed('nope'))
+        self.processor._index_batch = mock.MagicMock(
+            side_effect=RuntimeError('nope')
+        )
+
+        with self.assertRaises(RuntimeError):
+            self.processor.go()
+
+        self.assertEqual(len(self.processor.retries), 0)
+        entries = self.processor.retries.dead_letters.read()
+        self.assertEqual([e['arxiv_id'] for e in entries], ['2345.67890'])
+        self.assertEqual(self.checkpointer.checkpoint.call_count, 0,
+                         'The failed record is not checkpointed')
+
+    def test_failure_checkpoints_done_records(self):
+        """If processing fails, the records that are done are checkpointed."""
+        self.processor._index_batch = mock.MagicMock(side_effect=[
+            None, None, None, RuntimeError('nope')
+        ])
+
+        with self.assertRaises(RuntimeError):
+            self.processor.go()
+
+        self.assertEqual(self.checkpointer.checkpoint.call_args_list,
+                         [mock.call('2'), mock.call('3')])
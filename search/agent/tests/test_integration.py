@@ -83,10 +83,16 @@ class TestKinesisIntegration(TestCase):
                                  stderr=subprocess.PIPE,
                                  shell=True)
 
+    @mock.patch('search.agent.index')
+    @mock.patch('search.agent.metadata')
     @mock.patch('search.agent.consumer.index')
     @mock.patch('search.agent.consumer.metadata')
-    def test_process(self, mock_metadata, mock_index):
+    def test_process(self, mock_metadata, mock_index, mock_agent_metadata,
+                     mock_agent_index):
         """Add some records to the stream, and run processing loop for 5s."""
+        # The consumers use sessions created by process_stream.
+        mock_agent_metadata.get_session.return_value = mock_metadata
+        mock_agent_index.get_session.return_value = mock_index
         to_index = [
             "1712.04442",    # flux capacitor
             "1511.07473",    # flux capacitor
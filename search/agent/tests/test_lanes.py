@@ -0,0 +1,166 @@
+"""Tests for :mod:`search.agent.lanes`."""
+
+from datetime import date
+from unittest import TestCase, mock
+
+from search.domain import DocMeta
+from search.agent.lanes import BACKFILL, NEW, Lane, Watermark, classify
+
+from .util import ProcessorTestCase, _record
+
+
+class TestClassify(TestCase):
+    """Records are sorted into lanes by the age of the paper."""
+
+    def test_classify(self):
+        """Papers that were not recently announced are backfill."""
+        today = date(2019, 3, 14)
+        self.assertEqual(classify({'document_id': '1903.01234'}, today), NEW)
+        self.assertEqual(classify({'document_id': '1902.01234'}, today), NEW)
+        self.assertEqual(classify({'document_id': '1901.01234'}, today),
+                         BACKFILL)
+        self.assertEqual(classify({'document_id': 'hep-th/9901001'}, today),
+                         BACKFILL)
+        self.assertEqual(classify({'document_id': 'math.GT/0309136'}, today),
+                         BACKFILL)
+
+    def test_version(self):
+        """A record for a particular version is for a new version."""
+        self.assertEqual(classify({'document_id': '1901.01234v3'}), NEW)
+
+    def test_override(self):
+        """The payload can say which lane a record is in."""
+        self.assertEqual(classify({'document_id': '1901.01234',
+                                   'lane': 'new'}), NEW)
+        self.assertEqual(classify({'document_id': '1901.01234v3',
+                                   'lane': 'backfill'}), BACKFILL)
+        self.assertEqual(classify({'backfill': True}), BACKFILL)
+        self.assertEqual(classify({'document_id': '1901.01234v3',
+                                   'lane': 'express'}), NEW)
+
+    def test_unknown(self):
+        """Records that we can't make sense of are not held up."""
+        self.assertEqual(classify({}), NEW)
+        self.assertEqual(classify({'document_id': 'foo'}), NEW)
+        self.assertEqual(classify({'document_id': '1234.56789'}), NEW)
+
+
+class TestLane(TestCase):
+    """:class:`.Lane` hands out batches of its oldest records."""
+
+    def test_take(self):
+        """Batches are no bigger than requested, and retries go first."""
+        lane = Lane(BACKFILL)
+        self.assertFalse(lane)
+        self.assertEqual(lane.age, 0)
+        for i in range(5):
+            lane.add(_record(i, f'1234.{i:05}'), f'1234.{i:05}')
+        lane.retry('2345.67890')
+        self.assertEqual(len(lane), 5)
+
+        batch = lane.take(3)
+        self.assertEqual(batch.lane, BACKFILL)
+        self.assertEqual(batch.position, '1')
+        self.assertEqual(batch.arxiv_ids, ['2345.67890', '1234.00000',
+                                           '1234.00001'])
+        batch = lane.take(3)
+        self.assertEqual(batch.position, '4')
+        self.assertEqual(len(batch.arxiv_ids), 3)
+        self.assertFalse(lane)
+
+    def test_take_retries(self):
+        """Retries are handed out no faster than other records."""
+        lane = Lane(NEW)
+        for i in range(5):
+            lane.retry(f'1234.{i:05}')
+        self.assertEqual(len(lane.take(2).arxiv_ids), 2)
+        self.assertTrue(lane)
+        self.assertEqual(len(lane.take(5).arxiv_ids), 3)
+        self.assertFalse(lane)
+
+
+class TestWatermark(TestCase):
+    """:class:`.Watermark` only advances past contiguous processed records."""
+
+    def test_processed(self):
+        """The position waits for earlier records that are not done."""
+        watermark = Watermark()
+        for i in range(1, 5):
+            watermark.read(str(i))
+        self.assertIn('3', watermark)
+        self.assertIsNone(watermark.processed([{'SequenceNumber': '3'},
+                                               {'SequenceNumber': '4'}]))
+        self.assertEqual(watermark.processed([{'SequenceNumber': '1'}]), '1')
+        self.assertEqual(len(watermark), 3)
+        self.assertEqual(watermark.processed([{'SequenceNumber': '2'}]), '4')
+        self.assertEqual(len(watermark), 0)
+        self.assertIsNone(watermark.processed([{'SequenceNumber': '5'}]))
+
+
+class TestPriority(ProcessorTestCase):
+    """New papers are processed ahead of backfill."""
+
+    max_batch_size = 2
+
+    def setUp(self):
+        """Index papers as they are requested, without any services."""
+        super(TestPriority, self).setUp()
+        self.processor.metadata_session = mock.MagicMock()
+        self.processor.metadata_session.bulk_retrieve.side_effect = \
+            lambda arxiv_ids: [DocMeta(paper_id=arxiv_id, version=1)
+                               for arxiv_id in arxiv_ids]
+        self.processor.index_session = mock.MagicMock()
+        self.indexed = []
+
+        def bulk_add_documents(documents, **kwargs):
+            self.indexed.append([d.paper_id for d in documents])
+            return len(documents)
+
+        self.processor.index_session.bulk_add_documents.side_effect = \
+            bulk_add_documents
+
+    def test_new_papers_first(self):
+        """Backfill fills in behind new papers, and holds the position."""
+        self.processor.max_backlog = 3
+        self.processor.max_batch_latency = 0
+        self._get_records(_record(1, '1111.11111', lane='backfill'),
+                          _record(2, '2222.22222'),
+                          _record(3, '3333.33333', lane='backfill'),
+                          _record(4, '4444.44444'),
+                          _record(5, '5555.55555', lane='backfill'))
+
+        _, processed = self.processor.process_records('start')
+        self.assertEqual(self.processor.get_records.call_args[0][1], 3,
+                         'We only read as far ahead as the backlog allows')
+        self.assertEqual(processed, 4)
+        self.assertEqual(self.indexed, [['2222.22222', '4444.44444'],
+                                        ['1111.11111', '3333.33333']])
+        self.assertEqual(self.processor.position, '4')
+
+        # The last of the backfill goes once we have looked for new papers.
+        self._get_records()
+        _, processed = self.processor.process_records('next')
+        self.assertEqual(processed, 1)
+        self.assertEqual(self.indexed[-1], ['5555.55555'])
+        self.assertEqual(self.processor.position, '5')
+
+        metrics = self.processor.metrics
+        self.assertEqual(metrics.records.total(lane=NEW), 2)
+        self.assertEqual(metrics.records.total(lane=BACKFILL), 3)
+        self.assertIn('backfill 3 records', metrics.summary())
+
+    def test_stop_without_backfill(self):
+        """When stopping, backfill is left to be replayed after a restart."""
+        self._get_records(_record(1, '1111.11111', lane='backfill'),
+                          _record(2, '2222.22222'))
+        _, processed = self.processor.process_records('start')
+        self.assertEqual(processed, 0, 'Neither batch is ready yet')
+        self.assertEqual(self.processor.metrics.waiting.total(), 2)
+
+        self.assertEqual(self.processor.drain(backfill=False), 1)
+        self.assertEqual(self.indexed, [['2222.22222']])
+        self.assertIsNone(self.processor.position,
+                          'The position waits for the backfill')
+
+        self.assertEqual(self.processor.drain(), 1)
+        self.assertEqual(self.processor.position, '2')
@@ -0,0 +1,140 @@
+"""Tests for :mod:`search.agent.metrics`."""
+
+import threading
+from datetime import datetime, timezone
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from search.agent.batch import RecordBatch
+from search.agent.consumer import DocumentFailed
+from search.agent.metrics import AgentMetrics, Counter, Gauge, Histogram, \
+    MetricsServer, CONTENT_TYPE
+from search.services import metadata
+
+
+class TestExposition(TestCase):
+    """Metrics are exposed in the Prometheus text format."""
+
+    def test_counter(self):
+        """A counter has a line for each combination of labels."""
+        counter = Counter('things_total', 'Things.')
+        counter.inc()
+        counter.inc(2, kind='a "quoted" kind')
+        self.assertEqual(counter.expose(), [
+            '# HELP things_total Things.',
+            '# TYPE things_total counter',
+            'things_total 1',
+            'things_total{kind="a \\"quoted\\" kind"} 2'
+        ])
+
+    def test_histogram(self):
+        """A histogram has cumulative buckets, a sum, and a count."""
+        histogram = Histogram('seconds', 'Time.', [1, 5])
+        for value in (.5, 2, 3, 10):
+            histogram.observe(value, stage='fetch')
+        self.assertEqual(histogram.expose()[2:], [
+            'seconds_bucket{stage="fetch",le="1"} 1',
+            'seconds_bucket{stage="fetch",le="5"} 3',
+            'seconds_bucket{stage="fetch",le="+Inf"} 4',
+            'seconds_sum{stage="fetch"} 15.5',
+            'seconds_count{stage="fetch"} 4'
+        ])
+        self.assertEqual(histogram.mean(stage='fetch'), 3.875)
+        self.assertEqual(histogram.quantile(.5, stage='fetch'), 5)
+        self.assertEqual(histogram.count(stage='index'), 0)
+
+    def test_expose_while_set(self):
+        """A metric can be exposed while another thread updates it."""
+        gauge = Gauge('waiting', 'Waiting.')
+        done = threading.Event()
+
+        def update():
+            for i in range(20000):
+                gauge.set(i, shard=str(i))
+            done.set()
+
+        thread = threading.Thread(target=update)
+        thread.start()
+        while not done.is_set():
+            lines = gauge.expose()
+        thread.join()
+        self.assertEqual(len(gauge.expose()), 20002)
+        self.assertGreaterEqual(len(lines), 2)
+
+
+class TestAgentMetrics(TestCase):
+    """Batches update the agent metrics."""
+
+    def test_record_batch(self):
+        """Throughput, stage latency, errors, and lag are recorded."""
+        arrived = datetime(2019, 1, 1, tzinfo=timezone.utc)
+        batch = RecordBatch()
+        for i, arxiv_id in enumerate(['1234.56789', '2345.67890',
+                                      '1234.56789']):
+            batch.add({'SequenceNumber': str(i), 'Data': b'',
+                       'ApproximateArrivalTimestamp': arrived}, arxiv_id)
+        batch.timings = {'fetch': .2, 'transform': .01, 'index': .3}
+        batch.documents = ['a document', 'another document']
+        batch.skipped = 1
+        try:
+            raise DocumentFailed('nope') from metadata.RequestFailed('nope')
+        except DocumentFailed as e:
+            batch.fail('2345.67890', e)
+
+        metrics = AgentMetrics()
+        metrics.record_batch(batch, now=arrived.timestamp() + 30)
+
+        self.assertEqual(metrics.records.total(), 3)
+        self.assertEqual(metrics.documents.value(outcome='indexed'), 1)
+        self.assertEqual(metrics.documents.value(outcome='skipped'), 1)
+        self.assertEqual(metrics.batch_papers.mean(), 2)
+        self.assertEqual(metrics.stage_seconds.mean(stage='index'), .3)
+        self.assertEqual(metrics.errors.value(error='RequestFailed'), 1)
+        self.assertEqual(metrics.lag.value(), 30)
+        self.assertEqual(metrics.record_latency.count(), 3)
+
+        summary = metrics.summary()
+        self.assertIn('3 records', summary)
+        self.assertIn('RequestFailed: 1', summary)
+        self.assertIn('lag 30.0s', summary)
+
+    def test_record_checkpoint(self):
+        """The time spent checkpointing is recorded."""
+        metrics = AgentMetrics()
+        self.assertIn('no checkpoints', metrics.summary())
+        metrics.record_checkpoint(.002, 100)
+        metrics.record_checkpoint(.004, 300)
+        self.assertEqual(metrics.checkpoint_seconds.count(), 2)
+        self.assertEqual(metrics.checkpoint_records.mean(), 200)
+        self.assertIn('2 checkpoints, mean 3.0ms and 200 records apart',
+                      metrics.summary())
+
+
+class TestMetricsServer(TestCase):
+    """Metrics are served over HTTP."""
+
+    def setUp(self):
+        """Start a server on a free port."""
+        self.metrics = AgentMetrics()
+        self.server = MetricsServer(self.metrics, port=0).start()
+        self.url = f'http://127.0.0.1:{self.server.port}'
+
+    def tearDown(self):
+        """Stop the server."""
+        self.server.stop()
+
+    def test_metrics(self):
+        """The metrics are served at ``/metrics``."""
+        self.metrics.records.inc(5)
+        with urlopen(f'{self.url}/metrics') as response:
+            self.assertEqual(response.headers['Content-Type'], CONTENT_TYPE)
+            body = response.read().decode('utf-8')
+        self.assertIn('search_agent_records_total 5\n', body)
+        self.assertIn('# TYPE search_agent_stage_seconds histogram\n', body)
+
+    def test_not_found(self):
+        """Nothing else is served."""
+        with self.assertRaises(HTTPError) as context:
+            urlopen(f'{self.url}/foo')
+        self.assertEqual(context.exception.code, 404)
@@ -0,0 +1,82 @@
+"""Tests for :mod:`search.agent.pipeline`."""
+
+import threading
+from unittest import TestCase
+
+from search.agent.batch import RecordBatch
+from search.agent.pipeline import Pipeline
+
+
+def _batch(*arxiv_ids):
+    batch = RecordBatch()
+    for i, arxiv_id in enumerate(arxiv_ids):
+        batch.add({'SequenceNumber': str(i)}, arxiv_id)
+    return batch
+
+
+class TestPipeline(TestCase):
+    """Batches pass through the stages of a :class:`.Pipeline`."""
+
+    def test_stages_in_order(self):
+        """Each batch passes through the stages in order."""
+        def fetch(batch):
+            batch.metadata = ['fetched']
+
+        def transform(batch):
+            batch.documents = batch.metadata + ['transformed']
+
+        pipeline = Pipeline([('fetch', fetch), ('transform', transform)])
+        batches = [_batch(str(i)) for i in range(5)]
+        for batch in batches:
+            pipeline.submit(batch)
+        completed = pipeline.drain()
+        pipeline.stop()
+
+        self.assertEqual(completed, batches, 'Batches come out in order')
+        for batch in completed:
+            self.assertEqual(batch.documents, ['fetched', 'transformed'])
+        self.assertEqual(len(pipeline), 0)
+        self.assertEqual([stats.batches for stats in pipeline.stats], [5, 5])
+        self.assertEqual(pipeline.stats[0].papers, 5)
+
+    def test_stage_fails(self):
+        """A failed batch skips the remaining stages."""
+        transformed = []
+
+        def fetch(batch):
+            if '1' in batch.arxiv_ids:
+                raise RuntimeError('nope')
+
+        pipeline = Pipeline([('fetch', fetch),
+                             ('transform', transformed.append)])
+        for i in range(3):
+            pipeline.submit(_batch(str(i)))
+        completed = pipeline.drain()
+        pipeline.stop()
+
+        self.assertIsNone(completed[0].error)
+        self.assertIsInstance(completed[1].error, RuntimeError)
+        self.assertIsNone(completed[2].error)
+        self.assertEqual(transformed, [completed[0], completed[2]])
+
+    def test_backpressure(self):
+        """Submitting blocks when the pipeline is full."""
+        release = threading.Event()
+
+        def index(batch):
+            release.wait()
+
+        pipeline = Pipeline([('index', index)], depth=1)
+        pipeline.submit(_batch('1'))    # Being indexed.
+        pipeline.submit(_batch('2'))    # Waiting.
+        blocked = threading.Thread(target=pipeline.submit,
+                                   args=(_batch('3'),))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive(), 'Third batch should wait')
+
+        release.set()
+        blocked.join(1)
+        self.assertFalse(blocked.is_alive())
+        self.assertEqual(len(pipeline.drain()), 3)
+        pipeline.stop()
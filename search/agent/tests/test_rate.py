@@ -0,0 +1,90 @@
+"""Tests for :mod:`search.agent.rate`."""
+
+from unittest import TestCase
+
+from search.agent.rate import RateController, is_throttled
+from search.services import index, metadata
+
+
+class TestIsThrottled(TestCase):
+    """Throttling is detected from status codes on exceptions."""
+
+    def test_status_code(self):
+        """A 429 or 503 response means that we are being throttled."""
+        self.assertTrue(is_throttled(metadata.RequestFailed('', 429)))
+        self.assertTrue(is_throttled(index.IndexConnectionError('', 503)))
+        self.assertFalse(is_throttled(metadata.RequestFailed('', 404)))
+        self.assertFalse(is_throttled(metadata.RequestFailed('')))
+        self.assertFalse(is_throttled(None))
+
+    def test_bulk_status_codes(self):
+        """A bulk request is throttled if any of the documents were."""
+        e = index.BulkIndexingError('', ['1', '2'], [400, 429])
+        self.assertTrue(is_throttled(e))
+        e = index.BulkIndexingError('', ['1'], [400])
+        self.assertFalse(is_throttled(e))
+
+    def test_cause(self):
+        """The exceptions that caused an exception are also considered."""
+        try:
+            try:
+                raise metadata.RequestFailed('', 503)
+            except metadata.RequestFailed as e:
+                raise RuntimeError('wrapped') from e
+        except RuntimeError as e:
+            self.assertTrue(is_throttled(e))
+
+
+class TestRateController(TestCase):
+    """The delay between batches responds to pressure and lag."""
+
+    def setUp(self):
+        """Start with a small delay."""
+        self.rate = RateController(delay=0.1, step=0.05, backoff=2.,
+                                   max_delay=1., target_latency=5.,
+                                   max_lag=1000)
+
+    def test_backoff_when_throttled(self):
+        """The delay is multiplied when we are throttled, up to a limit."""
+        self.rate.update(1., throttled=True)
+        self.assertAlmostEqual(self.rate.delay, 0.2)
+        for _ in range(10):
+            self.rate.update(1., throttled=True)
+        self.assertEqual(self.rate.delay, 1.)
+
+    def test_backoff_when_slow(self):
+        """The delay is multiplied when batches take too long."""
+        self.rate.update(6.)
+        self.assertAlmostEqual(self.rate.delay, 0.2)
+
+    def test_backoff_from_zero(self):
+        """If there is no delay, backing off starts with one step."""
+        self.rate.delay = 0.
+        self.rate.update(1., throttled=True)
+        self.assertAlmostEqual(self.rate.delay, 0.05)
+
+    def test_speed_up_when_behind(self):
+        """The delay decreases by a fixed step when we are behind."""
+        self.rate.lag = 5000
+        self.rate.update(1.)
+        self.assertAlmostEqual(self.rate.delay, 0.05)
+        self.rate.update(1.)
+        self.rate.update(1.)
+        self.assertEqual(self.rate.delay, 0.)
+        self.assertEqual(self.rate.rate, float('inf'))
+
+    def test_steady_when_caught_up(self):
+        """The delay does not change if we are healthy and caught up."""
+        self.rate.lag = 0
+        self.rate.update(1.)
+        self.assertEqual(self.rate.delay, 0.1)
+        self.rate.lag = None
+        self.rate.update(1.)
+        self.assertEqual(self.rate.delay, 0.1)
+
+    def test_poll_interval(self):
+        """The stream is polled more often when we are behind."""
+        self.assertEqual(self.rate.poll_interval(5.), 5.)
+        self.rate.lag = 5000
+        self.assertEqual(self.rate.poll_interval(5.),
+                         RateController.MIN_POLL_INTERVAL)
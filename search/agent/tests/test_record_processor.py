@@ -2,10 +2,13 @@
 
 from unittest import TestCase, mock
 
-from search.domain import DocMeta, Document
+from search.domain import DocMeta, Document, Fulltext
+from search.process import enrich
 from search.services import metadata, index
 from search.agent import consumer
 
+from .util import ProcessorTestCase, _record
+
 # type: ignore
 
 
@@ -42,7 +45,9 @@ class TestIndexPaper(TestCase):
 
         processor.index_paper('1234.56789')
 
-        mock_idx.bulk_add_documents.assert_called_once_with([mock_doc])
+        mock_idx.bulk_add_documents.assert_called_once_with(
+            [mock_doc], skip_unchanged=True
+        )
 
     @mock.patch('boto3.client')
     @mock.patch('search.agent.consumer.index')
@@ -99,7 +104,9 @@ class TestIndexPaper(TestCase):
                          " version")
 
         mock_idx.bulk_add_documents.assert_called_once_with(
-            [mock_doc_3, mock_doc_1, mock_doc_2, mock_doc_3])
+            [mock_doc_3, mock_doc_1, mock_doc_2, mock_doc_3],
+            skip_unchanged=True
+        )
 
 
 class TestAddToIndex(TestCase):
@@ -327,3 +334,323 @@ class TestGetMetadata(TestCase):
         mock_metadata.retrieve.side_effect = metadata.BadResponse
         with self.assertRaises(consumer.DocumentFailed):
             processor._get_metadata('1234.5678')
+
+
+class TestProcessRecords(ProcessorTestCase):
+    """Records are processed in micro-batches."""
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_batch_is_deduplicated(self, mock_meta, mock_idx):
+        """Each paper is retrieved and indexed once per batch."""
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1),
+            DocMeta(paper_id='2345.67890', version=1)
+        ]
+        self._get_records(_record(1, '1234.56789'), _record(2, '2345.67890'),
+                          _record(3, '1234.56789'), _record(4, '1234.56789'))
+
+        _, processed = self.processor.process_records('start')
+
+        self.assertEqual(processed, 4)
+        mock_meta.bulk_retrieve.assert_called_once_with(
+            ['1234.56789', '2345.67890']
+        )
+        self.assertEqual(mock_idx.bulk_add_documents.call_count, 1)
+        documents = mock_idx.bulk_add_documents.call_args[0][0]
+        self.assertEqual([d.paper_id for d in documents],
+                         ['1234.56789', '2345.67890'])
+        self.assertEqual(self.processor.position, '4')
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_fulltext_is_added(self, mock_meta, mock_idx):
+        """Fulltext is added where there is any, without failing papers."""
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1),
+            DocMeta(paper_id='1234.56789', version=2),
+            DocMeta(paper_id='2345.67890', version=1)
+        ]
+        session = mock.MagicMock()
+
+        def retrieve(paper_id_v):
+            if paper_id_v == '2345.67890v1':
+                raise IOError('Not extracted yet')
+            return Fulltext(content=f' Text\nof  {paper_id_v} ',
+                            version='0.3', created=None)
+        session.retrieve.side_effect = retrieve
+        self.processor.enricher = enrich.FulltextEnricher(session)
+        self._get_records(*[_record(i, paper_id) for i, paper_id
+                            in enumerate(['1234.56789', '2345.67890'] * 2)])
+
+        self.processor.process_records('start')
+        self.processor.enricher.close()
+
+        documents = mock_idx.bulk_add_documents.call_args[0][0]
+        self.assertEqual([d.fulltext for d in documents],
+                         ['Text of 1234.56789v1', 'Text of 1234.56789v2', ''])
+        metrics = self.processor.metrics
+        self.assertEqual(metrics.fulltext.value(outcome='retrieved'), 2)
+        self.assertEqual(metrics.fulltext.value(outcome='missing'), 1)
+        self.assertEqual(metrics.stage_seconds.count(stage='enrich'), 1)
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_unchanged_are_counted(self, mock_meta, mock_idx):
+        """Documents that were skipped because they are unchanged count."""
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1),
+            DocMeta(paper_id='1234.56789', version=2)
+        ]
+        mock_idx.bulk_add_documents.return_value = 1
+        self._get_records(*[_record(i, '1234.56789') for i in range(4)])
+
+        self.processor.process_records('start')
+
+        self.assertEqual(mock_idx.bulk_add_documents.call_args[1],
+                         {'skip_unchanged': True})
+        documents = self.processor.metrics.documents
+        self.assertEqual(documents.value(outcome='indexed'), 1)
+        self.assertEqual(documents.value(outcome='skipped'), 1)
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_partial_batch_waits(self, mock_meta, mock_idx):
+        """A batch is not processed until it is full, or has waited."""
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1)
+        ]
+        self._get_records(_record(1, '1234.56789'))
+
+        _, processed = self.processor.process_records('start')
+        self.assertEqual(processed, 0)
+        self.assertEqual(mock_meta.bulk_retrieve.call_count, 0)
+        self.assertIsNone(self.processor.position)
+
+        self.processor.max_batch_latency = 0
+        self._get_records()
+        _, processed = self.processor.process_records('next')
+        self.assertEqual(processed, 1)
+        self.assertEqual(mock_meta.bulk_retrieve.call_count, 1)
+        self.assertEqual(self.processor.position, '1')
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_failures_are_attributed(self, mock_meta, mock_idx):
+        """Failures are attributed to the records that requested them."""
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1),
+            DocMeta(paper_id='3456.78901', version=1)
+        ]
+        mock_idx.bulk_add_documents.side_effect = index.BulkIndexingError(
+            'nope', ['3456.78901v1']
+        )
+        mock_idx.IndexConnectionError = index.IndexConnectionError
+        self._get_records(_record(1, '1234.56789'), _record(2, '2345.67890'),
+                          _record(3, '3456.78901'), _record(4, '3456.78901'))
+
+        _, processed = self.processor.process_records('start')
+
+        self.assertEqual(processed, 4)
+        # One record for a paper without metadata, and two for a paper that
+        # could not be indexed.
+        self.assertEqual(self.processor._error_count, 3)
+        self.assertEqual(self.processor.position, '4')
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_backoff_when_throttled(self, mock_meta, mock_idx):
+        """The agent slows down when the index throttles bulk requests."""
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1)
+        ]
+        mock_idx.bulk_add_documents.side_effect = index.BulkIndexingError(
+            'nope', ['1234.56789v1'], [429]
+        )
+        mock_idx.IndexConnectionError = index.IndexConnectionError
+        self.processor.rate.delay = 0.
+        self.processor.rate.wait = mock.MagicMock()
+        self._get_records(*[_record(i, '1234.56789') for i in range(4)])
+
+        self.processor.process_records('start')
+        self.assertGreater(self.processor.rate.delay, 0)
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_no_backoff_when_unavailable(self, mock_meta, mock_idx):
+        """Failures that are not throttling don't slow the agent down."""
+        mock_meta.ConnectionFailed = metadata.ConnectionFailed
+        mock_meta.bulk_retrieve.side_effect = metadata.ConnectionFailed
+        mock_meta.retrieve.side_effect = metadata.ConnectionFailed
+        self.processor.rate.delay = 0.
+        self.processor.rate.wait = mock.MagicMock()
+        self._get_records(*[_record(i, f'1234.{i:05}') for i in range(4)])
+
+        self.processor.process_records('start')
+        self.assertEqual(len(self.processor.retries), 4)
+        self.assertEqual(self.processor.rate.delay, 0)
+
+    @mock.patch('search.agent.consumer.time')
+    def test_poll_faster_when_behind(self, mock_time):
+        """The stream is polled more often when the agent falls behind."""
+        self.processor.sleep_time = 5
+        self.processor.get_records.return_value = ('next', {
+            'Records': [], 'MillisBehindLatest': 60000
+        })
+        self.processor.process_records('start')
+        mock_time.sleep.assert_called_with(5)
+        self.processor.process_records('next')
+        mock_time.sleep.assert_called_with(
+            self.processor.rate.MIN_POLL_INTERVAL
+        )
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_bulk_metadata_failure_is_isolated(self, mock_meta, mock_idx):
+        """If the bulk metadata request fails, papers are retried alone."""
+        mock_meta.RequestFailed = metadata.RequestFailed
+        mock_meta.ConnectionFailed = metadata.ConnectionFailed
+
+        def bulk_retrieve(arxiv_ids):
+            if '2345.67890' in arxiv_ids:
+                raise metadata.RequestFailed('nope')
+            return [DocMeta(paper_id=arxiv_id, version=1)
+                    for arxiv_id in arxiv_ids]
+
+        mock_meta.bulk_retrieve.side_effect = bulk_retrieve
+        self._get_records(_record(1, '1234.56789'), _record(2, '2345.67890'),
+                          _record(3, '3456.78901'),
+                          {'SequenceNumber': '4', 'Data': b'not json'})
+
+        self.processor.process_records('start')
+
+        documents = mock_idx.bulk_add_documents.call_args[0][0]
+        self.assertEqual([d.paper_id for d in documents],
+                         ['1234.56789', '3456.78901'])
+        self.assertEqual(self.processor._error_count, 2)
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_chunk_of_bulk_metadata_fails(self, mock_meta, mock_idx):
+        """Papers in chunks that were retrieved are not retried."""
+        mock_meta.RequestFailed = metadata.RequestFailed
+        mock_meta.ConnectionFailed = metadata.ConnectionFailed
+        mock_meta.BadResponse = metadata.BadResponse
+        self.processor.retries.base_delay = 0
+        self.processor.max_batch_latency = 0
+
+        def bulk_retrieve(arxiv_ids):
+            if '1234.56789' in arxiv_ids:
+                error = metadata.ConnectionFailed('nope')
+                error.retrieved = [DocMeta(paper_id='1234.56789', version=1)]
+                error.failed = arxiv_ids[1:]
+                raise error
+            raise metadata.ConnectionFailed('still nope')
+
+        mock_meta.bulk_retrieve.side_effect = bulk_retrieve
+        self._get_records(_record(1, '1234.56789'), _record(2, '2345.67890'),
+                          _record(3, '3456.78901'))
+
+        self.processor.process_records('start')
+
+        self.assertEqual(mock_meta.bulk_retrieve.call_args[0][0],
+                         ['2345.67890', '3456.78901'],
+                         'Only papers that were not retrieved are retried')
+        documents = mock_idx.bulk_add_documents.call_args[0][0]
+        self.assertEqual([d.paper_id for d in documents], ['1234.56789'])
+        self.assertNotIn('1234.56789', self.processor.retries)
+        self.assertIn('2345.67890', self.processor.retries)
+        self.assertIn('3456.78901', self.processor.retries)
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_failures_are_dead_lettered(self, mock_meta, mock_idx):
+        """Papers that cannot be indexed go to the dead-letter file."""
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1)
+        ]
+        self._get_records(_record(1, '1234.56789'), _record(2, '2345.67890'),
+                          _record(3, '1234.56789'), _record(4, '1234.56789'))
+
+        _, processed = self.processor.process_records('start')
+
+        self.assertEqual(processed, 4)
+        self.assertEqual(self.processor.position, '4')
+        self.assertEqual(len(self.processor.retries), 0)
+        entries = self.processor.retries.dead_letters.read()
+        self.assertEqual([e['arxiv_id'] for e in entries], ['2345.67890'])
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_transient_failures_are_retried(self, mock_meta, mock_idx):
+        """Papers that fail for transient reasons are retried later."""
+        mock_meta.ConnectionFailed = metadata.ConnectionFailed
+        mock_meta.RequestFailed = metadata.RequestFailed
+        mock_meta.BadResponse = metadata.BadResponse
+        mock_meta.bulk_retrieve.side_effect = metadata.ConnectionFailed
+        self.processor.retries.base_delay = 0
+        self._get_records(*[_record(i, '1234.56789') for i in range(4)])
+
+        # The metadata service is unavailable, but processing goes on.
+        _, processed = self.processor.process_records('start')
+        self.assertEqual(processed, 4)
+        self.assertEqual(self.processor.position, '3')
+        self.assertIn('1234.56789', self.processor.retries)
+        self.assertEqual(mock_idx.bulk_add_documents.call_count, 0)
+
+        # The metadata service is back, and the paper is indexed.
+        mock_meta.bulk_retrieve.side_effect = None
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1)
+        ]
+        self.processor.max_batch_latency = 0
+        self._get_records()
+        _, processed = self.processor.process_records('next')
+        self.assertEqual(processed, 0, 'No records were in the batch')
+        self.assertEqual(mock_idx.bulk_add_documents.call_count, 1)
+        self.assertEqual(len(self.processor.retries), 0)
+        self.assertEqual(self.processor.retries.attempts('1234.56789'), 0)
+        self.assertEqual(self.processor.position, '3')
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_retries_are_capped(self, mock_meta, mock_idx):
+        """A paper goes to the dead-letter file when it runs out of tries."""
+        mock_meta.ConnectionFailed = metadata.ConnectionFailed
+        mock_meta.bulk_retrieve.side_effect = metadata.ConnectionFailed
+        self.processor.retries.base_delay = 0
+        self.processor.retries.max_attempts = 3
+        self.processor.max_batch_latency = 0
+        self._get_records(_record(1, '1234.56789'))
+        self.processor.process_records('start')
+        self._get_records()
+        for _ in range(2):
+            self.processor.process_records('next')
+
+        self.assertEqual(mock_meta.bulk_retrieve.call_count, 6,
+                         'Each attempt includes the immediate retry')
+        self.assertEqual(len(self.processor.retries), 0)
+        entries = self.processor.retries.dead_letters.read()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['arxiv_id'], '1234.56789')
+        self.assertEqual(entries[0]['attempts'], 3)
+
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_pipelined(self, mock_meta, mock_idx):
+        """Batches can be processed in a pipeline."""
+        self.processor.pipeline_depth = 1
+        mock_meta.bulk_retrieve.side_effect = lambda arxiv_ids: [
+            DocMeta(paper_id=arxiv_id, version=1) for arxiv_id in arxiv_ids
+        ]
+        self._get_records(*[_record(i, f'1234.{i:05}') for i in range(12)])
+
+        _, processed = self.processor.process_records('start')
+        processed += self.processor._complete(
+            self.processor._pipeline.drain()
+        )
+        self.processor._pipeline.stop()
+
+        self.assertEqual(processed, 12)
+        self.assertEqual(self.processor.position, '11')
+        self.assertEqual(mock_idx.bulk_add_documents.call_count, 3)
@@ -0,0 +1,160 @@
+"""Tests for :mod:`search.agent.retry`."""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from search.agent.retry import DeadLetters, RetryQueue, is_transient
+from search.services import index, metadata
+
+
+class TestIsTransient(TestCase):
+    """Failures that might go away are distinguished from those that won't."""
+
+    def test_transient(self):
+        """Connection errors, throttling and server errors are transient."""
+        self.assertTrue(is_transient(metadata.ConnectionFailed()))
+        self.assertTrue(is_transient(index.IndexConnectionError()))
+        self.assertTrue(is_transient(metadata.RequestFailed('', 502)))
+        self.assertTrue(is_transient(metadata.RequestFailed('', 429)))
+        self.assertTrue(is_transient(
+            index.BulkIndexingError('', ['1'], [503])
+        ))
+
+    def test_not_transient(self):
+        """Other failures are not worth retrying."""
+        self.assertFalse(is_transient(metadata.RequestFailed('', 404)))
+        self.assertFalse(is_transient(metadata.BadResponse()))
+        self.assertFalse(is_transient(
+            index.BulkIndexingError('', ['1'], [400])
+        ))
+        self.assertFalse(is_transient(RuntimeError()))
+
+
+class DeadLetterTestCase(TestCase):
+    """Provides a temporary dead-letter file."""
+
+    def setUp(self):
+        """Use a temporary directory for the dead-letter file."""
+        self.workdir = tempfile.mkdtemp()
+        self.dead_letters = DeadLetters(
+            os.path.join(self.workdir, 'spool', 'dead.ndjson')
+        )
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.workdir)
+
+
+class TestDeadLetters(DeadLetterTestCase):
+    """Papers that could not be indexed are spooled to a file."""
+
+    def test_add_and_read(self):
+        """Papers are appended to the file."""
+        self.assertEqual(self.dead_letters.read(), [])
+        self.dead_letters.add('1234.56789', 'nope', 5)
+        self.dead_letters.add('2345.67890', 'also nope')
+        entries = self.dead_letters.read()
+        self.assertEqual([e['arxiv_id'] for e in entries],
+                         ['1234.56789', '2345.67890'])
+        self.assertEqual(entries[0]['attempts'], 5)
+        self.assertEqual(entries[1]['reason'], 'also nope')
+
+    def test_take(self):
+        """Papers are taken once each, and kept until replay is done."""
+        self.dead_letters.add('1234.56789', 'nope')
+        self.dead_letters.add('2345.67890', 'nope')
+        self.dead_letters.add('1234.56789', 'nope')
+        self.assertEqual(self.dead_letters.take(),
+                         ['1234.56789', '2345.67890'])
+
+        # Papers can be added while the replay is in progress. If the replay
+        # is interrupted, the papers are taken again.
+        self.dead_letters.add('2345.67890', 'still nope')
+        self.assertEqual(self.dead_letters.take(),
+                         ['1234.56789', '2345.67890'])
+        self.dead_letters.done()
+        self.assertEqual(self.dead_letters.read(), [])
+        self.assertEqual(self.dead_letters.take(), [])
+
+
+class TestRetryQueue(DeadLetterTestCase):
+    """Papers are retried with jittered exponential backoff."""
+
+    def setUp(self):
+        """Create a queue with a short delay."""
+        super(TestRetryQueue, self).setUp()
+        self.retries = RetryQueue(self.dead_letters, max_attempts=3,
+                                  base_delay=1., max_delay=3.)
+
+    def test_delay(self):
+        """The delay grows exponentially, with jitter, up to a limit."""
+        for attempts, (low, high) in enumerate([(.5, 1.), (1., 2.),
+                                                (1.5, 3.), (1.5, 3.)], 1):
+            for _ in range(20):
+                delay = self.retries.delay(attempts)
+                self.assertGreaterEqual(delay, low)
+                self.assertLessEqual(delay, high)
+
+    @mock.patch('search.agent.retry.time')
+    def test_retry_when_due(self, mock_time):
+        """Papers are not retried until their delay has passed."""
+        mock_time.monotonic.return_value = 100.
+        self.assertTrue(self.retries.failed('1234.56789',
+                                            metadata.ConnectionFailed()))
+        self.assertIn('1234.56789', self.retries)
+        self.assertEqual(self.retries.due(), [])
+
+        mock_time.monotonic.return_value = 101.
+        self.assertEqual(self.retries.due(), ['1234.56789'])
+        self.assertEqual(len(self.retries), 0)
+        self.assertEqual(self.retries.attempts('1234.56789'), 1)
+
+    @mock.patch('search.agent.retry.time')
+    def test_attempts_are_capped(self, mock_time):
+        """A paper is dead-lettered when it runs out of attempts."""
+        mock_time.monotonic.return_value = 100.
+        reason = metadata.ConnectionFailed('down')
+        self.assertTrue(self.retries.failed('1234.56789', reason))
+        self.assertTrue(self.retries.failed('1234.56789', reason),
+                        'A paper that is already waiting is not rescheduled')
+        self.assertEqual(self.retries.attempts('1234.56789'), 1)
+        mock_time.monotonic.return_value = 200.
+        self.retries.due()
+        self.assertTrue(self.retries.failed('1234.56789', reason))
+        mock_time.monotonic.return_value = 300.
+        self.retries.due()
+        self.assertFalse(self.retries.failed('1234.56789', reason))
+
+        entries = self.dead_letters.read()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['attempts'], 3)
+        self.assertEqual(entries[0]['reason'], 'ConnectionFailed: down')
+        self.assertEqual(self.retries.attempts('1234.56789'), 0)
+
+    def test_permanent_failure(self):
+        """A paper that will not succeed is dead-lettered right away."""
+        self.assertFalse(self.retries.failed('1234.56789',
+                                             metadata.BadResponse()))
+        self.assertEqual(len(self.retries), 0)
+        self.assertEqual(len(self.dead_letters.read()), 1)
+
+    @mock.patch('search.agent.retry.time')
+    def test_succeeded(self, mock_time):
+        """A paper that was indexed in the meantime is not retried."""
+        mock_time.monotonic.return_value = 100.
+        self.retries.failed('1234.56789', metadata.ConnectionFailed())
+        self.retries.succeeded('1234.56789')
+        mock_time.monotonic.return_value = 200.
+        self.assertEqual(self.retries.due(), [])
+        self.assertEqual(len(self.retries), 0)
+
+    def test_spool(self):
+        """Papers still waiting can be moved to the dead-letter file."""
+        self.retries.failed('1234.56789', metadata.ConnectionFailed())
+        self.retries.spool()
+        self.assertEqual(len(self.retries), 0)
+        self.assertEqual([e['arxiv_id'] for e in self.dead_letters.read()],
+                         ['1234.56789'])
+        self.assertEqual(self.retries.due(), [])
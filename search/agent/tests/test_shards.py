@@ -0,0 +1,281 @@
+"""Tests for :mod:`search.agent.shards`."""
+
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+from arxiv.base.agent import StopProcessing
+
+from search.domain import DocMeta
+from search.agent import consumer
+from search.agent.consumer import SHARD_END
+from search.agent.metrics import AgentMetrics
+from search.agent.shards import ShardCoordinator, legacy_shard_id, \
+    read_legacy_checkpoint
+
+from .util import _record
+
+
+def _shard(shard_id, parent=None, adjacent=None):
+    shard = {'ShardId': shard_id}
+    if parent:
+        shard['ParentShardId'] = parent
+    if adjacent:
+        shard['AdjacentParentShardId'] = adjacent
+    return shard
+
+
+def _client(*shards):
+    client = mock.MagicMock()
+    client.describe_stream.return_value = {'StreamDescription': {
+        'Shards': list(shards), 'HasMoreShards': False
+    }}
+    return client
+
+
+class FakeConsumer:
+    """Stands in for a :class:`.MetadataRecordProcessor`."""
+
+    def __init__(self, shard_id, from_start, position=None, closed=False,
+                 error=None):
+        self.shard_id = shard_id
+        self.from_start = from_start
+        self.position = position
+        self.closed = closed
+        self.error = error
+        self.stopping = threading.Event()
+
+    def go(self):
+        if self.error is not None:
+            raise self.error
+        if self.closed:
+            self.position = SHARD_END
+            return
+        self.stopping.wait()
+        raise StopProcessing('Asked to stop')
+
+    def shutdown(self):
+        self.stopping.set()
+
+
+class TestLegacyCheckpoint(TestCase):
+    """Checkpoints named with the short form of the shard ID are used."""
+
+    def test_legacy_shard_id(self):
+        """The short form of a shard ID is its number."""
+        self.assertEqual(legacy_shard_id('shardId-000000000000'), '0')
+        self.assertEqual(legacy_shard_id('shardId-000000000012'), '12')
+        self.assertIsNone(legacy_shard_id('0'))
+
+    def test_read_legacy_checkpoint(self):
+        """The position is read from the checkpoint for the short ID."""
+        volume = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(volume, 'stream__0.json'), 'w') as f:
+                f.write('12345')
+            self.assertEqual(read_legacy_checkpoint(
+                volume, 'stream', 'shardId-000000000000'
+            ), '12345')
+            self.assertIsNone(read_legacy_checkpoint(
+                volume, 'stream', 'shardId-000000000001'
+            ))
+        finally:
+            shutil.rmtree(volume)
+
+
+class TestShardCoordinator(TestCase):
+    """:class:`.ShardCoordinator` runs a consumer for each shard."""
+
+    def setUp(self):
+        """Keep track of the consumers that are created."""
+        self.consumers = {}
+        self.options = {}
+
+    def _make_consumer(self, shard_id, from_start):
+        self.consumers[shard_id] = FakeConsumer(
+            shard_id, from_start, **self.options.get(shard_id, {})
+        )
+        return self.consumers[shard_id]
+
+    def _join(self, coordinator):
+        for worker in list(coordinator.workers.values()):
+            if worker.consumer.closed or worker.consumer.error:
+                worker._thread.join(5)
+
+    def test_consumes_all_shards(self):
+        """A consumer is started for each open shard."""
+        client = _client(_shard('shardId-0'), _shard('shardId-1'))
+        metrics = AgentMetrics()
+        coordinator = ShardCoordinator(client, 'stream', self._make_consumer,
+                                       metrics=metrics)
+        coordinator.rebalance()
+        self.assertEqual(set(coordinator.workers), {'shardId-0', 'shardId-1'})
+        self.assertTrue(all(w.alive for w in coordinator.workers.values()))
+        self.assertEqual(metrics.shards.value(state='active'), 2)
+
+        coordinator.stop()
+        self.assertFalse(any(w.alive for w in coordinator.workers.values()))
+        self.assertTrue(all(c.stopping.is_set()
+                            for c in self.consumers.values()))
+
+    def test_resharding(self):
+        """Child shards are consumed after their parent is finished."""
+        client = _client(_shard('shardId-0'),
+                         _shard('shardId-1', parent='shardId-0'),
+                         _shard('shardId-2', parent='shardId-0'))
+        self.options['shardId-0'] = {'closed': True}
+        coordinator = ShardCoordinator(client, 'stream', self._make_consumer)
+
+        coordinator.rebalance()
+        self.assertEqual(set(coordinator.workers), {'shardId-0'})
+        self._join(coordinator)
+
+        coordinator.rebalance()
+        self.assertEqual(coordinator.finished, {'shardId-0'})
+        self.assertEqual(set(coordinator.workers), {'shardId-1', 'shardId-2'})
+        self.assertTrue(self.consumers['shardId-1'].from_start,
+                        'Child shards are read from the start')
+        self.assertFalse(self.consumers['shardId-0'].from_start)
+        coordinator.stop()
+
+    def test_merge_waits_for_both_parents(self):
+        """A merged shard waits for both of its parents."""
+        client = _client(_shard('shardId-0'), _shard('shardId-1'),
+                         _shard('shardId-2', parent='shardId-0',
+                                adjacent='shardId-1'))
+        self.options['shardId-0'] = {'closed': True}
+        coordinator = ShardCoordinator(client, 'stream', self._make_consumer)
+        coordinator.rebalance()
+        self._join(coordinator)
+        coordinator.rebalance()
+        self.assertNotIn('shardId-2', coordinator.workers)
+        coordinator.stop()
+
+    def test_finished_according_to_checkpoint(self):
+        """Shards that were finished before a restart are not consumed."""
+        client = _client(_shard('shardId-0'),
+                         _shard('shardId-1', parent='shardId-0'))
+        self.options['shardId-0'] = {'position': SHARD_END}
+        coordinator = ShardCoordinator(client, 'stream', self._make_consumer)
+        coordinator.rebalance()
+        self.assertEqual(coordinator.finished, {'shardId-0'})
+        self.assertEqual(set(coordinator.workers), {'shardId-1'})
+        coordinator.stop()
+
+    def test_expired_parent(self):
+        """Shards whose parents have expired from the stream are consumed."""
+        client = _client(_shard('shardId-1', parent='shardId-0'))
+        coordinator = ShardCoordinator(client, 'stream', self._make_consumer)
+        coordinator.rebalance()
+        self.assertEqual(set(coordinator.workers), {'shardId-1'})
+        self.assertFalse(self.consumers['shardId-1'].from_start)
+        coordinator.stop()
+
+    def test_restart_failed_consumer(self):
+        """A consumer that fails is replaced after a delay."""
+        client = _client(_shard('shardId-0'))
+        self.options['shardId-0'] = {'error': RuntimeError('nope')}
+        coordinator = ShardCoordinator(client, 'stream', self._make_consumer,
+                                       restart_delay=0)
+        coordinator.rebalance()
+        failed = self.consumers['shardId-0']
+        self._join(coordinator)
+        self.assertIsInstance(coordinator.workers['shardId-0'].error,
+                              RuntimeError)
+
+        self.options['shardId-0'] = {}
+        coordinator.rebalance()
+        self.assertIsNot(self.consumers['shardId-0'], failed)
+        self.assertTrue(coordinator.workers['shardId-0'].alive)
+        coordinator.stop()
+
+    def test_shard_ids(self):
+        """Only the configured shard is consumed, if there is one."""
+        client = _client(_shard('shardId-000000000000'),
+                         _shard('shardId-000000000001'))
+        coordinator = ShardCoordinator(client, 'stream', self._make_consumer,
+                                       shard_ids=['0'])
+        coordinator.rebalance()
+        self.assertEqual(set(coordinator.workers), {'shardId-000000000000'})
+        coordinator.stop()
+
+    def test_run_for_duration(self):
+        """The consumers are stopped when the duration has elapsed."""
+        client = _client(_shard('shardId-0'))
+        coordinator = ShardCoordinator(client, 'stream', self._make_consumer)
+        coordinator.run(duration=0)
+        self.assertTrue(self.consumers['shardId-0'].stopping.is_set())
+        self.assertFalse(coordinator.workers['shardId-0'].alive)
+
+
+class TestClosedShard(TestCase):
+    """A consumer processes everything in a closed shard, then stops."""
+
+    def setUp(self):
+        """Create a consumer with a shared client."""
+        self.workdir = tempfile.mkdtemp()
+        self.client = mock.MagicMock()
+        self.client.get_shard_iterator.return_value = {'ShardIterator': 'it'}
+        self.checkpointer = mock.MagicMock(position=None)
+        self.processor = consumer.MetadataRecordProcessor(
+            'stream', 'shardId-0', checkpointer=self.checkpointer,
+            client=self.client, sleep=0, max_batch_size=10,
+            metadata_session=mock.MagicMock(),
+            index_session=mock.MagicMock(),
+            dead_letter_path=os.path.join(self.workdir, 'dead.ndjson')
+        )
+        self.processor.sleep_time = 0
+
+    def tearDown(self):
+        """Remove the dead-letter file."""
+        shutil.rmtree(self.workdir)
+
+    def test_shard_end(self):
+        """The last batch is processed before the shard is marked done."""
+        self.client.get_records.return_value = {
+            'Records': [_record(1, '1234.56789')]
+        }
+        self.processor.metadata_session.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1)
+        ]
+        self.processor.index_session.bulk_add_documents.return_value = 1
+
+        self.processor.go()
+
+        self.assertEqual(self.processor.stream_name, 'stream')
+        self.assertEqual(self.processor.shard_id, 'shardId-0')
+        self.assertEqual(
+            self.processor.index_session.bulk_add_documents.call_count, 1
+        )
+        self.assertEqual(self.checkpointer.checkpoint.call_args_list,
+                         [mock.call(SHARD_END)])
+
+    def test_already_finished(self):
+        """A consumer for a finished shard does nothing."""
+        self.processor.position = SHARD_END
+        self.processor.go()
+        self.assertEqual(self.client.get_records.call_count, 0)
+
+    def test_shutdown(self):
+        """A consumer that is asked to stop processes its current batch."""
+        responses = [{'Records': [_record(1, '1234.56789')],
+                      'NextShardIterator': 'it'},
+                     {'Records': [], 'NextShardIterator': 'it'}]
+
+        def get_records(**kwargs):
+            if not responses[1:]:
+                self.processor.shutdown()
+            return responses.pop(0) if responses[1:] else responses[0]
+
+        self.client.get_records.side_effect = get_records
+        self.processor.metadata_session.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1)
+        ]
+        self.processor.index_session.bulk_add_documents.return_value = 1
+
+        with self.assertRaises(StopProcessing):
+            self.processor.go()
+        self.assertEqual(self.processor.position, '1')
+        self.checkpointer.checkpoint.assert_called_with('1')
@@ -0,0 +1,137 @@
+"""Tests for :mod:`search.agent.stream`."""
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from search.domain import DocMeta
+from search.agent import consumer
+from search.agent.stream import FileStream, InvalidArgumentException
+
+
+class TestFileStream(TestCase):
+    """:class:`.FileStream` serves records from an NDJSON file."""
+
+    def setUp(self):
+        """Write a file with five records."""
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'stream.ndjson')
+        with open(self.path, 'w') as f:
+            for i in range(5):
+                f.write(json.dumps({'document_id': f'1234.{i:05d}'}) + '\n')
+            f.write('\n')
+
+    def tearDown(self):
+        """Remove the file."""
+        shutil.rmtree(self.workdir)
+
+    def test_get_records(self):
+        """Records are served in order, up to the limit."""
+        stream = FileStream(self.path)
+        self.assertEqual(len(stream), 5)
+        iterator = stream.get_shard_iterator(
+            ShardIteratorType='TRIM_HORIZON'
+        )['ShardIterator']
+        response = stream.get_records(ShardIterator=iterator, Limit=3)
+        self.assertEqual([r['SequenceNumber'] for r in response['Records']],
+                         ['1', '2', '3'])
+        self.assertEqual(json.loads(response['Records'][0]['Data']),
+                         {'document_id': '1234.00000'})
+        self.assertFalse(stream.exhausted)
+
+        response = stream.get_records(
+            ShardIterator=response['NextShardIterator'], Limit=3
+        )
+        self.assertEqual([r['SequenceNumber'] for r in response['Records']],
+                         ['4', '5'])
+        self.assertTrue(stream.exhausted)
+
+        response = stream.get_records(
+            ShardIterator=response['NextShardIterator'], Limit=3
+        )
+        self.assertEqual(response['Records'], [], 'Waits for more records')
+        self.assertIsNotNone(response['NextShardIterator'])
+
+    def test_after_sequence_number(self):
+        """Reading resumes after a checkpoint."""
+        stream = FileStream(self.path)
+        iterator = stream.get_shard_iterator(
+            ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+            StartingSequenceNumber='4'
+        )['ShardIterator']
+        response = stream.get_records(ShardIterator=iterator, Limit=10)
+        self.assertEqual([r['SequenceNumber'] for r in response['Records']],
+                         ['5'])
+        with self.assertRaises(stream.exceptions.InvalidArgumentException):
+            stream.get_shard_iterator(
+                ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+                StartingSequenceNumber='6'
+            )
+
+    def test_rate(self):
+        """Records are not served before they arrive."""
+        stream = FileStream(self.path, rate=1.)
+        response = stream.get_records(ShardIterator='0', Limit=10)
+        self.assertEqual(len(response['Records']), 1)
+        self.assertEqual(response['Records'][0]['ApproximateArrivalTimestamp'],
+                         stream.opened)
+
+        stream.opened -= 2.5    # As though we started 2.5 seconds ago.
+        response = stream.get_records(
+            ShardIterator=response['NextShardIterator'], Limit=1
+        )
+        self.assertEqual([r['SequenceNumber'] for r in response['Records']],
+                         ['2'])
+        self.assertEqual(response['MillisBehindLatest'], 1000)
+
+    def test_invalid_iterator(self):
+        """An iterator that the stream did not issue is rejected."""
+        with self.assertRaises(InvalidArgumentException):
+            FileStream(self.path).get_records(ShardIterator='foo')
+
+
+class TestConsumeFileStream(TestCase):
+    """A :class:`.FileStream` can be consumed in place of Kinesis."""
+
+    def setUp(self):
+        """Write a file with three records, for two papers."""
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'stream.ndjson')
+        with open(self.path, 'w') as f:
+            for paper_id in ('1234.56789', '2345.67890', '1234.56789'):
+                f.write(json.dumps({'document_id': paper_id}) + '\n')
+
+    def tearDown(self):
+        """Remove the file."""
+        shutil.rmtree(self.workdir)
+
+    @mock.patch('boto3.client')
+    @mock.patch('search.agent.consumer.index')
+    @mock.patch('search.agent.consumer.metadata')
+    def test_consume(self, mock_meta, mock_idx, mock_client_factory):
+        """Records are processed without connecting to Kinesis."""
+        mock_meta.bulk_retrieve.return_value = [
+            DocMeta(paper_id='1234.56789', version=1),
+            DocMeta(paper_id='2345.67890', version=1)
+        ]
+        mock_idx.bulk_add_documents.return_value = 2
+        stream = FileStream(self.path)
+        processor = consumer.MetadataRecordProcessor(
+            'MetadataIsAvailable', '0', client=stream, sleep=0,
+            start_type='TRIM_HORIZON', max_batch_size=10,
+            dead_letter_path=os.path.join(self.workdir, 'dead.ndjson')
+        )
+        processor.sleep_time = 0
+        self.assertEqual(mock_client_factory.call_count, 0)
+        self.assertEqual(processor.stream_name, stream.name)
+
+        start = processor._get_iterator()
+        start, processed = processor.process_records(start)
+        self.assertTrue(stream.exhausted)
+        self.assertEqual(processed, 0, 'Batch is not full yet')
+        self.assertEqual(processor.drain(), 3)
+        self.assertEqual(processor.position, '3')
+        self.assertEqual(mock_meta.bulk_retrieve.call_count, 1)
+        self.assertEqual(processor.metrics.records.total(), 3)
@@ -0,0 +1,42 @@
+"""Helpers for the tests of :mod:`search.agent`."""
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from search.agent import consumer
+
+
+def _record(sequence_number, document_id, **payload):
+    """Make a Kinesis record, as returned by ``get_records``."""
+    payload['document_id'] = document_id
+    return {'SequenceNumber': str(sequence_number),
+            'Data': json.dumps(payload).encode('utf-8')}
+
+
+class ProcessorTestCase(TestCase):
+    """Tests for a processor that is not connected to a stream."""
+
+    max_batch_size = 4
+
+    def setUp(self):
+        """Initialize a processor that is not connected to a stream."""
+        self.workdir = tempfile.mkdtemp()
+        self.dead_letter_path = os.path.join(self.workdir, 'dead.ndjson')
+        self.processor = consumer.MetadataRecordProcessor(
+            sleep=0, max_batch_size=self.max_batch_size,
+            max_batch_latency=60, dead_letter_path=self.dead_letter_path
+        )
+        self.processor.sleep_time = 0
+        self.processor.get_records = mock.MagicMock()
+
+    def tearDown(self):
+        """Remove the dead-letter file."""
+        shutil.rmtree(self.workdir)
+
+    def _get_records(self, *records):
+        self.processor.get_records.return_value = ('next', {
+            'Records': list(records)
+        })
@@ -171,8 +171,37 @@ ELASTICSEARCH_USER = os.environ.get('ELASTICSEARCH_USER', None)
 ELASTICSEARCH_PASSWORD = os.environ.get('ELASTICSEARCH_PASSWORD', None)
 ELASTICSEARCH_VERIFY = os.environ.get('ELASTICSEARCH_VERIFY', 'true')
 """Indicates whether SSL certificate verification for ES should be enforced."""
+ELASTICSEARCH_CURRENT_INDEX = os.environ.get('ELASTICSEARCH_CURRENT_INDEX', '')
+"""
+Index of only the current version of each paper, e.g. ``'arxiv-current'``.
+
+If set, it is kept up to date alongside ``ELASTICSEARCH_INDEX`` by the same
+indexing paths, and searches that do not include older versions are performed
+on it. Fill it for the first time with ``reindex.py --current-only``.
+"""
+
+ELASTICSEARCH_PASSAGE_INDEX = os.environ.get('ELASTICSEARCH_PASSAGE_INDEX', '')
+"""
+Index of fulltext passages, e.g. ``'arxiv-passages'``.
+
+If set, the fulltext of documents is indexed there as passages, and
+``full_text`` searches are performed on it. Otherwise, they are redirected to
+the classic fulltext search.
+"""
 
 
+ASYNC_MAX_REQUESTS = os.environ.get('ASYNC_MAX_REQUESTS', '100')
+"""
+Max number of requests in flight at once from an asyncio client.
+
+The asyncio sessions with the metadata and fulltext services (see
+:mod:`search.services.aio`) can share a client, and so this limit.
+"""
+
+ASYNC_MAX_REQUESTS_PER_HOST = os.environ.get('ASYNC_MAX_REQUESTS_PER_HOST',
+                                             '0')
+"""Max number of requests in flight at once to a host (0 for no limit)."""
+
 METADATA_ENDPOINT = os.environ.get('METADATA_ENDPOINT',
                                    'https://arxiv.org/')
 """
@@ -181,15 +210,107 @@ Location of endpoint(s) for metadata retrieval.
 Multiple endpoints may be provided with comma delimitation.
 """
 
+METADATA_BULK_CHUNK_SIZE = os.environ.get('METADATA_BULK_CHUNK_SIZE', '50')
+"""Max number of papers in a single bulk metadata request."""
+
+METADATA_BULK_MAX_URL_LENGTH = os.environ.get('METADATA_BULK_MAX_URL_LENGTH',
+                                              '2000')
+"""
+Max length of the URL of a bulk metadata request.
+
+Larger lists of papers are split into chunks that are requested separately.
+"""
+
+METADATA_BULK_CONCURRENCY = os.environ.get('METADATA_BULK_CONCURRENCY', '4')
+"""Max number of chunks of a list of papers to request at a time."""
+
 METADATA_CACHE_DIR = os.environ.get('METADATA_CACHE_DIR')
-"""Cache directory for metadata documents."""
+"""
+Cache directory for metadata documents.
+
+If set, metadata that are retrieved are kept on disk (as well as in memory),
+and can be shared between processes and reused after a restart.
+"""
+
+METADATA_CACHE_SIZE = os.environ.get('METADATA_CACHE_SIZE', '10000')
+"""Max number of metadata documents to keep in memory."""
+
+METADATA_CACHE_MAX_MB = os.environ.get('METADATA_CACHE_MAX_MB', '1024')
+"""Max size (MB) of the metadata cache in ``METADATA_CACHE_DIR``."""
+
+METADATA_CACHE_MAX_AGE = os.environ.get('METADATA_CACHE_MAX_AGE', '0')
+"""
+Time (seconds) for which cached metadata for current versions are used.
+
+Metadata for the current version of a paper (and the list of its versions)
+may change at any time, so by default they are always retrieved again.
+Metadata for versions that have been superseded are used for as long as they
+are cached.
+"""
 
 METADATA_VERIFY_CERT = os.environ.get('METADATA_VERIFY_CERT', 'True')
 """If ``False``, SSL certificate verification will be disabled."""
 
+METADATA_POOL_SIZE = os.environ.get('METADATA_POOL_SIZE', '10')
+"""Max number of connections to keep open to each metadata endpoint."""
+
+METADATA_RETRIES = os.environ.get('METADATA_RETRIES', '3')
+"""
+Number of times to retry a metadata request that failed.
+
+Requests that get no response, or a server error, are retried on another
+endpoint if there is one.
+"""
+
+METADATA_CONNECT_TIMEOUT = os.environ.get('METADATA_CONNECT_TIMEOUT', '3.05')
+"""Time (seconds) to wait for a connection to a metadata endpoint."""
+
+METADATA_READ_TIMEOUT = os.environ.get('METADATA_READ_TIMEOUT', '30')
+"""Time (seconds) to wait for a metadata endpoint to respond."""
+
+METADATA_PROBE_INTERVAL = os.environ.get('METADATA_PROBE_INTERVAL', '30')
+"""
+Time (seconds) between probes of a metadata endpoint that kept failing.
+
+A metadata endpoint that fails three requests in a row is taken out of
+service (unless it is the only one left), until it responds to a probe.
+"""
+
 FULLTEXT_ENDPOINT = os.environ.get('FULLTEXT_ENDPOINT',
                                    'https://fulltext.arxiv.org/fulltext/')
 
+FULLTEXT_CONCURRENCY = os.environ.get('FULLTEXT_CONCURRENCY', '8')
+"""Max number of requests to the fulltext service at once, when indexing."""
+
+FULLTEXT_CACHE_DIR = os.environ.get('FULLTEXT_CACHE_DIR')
+"""
+Cache directory for fulltext.
+
+If set, fulltext that is retrieved is kept on disk (as well as in memory). It
+is only downloaded again if the fulltext service says that it has changed.
+"""
+
+FULLTEXT_CACHE_SIZE = os.environ.get('FULLTEXT_CACHE_SIZE', '100')
+"""Max number of extractions to keep in memory."""
+
+FULLTEXT_CACHE_MAX_MB = os.environ.get('FULLTEXT_CACHE_MAX_MB', '10240')
+"""Max size (MB) of the fulltext cache in ``FULLTEXT_CACHE_DIR``."""
+
+FULLTEXT_CACHE_MAX_AGE = os.environ.get('FULLTEXT_CACHE_MAX_AGE', '0')
+"""
+Time (seconds) for which cached fulltext is used without checking.
+
+After this, cached fulltext is revalidated with a conditional request.
+"""
+
+FULLTEXT_MAX_CHARS = os.environ.get('FULLTEXT_MAX_CHARS', '1000000')
+"""
+Max length (characters) of the fulltext indexed for a paper.
+
+Fulltext is normalized (e.g. runs of whitespace are collapsed) before it is
+truncated; see :func:`search.process.enrich.normalize`.
+"""
+
 # Settings for the indexing agent.
 KINESIS_ENDPOINT = os.environ.get('KINESIS_ENDPOINT')
 """Can be used to set an alternate endpoint, e.g. for testing."""
@@ -200,7 +321,12 @@ KINESIS_VERIFY = os.environ.get('KINESIS_VERIFY', "true")
 KINESIS_STREAM = os.environ.get('KINESIS_STREAM', 'MetadataIsAvailable')
 """Name of the stream to which the indexing agent subscribes."""
 
-KINESIS_SHARD_ID = os.environ.get('KINESIS_SHARD_ID', '0')
+KINESIS_SHARD_ID = os.environ.get('KINESIS_SHARD_ID', '')
+"""
+Shard to consume, e.g. ``shardId-000000000000`` (or ``0``).
+
+If empty, the agent consumes all of the shards of ``KINESIS_STREAM``.
+"""
 
 KINESIS_CHECKPOINT_VOLUME = os.environ.get('KINESIS_CHECKPOINT_VOLUME',
                                            '/tmp')
@@ -209,7 +335,106 @@ KINESIS_START_TYPE = os.environ.get('KINESIS_START_TYPE', 'AT_TIMESTAMP')
 KINESIS_START_AT = os.environ.get('KINESIS_START_AT')
 
 KINESIS_SLEEP = os.environ.get('KINESIS_SLEEP', '0.1')
-"""Amount of time to wait before moving on to the next record."""
+"""
+Initial amount of time to wait before moving on to the next batch of records.
+
+The agent adjusts this as it goes, slowing down when the metadata service or
+the index are under pressure, and speeding up when it is falling behind.
+"""
+
+AGENT_BATCH_SIZE = os.environ.get('AGENT_BATCH_SIZE', '100')
+"""Maximum number of stream records that the agent processes together."""
+
+AGENT_BATCH_LATENCY = os.environ.get('AGENT_BATCH_LATENCY', '10')
+"""Maximum time (seconds) that a record waits for its batch to fill up."""
+
+AGENT_PIPELINE_DEPTH = os.environ.get('AGENT_PIPELINE_DEPTH', '2')
+"""
+Number of batches that can wait at each stage of the agent's pipeline.
+
+If 0, metadata retrieval, transformation, and indexing are performed one after
+another in the consumer's thread.
+"""
+
+AGENT_MAX_DELAY = os.environ.get('AGENT_MAX_DELAY', '30')
+"""Maximum time (seconds) to wait before each batch, when backing off."""
+
+AGENT_TARGET_LATENCY = os.environ.get('AGENT_TARGET_LATENCY', '10')
+"""The agent backs off when a batch takes longer (seconds) than this."""
+
+AGENT_RETRY_ATTEMPTS = os.environ.get('AGENT_RETRY_ATTEMPTS', '5')
+"""Max number of times the agent tries to index a paper."""
+
+AGENT_RETRY_DELAY = os.environ.get('AGENT_RETRY_DELAY', '1')
+"""
+Delay (seconds) before the agent first retries a paper.
+
+The delay doubles (with jitter) after each failed attempt, up to
+``AGENT_RETRY_MAX_DELAY``.
+"""
+
+AGENT_RETRY_MAX_DELAY = os.environ.get('AGENT_RETRY_MAX_DELAY', '300')
+"""Max delay (seconds) before the agent retries a paper."""
+
+AGENT_DEAD_LETTER_PATH = os.environ.get('AGENT_DEAD_LETTER_PATH',
+                                        'dead-letters.ndjson')
+"""
+File to which the agent writes papers that it could not index.
+
+These papers can be indexed later using ``replay.py``.
+"""
+
+AGENT_BACKFILL_BACKLOG = os.environ.get('AGENT_BACKFILL_BACKLOG', '10000')
+"""
+Max number of backfill records that the agent reads ahead.
+
+Backfill records (for papers that were not recently announced; see
+:mod:`search.agent.lanes`) are processed after newly announced papers. The
+agent reads this far ahead in the stream to find new papers that are queued
+behind backfill.
+"""
+
+AGENT_CHECKPOINT_RECORDS = os.environ.get('AGENT_CHECKPOINT_RECORDS', '1000')
+"""
+Max number of stream records that the agent processes between checkpoints.
+
+Checkpoints are written once the papers for those records have been indexed.
+After a restart, the agent processes the records since its last checkpoint
+again. If 0, only ``AGENT_CHECKPOINT_INTERVAL`` applies; if both are 0, the
+agent checkpoints after every batch.
+"""
+
+AGENT_CHECKPOINT_INTERVAL = os.environ.get('AGENT_CHECKPOINT_INTERVAL', '10')
+"""Max time (seconds) between the agent's checkpoints, if there is work."""
+
+AGENT_METRICS_HOST = os.environ.get('AGENT_METRICS_HOST', '127.0.0.1')
+"""Address on which the agent serves metrics."""
+
+AGENT_METRICS_PORT = os.environ.get('AGENT_METRICS_PORT', '9100')
+"""
+Port on which the agent serves metrics, in the Prometheus text format.
+
+If empty, metrics are not served (but are still summarized in the logs).
+"""
+
+AGENT_SHARD_DISCOVERY_INTERVAL = \
+    os.environ.get('AGENT_SHARD_DISCOVERY_INTERVAL', '60')
+"""Time (seconds) between checks for new shards, e.g. after resharding."""
+
+AGENT_FULLTEXT = os.environ.get('AGENT_FULLTEXT', 'false')
+"""
+If ``'true'``, the agent adds fulltext to the documents that it indexes.
+
+Papers for which fulltext cannot be retrieved are indexed without it.
+"""
+
+AGENT_STREAM_FILE = os.environ.get('AGENT_STREAM_FILE')
+"""
+NDJSON file of stream records, for running the agent without Kinesis.
+
+If set, the agent reads ``MetadataIsAvailable`` records from this file (see
+:mod:`search.agent.stream`) instead of from ``KINESIS_STREAM``.
+"""
 
 
 """
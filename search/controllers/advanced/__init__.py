@@ -22,7 +22,8 @@ from arxiv import status, taxonomy
 
 from search.services import index, fulltext, metadata
 from search.domain import AdvancedQuery, FieldedSearchTerm, DateRange, \
-    Classification, FieldedSearchList, ClassificationList, Query, asdict
+    Classification, FieldedSearchList, ClassificationList, Query, \
+    shallow_asdict
 from arxiv.base import logging
 from search.controllers.util import paginate, catch_underscore_syntax
 
@@ -110,7 +111,7 @@ def search(request_params: MultiDict) -> Response:
                 # Execute the search. We'll use the results directly in
                 #  template rendering, so they get added directly to the
                 #  response content.
-                response_data.update(asdict(index.search(q)))
+                response_data.update(shallow_asdict(index.search(q)))
             except index.IndexConnectionError as e:
                 # There was a (hopefully transient) connection problem. Either
                 #  this will clear up relatively quickly (next request), or
@@ -17,8 +17,8 @@ from arxiv import status, identifier, taxonomy
 
 from arxiv.base import logging
 from search.services import index, fulltext, metadata
-from search.domain import Query, SimpleQuery, asdict, Classification, \
-    ClassificationList
+from search.domain import Query, SimpleQuery, shallow_asdict, \
+    Classification, ClassificationList
 from search.controllers.util import paginate, catch_underscore_syntax
 
 from .forms import SimpleSearchForm
@@ -103,6 +103,11 @@ def search(request_params: MultiDict,
             response_data['has_classic_format'] = _classic
             request_params['query'] = _query
 
+    # Fulltext is searched by relevance, unless the user asks otherwise.
+    if request_params.get('searchtype') == 'full_text' \
+            and 'order' not in request_params:
+        request_params['order'] = ''
+
     # Fall back to form-based search.
     form = SimpleSearchForm(request_params)
 
@@ -112,8 +117,12 @@ def search(request_params: MultiDict,
             return {}, status.HTTP_301_MOVED_PERMANENTLY,\
                 {'Location': f'/help/search?q={form.query.data}'}
 
-        # Support classic "expeirmental" search
-        elif form.searchtype.data == 'full_text':
+        # Support classic "expeirmental" search, unless fulltext is indexed.
+        # Passages can't be limited to archives or sorted, so those searches
+        # go to the classic search, too.
+        elif form.searchtype.data == 'full_text' \
+                and (not index.passages_enabled() or archives is not None
+                     or form.order.data):
             return {}, status.HTTP_301_MOVED_PERMANENTLY,\
                 {'Location': 'http://search.arxiv.org:8081/'
                              f'?in=&query={form.query.data}'}
@@ -133,7 +142,7 @@ def search(request_params: MultiDict,
             # Execute the search. We'll use the results directly in
             #  template rendering, so they get added directly to the
             #  response content.
-            response_data.update(asdict(index.search(q)))
+            response_data.update(shallow_asdict(index.search(q)))
         except index.IndexConnectionError as e:
             # There was a (hopefully transient) connection problem. Either
             #  this will clear up relatively quickly (next request), or
@@ -136,6 +136,69 @@ class TestSearchController(TestCase):
                               "An SimpleQuery is passed to the search index")
         self.assertEqual(code, status.HTTP_200_OK, "Response should be OK.")
 
+    @mock.patch('search.controllers.simple.index')
+    def test_full_text(self, mock_index):
+        """Fulltext is searched natively if there is a passage index."""
+        mock_index.passages_enabled.return_value = True
+        mock_index.search.return_value = DocumentSet(metadata={}, results=[])
+        request_data = MultiDict({
+            'searchtype': 'full_text',
+            'query': 'dark matter'
+        })
+        response_data, code, headers = simple.search(request_data)
+        self.assertEqual(code, status.HTTP_200_OK, "Response should be OK.")
+        self.assertEqual(mock_index.search.call_count, 1,
+                         "A search should be attempted")
+        call_args, call_kwargs = mock_index.search.call_args
+        self.assertEqual(call_args[0].search_field, 'full_text')
+
+    @mock.patch('search.controllers.simple.index')
+    def test_full_text_by_relevance(self, mock_index):
+        """Fulltext searches are by relevance, unless otherwise requested."""
+        mock_index.passages_enabled.return_value = True
+        mock_index.search.return_value = DocumentSet(metadata={}, results=[])
+        request_data = MultiDict({
+            'searchtype': 'full_text',
+            'query': 'dark matter'
+        })
+        simple.search(request_data)
+        call_args, call_kwargs = mock_index.search.call_args
+        self.assertIsNone(call_args[0].order)
+
+    @mock.patch('search.controllers.simple.index')
+    def test_full_text_sorted_or_in_archive(self, mock_index):
+        """Sorted or archive fulltext searches go to the classic search."""
+        mock_index.passages_enabled.return_value = True
+        request_data = MultiDict({
+            'searchtype': 'full_text',
+            'query': 'dark matter',
+            'order': '-submitted_date'
+        })
+        _, code, _ = simple.search(request_data)
+        self.assertEqual(code, status.HTTP_301_MOVED_PERMANENTLY)
+        request_data = MultiDict({
+            'searchtype': 'full_text',
+            'query': 'dark matter'
+        })
+        _, code, _ = simple.search(request_data, archives=['cs'])
+        self.assertEqual(code, status.HTTP_301_MOVED_PERMANENTLY)
+        self.assertEqual(mock_index.search.call_count, 0,
+                         "No search should be attempted")
+
+    @mock.patch('search.controllers.simple.index')
+    def test_full_text_classic(self, mock_index):
+        """Otherwise, fulltext searches go to the classic search."""
+        mock_index.passages_enabled.return_value = False
+        request_data = MultiDict({
+            'searchtype': 'full_text',
+            'query': 'dark matter'
+        })
+        response_data, code, headers = simple.search(request_data)
+        self.assertEqual(code, status.HTTP_301_MOVED_PERMANENTLY,
+                         "Response should be a 301 redirect.")
+        self.assertEqual(mock_index.search.call_count, 0,
+                         "No search should be attempted")
+
     @mock.patch('search.controllers.simple.index')
     def test_invalid_data(self, mock_index):
         """Form data are invalid."""
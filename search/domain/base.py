@@ -15,10 +15,80 @@ EASTERN = timezone('US/Eastern')
 
 
 def asdict(obj: Any) -> dict:
-    """Coerce a dataclass object to a dict."""
+    """
+    Coerce a dataclass object to a dict.
+
+    All of the values in the returned dict are (deep) copies. Use
+    :func:`shallow_asdict` if the result will not be modified.
+    """
     return {key: value for key, value in _asdict(obj).items()}
 
 
+def shallow_asdict(obj: Any) -> dict:
+    """
+    Coerce a dataclass object to a dict, without copying its values.
+
+    Dataclasses (including those nested in lists and dicts) are converted to
+    dicts, just like :func:`asdict`. Everything else is passed through as-is,
+    so the result shares strings, lists, and dicts with ``obj``. This is much
+    cheaper than :func:`asdict` for large objects like :class:`.DocumentSet`,
+    but the result should be treated as read-only.
+
+    Parameters
+    ----------
+    obj : dataclass instance
+
+    Returns
+    -------
+    dict
+
+    """
+    return {name: _shallow(getattr(obj, name))
+            for name in obj.__dataclass_fields__}
+
+
+_ATOMIC = frozenset([str, int, float, bool, type(None), datetime, date])
+"""Types that never contain dataclasses."""
+
+
+def _shallow(value: Any) -> Any:
+    """Convert any dataclasses in ``value``, but otherwise leave it alone."""
+    if type(value) in _ATOMIC:
+        return value
+    if hasattr(type(value), '__dataclass_fields__'):
+        return shallow_asdict(value)
+    if isinstance(value, list):
+        converted = [_shallow(item) for item in value]
+        if any(new is not old for new, old in zip(converted, value)):
+            return type(value)(converted)
+    elif type(value) is dict:
+        converted_items = {key: _shallow(item) for key, item in value.items()}
+        if any(new is not value[key] for key, new in converted_items.items()):
+            return converted_items
+    return value
+
+
+def _slotted(cls: type) -> type:
+    """
+    Rebuild a dataclass so that its fields are stored in ``__slots__``.
+
+    Instances of slotted classes have no per-instance ``__dict__``, which
+    makes them considerably smaller and a bit faster to access. This matters
+    for the domain classes of which we create many thousands of instances
+    (e.g. when bulk indexing, or when rendering a large page of results).
+
+    Note that instances of a slotted class cannot be given attributes other
+    than their fields.
+    """
+    names = tuple(cls.__dataclass_fields__)     # type: ignore
+    exclude = set(names) | {'__dict__', '__weakref__'}
+    namespace = {key: value for key, value in cls.__dict__.items()
+                 if key not in exclude}
+    namespace['__slots__'] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@_slotted
 @dataclass
 class Person:
     """Represents an author, owner, or other person in metadata."""
@@ -43,6 +113,7 @@ class Person:
         return cls.__dataclass_fields__.keys()  # type: ignore
 
 
+@_slotted
 @dataclass
 class DocMeta:
     """Metadata for an arXiv paper, retrieved from the core repository."""
@@ -124,6 +195,7 @@ class DateRange:
         return _str
 
 
+@_slotted
 @dataclass
 class Classification:
     """Represents an arXiv classification for a paper."""
@@ -259,6 +331,7 @@ class SimpleQuery(Query):
     """If True, secondaries are considered when limiting by classification."""
 
 
+@_slotted
 @dataclass(init=True)
 class Document:
     """A search document, representing an arXiv paper."""
@@ -304,6 +377,8 @@ class Document:
     secondary_classification: ClassificationList = field(
         default_factory=ClassificationList
     )
+    fulltext: str = field(default_factory=str)
+    """Extracted text of the paper, if available (see :mod:`.enrich`)."""
 
     score: float = 1.0
 
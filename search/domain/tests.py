@@ -0,0 +1,63 @@
+"""Tests for :mod:`search.domain`."""
+
+from unittest import TestCase
+
+from search.domain import Document, DocumentSet, Person, Classification, \
+    ClassificationList, asdict, shallow_asdict
+
+
+class TestShallowAsdict(TestCase):
+    """:func:`.shallow_asdict` converts dataclasses without copying."""
+
+    def setUp(self):
+        """Build a document with nested dataclasses."""
+        self.document = Document(
+            id='1234.5678v2',
+            title='A title',
+            authors=[Person(full_name='Ada Lovelace')],
+            formats=['pdf', 'ps'],
+            license={'uri': 'http://creativecommons.org/licenses/by/4.0/'},
+            primary_classification=Classification(category={'id': 'cs.AI'}),
+            secondary_classification=ClassificationList([
+                Classification(category={'id': 'cs.DL'})
+            ])
+        )
+
+    def test_same_as_asdict(self):
+        """The result is equal to that of :func:`.asdict`."""
+        self.assertEqual(shallow_asdict(self.document), asdict(self.document))
+        documents = DocumentSet(metadata={}, results=[self.document])
+        self.assertEqual(shallow_asdict(documents), asdict(documents))
+
+    def test_values_are_not_copied(self):
+        """Values that are not dataclasses are passed through as-is."""
+        data = shallow_asdict(self.document)
+        self.assertIs(data['formats'], self.document.formats)
+        self.assertIs(data['license'], self.document.license)
+
+    def test_nested_dataclasses(self):
+        """Dataclasses in lists are converted to dicts."""
+        data = shallow_asdict(self.document)
+        self.assertEqual(data['authors'][0]['full_name'], 'Ada Lovelace')
+        self.assertIsInstance(data['secondary_classification'],
+                              ClassificationList)
+        self.assertEqual(data['secondary_classification'][0]['category'],
+                         {'id': 'cs.DL'})
+
+
+class TestSlotted(TestCase):
+    """Hot domain classes store their fields in slots."""
+
+    def test_no_instance_dict(self):
+        """Instances do not have a ``__dict__``."""
+        for obj in [Document(), Person(full_name='Ada Lovelace'),
+                    Classification()]:
+            self.assertFalse(hasattr(obj, '__dict__'))
+
+    def test_post_init(self):
+        """The latest version is still set on :class:`.Document`."""
+        self.assertEqual(Document(latest='1234.5678v3').latest_version, 3)
+
+    def test_defaults_are_not_shared(self):
+        """Each instance gets its own default containers."""
+        self.assertIsNot(Document().authors, Document().authors)
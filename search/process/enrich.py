@@ -0,0 +1,192 @@
+"""
+Adds fulltext content to metadata, for indexing.
+
+Fulltext is optional: a paper whose fulltext has not been extracted yet (or
+cannot be retrieved right now) is still indexed, just without it. So, unlike
+metadata, a failure to retrieve fulltext is counted and logged, rather than
+failing the paper. Fulltext is retrieved for several papers at once, by a
+bounded pool of threads, and is normalized and truncated before it is added
+to a search document, so that a few very large extractions do not blow up
+the size of bulk requests to the index.
+"""
+
+import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, \
+    Tuple
+
+from arxiv.base import logging
+from search.context import get_application_config
+from search.domain import DocMeta, Fulltext
+from search.services import fulltext
+
+logger = logging.getLogger(__name__)
+
+_CONTROL = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Fetch(NamedTuple):
+    """The outcome of a request for the fulltext of one paper version."""
+
+    paper_id_v: str
+    fulltext: Optional[Fulltext]
+    """Normalized fulltext, or ``None`` if it could not be retrieved."""
+
+    seconds: float
+    """Time spent on the request."""
+
+    size: int
+    """Number of characters of content retrieved, before normalizing."""
+
+    truncated: bool = False
+
+
+def normalize(content: str, max_chars: int) -> Tuple[str, bool]:
+    """
+    Normalize extracted text, and truncate it to at most ``max_chars``.
+
+    Control characters are removed, runs of whitespace (including the line
+    breaks left over from extraction) become single spaces, and the text is
+    converted to Unicode normal form C. Text that is too long is cut at the
+    last space before the limit.
+
+    Returns
+    -------
+    str
+        The normalized text.
+    bool
+        Whether the text was truncated.
+
+    """
+    # Collapsing whitespace only makes text shorter, so there is no need to
+    # normalize more of a very long extraction than we might keep.
+    content = content[:max_chars * 2]
+    content = _WHITESPACE.sub(' ', _CONTROL.sub('', content)).strip()
+    content = unicodedata.normalize('NFC', content)
+    if len(content) <= max_chars:
+        return content, False
+    cut = content.rfind(' ', 0, max_chars + 1)
+    return content[:cut if cut > 0 else max_chars], True
+
+
+class FulltextEnricher:
+    """Retrieves fulltext for batches of papers, a few at a time."""
+
+    MAX_CHARS = 1000000
+    """Default max length of fulltext added to a document (characters)."""
+
+    def __init__(self, session: Any, concurrency: int = 8,
+                 max_chars: int = MAX_CHARS) -> None:
+        """
+        Set up the enricher.
+
+        Parameters
+        ----------
+        session : object
+            Session with the fulltext service, e.g. a
+            :class:`.FulltextSession`, or the :mod:`.fulltext` module.
+        concurrency : int
+            Max number of requests to the fulltext service at once.
+        max_chars : int
+            Max length of fulltext added to a document (characters).
+
+        """
+        self.session = session
+        self.concurrency = concurrency
+        self.max_chars = max_chars
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def enrich(self, metadata: Iterable[DocMeta]) -> List[Fetch]:
+        """
+        Retrieve fulltext for each version in ``metadata``.
+
+        Returns
+        -------
+        list
+            A :class:`.Fetch` for each version, in the same order. Versions
+            for which fulltext could not be retrieved have none.
+
+        """
+        paper_ids_v = [f'{docmeta.paper_id}v{docmeta.version}'
+                       for docmeta in metadata]
+        return list(self._executor.map(self._fetch, paper_ids_v))
+
+    def close(self) -> None:
+        """Stop the worker threads."""
+        self._executor.shutdown()
+
+    def _fetch(self, paper_id_v: str) -> Fetch:
+        started = time.monotonic()
+        try:
+            text: Fulltext = self.session.retrieve(paper_id_v)
+        except (IOError, ValueError, TypeError) as e:
+            # Fulltext may not have been extracted yet, or the fulltext
+            # service may be down; the paper is indexed without it.
+            logger.warning(f'{paper_id_v}: no fulltext: {e}')
+            return Fetch(paper_id_v, None, time.monotonic() - started, 0)
+        seconds = time.monotonic() - started
+        size = len(text.content or '')
+        content, truncated = normalize(text.content or '', self.max_chars)
+        if truncated:
+            logger.debug(f'{paper_id_v}: fulltext truncated from {size}'
+                         f' characters')
+        return Fetch(paper_id_v,
+                     Fulltext(content=content, version=text.version,
+                              created=text.created),
+                     seconds, size, truncated)
+
+
+class FetchStats:
+    """Running totals for fulltext requests, for a summary at the end."""
+
+    def __init__(self) -> None:
+        """Start with no requests."""
+        self.requests = 0
+        self.retrieved = 0
+        self.truncated = 0
+        self.seconds = 0.
+        self.max_seconds = 0.
+        self.size = 0
+        """Total number of characters retrieved, before normalizing."""
+
+    def add(self, fetches: Iterable[Fetch]) -> None:
+        """Count some requests."""
+        for fetch in fetches:
+            self.requests += 1
+            self.seconds += fetch.seconds
+            self.max_seconds = max(self.max_seconds, fetch.seconds)
+            if fetch.fulltext is not None:
+                self.retrieved += 1
+                self.truncated += fetch.truncated
+                self.size += fetch.size
+
+    def summary(self) -> str:
+        """Describe the requests so far."""
+        if not self.requests:
+            return 'no requests'
+        mean_size = self.size / self.retrieved if self.retrieved else 0.
+        return (f'{self.retrieved} of {self.requests} retrieved'
+                f' ({self.truncated} truncated); mean latency'
+                f' {self.seconds / self.requests * 1000:.0f}ms, max'
+                f' {self.max_seconds * 1000:.0f}ms; mean size'
+                f' {mean_size:.0f} characters')
+
+
+def by_version(fetches: Iterable[Fetch]) -> Dict[str, Fulltext]:
+    """Get the fulltext that was retrieved, by versioned arXiv ID."""
+    return {fetch.paper_id_v: fetch.fulltext for fetch in fetches
+            if fetch.fulltext is not None}
+
+
+def get_enricher(app: object = None) -> FulltextEnricher:
+    """Get an enricher, with the settings in the application config."""
+    config = get_application_config(app)
+    return FulltextEnricher(
+        fulltext.get_session(app),
+        concurrency=int(config.get('FULLTEXT_CONCURRENCY', 8)),
+        max_chars=int(config.get('FULLTEXT_MAX_CHARS',
+                                 FulltextEnricher.MAX_CHARS))
+    )
@@ -1,11 +1,12 @@
-"""Tests for :mod:`search.transform`."""
+"""Tests for :mod:`search.process`."""
 
-from unittest import TestCase
+from copy import deepcopy
+from unittest import TestCase, mock
 import json
 import jsonschema
 from datetime import datetime, date
-from search.process import transform
-from search.domain import Document, DocMeta
+from search.process import enrich, transform
+from search.domain import Document, DocMeta, Fulltext
 
 
 class TestTransformMetdata(TestCase):
@@ -361,3 +362,88 @@ class TestTransformBulkDocmeta(TestCase):
                 self.assertFalse(doc.is_current)
                 self.assertEqual(doc.id, doc.paper_id_v)
             self.assertEqual(doc.latest_version, 2)
+
+
+class TestTransformBatch(TestCase):
+    """Test batch transformation with :func:`.to_search_documents`."""
+
+    def setUp(self):
+        """Load docmeta retrieved from the bulk endpoint."""
+        with open('tests/data/docmeta_bulk.json') as f:
+            self.docmeta = [DocMeta(**datum) for datum in json.load(f)]
+
+    def test_same_as_single(self):
+        """Batch transformation is equivalent to one at a time."""
+        self.assertEqual(
+            transform.to_search_documents(self.docmeta),
+            [transform.to_search_document(meta) for meta in self.docmeta]
+        )
+
+    def test_inputs_not_modified(self):
+        """The metadata records are not modified."""
+        original = deepcopy(self.docmeta)
+        transform.to_search_documents(self.docmeta)
+        self.assertEqual(self.docmeta, original)
+        self.assertNotIn('full_name', self.docmeta[0].authors_parsed[0])
+
+    def test_process_pool(self):
+        """Records can be transformed in worker processes."""
+        self.assertEqual(
+            transform.to_search_documents(self.docmeta, processes=2,
+                                          chunksize=1),
+            transform.to_search_documents(self.docmeta)
+        )
+
+    def test_repeated_authors(self):
+        """Each author gets their own dict, even if names are cached."""
+        meta = DocMeta(paper_id='1234.56789', authors_parsed=[
+            {'first_name': 'B. Ivan', 'last_name': 'Dole'},
+            {'first_name': 'B. Ivan', 'last_name': 'Dole'}
+        ])
+        first, second = transform.to_search_document(meta).authors
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertEqual(first['full_name_initialized'], 'B I Dole')
+
+
+class TestEnrich(TestCase):
+    """Fulltext is retrieved and normalized for indexing."""
+
+    def test_normalize(self):
+        """Whitespace is collapsed, and long text is cut between words."""
+        self.assertEqual(enrich.normalize(' Some\n\ttext\x00 here \x0c', 20),
+                         ('Some text here', False))
+        self.assertEqual(enrich.normalize('Cafe\u0301 au lait', 10),
+                         ('Caf\u00e9 au', True))
+        self.assertEqual(enrich.normalize('x' * 30, 10), ('x' * 10, True))
+
+    def test_enrich(self):
+        """Misses are tolerated, and sizes and latencies are tracked."""
+        session = mock.MagicMock()
+
+        def retrieve(paper_id_v):
+            if paper_id_v == '1234.56789v2':
+                raise IOError('No fulltext')
+            return Fulltext(content='word ' * 10, version='0.3',
+                            created=datetime(2017, 8, 30))
+        session.retrieve.side_effect = retrieve
+        enricher = enrich.FulltextEnricher(session, concurrency=2,
+                                           max_chars=20)
+        metadata = [DocMeta(paper_id='1234.56789', version=v)
+                    for v in (1, 2, 3)]
+        fetches = enricher.enrich(metadata)
+        enricher.close()
+
+        self.assertEqual([fetch.paper_id_v for fetch in fetches],
+                         ['1234.56789v1', '1234.56789v2', '1234.56789v3'])
+        self.assertEqual([fetch.size for fetch in fetches], [50, 0, 50])
+        self.assertTrue(fetches[0].truncated)
+        texts = enrich.by_version(fetches)
+        self.assertEqual(sorted(texts), ['1234.56789v1', '1234.56789v3'])
+        documents = transform.to_search_documents(metadata, fulltext=texts)
+        self.assertEqual([doc.fulltext for doc in documents],
+                         ['word word word word', '', 'word word word word'])
+
+        stats = enrich.FetchStats()
+        stats.add(fetches)
+        self.assertIn('2 of 3 retrieved (2 truncated)', stats.summary())
@@ -1,8 +1,12 @@
 """Responsible for transforming metadata & fulltext into a search document."""
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from operator import attrgetter
 from string import punctuation
 import re
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, \
+    Tuple, Union
 from search.domain import Document, DocMeta, Fulltext
 
 DEFAULT_LICENSE = {
@@ -42,14 +46,29 @@ def _constructACMClass(meta: DocMeta) -> Optional[list]:
     return [obj.strip() for obj in meta.acm_class.split(';')]
 
 
+@lru_cache(maxsize=16384)
+def _normalizeName(first_name: str, last_name: str) -> Tuple[str, str, str]:
+    """
+    Generate the full name, initials, and initialized name of an author.
+
+    Prolific authors appear on many papers, so this is cached.
+    """
+    full_name = re.sub(r'\s+', ' ', f"{first_name} {last_name}")
+    initials = " ".join([pt[0] for pt in first_name.split() if pt])
+    name_parts = first_name.split() + last_name.split()
+    full_name_initialized = ' '.join([part[0] for part in name_parts[:-1]]
+                                     + [name_parts[-1]])
+    return full_name, initials, full_name_initialized
+
+
 def _transformAuthor(author: dict) -> Optional[Dict]:
+    """Get a copy of ``author`` with generated name fields."""
     if (not author['last_name']) and (not author['first_name']):
         return None
-    author['full_name'] = re.sub(r'\s+', ' ', f"{author['first_name']} {author['last_name']}")
-    author['initials'] = " ".join([pt[0] for pt in author['first_name'].split() if pt])
-    name_parts = author['first_name'].split() + author['last_name'].split()
-    author['full_name_initialized'] = ' '.join([part[0] for part in name_parts[:-1]] + [name_parts[-1]])
-    return author
+    full_name, initials, full_name_initialized = \
+        _normalizeName(author['first_name'], author['last_name'])
+    return dict(author, full_name=full_name, initials=initials,
+                full_name_initialized=full_name_initialized)
 
 
 def _constructAuthors(meta: DocMeta) -> List[Dict]:
@@ -130,6 +149,22 @@ _transformations: List[Tuple[str, TransformType, bool]] = [
 ]
 
 
+_Getter = Callable[[DocMeta], Any]
+
+
+def _compile(transformations: List[Tuple[str, TransformType, bool]]) \
+        -> Tuple[Tuple[str, _Getter, bool], ...]:
+    """Replace attribute names in a transformation table with getters."""
+    return tuple(
+        (key, attrgetter(source) if isinstance(source, str) else source,
+         is_required)
+        for key, source, is_required in transformations
+    )
+
+
+_compiled = _compile(_transformations)
+
+
 def to_search_document(metadata: DocMeta, fulltext: Optional[Fulltext] = None)\
         -> Document:
     """
@@ -150,11 +185,8 @@ def to_search_document(metadata: DocMeta, fulltext: Optional[Fulltext] = None)\
 
     """
     data = {}
-    for key, source, is_required in _transformations:
-        if isinstance(source, str):
-            value = getattr(metadata, source, None)
-        elif hasattr(source, '__call__'):
-            value = source(metadata)
+    for key, getter, is_required in _compiled:
+        value = getter(metadata)
         if value is None and not is_required:
             continue
         data[key] = value
@@ -162,3 +194,43 @@ def to_search_document(metadata: DocMeta, fulltext: Optional[Fulltext] = None)\
         data['fulltext'] = fulltext.content
     return Document(**data)     # type: ignore
     # See https://github.com/python/mypy/issues/3937
+
+
+def to_search_documents(metadata: Iterable[DocMeta],
+                        processes: Optional[int] = None,
+                        chunksize: int = 100,
+                        fulltext: Optional[Mapping[str, Fulltext]] = None) \
+        -> List[Document]:
+    """
+    Transform a batch of metadata records into search documents.
+
+    Parameters
+    ----------
+    metadata : iterable
+        :class:`.DocMeta` records to transform. These are not modified.
+    processes : int
+        If provided, the records are transformed in a pool of this many
+        worker processes. This is only worthwhile for large batches (e.g.
+        backfills), since records and documents must be pickled in order to
+        pass them between processes.
+    chunksize : int
+        Number of records sent to a worker process at a time.
+    fulltext : mapping
+        :class:`.Fulltext` for some or all of the records, by versioned arXiv
+        ID (e.g. ``1234.56789v2``).
+
+    Returns
+    -------
+    list
+        A :class:`.Document` for each record, in the same order.
+
+    """
+    fulltext = fulltext or {}
+    metadata = list(metadata)
+    texts = [fulltext.get(_constructPaperVersion(meta)) for meta in metadata]
+    if not processes:
+        return [to_search_document(meta, text)
+                for meta, text in zip(metadata, texts)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(to_search_document, metadata, texts,
+                                 chunksize=chunksize))
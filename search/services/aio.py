@@ -0,0 +1,154 @@
+"""
+Requests to backend services with asyncio, using :mod:`aiohttp`.
+
+Indexing is mostly a matter of waiting for the metadata and fulltext
+services. With an :class:`aiohttp.ClientSession`, a single thread can wait
+for hundreds of requests at once: connections are kept alive and reused, and
+the number of requests in flight (and so of connections in use) is limited by
+its connector, across all of the sessions that share it.
+
+:func:`.request` wraps each response in a :class:`.Response`, with a similar
+API to :mod:`requests`, so that the asyncio sessions can decode responses in
+the same way as the synchronous ones, and turns failures into
+:class:`.ClientError`.
+"""
+
+import asyncio
+import json
+from typing import Any, Mapping, Optional, Tuple
+
+import aiohttp
+
+from arxiv.base import logging
+from search.context import get_application_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (3.05, 30.)
+"""Default connect and read timeouts (seconds)."""
+
+
+class ClientError(IOError):
+    """A request did not get a (valid) response."""
+
+
+class SSLError(ClientError):
+    """The secure connection failed."""
+
+
+class Timeout(ClientError):
+    """A connection or response took too long."""
+
+
+class Response:
+    """A response to a request, with a similar API to :mod:`requests`."""
+
+    def __init__(self, url: str, status_code: int, headers: Mapping[str, str],
+                 content: bytes) -> None:
+        """Keep the parts of the response; header names ignore case."""
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self) -> Any:
+        """Decode the body of the response as JSON."""
+        return json.loads(self.content.decode('utf-8'))
+
+
+async def connect(limit: int = 100,
+                  limit_per_host: int = 0) -> aiohttp.ClientSession:
+    """
+    Open a client, with a pool of keep-alive connections.
+
+    This is a coroutine so that the client belongs to the running event
+    loop, even when it is opened from synchronous code (e.g. with
+    ``loop.run_until_complete``).
+
+    Parameters
+    ----------
+    limit : int
+        Max number of requests in flight at once.
+    limit_per_host : int
+        Max number of requests in flight at once to each host. If 0, only
+        ``limit`` applies.
+
+    Returns
+    -------
+    :class:`aiohttp.ClientSession`
+        Must be closed (with ``await client.close()``) when it is no longer
+        needed.
+
+    """
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def get_client(app: object = None) -> aiohttp.ClientSession:
+    """Open a client, with the limits in the application config."""
+    config = get_application_config(app)
+    return await connect(
+        limit=int(config.get('ASYNC_MAX_REQUESTS', 100)),
+        limit_per_host=int(config.get('ASYNC_MAX_REQUESTS_PER_HOST', 0))
+    )
+
+
+async def get(client: aiohttp.ClientSession, url: str,
+              **kwargs: Any) -> Response:
+    """Send a ``GET`` request (see :func:`request`)."""
+    return await request(client, 'GET', url, **kwargs)
+
+
+async def head(client: aiohttp.ClientSession, url: str,
+               **kwargs: Any) -> Response:
+    """Send a ``HEAD`` request (see :func:`request`)."""
+    return await request(client, 'HEAD', url, **kwargs)
+
+
+async def request(client: aiohttp.ClientSession, method: str, url: str,
+                  headers: Optional[Mapping[str, str]] = None,
+                  timeout: Optional[Tuple[float, float]] = None,
+                  verify: bool = True) -> Response:
+    """
+    Send a request, and wait for the whole response.
+
+    Parameters
+    ----------
+    client : :class:`aiohttp.ClientSession`
+        See :func:`connect`.
+    method : str
+        E.g. ``GET`` or ``HEAD``.
+    url : str
+    headers : dict
+        Extra headers for the request.
+    timeout : tuple
+        Connect and read timeouts (seconds), if not the default. Time spent
+        waiting for a free connection does not count.
+    verify : bool
+        Whether to verify the certificate of an HTTPS endpoint.
+
+    Raises
+    ------
+    :class:`.SSLError`
+    :class:`.Timeout`
+    :class:`.ClientError`
+        If there was no (valid) response.
+
+    """
+    connect_timeout, read_timeout = timeout or DEFAULT_TIMEOUT
+    kwargs: dict = {} if verify else {'ssl': False}
+    try:
+        async with client.request(
+                method, url, headers=headers,
+                timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                              sock_read=read_timeout),
+                **kwargs) as response:
+            content = await response.read()
+            return Response(url, response.status, response.headers, content)
+    except asyncio.TimeoutError as e:
+        raise Timeout(f'{method} {url} timed out') from e
+    except aiohttp.ClientSSLError as e:
+        raise SSLError(f'{method} {url}: {e}') from e
+    except aiohttp.ClientError as e:
+        raise ClientError(f'{method} {url} failed: {e}') from e
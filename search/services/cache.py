@@ -0,0 +1,213 @@
+"""
+A two-tier cache for responses from backend services.
+
+:class:`.Cache` keeps recently used entries in memory (up to a number of
+entries), in front of an optional store on disk (up to a number of bytes) that
+is shared between processes and survives restarts. The least recently used
+entries are evicted from each tier when it is full. Entries are JSON-
+serializable dicts; what they mean, and whether they are still good, is up to
+the caller.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from arxiv.base import logging
+
+logger = logging.getLogger(__name__)
+
+_PREFIX = re.compile(r'^[0-9a-f]{2}$')
+
+
+class Cache:
+    """An in-memory LRU cache, backed by an optional store on disk."""
+
+    def __init__(self, max_items: int = 10000,
+                 directory: Optional[str] = None,
+                 max_bytes: int = 2 ** 30) -> None:
+        """
+        Set up the cache.
+
+        Parameters
+        ----------
+        max_items : int
+            Max number of entries to keep in memory. If 0, entries are not
+            kept in memory.
+        directory : str
+            Directory for the store on disk. If not set, entries are only
+            kept in memory.
+        max_bytes : int
+            Max total size of the files in the store on disk. When it is
+            exceeded, the least recently used files are removed until the
+            store is down to 90% of this size.
+
+        """
+        self.max_items = max_items
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats: Counter = Counter()
+        """Hits in each tier, misses, writes and evictions."""
+
+        self._memory: Dict[str, dict] = OrderedDict()
+        self._disk_bytes: Optional[int] = None   # Counted when first needed.
+        self._lock = threading.RLock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        """Get the number of entries in memory."""
+        return len(self._memory)
+
+    def get(self, key: str) -> Optional[dict]:
+        """Get an entry, or ``None`` if it is not in the cache."""
+        value = self.peek(key)
+        with self._lock:
+            if value is None:
+                self.stats['misses'] += 1
+            elif key in self._memory:
+                self.stats['memory_hits'] += 1
+            else:
+                self.stats['disk_hits'] += 1
+                self._remember(key, value)
+        return value
+
+    def peek(self, key: str) -> Optional[dict]:
+        """Get an entry without counting the lookup or promoting it."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)   # type: ignore
+                return self._memory[key]
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value: dict = json.load(f)
+            os.utime(path)     # The store on disk is evicted by last use.
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f'Removing unreadable cache entry {path}: {e}')
+            self._remove(path)
+            return None
+        return value
+
+    def put(self, key: str, value: dict) -> None:
+        """Add or replace an entry."""
+        with self._lock:
+            self._remember(key, value)
+            self.stats['writes'] += 1
+        if self.directory:
+            self._write(key, value)
+
+    def summary(self) -> str:
+        """Describe the use of the cache so far."""
+        lookups = sum(self.stats[k]
+                      for k in ('memory_hits', 'disk_hits', 'misses'))
+        if not lookups:
+            return 'no lookups'
+        hits = lookups - self.stats['misses']
+        return (f'{lookups} lookups, {hits / lookups:.0%} hits'
+                f' ({self.stats["memory_hits"]} in memory,'
+                f' {self.stats["disk_hits"]} on disk);'
+                f' {self.stats["evictions"]} evictions')
+
+    def _remember(self, key: str, value: dict) -> None:
+        if not self.max_items:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)   # type: ignore
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)    # type: ignore
+            self.stats['evictions'] += 1
+
+    def _path(self, key: str) -> str:
+        """Get the path of the file for an entry on disk."""
+        # Spread entries over subdirectories, to keep directories small.
+        prefix = hashlib.sha1(key.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.directory or '', prefix,
+                            f'{quote(key, safe="")}.json')
+
+    def _write(self, key: str, value: dict) -> None:
+        """Write an entry atomically, so that readers never see part of it."""
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                self._remove(tmp_path)
+                raise
+            size = os.path.getsize(path)
+        except (OSError, TypeError, ValueError) as e:
+            # The cache is an optimization; failing to write is not an error.
+            logger.warning(f'Could not write {key} to the cache: {e}')
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._files())
+            else:
+                self._disk_bytes += size - replaced
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self) -> List[Tuple[float, int, str]]:
+        """Get the last use, size and path of each file on disk."""
+        files = []
+        # Only the subdirectories made by _path belong to the store; others
+        # (e.g. another cache) are left alone.
+        try:
+            prefixes = [name for name in os.listdir(self.directory or '')
+                        if _PREFIX.match(name)]
+        except OSError:
+            return files
+        for prefix in prefixes:
+            root = os.path.join(self.directory or '', prefix)
+            try:
+                names = os.listdir(root)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:     # Removed by another process.
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _evict(self) -> None:
+        """Remove the least recently used files from disk."""
+        # Other processes may share the store, so start from what is there.
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_bytes * .9)
+        for _, size, path in files:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+            self.stats['evictions'] += 1
+        self._disk_bytes = total
+        logger.debug(f'Cache on disk is down to {total} bytes')
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,188 @@
+"""
+Health-aware balancing across the endpoints of an HTTP service.
+
+:class:`.EndpointPool` keeps a pooled, keep-alive :class:`requests.Session`
+for each endpoint, and picks the endpoint for each request by how it has been
+doing: the healthy endpoint with the lowest expected wait (its recent latency
+times the requests that it is already handling) is used. An endpoint that
+fails several requests in a row is ejected (unless it is the last one in
+service); once it has been out for a while it is probed, and is used again if
+the probe gets a response.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence, Set, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from arxiv.base import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint:
+    """An endpoint of a service, and how it has been doing lately."""
+
+    SMOOTHING = 0.3
+    """Weight of the latest response time in the moving average latency."""
+
+    def __init__(self, url: str, session: requests.Session) -> None:
+        """Start with no history."""
+        if not url.endswith('/'):
+            url += '/'
+        self.url = url
+        self.session = session
+        self.latency = 0.
+        """Moving average of response times (seconds) of the endpoint."""
+
+        self.in_flight = 0
+        """Number of requests that are waiting for the endpoint."""
+
+        self.failures = 0
+        """Number of requests to the endpoint that failed in a row."""
+
+        self.ejected_until: Optional[float] = None
+        """When (monotonic) an ejected endpoint should next be probed."""
+
+    @property
+    def healthy(self) -> bool:
+        """Determine whether the endpoint is in service."""
+        return self.ejected_until is None
+
+    @property
+    def cost(self) -> float:
+        """Get the expected wait for a new request to the endpoint."""
+        return self.latency * (self.in_flight + 1)
+
+    def succeeded(self, latency: float) -> None:
+        """Update the endpoint's history after a successful request."""
+        if self.latency:
+            self.latency += self.SMOOTHING * (latency - self.latency)
+        else:
+            self.latency = latency
+        self.failures = 0
+        self.ejected_until = None
+
+
+class EndpointPool:
+    """Picks endpoints for requests, by latency and health."""
+
+    def __init__(self, urls: Sequence[str], pool_size: int = 10,
+                 max_failures: int = 3, probe_interval: float = 30.,
+                 timeout: Tuple[float, float] = (3.05, 30.)) -> None:
+        """
+        Set up a connection pool for each endpoint.
+
+        Parameters
+        ----------
+        urls : list
+            Base URLs of the endpoints.
+        pool_size : int
+            Max number of connections to keep open to each endpoint.
+        max_failures : int
+            Eject an endpoint when this many requests in a row have failed.
+        probe_interval : float
+            Time (seconds) between probes of an endpoint that was ejected.
+        timeout : tuple
+            Connect and read timeouts (seconds), for requests and probes.
+
+        """
+        if not urls:
+            raise ValueError('At least one endpoint is required')
+        self.max_failures = max_failures
+        self.probe_interval = probe_interval
+        self.timeout = timeout
+        self.endpoints: List[Endpoint] = []
+        for url in urls:
+            session = requests.Session()
+            # Retries are up to the caller, so that they can go elsewhere.
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                  max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self.endpoints.append(Endpoint(url, session))
+        self._lock = threading.Lock()
+
+    def pick(self, exclude: Optional[Set[str]] = None,
+             probe: bool = True) -> Endpoint:
+        """
+        Get the best endpoint for a request.
+
+        Parameters
+        ----------
+        exclude : set
+            URLs of endpoints to avoid (e.g. because they just failed this
+            request), unless there is nothing else.
+        probe : bool
+            Whether to probe ejected endpoints that are due first. Callers
+            that cannot block (see :mod:`.aio`) use :meth:`due` and
+            :meth:`restore` to probe them in their own way.
+
+        """
+        if probe:
+            for endpoint in self.due():
+                self.probe(endpoint)
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.healthy]
+            preferred = [e for e in healthy if e.url not in (exclude or ())]
+            return min(preferred or healthy, key=lambda e: e.cost)
+
+    def due(self) -> List[Endpoint]:
+        """Get the ejected endpoints that are due for a probe."""
+        with self._lock:
+            now = time.monotonic()
+            due = [e for e in self.endpoints if e.ejected_until is not None
+                   and e.ejected_until <= now]
+            for endpoint in due:    # Only one caller gets to probe each.
+                endpoint.ejected_until = now + self.probe_interval
+        return due
+
+    def probe(self, endpoint: Endpoint) -> bool:
+        """Check whether an ejected endpoint is responding again."""
+        try:
+            response = endpoint.session.head(endpoint.url,
+                                             timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logger.debug(f'Probe of {endpoint.url} failed: {e}')
+            return False
+        return self.restore(endpoint, response.status_code)
+
+    def restore(self, endpoint: Endpoint, status_code: int) -> bool:
+        """Put an endpoint back in service if a probe got a good response."""
+        if status_code >= 500:
+            logger.debug(f'Probe of {endpoint.url} failed: {status_code}')
+            return False
+        logger.info(f'Endpoint {endpoint.url} is back in service')
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.ejected_until = None
+        return True
+
+    @contextmanager
+    def request(self, endpoint: Endpoint) -> Iterator[Endpoint]:
+        """Keep track of a request to ``endpoint``, and of how it went."""
+        with self._lock:
+            endpoint.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield endpoint
+        except Exception:
+            with self._lock:
+                endpoint.in_flight -= 1
+                self._failed(endpoint)
+            raise
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.succeeded(time.monotonic() - started)
+
+    def _failed(self, endpoint: Endpoint) -> None:
+        endpoint.failures += 1
+        others = [e for e in self.endpoints if e.healthy and e is not endpoint]
+        if endpoint.healthy and endpoint.failures >= self.max_failures \
+                and others:
+            logger.warning(f'Ejecting endpoint {endpoint.url} after'
+                           f' {endpoint.failures} failures')
+            endpoint.ejected_until = time.monotonic() + self.probe_interval
@@ -1,29 +1,173 @@
-"""Provides access to fulltext content for arXiv papers."""
+"""
+Provides access to fulltext content for arXiv papers.
 
+:class:`.FulltextSession` keeps a pool of keep-alive connections to the
+fulltext endpoint. Fulltext can be cached (see :class:`.Cache`), in memory
+and on disk in ``FULLTEXT_CACHE_DIR``, by versioned arXiv ID. Cached fulltext
+is revalidated with a conditional request (using the ``ETag`` and
+``Last-Modified`` of the response, or else the date of the extraction), so
+that an extraction that has not changed since it was last retrieved (e.g. by
+an earlier run of ``bulk_index.py``) is not downloaded again.
+"""
+
+import calendar
+from collections import Counter
+from email.utils import formatdate
 from functools import wraps
-import os
+from typing import Any, Dict, Optional, Tuple
 from urllib.parse import urljoin
 import json
+import time
 
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
 
 from arxiv import status
+from arxiv.base import logging
 from search.context import get_application_config, get_application_global
 from search.domain import Fulltext
+from . import aio
+from .cache import Cache
 
+logger = logging.getLogger(__name__)
 
-class FulltextSession(object):
-    """An HTTP session with the fulltext endpoint."""
 
-    def __init__(self, endpoint: str) -> None:
-        """Initialize an HTTP session."""
-        self._session = requests.Session()
-        self._adapter = requests.adapters.HTTPAdapter(max_retries=2)
-        self._session.mount('https://', self._adapter)
+def _created(data: dict) -> Optional[str]:
+    """Get the date of an extraction as an HTTP date, if it can be parsed."""
+    created = data.get('created')
+    if not isinstance(created, str):
+        return None
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            parsed = time.strptime(created[:26], fmt)
+        except ValueError:
+            continue
+        return formatdate(calendar.timegm(parsed), usegmt=True)
+    return None
+
 
+class _BaseFulltextSession(object):
+    """Configuration and helpers shared by the fulltext sessions."""
+
+    def __init__(self, endpoint: str, cache: Optional[Cache] = None,
+                 max_age: float = 0.) -> None:
+        """
+        Set the endpoint, and the cache.
+
+        Parameters
+        ----------
+        endpoint : str
+            Base URL for fulltext endpoint.
+        cache : :class:`.Cache`
+            Cache for fulltext, by versioned arXiv ID. If not set, fulltext is
+            always downloaded.
+        max_age : float
+            Time (seconds) for which cached fulltext is used without checking
+            whether it has changed.
+
+        """
         if not endpoint[-1] == '/':
             endpoint += '/'
         self.endpoint = endpoint
+        self.cache = cache
+        self.max_age = max_age
+        self.stats: Counter = Counter()
+        """Fulltext downloaded, not modified, and used without checking."""
+
+    def _lookup(self, document_id: str) \
+            -> Tuple[Optional[dict], Dict[str, str]]:
+        """Get cached fulltext, and the headers to revalidate it."""
+        headers = {'User-Agent': 'arXiv/system'}
+        if self.cache is None:
+            return None, headers
+        entry = self.cache.get(document_id)
+        if entry is None:
+            return None, headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        modified = entry.get('last_modified') or _created(entry['data'])
+        if modified:
+            headers['If-Modified-Since'] = modified
+        return entry, headers
+
+    def _fresh(self, entry: Optional[dict]) -> bool:
+        """Determine whether cached fulltext can be used without checking."""
+        return entry is not None \
+            and time.time() - entry['retrieved'] < self.max_age
+
+    def _decode(self, response: Any, document_id: str,
+                entry: Optional[dict]) -> Fulltext:
+        """Get fulltext from a response, or from the cache if unchanged."""
+        if response.status_code == status.HTTP_304_NOT_MODIFIED \
+                and entry is not None:
+            logger.debug(f'{document_id}: fulltext not modified')
+            self.stats['not_modified'] += 1
+            if self.max_age:    # Checked just now, so good for a while.
+                entry['retrieved'] = time.time()
+                self._put(document_id, entry)
+            return Fulltext(**entry['data'])    # type: ignore
+        if response.status_code != status.HTTP_200_OK:
+            raise IOError('%s: could not retrieve fulltext: %i' %
+                          (document_id, response.status_code))
+        try:
+            data = response.json()
+        except json.decoder.JSONDecodeError as e:
+            raise IOError('%s: could not decode response: %s' %
+                          (document_id, e)) from e
+        self.stats['downloaded'] += 1
+        self._put(document_id, {
+            'retrieved': time.time(),
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'data': data
+        })
+        return Fulltext(**data)     # type: ignore
+        # See https://github.com/python/mypy/issues/3937
+
+    def _put(self, document_id: str, entry: dict) -> None:
+        if self.cache is not None:
+            self.cache.put(document_id, entry)
+
+
+class FulltextSession(_BaseFulltextSession):
+    """An HTTP session with the fulltext endpoint."""
+
+    def __init__(self, endpoint: str, pool_size: int = 10, retries: int = 2,
+                 connect_timeout: float = 3.05, read_timeout: float = 30.,
+                 cache: Optional[Cache] = None, max_age: float = 0.) -> None:
+        """
+        Initialize an HTTP session.
+
+        Parameters
+        ----------
+        endpoint : str
+            Base URL for fulltext endpoint.
+        pool_size : int
+            Max number of connections to keep open to the endpoint.
+        retries : int
+            Number of times to retry a request that could not connect.
+        connect_timeout : float
+            Time (seconds) to wait for a connection to the endpoint.
+        read_timeout : float
+            Time (seconds) to wait for the endpoint to respond.
+        cache : :class:`.Cache`
+            Cache for fulltext, by versioned arXiv ID. If not set, fulltext is
+            always downloaded.
+        max_age : float
+            Time (seconds) for which cached fulltext is used without checking
+            whether it has changed.
+
+        """
+        super(FulltextSession, self).__init__(endpoint, cache=cache,
+                                              max_age=max_age)
+        self._timeout = (connect_timeout, read_timeout)
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1,
+                                    pool_maxsize=pool_size,
+                                    max_retries=retries)
+        self._session.mount('https://', self._adapter)
+        self._session.mount('http://', self._adapter)
 
     def retrieve(self, document_id: str) -> Fulltext:
         """
@@ -33,8 +177,6 @@ class FulltextSession(object):
         ----------
         document_id : str
             arXiv identifier, including version tag. E.g. ``"1234.56787v3"``.
-        endpoint : str
-            Base URL for fulltext endpoint.
 
         Returns
         -------
@@ -52,21 +194,83 @@ class FulltextSession(object):
         if not document_id:    # This could use further elaboration.
             raise ValueError('Invalid value for document_id')
 
+        entry, headers = self._lookup(document_id)
+        if self._fresh(entry):
+            self.stats['cached'] += 1
+            return Fulltext(**entry['data'])    # type: ignore
         try:
-            response = requests.get(urljoin(self.endpoint, document_id))
+            response = self._session.get(urljoin(self.endpoint, document_id),
+                                         headers=headers,
+                                         timeout=self._timeout)
         except requests.exceptions.SSLError as e:
             raise IOError('SSL failed: %s' % e)
-
-        if response.status_code != status.HTTP_200_OK:
-            raise IOError('%s: could not retrieve fulltext: %i' %
-                          (document_id, response.status_code))
-        try:
-            data = response.json()
-        except json.decoder.JSONDecodeError as e:
-            raise IOError('%s: could not decode response: %s' %
+        except requests.exceptions.RequestException as e:
+            raise IOError('%s: could not retrieve fulltext: %s' %
                           (document_id, e)) from e
-        return Fulltext(**data)     # type: ignore
-        # See https://github.com/python/mypy/issues/3937
+        return self._decode(response, document_id, entry)
+
+
+class AsyncFulltextSession(_BaseFulltextSession):
+    """
+    An asyncio session with the fulltext endpoint.
+
+    Has the same API as :class:`.FulltextSession`, except that
+    :meth:`retrieve` is a coroutine.
+    """
+
+    def __init__(self, endpoint: str,
+                 client: Optional[aiohttp.ClientSession] = None,
+                 cache: Optional[Cache] = None, max_age: float = 0.) -> None:
+        """
+        Initialize a session.
+
+        Parameters
+        ----------
+        endpoint : str
+            Base URL for fulltext endpoint.
+        client : :class:`aiohttp.ClientSession`
+            Client for the requests (see :func:`.aio.connect`), which may be
+            shared with other sessions so that they share its limit on
+            requests in flight. If not set, the session opens its own client
+            (see :func:`.aio.get_client`) when it first needs one.
+        cache : :class:`.Cache`
+            Cache for fulltext, as for :class:`.FulltextSession`.
+        max_age : float
+            Time (seconds) for which cached fulltext is used without checking
+            whether it has changed.
+
+        """
+        super(AsyncFulltextSession, self).__init__(endpoint, cache=cache,
+                                                   max_age=max_age)
+        self.client = client
+        self._own_client = client is None
+
+    async def _client(self) -> aiohttp.ClientSession:
+        """Get the client, opening one if there is none yet."""
+        if self.client is None:
+            self.client = await aio.get_client()
+        return self.client
+
+    async def close(self) -> None:
+        """Close the client, if the session opened it."""
+        if self._own_client and self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def retrieve(self, document_id: str) -> Fulltext:
+        """Retrieve fulltext content for an arXiv paper."""
+        if not document_id:    # This could use further elaboration.
+            raise ValueError('Invalid value for document_id')
+
+        entry, headers = self._lookup(document_id)
+        if self._fresh(entry):
+            self.stats['cached'] += 1
+            return Fulltext(**entry['data'])    # type: ignore
+        # aio.ClientError is an IOError, like the other failures here.
+        response = await aio.get(await self._client(),
+                                 urljoin(self.endpoint, document_id),
+                                 headers=headers)
+        return self._decode(response, document_id, entry)
 
 
 def init_app(app: object = None) -> None:
@@ -76,12 +280,39 @@ def init_app(app: object = None) -> None:
                       'https://fulltext.arxiv.org/fulltext/')
 
 
+def _cache_kwargs(app: object = None) -> Dict[str, Any]:
+    """Get the cache for a session, from config."""
+    config = get_application_config(app)
+    cache = Cache(
+        max_items=int(config.get('FULLTEXT_CACHE_SIZE', 100)),
+        directory=config.get('FULLTEXT_CACHE_DIR') or None,
+        max_bytes=int(config.get('FULLTEXT_CACHE_MAX_MB', 10240)) * 2 ** 20
+    )
+    return dict(cache=cache,
+                max_age=float(config.get('FULLTEXT_CACHE_MAX_AGE', 0)))
+
+
 def get_session(app: object = None) -> FulltextSession:
     """Get a new session with the fulltext endpoint."""
     config = get_application_config(app)
     endpoint = config.get('FULLTEXT_ENDPOINT',
                           'https://fulltext.arxiv.org/fulltext/')
-    return FulltextSession(endpoint)
+    # Each of the threads that retrieve fulltext gets a connection.
+    return FulltextSession(
+        endpoint, pool_size=int(config.get('FULLTEXT_CONCURRENCY', 10)),
+        **_cache_kwargs(app)
+    )
+
+
+def get_async_session(app: object = None,
+                      client: Optional[aiohttp.ClientSession] = None) \
+        -> AsyncFulltextSession:
+    """Get a new asyncio session with the fulltext endpoint."""
+    config = get_application_config(app)
+    endpoint = config.get('FULLTEXT_ENDPOINT',
+                          'https://fulltext.arxiv.org/fulltext/')
+    return AsyncFulltextSession(endpoint, client=client,
+                                **_cache_kwargs(app))
 
 
 def current_session() -> FulltextSession:
@@ -19,12 +19,12 @@ context of the request.
 import json
 import urllib3
 from contextlib import contextmanager
-from typing import Any, Optional, Tuple, Union, List, Generator
+from typing import Any, Dict, Optional, Tuple, Union, List, Generator, \
+    Iterable
 from functools import reduce, wraps
 from operator import ior
 from elasticsearch import Elasticsearch, ElasticsearchException, \
-                          SerializationError, TransportError, NotFoundError, \
-                          helpers
+                          SerializationError, TransportError, NotFoundError
 from elasticsearch.connection import Urllib3HttpConnection
 from elasticsearch.helpers import BulkIndexError
 
@@ -33,15 +33,17 @@ from elasticsearch_dsl import Search, Q
 from search.context import get_application_config, get_application_global
 from arxiv.base import logging
 from search.domain import Document, DocumentSet, Query, AdvancedQuery, \
-    SimpleQuery, asdict, APIQuery
+    SimpleQuery, shallow_asdict, APIQuery
 
 from .exceptions import QueryError, IndexConnectionError, DocumentNotFound, \
-    IndexingError, OutsideAllowedRange, MappingError
+    IndexingError, BulkIndexingError, OutsideAllowedRange, MappingError
 from .util import MAX_RESULTS
 from .advanced import advanced_search
 from .simple import simple_search
 from .api import api_search
+from .bulk import BulkEncoder, HASH_FIELD, VERSION_FIELDS
 from . import highlighting
+from . import passages
 from . import results
 
 logger = logging.getLogger(__name__)
@@ -81,26 +83,53 @@ def handle_es_exceptions() -> Generator:
             raise DocumentNotFound('No such document')
         logger.error('Problem communicating with ES: %s' % e.error)
         raise IndexConnectionError(
-            'Problem communicating with ES: %s' % e.error
+            'Problem communicating with ES: %s' % e.error,
+            status_code=e.status_code if type(e.status_code) is int else None
         ) from e
     except SerializationError as e:
         logger.error("SerializationError: %s", e)
         raise IndexingError('Problem serializing document: %s' % e) from e
     except BulkIndexError as e:
         logger.error("BulkIndexError: %s", e)
-        raise IndexingError('Problem with bulk indexing: %s' % e) from e
+        failed = [error.get('_id') for error in e.errors]
+        status_codes = [error.get('status') for error in e.errors]
+        raise BulkIndexingError('Problem with bulk indexing: %s' % e,
+                                failed, status_codes) from e
     except Exception as e:
         logger.error('Unhandled exception: %s')
         raise
 
 
+def _mapping_agrees(expected: Any, actual: Any) -> bool:
+    """
+    Determine whether a mapping returned by ES agrees with ``expected``.
+
+    ES fills in defaults that are not in our mapping files, and may return
+    scalar settings as strings (e.g. ``"false"`` for ``false``), so only the
+    settings in ``expected`` are compared, and scalars are compared as
+    strings.
+    """
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(
+            key in actual and _mapping_agrees(value, actual[key])
+            for key, value in expected.items()
+        )
+    if isinstance(expected, list):
+        return isinstance(actual, list) and len(expected) == len(actual) \
+            and all(map(_mapping_agrees, expected, actual))
+    return str(expected).lower() == str(actual).lower()
+
+
 class SearchSession(object):
     """Encapsulates session with Elasticsearch host."""
 
     def __init__(self, host: str, index: str, port: int=9200,
                  scheme: str='http', user: Optional[str]=None,
                  password: Optional[str]=None, mapping: Optional[str]=None,
-                 verify: bool=True, **extra: Any) -> None:
+                 verify: bool=True, passage_index: Optional[str] = None,
+                 passage_mapping: Optional[str] = None,
+                 current_index: Optional[str] = None,
+                 **extra: Any) -> None:
         """
         Initialize the connection to Elasticsearch.
 
@@ -116,6 +145,16 @@ class SearchSession(object):
             Default: None
         password: str
             Default: None
+        passage_index : str
+            Name of the index of fulltext passages (see :mod:`.passages`). If
+            not set, fulltext is not indexed or searched.
+        passage_mapping : str
+            Path to the mapping for the passage index.
+        current_index : str
+            Name of an index that holds only the current version of each
+            paper, alongside ``index``. If set, it is kept up to date when
+            documents are added, and searches that do not include older
+            versions are performed on it.
 
         Raises
         ------
@@ -127,6 +166,11 @@ class SearchSession(object):
         self.index = index
         self.mapping = mapping
         self.doc_type = 'document'
+        self.passage_index = passage_index
+        self.passage_mapping = passage_mapping
+        self.passage_type = 'passage'
+        self.current_index = current_index
+        self._indexes_ready = False
         use_ssl = True if scheme == 'https' else False
         http_auth = '%s:%s' % (user, password) if user else None
 
@@ -148,16 +192,37 @@ class SearchSession(object):
                 'Could not initialize ES session: %s' % e
             ) from e
 
-    def _base_search(self) -> Search:
-        return Search(using=self.es, index=self.index)
-
-    def _load_mapping(self) -> dict:
-        if not self.mapping or type(self.mapping) is not str:
+    def _base_search(self, index: Optional[str] = None) -> Search:
+        # Fulltext can be very large, and is only used for matching.
+        return Search(using=self.es, index=index or self.index,
+                      extra={'_source': {'excludes': ['fulltext']}})
+
+    def _index_for(self, query: Query) -> str:
+        """Get the index on which to perform a query."""
+        # Simple searches are always limited to current versions.
+        if self.current_index and (isinstance(query, SimpleQuery)
+                                   or not query.include_older_versions):
+            return self.current_index
+        return self.index
+
+    def _load_mapping(self, mapping: Optional[str] = None) -> dict:
+        mapping = mapping or self.mapping
+        if not mapping or type(mapping) is not str:
             raise IndexingError('Mapping not set')
-        with open(self.mapping) as f:
+        with open(mapping) as f:
             mappings: dict = json.load(f)
         return mappings
 
+    def passages_enabled(self) -> bool:
+        """
+        Determine whether fulltext is indexed and searched as passages.
+
+        Returns
+        -------
+        bool
+        """
+        return bool(self.passage_index)
+
     def cluster_available(self) -> bool:
         """
         Determine whether or not the ES cluster is available.
@@ -178,7 +243,8 @@ class SearchSession(object):
 
     def create_index(self) -> None:
         """
-        Create the search index.
+        Create the search index, and the current-version and passage indexes
+        if there are any.
 
         Parameters
         ----------
@@ -187,9 +253,36 @@ class SearchSession(object):
             elastic.co/guide/en/elasticsearch/reference/current/mapping.html
 
         """
-        logger.debug('create ES index "%s"', self.index)
-        with handle_es_exceptions():
-            self.es.indices.create(self.index, self._load_mapping())
+        for name, mapping in self._indexes():
+            logger.debug('create ES index "%s"', name)
+            with handle_es_exceptions():
+                self.es.indices.create(name, self._load_mapping(mapping))
+
+    def _indexes(self) -> List[Tuple[str, Optional[str]]]:
+        """Get the name and mapping of each configured index."""
+        indexes = [(self.index, self.mapping)]
+        if self.current_index:
+            indexes.append((self.current_index, self.mapping))
+        if self.passage_index:
+            indexes.append((self.passage_index, self.passage_mapping))
+        return indexes
+
+    def _ensure_indexes(self) -> None:
+        """
+        Create any of the configured indexes that do not exist yet.
+
+        Each index is checked separately, so that none of them is created by
+        ES on the first write, with a dynamic mapping. This is only done once
+        per session.
+        """
+        if self._indexes_ready:
+            return
+        for name, mapping in self._indexes():
+            if not self.es.indices.exists(index=name):
+                logger.debug('create ES index "%s"', name)
+                with handle_es_exceptions():
+                    self.es.indices.create(name, self._load_mapping(mapping))
+        self._indexes_ready = True
 
     def index_exists(self, index_name: str) -> bool:
         """
@@ -209,7 +302,8 @@ class SearchSession(object):
             return _exists
 
     def reindex(self, old_index: str, new_index: str,
-                wait_for_completion: bool = False) -> dict:
+                wait_for_completion: bool = False,
+                current_only: bool = False) -> dict:
         """
         Create a new index and reindex with the current mappings.
 
@@ -217,7 +311,8 @@ class SearchSession(object):
         separate actions via the ES API. If creation of the next index
         succeeds but the request to reindex fails, no attempt is made to clean
         up. If the new index already exists, will still attempt to perform
-        the reindex operation.
+        the reindex operation, provided that its mapping agrees with the
+        current mapping.
 
         Parameters
         ----------
@@ -225,6 +320,9 @@ class SearchSession(object):
             Name of the index to copy from.
         new_index: str
             Name of the index to create and copy to.
+        current_only : bool
+            If True, only the current version of each paper is copied, e.g.
+            to fill the index of current versions for the first time.
 
         Returns
         -------
@@ -233,13 +331,32 @@ class SearchSession(object):
             is False (default), should include a `task` key with a task ID
             that can be used to check the status of the reindexing operation.
 
+        Raises
+        ------
+        :class:`.MappingError`
+            ``new_index`` already exists, with a different mapping.
+
         """
         logger.debug('reindex "%s" as "%s"', old_index, new_index)
-        with handle_es_exceptions():
-            self.es.indices.create(new_index, self._load_mapping())
-
+        mapping = self._load_mapping()
+        if self.es.indices.exists(index=new_index):
+            with handle_es_exceptions():
+                existing = self.es.indices.get_mapping(index=new_index)
+            if not _mapping_agrees(mapping['mappings'],
+                                   existing[new_index]['mappings']):
+                logger.error('index "%s" exists with another mapping',
+                             new_index)
+                raise MappingError(f'Index {new_index} already exists, with'
+                                   ' a different mapping')
+        else:
+            with handle_es_exceptions():
+                self.es.indices.create(new_index, mapping)
+
+        source: Dict[str, Any] = {"index": old_index}
+        if current_only:
+            source["query"] = {"term": {"is_current": True}}
         response: dict = self.es.reindex({
-            "source": {"index": old_index},
+            "source": source,
             "dest": {"index": new_index}
         }, wait_for_completion=wait_for_completion)
         return response
@@ -285,17 +402,26 @@ class SearchSession(object):
             Problem serializing ``document`` for indexing.
 
         """
-        if not self.es.indices.exists(index=self.index):
-            self.create_index()
+        self._ensure_indexes()
 
         with handle_es_exceptions():
             ident = document.id if document.id else document.paper_id
             logger.debug(f'{ident}: index document')
+            body = shallow_asdict(document)
             self.es.index(index=self.index, doc_type=self.doc_type,
-                          id=ident, body=document)
+                          id=ident, body=body)
+            if not self.current_index:
+                return
+            if document.is_current:
+                self.es.index(index=self.current_index,
+                              doc_type=self.doc_type, id=ident, body=body)
+            else:
+                self.es.delete(index=self.current_index,
+                               doc_type=self.doc_type, id=ident, ignore=404)
 
     def bulk_add_documents(self, documents: List[Document],
-                           docs_per_chunk: int = 500) -> None:
+                           docs_per_chunk: int = 500,
+                           skip_unchanged: bool = False) -> int:
         """
         Add documents to the search index using the bulk API.
 
@@ -306,30 +432,199 @@ class SearchSession(object):
             ``schema/DocumentMetadata.json``.
         docs_per_chunk: int
             Number of documents to send to ES in a single chunk
+        skip_unchanged : bool
+            If True, documents whose content is the same as the version
+            already in the index are not sent to ES again. Documents for
+            which only the fields that depend on the latest version of the
+            paper have changed (e.g. ``is_current``, when a new version is
+            announced) are updated in place, rather than indexed again.
+
+        If there is an index of current versions, current documents that are
+        sent to ES are also indexed there, and documents that are no longer
+        current are deleted from it. If there is a passage index, the
+        fulltext of each document is indexed there as passages (see
+        :mod:`.passages`), rather than with the rest of the document.
+
+        Returns
+        -------
+        int
+            The number of documents that were sent to ES (in full, or as
+            partial updates).
+
         Raises
         ------
         IndexConnectionError
             Problem communicating with Elasticsearch host.
         BulkIndexingError
-            Problem serializing ``document`` for indexing.
+            Some of the documents could not be indexed. The rest were. A
+            document that could not be indexed in the current or passage
+            index is not written to the paper index either, so that it is
+            not skipped as unchanged when it is retried.
 
         """
-        if not self.es.indices.exists(index=self.index):
-            logger.debug('index does not exist')
-            self.create_index()
-            logger.debug('created index')
-
+        self._ensure_indexes()
+
+        # Documents are encoded directly to NDJSON, so the ES client passes
+        # each chunk through without serializing it again.
+        omit = ['fulltext'] if self.passage_index else []
+        encoder = BulkEncoder(self.index, self.doc_type, omit=omit)
+        current_encoder = BulkEncoder(str(self.current_index), self.doc_type,
+                                      omit=omit)
+        added = updated = 0
         with handle_es_exceptions():
-            actions = ({
-                '_index': self.index,
-                '_type': self.doc_type,
-                '_id': document.id,
-                '_source': asdict(document)
-            } for document in documents)
+            failed: List[dict] = []
+            for start in range(0, len(documents), docs_per_chunk):
+                group = documents[start:start + docs_per_chunk]
+                indexed: Dict[str, dict] = {}
+                if skip_unchanged:
+                    indexed = self._get_indexed_versions(
+                        [document.id for document in group]
+                    )
+                bodies: List[Tuple[str, bytes]] = []
+                current_bodies: List[bytes] = []
+                changed: List[Tuple[Document, str]] = []
+                moved: List[Document] = []
+                for document in group:
+                    content_hash, body = encoder.encode_with_hash(document)
+                    current = indexed.get(document.id)
+                    if current is None \
+                            or current.get(HASH_FIELD) != content_hash:
+                        bodies.append((document.id, body))
+                        changed.append((document, content_hash))
+                        added += 1
+                        if document.is_current:
+                            current_bodies.append(
+                                current_encoder.retarget(document.id, body)
+                            )
+                    elif any(current.get(name) != value for name, value
+                             in encoder.version_fields(document).items()):
+                        bodies.append((document.id,
+                                       encoder.encode_update(document)))
+                        moved.append(document)
+                        updated += 1
+                        if document.is_current:
+                            # It may not be in the index of current versions.
+                            current_bodies.append(
+                                current_encoder.encode(document)
+                            )
+                    else:
+                        continue
+                    if not document.is_current:
+                        current_bodies.append(
+                            current_encoder.encode_delete(document.id)
+                        )
+                # The paper index holds the content hashes by which unchanged
+                # documents are skipped, so it is written last, and only for
+                # documents that are up to date in the other indexes.
+                # Otherwise, the documents would be skipped when retried.
+                incomplete: Dict[str, dict] = {}
+                if self.current_index:
+                    for result in self._bulk(current_encoder.chunks(
+                            current_bodies, docs_per_chunk)):
+                        incomplete.setdefault(result['_id'], result)
+                if self.passage_index:
+                    for result in self._index_passages(changed, moved,
+                                                       docs_per_chunk):
+                        incomplete.setdefault(result['_id'], result)
+                failed += incomplete.values()
+                failed += self._bulk(encoder.chunks(
+                    (body for document_id, body in bodies
+                     if document_id not in incomplete), docs_per_chunk
+                ))
+            if failed:
+                raise BulkIndexError(
+                    '%i document(s) failed to index.' % len(failed), failed
+                )
+            logger.debug('added %i documents to index, updated %i, skipped'
+                         ' %i unchanged', added, updated,
+                         len(documents) - added - updated)
+        return added + updated
+
+    def _bulk(self, chunks: Iterable[bytes]) -> List[dict]:
+        """Send bulk requests; get the results of actions that failed."""
+        failed: List[dict] = []
+        for chunk in chunks:
+            response = self.es.bulk(body=chunk)
+            if response.get('errors'):
+                # Each item has a single key: the type of action.
+                failed += [result for item in response['items']
+                           for result in item.values()
+                           if 'error' in result]
+        return failed
+
+    def _index_passages(self, changed: List[Tuple[Document, str]],
+                        moved: List[Document],
+                        docs_per_chunk: int = 500) -> List[dict]:
+        """
+        Bring the passages of some documents up to date.
+
+        Parameters
+        ----------
+        changed : list
+            Documents that were indexed again, with their content hashes.
+            Their passages are replaced.
+        moved : list
+            Documents of which only the :data:`.VERSION_FIELDS` were updated.
+            The ``is_current`` flag of their passages is updated to match.
+
+        Returns
+        -------
+        list
+            Bulk results for the passages that could not be indexed, with the
+            ``_id`` of the paper version to which each belongs.
 
-            helpers.bulk(client=self.es, actions=actions,
-                         chunk_size=docs_per_chunk)
-            logger.debug('added %i documents to index', len(documents))
+        """
+        encoder = BulkEncoder(str(self.passage_index), self.passage_type)
+        failed = self._bulk(encoder.chunks(
+            (encoder.encode(passage) for document, content_hash in changed
+             for passage in passages.to_passages(document, content_hash)),
+            docs_per_chunk
+        ))
+        if changed:
+            # A revision of a version may have fewer passages than before
+            # (or none), so the passages of earlier revisions are removed.
+            self.es.delete_by_query(
+                index=self.passage_index, doc_type=self.passage_type,
+                body={'query': {'bool': {
+                    'filter': {'terms': {
+                        'paper_id_v': [document.id for document, _ in changed]
+                    }},
+                    'must_not': {'terms': {
+                        'document_hash': [content_hash
+                                          for _, content_hash in changed]
+                    }}
+                }}},
+                conflicts='proceed'
+            )
+        for is_current in (True, False):
+            ids = [document.id for document in moved
+                   if document.is_current == is_current]
+            if not ids:
+                continue
+            self.es.update_by_query(
+                index=self.passage_index, doc_type=self.passage_type,
+                body={
+                    'query': {'terms': {'paper_id_v': ids}},
+                    'script': {
+                        'source': 'ctx._source.is_current = params.value',
+                        'lang': 'painless',
+                        'params': {'value': is_current}
+                    }
+                },
+                conflicts='proceed'
+            )
+        # Passage IDs are ``{paper_id_v}-{position}``.
+        return [dict(result, _id=result['_id'].rsplit('-', 1)[0])
+                for result in failed]
+
+    def _get_indexed_versions(self, document_ids: List[str]) \
+            -> Dict[str, dict]:
+        """Get the content hash and version fields of indexed documents."""
+        response = self.es.mget(index=self.index, doc_type=self.doc_type,
+                                body={'ids': document_ids},
+                                _source=[HASH_FIELD, *VERSION_FIELDS])
+        return {doc['_id']: doc['_source'] for doc in response['docs']
+                if doc.get('found') and '_source' in doc}
 
     def get_document(self, document_id: int) -> Document:
         """
@@ -356,7 +651,7 @@ class SearchSession(object):
         """
         with handle_es_exceptions():
             record = self.es.get(index=self.index, doc_type=self.doc_type,
-                                 id=document_id)
+                                 id=document_id, _source_exclude='fulltext')
 
         if not record:
             logger.error("No such document: %s", document_id)
@@ -393,7 +688,13 @@ class SearchSession(object):
 
         # Perform the search.
         logger.debug('got current search request %s', str(query))
-        current_search = self._base_search()
+        if isinstance(query, SimpleQuery) and self.passage_index \
+                and query.search_field == 'full_text':
+            if not passages.supports(query):
+                raise QueryError('Fulltext search cannot be limited by'
+                                 ' classification, or sorted')
+            return self._search_passages(query, highlight=highlight)
+        current_search = self._base_search(self._index_for(query))
         try:
             if isinstance(query, AdvancedQuery):
                 current_search = advanced_search(current_search, query)
@@ -409,7 +710,10 @@ class SearchSession(object):
         if highlight:
             # Highlighting is performed by Elasticsearch; here we include the
             # fields and configuration for highlighting.
-            current_search = highlighting.highlight(current_search)
+            current_search = highlighting.highlight(
+                current_search,
+                abstracts=not query.hide_abstracts
+            )
 
         if isinstance(query, APIQuery):
             current_search = current_search.extra(
@@ -423,6 +727,28 @@ class SearchSession(object):
         # Perform post-processing on the search results.
         return results.to_documentset(query, resp, highlight=highlight)
 
+    def _search_passages(self, query: SimpleQuery,
+                         highlight: bool = True) -> DocumentSet:
+        """Perform a fulltext search, on the passage index."""
+        current_search = passages.passage_search(
+            Search(using=self.es, index=self.passage_index), query,
+            highlight=highlight
+        )
+        sources: Dict[str, dict] = {}
+        with handle_es_exceptions():
+            resp = current_search[query.page_start:query.page_end].execute()
+            paper_ids_v = [hit.paper_id_v for hit in resp]
+            if paper_ids_v:
+                response = self.es.mget(index=self.index,
+                                        doc_type=self.doc_type,
+                                        body={'ids': paper_ids_v},
+                                        _source_exclude='fulltext')
+                sources = {doc['_id']: doc['_source']
+                           for doc in response['docs']
+                           if doc.get('found') and '_source' in doc}
+        return passages.to_documentset(query, resp, sources,
+                                       highlight=highlight)
+
     def exists(self, paper_id_v: str) -> bool:
         """Determine whether a paper exists in the index."""
         with handle_es_exceptions():
@@ -440,6 +766,10 @@ def init_app(app: object = None) -> None:
     config.setdefault('ELASTICSEARCH_PASSWORD', None)
     config.setdefault('ELASTICSEARCH_MAPPING', 'mappings/DocumentMapping.json')
     config.setdefault('ELASTICSEARCH_VERIFY', 'true')
+    config.setdefault('ELASTICSEARCH_CURRENT_INDEX', '')
+    config.setdefault('ELASTICSEARCH_PASSAGE_INDEX', '')
+    config.setdefault('ELASTICSEARCH_PASSAGE_MAPPING',
+                      'mappings/PassageMapping.json')
 
 
 # TODO: consider making this private.
@@ -455,8 +785,14 @@ def get_session(app: object = None) -> SearchSession:
     password = config.get('ELASTICSEARCH_PASSWORD', None)
     mapping = config.get('ELASTICSEARCH_MAPPING',
                          'mappings/DocumentMapping.json')
+    current_index = config.get('ELASTICSEARCH_CURRENT_INDEX') or None
+    passage_index = config.get('ELASTICSEARCH_PASSAGE_INDEX') or None
+    passage_mapping = config.get('ELASTICSEARCH_PASSAGE_MAPPING',
+                                 'mappings/PassageMapping.json')
     return SearchSession(host, index, port, scheme, user, password, mapping,
-                         verify=verify)
+                         verify=verify, passage_index=passage_index,
+                         passage_mapping=passage_mapping,
+                         current_index=current_index)
 
 
 # TODO: consider making this private.
@@ -476,6 +812,12 @@ def search(query: Query, highlight: bool = True) -> DocumentSet:
     return current_session().search(query, highlight=highlight)
 
 
+@wraps(SearchSession.passages_enabled)
+def passages_enabled() -> bool:
+    """Check whether fulltext is searched as passages."""
+    return current_session().passages_enabled()
+
+
 @wraps(SearchSession.add_document)
 def add_document(document: Document) -> None:
     """Add Document."""
@@ -483,9 +825,12 @@ def add_document(document: Document) -> None:
 
 
 @wraps(SearchSession.bulk_add_documents)
-def bulk_add_documents(documents: List[Document]) -> None:
+def bulk_add_documents(documents: List[Document],
+                       docs_per_chunk: int = 500,
+                       skip_unchanged: bool = False) -> int:
     """Add Documents."""
-    return current_session().bulk_add_documents(documents)
+    return current_session().bulk_add_documents(documents, docs_per_chunk,
+                                                skip_unchanged)
 
 
 @wraps(SearchSession.get_document)
@@ -520,9 +865,11 @@ def index_exists(index_name: str) -> bool:
 
 @wraps(SearchSession.reindex)
 def reindex(old_index: str, new_index: str,
-            wait_for_completion: bool = False) -> dict:
+            wait_for_completion: bool = False,
+            current_only: bool = False) -> dict:
     """Create a new index and reindex with the current mappings."""
-    return current_session().reindex(old_index, new_index, wait_for_completion)
+    return current_session().reindex(old_index, new_index, wait_for_completion,
+                                     current_only)
 
 
 @wraps(SearchSession.get_task_status)
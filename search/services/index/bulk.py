@@ -0,0 +1,302 @@
+"""
+Encodes search documents for the Elasticsearch bulk API.
+
+The bulk API expects newline-delimited JSON (NDJSON): an action line followed
+by the document source, for each document. Rather than converting each
+:class:`.Document` to a dict and then having the Elasticsearch client
+serialize that dict, :class:`.BulkEncoder` writes documents directly to
+NDJSON. Field names are encoded once per class, and date(time) values (of
+which there are relatively few distinct values in a batch) are formatted
+once.
+
+The source of each document includes a hash of its content (see
+:data:`.HASH_FIELD`), so that documents that have not changed since they were
+last indexed can be skipped. The hash leaves out the fields that describe a
+paper's versions (see :data:`.VERSION_FIELDS`), which change for every
+version of a paper when a new version is announced. When only those fields
+have changed, :meth:`.BulkEncoder.encode_update` provides a partial update.
+"""
+
+import hashlib
+import json
+from datetime import date, datetime
+from json import JSONEncoder
+from json.encoder import encode_basestring
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, \
+    Tuple, Union
+
+from elasticsearch import SerializationError
+
+from search.domain import Document
+
+DATE_CACHE_SIZE = 4096
+"""Maximum number of formatted date(time)s to retain."""
+
+HASH_FIELD = 'content_hash'
+"""Name of the source field that holds the hash of the document content."""
+
+VERSION_FIELDS = ('is_current', 'latest', 'latest_version',
+                  'submitted_date_all', 'submitted_date_latest')
+"""Fields that depend on the latest version of the paper."""
+
+
+class BulkEncoder:
+    """Encodes :class:`.Document` objects as NDJSON bulk indexing requests."""
+
+    def __init__(self, index: str, doc_type: str,
+                 omit: Iterable[str] = ()) -> None:
+        """
+        Set the index and document type for index actions.
+
+        Parameters
+        ----------
+        index : str
+            Name of the index to which documents will be added.
+        doc_type : str
+            Elasticsearch document type.
+        omit : iterable
+            Fields that are left out of the source of each document, e.g.
+            because they are indexed elsewhere. They are still part of the
+            content hash.
+
+        """
+        self._omit = frozenset(omit)
+        target = (
+            '{"_index":' + encode_basestring(index)
+            + ',"_type":' + encode_basestring(doc_type) + ',"_id":'
+        )
+        self._action = '{"index":' + target
+        self._update = '{"update":' + target
+        self._delete = '{"delete":' + target
+        self._hash_key = ',' + encode_basestring(HASH_FIELD) + ':'
+        self._fields: Dict[type, Tuple[Tuple[str, str], ...]] = {}
+        self._dates: Dict[Tuple[type, Any, Any], str] = {}
+        self._fallback = JSONEncoder(ensure_ascii=False, allow_nan=True)
+        self._encoders: Dict[type, Callable[[Any], str]] = {
+            str: encode_basestring,
+            bool: lambda value: 'true' if value else 'false',
+            int: int.__repr__,
+            float: self._fallback.encode,
+            type(None): lambda value: 'null',
+            list: self._array,
+            tuple: self._array,
+            dict: self._object,
+            datetime: self._date,
+            date: self._date,
+        }
+
+    def encode(self, document: Document) -> bytes:
+        """
+        Encode the index action and source for a single document.
+
+        Parameters
+        ----------
+        document : :class:`.Document`
+
+        Returns
+        -------
+        bytes
+            Two lines of NDJSON, each terminated by a newline.
+
+        """
+        return self.encode_with_hash(document)[1]
+
+    def encode_with_hash(self, document: Document) -> Tuple[str, bytes]:
+        """
+        Encode a document, and get the hash of its content.
+
+        The hash is of the encoded source (including any omitted fields),
+        without the hash itself or the :data:`.VERSION_FIELDS`. So it changes
+        if and only if the content of this version of the paper changes.
+
+        Parameters
+        ----------
+        document : :class:`.Document`
+
+        Returns
+        -------
+        str
+            Hex digest of the document content.
+        bytes
+            Two lines of NDJSON, each terminated by a newline.
+
+        """
+        fields: List[str] = []
+        content: List[str] = []
+        for name, key in self._keys(type(document)):
+            field = key + self._value(getattr(document, name))
+            if name not in self._omit:
+                fields.append(field)
+            if name not in VERSION_FIELDS:
+                content.append(field)
+        content_hash = \
+            hashlib.sha1(','.join(content).encode('utf-8')).hexdigest()
+        return content_hash, ''.join([
+            self._action, self._value(document.id), '}}\n{',
+            ','.join(fields), self._hash_key, '"', content_hash, '"}\n'
+        ]).encode('utf-8')
+
+    def encode_update(self, document: Document) -> bytes:
+        """
+        Encode a partial update of the :data:`.VERSION_FIELDS` of a document.
+
+        Parameters
+        ----------
+        document : :class:`.Document`
+
+        Returns
+        -------
+        bytes
+            Two lines of NDJSON, each terminated by a newline.
+
+        """
+        return ''.join([
+            self._update, self._value(document.id), '}}\n{"doc":{',
+            ','.join([key + self._value(getattr(document, name))
+                      for name, key in self._keys(type(document))
+                      if name in VERSION_FIELDS]),
+            '}}\n'
+        ]).encode('utf-8')
+
+    def encode_delete(self, document_id: str) -> bytes:
+        """
+        Encode the deletion of a document.
+
+        Parameters
+        ----------
+        document_id : str
+
+        Returns
+        -------
+        bytes
+            A single line of NDJSON, terminated by a newline.
+
+        """
+        return ''.join([self._delete, self._value(document_id),
+                        '}}\n']).encode('utf-8')
+
+    def retarget(self, document_id: str, encoded: bytes) -> bytes:
+        """
+        Get an index action for this index, for an already-encoded document.
+
+        Saves encoding the same document again, e.g. for a second index with
+        the same fields.
+
+        Parameters
+        ----------
+        document_id : str
+        encoded : bytes
+            An index action and source from :meth:`.encode` (of any
+            encoder).
+
+        Returns
+        -------
+        bytes
+            Two lines of NDJSON, each terminated by a newline.
+
+        """
+        return ''.join([self._action, self._value(document_id),
+                        '}}']).encode('utf-8') \
+            + encoded[encoded.index(b'\n'):]
+
+    def version_fields(self, document: Document) -> Dict[str, Any]:
+        """
+        Get the :data:`.VERSION_FIELDS` of a document, as they are indexed.
+
+        The values can be compared with the ``_source`` of an indexed
+        document, e.g. dates are strings.
+        """
+        return {name: json.loads(self._value(getattr(document, name)))
+                for name in VERSION_FIELDS}
+
+    def chunks(self, documents: Iterable[Union[Document, bytes]],
+               docs_per_chunk: int = 500,
+               bytes_per_chunk: int = 100 * 1024 * 1024) -> Iterator[bytes]:
+        """
+        Encode documents as a series of bulk request bodies.
+
+        Parameters
+        ----------
+        documents : iterable
+            :class:`.Document` objects to encode, or actions that have
+            already been encoded (e.g. with :meth:`.encode`).
+        docs_per_chunk : int
+            Maximum number of documents in a single request body.
+        bytes_per_chunk : int
+            Maximum size (in bytes) of a single request body. A single
+            document larger than this will still be sent, in its own chunk.
+
+        Yields
+        ------
+        bytes
+            NDJSON request bodies, ready to be passed to
+            :meth:`elasticsearch.Elasticsearch.bulk`.
+
+        """
+        buffer = bytearray()
+        count = 0
+        for document in documents:
+            if isinstance(document, bytes):
+                encoded = document
+            else:
+                encoded = self.encode(document)
+            if count and (count >= docs_per_chunk
+                          or len(buffer) + len(encoded) > bytes_per_chunk):
+                yield bytes(buffer)
+                buffer.clear()
+                count = 0
+            buffer += encoded
+            count += 1
+        if count:
+            yield bytes(buffer)
+
+    def _value(self, value: Any) -> str:
+        encoder = self._encoders.get(type(value))
+        if encoder is not None:
+            return encoder(value)
+        if hasattr(type(value), '__dataclass_fields__'):
+            return self._dataclass(value)
+        if isinstance(value, Mapping):
+            return self._object(value)
+        if isinstance(value, (list, tuple)):
+            return self._array(value)
+        if isinstance(value, (date, datetime)):
+            return self._date(value)
+        try:
+            return self._fallback.encode(value)
+        except (TypeError, ValueError) as e:
+            raise SerializationError(value, e)
+
+    def _keys(self, cls: type) -> Tuple[Tuple[str, str], ...]:
+        fields = self._fields.get(cls)
+        if fields is None:
+            fields = self._fields[cls] = tuple(
+                (name, encode_basestring(name) + ':')
+                for name in cls.__dataclass_fields__   # type: ignore
+            )
+        return fields
+
+    def _dataclass(self, obj: Any) -> str:
+        return '{' + ','.join([key + self._value(getattr(obj, name))
+                               for name, key in self._keys(type(obj))]) + '}'
+
+    def _object(self, obj: Mapping) -> str:
+        return '{' + ','.join([
+            encode_basestring(str(key)) + ':' + self._value(value)
+            for key, value in obj.items()
+        ]) + '}'
+
+    def _array(self, values: Iterable) -> str:
+        return '[' + ','.join([self._value(value) for value in values]) + ']'
+
+    def _date(self, value: date) -> str:
+        # Equal datetimes in different timezones have different ISO-8601
+        # representations, so the offset is part of the key.
+        offset = value.utcoffset() if isinstance(value, datetime) else None
+        key = (type(value), value, offset)
+        encoded = self._dates.get(key)
+        if encoded is None:
+            if len(self._dates) >= DATE_CACHE_SIZE:
+                self._dates.clear()
+            encoded = self._dates[key] = encode_basestring(value.isoformat())
+        return encoded
@@ -1,7 +1,10 @@
 """Exceptions raised by the search index service."""
 
+from typing import List, Optional
+
 __all__ = ('MappingError', 'IndexConnectionError', 'IndexingError',
-           'QueryError', 'DocumentNotFound', 'OutsideAllowedRange')
+           'BulkIndexingError', 'QueryError', 'DocumentNotFound',
+           'OutsideAllowedRange')
 
 
 class MappingError(ValueError):
@@ -11,11 +14,31 @@ class MappingError(ValueError):
 class IndexConnectionError(IOError):
     """There was a problem connecting to the search index."""
 
+    def __init__(self, message: str = '',
+                 status_code: Optional[int] = None) -> None:
+        """Keep track of the status code, if there was a response."""
+        super(IndexConnectionError, self).__init__(message)
+        self.status_code = status_code
+
 
 class IndexingError(IOError):
     """There was a problem adding a document to the index."""
 
 
+class BulkIndexingError(IndexingError):
+    """Some of the documents in a bulk request could not be indexed."""
+
+    def __init__(self, message: str, failed: List[str],
+                 status_codes: Optional[List[int]] = None) -> None:
+        """Keep track of the documents that failed."""
+        super(BulkIndexingError, self).__init__(message)
+        self.failed = failed
+        """Identifiers of the documents that could not be indexed."""
+
+        self.status_codes = status_codes if status_codes else []
+        """Status codes for each of the failed documents."""
+
+
 class QueryError(ValueError):
     """
     Elasticsearch could not handle the query.
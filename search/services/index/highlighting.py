@@ -6,10 +6,16 @@ the returned results. :func:`.highlight` adds a highlighting part to the query
 in the Elasticsearch DSL. :func:`.add_highlighting` performs post-processing
 of the search results. :func:`.preview` generates a TeX-safe snippet for
 abridged display in the search results.
+
+Abstracts are highlighted by ES as a small number of fragments, using offsets
+stored in the index (see ``mappings/DocumentMapping.json``), rather than as a
+whole field. Those fragments are stitched together into a TeX-safe preview,
+and put back in place to highlight the full abstract.
 """
 
 import re
-from typing import Any, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, \
+    MutableMapping, Optional, Tuple, Union
 
 from elasticsearch_dsl import Search, Q, SF
 from elasticsearch_dsl.response import Response, Hit
@@ -24,14 +30,92 @@ logger = logging.getLogger(__name__)
 HIGHLIGHT_TAG_OPEN = '<span class="search-hit mathjax">'
 HIGHLIGHT_TAG_CLOSE = '</span>'
 
+PREVIEW_SIZE = 400
+"""Approximate size (in characters) of the abstract preview."""
+
+ABSTRACT_FRAGMENTS = 2
+"""Maximum number of highlighted abstract fragments to request from ES."""
+
+ABSTRACT_FRAGMENT_SIZE = PREVIEW_SIZE // ABSTRACT_FRAGMENTS
+"""Size of each abstract fragment, such that they add up to a preview."""
+
+ABSTRACT_FIELDS = ['abstract', 'abstract.english', 'abstract.tex']
+"""Abstract fields that are highlighted as fragments."""
+
+
+class LazyMapping(MutableMapping):
+    """
+    A mapping in which some values are only computed on first access.
+
+    Values added with :meth:`.defer` are generated by calling a function the
+    first time that they are accessed, and are retained thereafter. Checking
+    whether a key is present does not generate its value.
+    """
 
-def highlight(search: Search) -> Search:
+    def __init__(self, data: Optional[Mapping] = None) -> None:
+        """Initialize with the (computed or deferred) values in ``data``."""
+        self._values: Dict[str, Any] = {}
+        self._deferred: Dict[str, Tuple[Callable, tuple]] = {}
+        if isinstance(data, LazyMapping):
+            self._values.update(data._values)
+            self._deferred.update(data._deferred)
+        elif data:
+            self._values.update(data)
+
+    def defer(self, key: str, func: Callable, *args: Any) -> None:
+        """Set the value of ``key`` to be generated by ``func(*args)``."""
+        self._values.pop(key, None)
+        self._deferred[key] = (func, args)
+
+    def __getitem__(self, key: str) -> Any:
+        """Get the value of ``key``, generating it if necessary."""
+        if key in self._deferred:
+            func, args = self._deferred.pop(key)
+            self._values[key] = func(*args)
+        return self._values[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        """Set the value of ``key``."""
+        self._deferred.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        """Remove ``key``, whether or not its value has been generated."""
+        if key not in self:
+            raise KeyError(key)
+        self._deferred.pop(key, None)
+        self._values.pop(key, None)
+
+    def __contains__(self, key: object) -> bool:
+        """Determine whether ``key`` is present, without generating it."""
+        return key in self._values or key in self._deferred
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over all keys, whether or not they have been generated."""
+        return iter(list(self._values) + list(self._deferred))
+
+    def __len__(self) -> int:
+        """Get the number of keys."""
+        return len(self._values) + len(self._deferred)
+
+    def __repr__(self) -> str:
+        """Show generated values, and the keys that are deferred."""
+        return f'{type(self).__name__}({self._values!r},' \
+            f' deferred={list(self._deferred)!r})'
+
+
+def highlight(search: Search, abstracts: bool = True) -> Search:
     """
     Apply hit highlighting to the search, before execution.
 
+    Only fields that are displayed in search results are highlighted.
+
     Parameters
     ----------
     search : :class:`.Search`
+    abstracts : bool
+        If False, abstracts will not be displayed, so there is no need to
+        highlight them.
 
     Returns
     -------
@@ -45,33 +129,36 @@ def highlight(search: Search) -> Search:
         pre_tags=[HIGHLIGHT_TAG_OPEN],
         post_tags=[HIGHLIGHT_TAG_CLOSE]
     )
-    search = search.highlight('title', type='plain', number_of_fragments=0)
-    search = search.highlight('title.english', type='plain',
-                              number_of_fragments=0)
-    search = search.highlight('title.tex', type='plain',
-                              number_of_fragments=0)
+    # Title, abstract, and comments are indexed with offsets (see
+    # ``mappings/DocumentMapping.json``), so the unified highlighter can use
+    # the postings list instead of re-analyzing the field for every hit.
+    # Setting number_of_fragments to 0 tells ES to highlight the entire field.
+    search = search.highlight('title', number_of_fragments=0)
+    search = search.highlight('title.english', number_of_fragments=0)
+    search = search.highlight('title.tex', number_of_fragments=0)
 
     search = search.highlight('comments', number_of_fragments=0)
     # Highlight any field the name of which begins with "author".
     search = search.highlight('author*')
     search = search.highlight('owner*')
-    search = search.highlight('announced_date_first')
     search = search.highlight('submitter*')
     search = search.highlight('journal_ref', type='plain')
     search = search.highlight('acm_class', number_of_fragments=0)
     search = search.highlight('msc_class', number_of_fragments=0)
-    search = search.highlight('doi', type='plain')
     search = search.highlight('report_num', type='plain')
 
-    # Setting number_of_fragments to 0 tells ES to highlight the entire field.
-    search = search.highlight('abstract', number_of_fragments=0)
-    search = search.highlight('abstract.tex', type='plain',
-                              number_of_fragments=0)
-    search = search.highlight('abstract.english', number_of_fragments=0)
+    # We only ever display a preview of the abstract, so there is no need to
+    # have ES highlight the entire field. Instead we ask for a few fragments
+    # that together are about the size of the preview.
+    if abstracts:
+        for field in ABSTRACT_FIELDS:
+            search = search.highlight(field,
+                                      number_of_fragments=ABSTRACT_FRAGMENTS,
+                                      fragment_size=ABSTRACT_FRAGMENT_SIZE)
     return search
 
 
-def preview(value: str, fragment_size: int = 400,
+def preview(value: str, fragment_size: int = PREVIEW_SIZE,
             start_tag: str = HIGHLIGHT_TAG_OPEN,
             end_tag: str = HIGHLIGHT_TAG_CLOSE) -> str:
     """
@@ -146,6 +233,11 @@ def add_highlighting(result: dict, raw: Union[Response, Hit]) -> dict:
     """
     Add hit highlighting to a search result.
 
+    Only cheap bookkeeping (e.g. which fields matched) happens here. The
+    highlighted values and previews themselves are added to ``result`` as
+    :class:`.LazyMapping` objects, and are only generated if and when they are
+    accessed (e.g. by the template that displays them).
+
     Parameters
     ----------
     result : dict
@@ -160,6 +252,10 @@ def add_highlighting(result: dict, raw: Union[Response, Hit]) -> dict:
         items.
 
     """
+    highlights = _lazy(result, 'highlight')
+    previews = _lazy(result, 'preview')
+    truncated = _lazy(result, 'truncated')
+
     # There may or may not be highlighting in the result set.
     highlighted_fields = getattr(raw.meta, 'highlight', None)
 
@@ -171,25 +267,13 @@ def add_highlighting(result: dict, raw: Union[Response, Hit]) -> dict:
     # secondary_classification.
     inner_hits = getattr(raw.meta, 'inner_hits', None)
 
-    # The values here will (almost) always be list-like. So we need to stitch
-    # them together. Note that dir(None) won't return anything, so this block
-    # is skipped if there are no highlights from ES.
+    # The values here will (almost) always be list-like, and will need to be
+    # stitched together. Note that dir(None) won't return anything, so this
+    # block is skipped if there are no highlights from ES.
+    fragments: Dict[str, List[str]] = {}
     for field in dir(highlighted_fields):
         if field.startswith('_'):
             continue
-        value = getattr(highlighted_fields, field)
-        if hasattr(value, '__iter__'):
-            value = '&hellip;'.join(value)
-
-        # Non-TeX searches may hit inside of TeXisms. Highlighting those
-        # fragments (i.e. inserting HTML) will break MathJax rendering.
-        # To guard against this while preserving highlighting, we move
-        # any highlighting tags from within TeXisms to encapsulate the
-        # entire TeXism.
-        if field in ['title', 'title.english',
-                     'abstract', 'abstract.english']:
-            value = _highlight_whole_texism(value)
-            value = _escape(value)
 
         # A hit on authors may originate in several different fields, most
         # of which are not displayed. And in any case, author names may be
@@ -201,10 +285,51 @@ def add_highlighting(result: dict, raw: Union[Response, Hit]) -> dict:
             result['match']['author'] = True
             continue
 
-        result['highlight'][field] = value
+        value = getattr(highlighted_fields, field)
+        if isinstance(value, str):
+            fragments[field] = [value]
+        else:
+            fragments[field] = list(value)
+
+    # If there is a hit in a TeX field, we prefer highlighting on that
+    # field, since other tokenizers will clobber the TeX.
+    for field in ['abstract', 'title']:
+        if f'{field}.tex' in fragments:
+            fragments[field] = fragments.pop(f'{field}.tex')
+
+    for field, value in fragments.items():
+        if field in ABSTRACT_FIELDS:
+            continue
+        # Non-TeX searches may hit inside of TeXisms. Highlighting those
+        # fragments (i.e. inserting HTML) will break MathJax rendering.
+        # To guard against this while preserving highlighting, we move
+        # any highlighting tags from within TeXisms to encapsulate the
+        # entire TeXism.
+        if field in ['title', 'title.english']:
+            highlights.defer(field, _highlight_tex_safe, value)
+        else:
+            highlights.defer(field, _join_fragments, value)
+
+    for field in ['title.english', 'title']:
+        if field in fragments:
+            highlights.defer('title', _highlight_tex_safe, fragments[field])
+            break
+
+    # The stitched abstract fragments are only a preview of the abstract.
+    # The full abstract, which is displayed when the user expands a truncated
+    # preview, is highlighted by putting the fragments back in place.
+    for field in ['abstract.english', 'abstract']:
+        if field in fragments:
+            previews.defer('abstract', _stitch_fragments, fragments[field],
+                           result.get('abstract') or '')
+            truncated.defer('abstract', is_truncated, previews, 'abstract')
+            highlights.defer('abstract', _place_fragments, fragments[field],
+                             result.get('abstract') or '')
+            result['match']['abstract'] = True
+            break
 
     for field in matched_fields:
-        if field not in result['highlight']:
+        if field not in highlights:
             result['match'][field] = True
 
     # We're using inner_hits to see which category in particular responded to
@@ -218,26 +343,168 @@ def add_highlighting(result: dict, raw: Union[Response, Hit]) -> dict:
     result['match']['announced_date_first'] = (
         bool('announced_date_first' in matched_fields)
     )
+    return result
 
-    # If there is a hit in a TeX field, we prefer highlighting on that
-    # field, since other tokenizers will clobber the TeX.
-    for field in ['abstract', 'title']:
-        if f'{field}.tex' in result['highlight']:
-            result['highlight'][field] = result['highlight'][f'{field}.tex']
-            del result['highlight'][f'{field}.tex']
-
-    for field in ['abstract.tex', 'abstract.english', 'abstract']:
-        if field in result['highlight']:
-            value = result['highlight'][field]
-            abstract_snippet = preview(value)
-            result['preview']['abstract'] = abstract_snippet
-            result['highlight']['abstract'] = value
+
+def is_truncated(previews: Mapping[str, str], field: str) -> bool:
+    """Determine whether the preview of ``field`` is truncated."""
+    return '&hellip;' in previews.get(field, '')
+
+
+def _lazy(result: dict, key: str) -> LazyMapping:
+    """Get the :class:`.LazyMapping` at ``key`` in ``result``."""
+    value = result.get(key)
+    if not isinstance(value, LazyMapping):
+        value = result[key] = LazyMapping(value)
+    return value
+
+
+def _join_fragments(fragments: List[str]) -> str:
+    """Join highlighted fragments with ellipses."""
+    return '&hellip;'.join(fragments)
+
+
+def _highlight_tex_safe(fragments: List[str]) -> str:
+    """Join highlighted fragments, without breaking TeXisms."""
+    return _escape(_highlight_whole_texism(_join_fragments(fragments)))
+
+
+def _in_texism(source: str, offset: int) -> bool:
+    """Determine whether ``offset`` falls inside of a TeXism in ``source``."""
+    # Display-math delimiters ($$) count as a single delimiter.
+    delimiters = source.count('$', 0, offset) - source.count('$$', 0, offset)
+    return delimiters % 2 == 1
+
+
+def _complete_texisms(fragment: str, source: str, start: int, end: int) \
+        -> Tuple[str, int, int]:
+    """
+    Extend a fragment so that it does not begin or end inside of a TeXism.
+
+    Parameters
+    ----------
+    fragment : str
+        A (possibly highlighted) fragment of ``source``.
+    source : str
+        The original, unhighlighted value of the field.
+    start : int
+        Offset of the (unhighlighted) fragment in ``source``.
+    end : int
+        Offset in ``source`` just past the end of the fragment.
+
+    Returns
+    -------
+    str
+        The fragment, extended to include the rest of any TeXism that it
+        interrupts.
+    int
+        The new start offset of the fragment in ``source``.
+    int
+        The new end offset of the fragment in ``source``.
+
+    """
+    _start, _end = start, end
+    while _in_texism(source, _start):
+        _start = source.rfind('$', 0, _start)
+        if _start < 0:
+            _start = 0
             break
-    for field in ['title.english', 'title']:
-        if field in result['highlight']:
-            result['highlight']['title'] = result['highlight'][field]
+        while _start > 0 and source[_start - 1] == '$':
+            _start -= 1
+    while _in_texism(source, _end):
+        _end = source.find('$', _end)
+        if _end < 0:
+            _end = len(source)
             break
-    return result
+        _end += 1
+        while _end < len(source) and source[_end] == '$':
+            _end += 1
+    fragment = source[_start:start] + fragment + source[end:_end]
+    return fragment, _start, _end
+
+
+def _stitch_fragments(fragments: Iterable[str], source: str) -> str:
+    """
+    Stitch highlighted fragments of a field together into a TeX-safe snippet.
+
+    Parameters
+    ----------
+    fragments : iterable
+        Highlighted fragments returned by ES, in the order in which they
+        appear in the field.
+    source : str
+        The original, unhighlighted value of the field. This is used to
+        locate the fragments, so that we can avoid breaking TeXisms and know
+        where ellipses are needed.
+
+    Returns
+    -------
+    str
+        Escaped fragments, joined by ellipses.
+
+    """
+    snippet = ''
+    last_end = 0
+    for fragment in fragments:
+        fragment = fragment.strip()
+        plain = fragment.replace(HIGHLIGHT_TAG_OPEN, '') \
+            .replace(HIGHLIGHT_TAG_CLOSE, '')
+        start = source.find(plain, last_end) if plain else -1
+        if start < 0:   # Can't place the fragment, so we assume it's partial.
+            snippet += '&hellip;' + _escape(_highlight_whole_texism(fragment))
+            snippet += '&hellip;'
+            last_end = len(source)
+            continue
+        fragment, start, end = _complete_texisms(fragment, source, start,
+                                                 start + len(plain))
+        gap = source[last_end:start]
+        if gap.strip():     # Some of the field was skipped.
+            snippet += '&hellip;'
+        elif snippet and gap:
+            snippet += ' '
+        snippet += _escape(_highlight_whole_texism(fragment))
+        last_end = end
+    if source[last_end:].strip():
+        snippet += '&hellip;'
+    return snippet
+
+
+def _place_fragments(fragments: Iterable[str], source: str) -> str:
+    """
+    Highlight a whole field, by putting highlighted fragments back in place.
+
+    Only hits within the fragments are highlighted; the rest of the field is
+    escaped, but otherwise left as it is.
+
+    Parameters
+    ----------
+    fragments : iterable
+        Highlighted fragments returned by ES, in the order in which they
+        appear in the field.
+    source : str
+        The original, unhighlighted value of the field.
+
+    Returns
+    -------
+    str
+        The escaped field, with TeX-safe highlighting.
+
+    """
+    highlighted = ''
+    last_end = 0
+    for fragment in fragments:
+        fragment = fragment.strip()
+        plain = fragment.replace(HIGHLIGHT_TAG_OPEN, '') \
+            .replace(HIGHLIGHT_TAG_CLOSE, '')
+        start = source.find(plain, last_end) if plain else -1
+        if start < 0:   # Can't place the fragment, so it stays unhighlighted.
+            continue
+        fragment, start, end = _complete_texisms(fragment, source, start,
+                                                 start + len(plain))
+        highlighted += _escape(source[last_end:start])
+        highlighted += _escape(_highlight_whole_texism(fragment))
+        last_end = end
+    return highlighted + _escape(source[last_end:])
 
 
 def _strip_highlight_and_enclose(match: Any) -> str:
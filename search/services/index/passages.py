@@ -0,0 +1,214 @@
+"""
+Fulltext search, on an index of passages.
+
+The fulltext of a paper can run to megabytes. Rather than indexing it as a
+single field of the paper document, which makes both indexing and
+highlighting expensive, it is split into passages of about
+:data:`.PASSAGE_SIZE` characters (see :func:`.split`), each of which is a
+document in a separate index (``ELASTICSEARCH_PASSAGE_INDEX``), keyed by the
+versioned arXiv ID of the paper and the position of the passage.
+
+A fulltext search (:func:`.passage_search`) matches passages, collapses them
+to the best-matching passage of each paper, and highlights a snippet of that
+passage only. The papers themselves are then retrieved from the paper index
+by ID, and combined with the snippets by :func:`.to_documentset`.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List
+
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response
+
+from search.domain import Document, DocumentSet, SimpleQuery
+from arxiv.base import logging
+
+from .highlighting import HIGHLIGHT_TAG_OPEN, HIGHLIGHT_TAG_CLOSE, \
+    PREVIEW_SIZE
+from .prepare import SEARCH_FIELDS
+from .results import page_metadata, to_document
+from .util import MAX_RESULTS
+
+logger = logging.getLogger(__name__)
+
+PASSAGE_SIZE = 1000
+"""Approximate size (in characters) of a passage."""
+
+PASSAGE_OVERLAP = 100
+"""
+Approximate overlap (in characters) between consecutive passages.
+
+So that a phrase that straddles the end of a passage can still be matched.
+"""
+
+
+@dataclass
+class Passage:
+    """A passage of the fulltext of a paper version."""
+
+    id: str
+    paper_id: str
+    paper_id_v: str
+    is_current: bool
+    position: int
+    """Position of the passage in the fulltext, from 0."""
+
+    document_hash: str
+    """Content hash of the paper document that the passage belongs to."""
+
+    text: str
+
+
+def split(text: str, size: int = PASSAGE_SIZE,
+          overlap: int = PASSAGE_OVERLAP) -> List[str]:
+    """
+    Split normalized text into overlapping passages.
+
+    Passages are cut at spaces where possible, so words are not split.
+
+    Parameters
+    ----------
+    text : str
+        Text in which whitespace has been collapsed to single spaces (see
+        :func:`search.process.enrich.normalize`).
+    size : int
+        Max size (in characters) of a passage.
+    overlap : int
+        Approximate number of characters at the end of each passage that are
+        repeated at the start of the next one. Must be less than half of
+        ``size``.
+
+    Returns
+    -------
+    list
+        Passages, in order.
+
+    """
+    passages: List[str] = []
+    start = 0
+    while start < len(text):
+        end = start + size
+        if end < len(text):
+            cut = text.rfind(' ', start + size // 2, end + 1)
+            if cut > 0:
+                end = cut
+        passage = text[start:end].strip()
+        if passage:
+            passages.append(passage)
+        if end >= len(text):
+            break
+        space = text.find(' ', end - overlap, end)
+        start = space + 1 if space >= 0 else end
+    return passages
+
+
+def to_passages(document: Document, document_hash: str) -> List[Passage]:
+    """
+    Get the passages of the fulltext of a paper document, if it has any.
+
+    Parameters
+    ----------
+    document : :class:`.Document`
+    document_hash : str
+        Content hash of the document, as indexed (see :mod:`.bulk`).
+
+    Returns
+    -------
+    list
+        :class:`.Passage` instances, with IDs ``{paper_id_v}-{position}``.
+
+    """
+    return [
+        Passage(id=f'{document.id}-{position}', paper_id=document.paper_id,
+                paper_id_v=document.id, is_current=document.is_current,
+                position=position, document_hash=document_hash, text=text)
+        for position, text in enumerate(split(document.fulltext))
+    ]
+
+
+def supports(query: SimpleQuery) -> bool:
+    """
+    Determine whether a fulltext query can be performed on passages.
+
+    Passages carry no classification or dates, so the results of a query
+    that is limited by classification or sorted could not be right.
+    """
+    return not query.classification and not query.order
+
+
+def passage_search(search: Search, query: SimpleQuery,
+                   highlight: bool = True) -> Search:
+    """
+    Prepare a fulltext search, on the passage index.
+
+    Parameters
+    ----------
+    search : :class:`.Search`
+        An Elasticsearch DSL search object for the passage index.
+    query : :class:`.SimpleQuery`
+        A query with ``search_field`` ``'full_text'`` (see :func:`.supports`).
+        Results are ordered by relevance.
+
+    Returns
+    -------
+    :class:`.Search`
+        A search for the best-matching current passage of each paper. The
+        number of papers is in the ``papers`` aggregation.
+
+    """
+    search = search.filter('term', is_current=True) \
+        .query(SEARCH_FIELDS['full_text'](query.value)) \
+        .source(['paper_id_v']) \
+        .extra(collapse={'field': 'paper_id_v'})
+    # Hits are passages; the number of distinct papers is estimated.
+    search.aggs.metric('papers', 'cardinality', field='paper_id_v',
+                       precision_threshold=MAX_RESULTS)
+    if highlight:
+        # Passages are plain text, so the HTML encoder escapes them.
+        search = search.highlight_options(
+            encoder='html', pre_tags=[HIGHLIGHT_TAG_OPEN],
+            post_tags=[HIGHLIGHT_TAG_CLOSE]
+        ).highlight('text.english', 'text', type='unified',
+                    fragment_size=PREVIEW_SIZE, number_of_fragments=1)
+    return search
+
+
+def to_documentset(query: SimpleQuery, response: Response,
+                   sources: Dict[str, dict],
+                   highlight: bool = True) -> DocumentSet:
+    """
+    Combine a page of passage hits with the papers to which they belong.
+
+    Parameters
+    ----------
+    query : :class:`.SimpleQuery`
+    response : :class:`.Response`
+        Response to a search prepared by :func:`.passage_search`.
+    sources : dict
+        The ``_source`` of each paper document, by versioned arXiv ID.
+
+    Returns
+    -------
+    :class:`.DocumentSet`
+        The papers, in order of relevance, each with a snippet of its
+        best-matching passage in ``highlight['fulltext']``.
+
+    """
+    documents: List[Document] = []
+    for hit in response:
+        source = sources.get(hit.paper_id_v)
+        if source is None:     # Not in the paper index (yet).
+            logger.warning('%s: passage without paper', hit.paper_id_v)
+            continue
+        document = to_document(source, highlight=highlight)
+        document.score = hit.meta.score
+        document.match['fulltext'] = True
+        matched = hit.meta.to_dict().get('highlight', {})
+        fragments = matched.get('text.english') or matched.get('text')
+        if fragments:
+            document.highlight['fulltext'] = fragments[0]
+        documents.append(document)
+    total = int(response.aggregations.papers.value)
+    logger.debug('got %i results', total)
+    return DocumentSet(metadata=page_metadata(query, total),  # type: ignore
+                       results=documents)
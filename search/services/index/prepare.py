@@ -52,6 +52,17 @@ def _query_abstract(term: str, default_operator: str = 'AND') -> Q:
              _name="abstract")
 
 
+def _query_full_text(term: str, default_operator: str = 'AND') -> Q:
+    # Fulltext is indexed as passages (see :mod:`.passages`), not as a field
+    # of the paper document.
+    fields = ["text.english"]
+    if is_literal_query(term):
+        fields += ["text"]
+    return Q("query_string", fields=fields, default_operator=default_operator,
+             allow_leading_wildcard=False, query=escape(term),
+             _name="full_text")
+
+
 def _query_comments(term: str, default_operator: str = 'AND') -> Q:
     return Q("query_string", fields=["comments"],
              default_operator=default_operator,
@@ -390,5 +401,6 @@ SEARCH_FIELDS: Dict[str, Callable[[str], Q]] = dict([
     ('orcid', orcid_query),
     ('author_id', author_id_query),
     ('license', _license_query),
+    ('full_text', _query_full_text),
     ('all', _query_all_fields)
 ])
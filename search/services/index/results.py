@@ -15,7 +15,8 @@ from search.domain import Document, Query, DocumentSet, Classification, Person
 from arxiv.base import logging
 
 from .util import MAX_RESULTS, TEXISM
-from .highlighting import add_highlighting, preview
+from .highlighting import add_highlighting, preview, is_truncated, \
+    LazyMapping
 
 logger = logging.getLogger(__name__)
 logger.propagate = False
@@ -90,15 +91,14 @@ def to_document(raw: Union[Hit, dict], highlight: bool = True) -> Document:
     if type(raw) is Response:
         result['score'] = raw.meta.score    # type: ignore
 
+    # The preview is only generated if it is actually displayed.
     if type(result.get('abstract')) is str and highlight:
-        if 'preview' not in result:
-            result['preview'] = {}
-        result['preview']['abstract'] = preview(result['abstract'])
-        if result['preview']['abstract'].endswith('&hellip;'):
-            result['truncated']['abstract'] = True
+        previews = result['preview'] = LazyMapping(result.get('preview'))
+        previews.defer('abstract', preview, result['abstract'])
+        truncated = result['truncated'] = LazyMapping(result['truncated'])
+        truncated.defer('abstract', is_truncated, previews, 'abstract')
 
     if highlight and type(raw) in [Response, Hit]:
-        result['highlight'] = {}
         logger.debug('%s: add highlighting to result',
                      raw.paper_id)  # type: ignore
         result = add_highlighting(result, raw)
@@ -126,23 +126,26 @@ def to_documentset(query: Query, response: Response, highlight: bool = True) \
         page, along with pagination metadata.
 
     """
-    max_pages = int(MAX_RESULTS/query.size)
-    N_pages_raw = response['hits']['total']/query.size
-    N_pages = int(floor(N_pages_raw)) + \
-        int(N_pages_raw % query.size > 0)
     logger.debug('got %i results', response['hits']['total'])
-
     return DocumentSet(**{  # type: ignore
-        'metadata': {
-            'start': query.page_start,
-            'end': min(query.page_start + query.size,
-                       response['hits']['total']),
-            'total': response['hits']['total'],
-            'current_page': query.page,
-            'total_pages': N_pages,
-            'size': query.size,
-            'max_pages': max_pages
-        },
+        'metadata': page_metadata(query, response['hits']['total']),
         'results': [to_document(raw, highlight=highlight) for raw in response]
     })
     # See https://github.com/python/mypy/issues/3937
+
+
+def page_metadata(query: Query, total: int) -> Dict[str, int]:
+    """Get the pagination metadata for a page of ``total`` results."""
+    max_pages = int(MAX_RESULTS/query.size)
+    N_pages_raw = total/query.size
+    N_pages = int(floor(N_pages_raw)) + \
+        int(N_pages_raw % query.size > 0)
+    return {
+        'start': query.page_start,
+        'end': min(query.page_start + query.size, total),
+        'total': total,
+        'current_page': query.page,
+        'total_pages': N_pages,
+        'size': query.size,
+        'max_pages': max_pages
+    }
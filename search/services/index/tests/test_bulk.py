@@ -0,0 +1,243 @@
+"""Tests for :mod:`search.services.index.bulk`."""
+
+import json
+from datetime import date, datetime
+from unittest import TestCase, mock
+
+from elasticsearch import SerializationError
+from elasticsearch.serializer import JSONSerializer
+from pytz import timezone
+
+from search.domain import Document, Person, Classification, \
+    ClassificationList, shallow_asdict
+from search.services import index
+from search.services.index.bulk import BulkEncoder, HASH_FIELD, \
+    VERSION_FIELDS
+
+EASTERN = timezone('US/Eastern')
+
+
+def _document(ident: str = '1234.5678v1') -> Document:
+    return Document(
+        id=ident,
+        title='Über $\\alpha$ "particles"',
+        submitted_date=EASTERN.localize(datetime(2018, 1, 2, 3, 4, 5)),
+        announced_date_first=date(2018, 1, 3),
+        authors=[Person(full_name='Ada Lovelace', affiliation=['IAS'])],
+        primary_classification=Classification(category={'id': 'cs.AI'}),
+        secondary_classification=ClassificationList([
+            Classification(category={'id': 'cs.DL'})
+        ]),
+        score=0.5
+    )
+
+
+def _indexed(document: Document) -> dict:
+    """Get the source of a document as returned by an _mget request."""
+    encoder = BulkEncoder('arxiv', 'document')
+    return {HASH_FIELD: encoder.encode_with_hash(document)[0],
+            **encoder.version_fields(document)}
+
+
+def _actions(body: bytes) -> list:
+    """Get the (action, source) pairs in a bulk request body."""
+    lines = [json.loads(line) for line in body.split(b'\n') if line]
+    return list(zip(lines[::2], lines[1::2]))
+
+
+class TestBulkEncoder(TestCase):
+    """:class:`.BulkEncoder` writes documents directly to NDJSON."""
+
+    def setUp(self):
+        """Create an encoder."""
+        self.encoder = BulkEncoder('arxiv', 'document')
+
+    def test_encode(self):
+        """The source is the same as the ES client would produce."""
+        document = _document()
+        action, source, end = self.encoder.encode(document).split(b'\n')
+        self.assertEqual(json.loads(action), {
+            'index': {'_index': 'arxiv', '_type': 'document',
+                      '_id': '1234.5678v1'}
+        })
+        expected = JSONSerializer().dumps(shallow_asdict(document))
+        source = json.loads(source)
+        self.assertIn(HASH_FIELD, source)
+        source.pop(HASH_FIELD)
+        self.assertEqual(source, json.loads(expected))
+        self.assertEqual(end, b'')
+
+    def test_content_hash(self):
+        """The content hash changes if and only if the content changes."""
+        content_hash, encoded = self.encoder.encode_with_hash(_document())
+        self.assertEqual(json.loads(encoded.split(b'\n')[1])[HASH_FIELD],
+                         content_hash)
+        self.assertEqual(self.encoder.encode_with_hash(_document())[0],
+                         content_hash)
+        changed = _document()
+        changed.title = 'Something else'
+        self.assertNotEqual(self.encoder.encode_with_hash(changed)[0],
+                            content_hash)
+        bumped = _document()
+        bumped.is_current = False
+        bumped.latest_version = 2
+        self.assertEqual(self.encoder.encode_with_hash(bumped)[0],
+                         content_hash, 'Version fields are not hashed')
+
+    def test_timezones(self):
+        """Equal datetimes in different timezones are formatted correctly."""
+        utc = datetime(2018, 1, 2, 8, 4, 5, tzinfo=timezone('UTC'))
+        eastern = utc.astimezone(EASTERN)
+        self.assertEqual(self.encoder._value(eastern),
+                         json.dumps(eastern.isoformat()))
+        self.assertEqual(self.encoder._value(utc),
+                         json.dumps(utc.isoformat()))
+
+    def test_unserializable(self):
+        """A value that cannot be serialized raises SerializationError."""
+        with self.assertRaises(SerializationError):
+            self.encoder.encode(Document(id='1', source={'foo': object()}))
+
+    def test_omit(self):
+        """Omitted fields are left out of the source, but not the hash."""
+        document = _document()
+        document.fulltext = 'Some text'
+        encoder = BulkEncoder('arxiv', 'document', omit=['fulltext'])
+        content_hash, encoded = encoder.encode_with_hash(document)
+        self.assertNotIn('fulltext', json.loads(encoded.split(b'\n')[1]))
+        self.assertEqual(content_hash,
+                         self.encoder.encode_with_hash(document)[0])
+
+    def test_retarget_and_delete(self):
+        """Encoded documents can be sent to another index, or deleted."""
+        encoded = self.encoder.encode(_document())
+        other = BulkEncoder('arxiv-current', 'document')
+        retargeted = other.retarget('1234.5678v1', encoded)
+        self.assertEqual(retargeted, other.encode(_document()))
+        self.assertEqual(json.loads(other.encode_delete('1234.5678v1')), {
+            'delete': {'_index': 'arxiv-current', '_type': 'document',
+                       '_id': '1234.5678v1'}
+        })
+
+    def test_chunks_by_count(self):
+        """Chunks contain at most ``docs_per_chunk`` documents."""
+        documents = [_document(str(i)) for i in range(5)]
+        chunks = list(self.encoder.chunks(documents, docs_per_chunk=2))
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [4, 4, 2])
+        self.assertEqual(b''.join(chunks),
+                         b''.join(map(self.encoder.encode, documents)))
+
+    def test_chunks_by_size(self):
+        """Chunks contain at most ``bytes_per_chunk`` bytes."""
+        documents = [_document(str(i)) for i in range(3)]
+        size = len(self.encoder.encode(documents[0]))
+        chunks = list(self.encoder.chunks(documents,
+                                          bytes_per_chunk=size * 2 - 1))
+        self.assertEqual(len(chunks), 3)
+
+
+class TestBulkAddDocuments(TestCase):
+    """:meth:`.SearchSession.bulk_add_documents` sends NDJSON chunks."""
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_bulk_add_documents(self, mock_Elasticsearch):
+        """Each chunk is sent as a pre-serialized request body."""
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': False, 'items': []}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv')
+        sent = session.bulk_add_documents(
+            [_document(str(i)) for i in range(3)], docs_per_chunk=2
+        )
+        self.assertEqual(sent, 3)
+        self.assertEqual(mock_es.bulk.call_count, 2)
+        self.assertEqual(mock_es.mget.call_count, 0)
+        body = mock_es.bulk.call_args[1]['body']
+        self.assertIsInstance(body, bytes)
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_skip_unchanged(self, mock_Elasticsearch):
+        """Documents with the same content as in the index are skipped."""
+        documents = [_document(str(i)) for i in range(3)]
+        changed = _document('1')
+        changed.title = 'A new title'
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': False, 'items': []}
+        mock_es.mget.return_value = {'docs': [
+            {'_id': '0', 'found': True, '_source': _indexed(documents[0])},
+            {'_id': '1', 'found': True, '_source': _indexed(changed)},
+            {'_id': '2', 'found': False}
+        ]}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv')
+
+        sent = session.bulk_add_documents(documents, skip_unchanged=True)
+
+        self.assertEqual(sent, 2)
+        self.assertEqual(mock_es.mget.call_args[1]['body'],
+                         {'ids': ['0', '1', '2']})
+        self.assertEqual(mock_es.mget.call_args[1]['_source'],
+                         [HASH_FIELD, *VERSION_FIELDS])
+        actions = _actions(mock_es.bulk.call_args[1]['body'])
+        self.assertEqual([action['index']['_id'] for action, _ in actions],
+                         ['1', '2'])
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_skip_all_unchanged(self, mock_Elasticsearch):
+        """If nothing has changed, nothing is sent to the bulk API."""
+        document = _document('0')
+        mock_es = mock.MagicMock()
+        mock_es.mget.return_value = {'docs': [
+            {'_id': '0', 'found': True, '_source': _indexed(document)}
+        ]}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv')
+
+        self.assertEqual(
+            session.bulk_add_documents([document], skip_unchanged=True), 0
+        )
+        self.assertEqual(mock_es.bulk.call_count, 0)
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_version_bump(self, mock_Elasticsearch):
+        """When a new version is announced, older versions are updated."""
+        old = _document('1234.5678v1')
+        old.latest, old.latest_version = '1234.5678v1', 1
+        bumped = _document('1234.5678v1')
+        bumped.is_current = False
+        bumped.latest, bumped.latest_version = '1234.5678v2', 2
+        new = _document('1234.5678v2')
+        new.latest, new.latest_version = '1234.5678v2', 2
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': False, 'items': []}
+        mock_es.mget.return_value = {'docs': [
+            {'_id': '1234.5678v1', 'found': True, '_source': _indexed(old)},
+            {'_id': '1234.5678v2', 'found': False}
+        ]}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv')
+
+        sent = session.bulk_add_documents([bumped, new], skip_unchanged=True)
+
+        self.assertEqual(sent, 2)
+        (update, partial), (add, source) = \
+            _actions(mock_es.bulk.call_args[1]['body'])
+        self.assertEqual(update['update']['_id'], '1234.5678v1')
+        self.assertEqual(set(partial['doc']), set(VERSION_FIELDS))
+        self.assertEqual(partial['doc']['is_current'], False)
+        self.assertEqual(partial['doc']['latest'], '1234.5678v2')
+        self.assertEqual(partial['doc']['latest_version'], 2)
+        self.assertEqual(add['index']['_id'], '1234.5678v2')
+        self.assertEqual(source['title'], new.title, 'Fully indexed')
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_failed_documents(self, mock_Elasticsearch):
+        """Errors reported by ES raise :class:`.IndexingError`."""
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': True, 'items': [
+            {'index': {'_id': '1', 'status': 400, 'error': {}}}
+        ]}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv')
+        with self.assertRaises(index.IndexingError):
+            session.bulk_add_documents([_document('1')])
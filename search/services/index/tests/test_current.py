@@ -0,0 +1,165 @@
+"""Tests for the index of current versions in :mod:`search.services.index`."""
+
+import json
+from unittest import TestCase, mock
+
+from search.domain import AdvancedQuery, FieldedSearchList, \
+    FieldedSearchTerm, SimpleQuery
+from search.services import index
+
+from .test_bulk import _actions, _document, _indexed
+
+
+def _advanced(include_older_versions: bool) -> AdvancedQuery:
+    return AdvancedQuery(
+        terms=FieldedSearchList([
+            FieldedSearchTerm(operator='AND', field='title', term='foo')
+        ]),
+        include_older_versions=include_older_versions
+    )
+
+
+class TestSearchCurrentIndex(TestCase):
+    """Searches for current versions only are routed to the current index."""
+
+    def setUp(self):
+        """Set up a session with an index of current versions."""
+        self.es = mock.MagicMock()
+        self.es.search.return_value = {'hits': {'total': 0, 'hits': []}}
+        with mock.patch('search.services.index.Elasticsearch') as mock_es:
+            mock_es.return_value = self.es
+            self.session = index.SearchSession('localhost', 'arxiv',
+                                               current_index='arxiv-current')
+
+    def _searched(self, query) -> list:
+        self.session.search(query)
+        return self.es.search.call_args[1]['index']
+
+    def test_simple(self):
+        """Simple searches are always for current versions."""
+        query = SimpleQuery(search_field='title', value='foo')
+        self.assertEqual(self._searched(query), ['arxiv-current'])
+
+    def test_advanced(self):
+        """Advanced searches use it unless older versions are included."""
+        self.assertEqual(self._searched(_advanced(False)), ['arxiv-current'])
+        self.assertEqual(self._searched(_advanced(True)), ['arxiv'])
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_disabled(self, mock_Elasticsearch):
+        """Without an index of current versions, all searches use one."""
+        mock_Elasticsearch.return_value = self.es
+        session = index.SearchSession('localhost', 'arxiv')
+        session.search(_advanced(False))
+        self.assertEqual(self.es.search.call_args[1]['index'], ['arxiv'])
+
+
+class TestIndexCurrentVersions(TestCase):
+    """Documents are indexed in, or deleted from, the current index."""
+
+    def setUp(self):
+        """Set up a session with an index of current versions."""
+        self.es = mock.MagicMock()
+        self.es.bulk.return_value = {'errors': False, 'items': []}
+        with mock.patch('search.services.index.Elasticsearch') as mock_es:
+            mock_es.return_value = self.es
+            self.session = index.SearchSession('localhost', 'arxiv',
+                                               current_index='arxiv-current')
+
+    def test_new_version(self):
+        """A new version replaces the previous one in the current index."""
+        old = _document('1234.5678v1')
+        old.latest, old.latest_version = '1234.5678v1', 1
+        bumped = _document('1234.5678v1')
+        bumped.is_current = False
+        bumped.latest, bumped.latest_version = '1234.5678v2', 2
+        new = _document('1234.5678v2')
+        new.latest, new.latest_version = '1234.5678v2', 2
+        self.es.mget.return_value = {'docs': [
+            {'_id': '1234.5678v1', 'found': True, '_source': _indexed(old)},
+            {'_id': '1234.5678v2', 'found': False}
+        ]}
+
+        sent = self.session.bulk_add_documents([bumped, new],
+                                               skip_unchanged=True)
+
+        self.assertEqual(sent, 2)
+        current, all_versions = self.es.bulk.call_args_list
+        self.assertEqual(len(_actions(all_versions[1]['body'])), 2)
+        lines = current[1]['body'].split(b'\n')
+        self.assertEqual(
+            json.loads(lines[0]),
+            {'delete': {'_index': 'arxiv-current', '_type': 'document',
+                        '_id': '1234.5678v1'}}
+        )
+        self.assertEqual(
+            json.loads(lines[1]),
+            {'index': {'_index': 'arxiv-current', '_type': 'document',
+                       '_id': '1234.5678v2'}}
+        )
+        self.assertEqual(json.loads(lines[2])['title'], new.title)
+        self.assertEqual(lines[3:], [b''])
+
+    def test_current_index_fails(self):
+        """A paper is not recorded as indexed until it is current."""
+        document = _document('1234.5678v1')
+        self.es.mget.return_value = {'docs': [
+            {'_id': '1234.5678v1', 'found': False}
+        ]}
+        self.es.bulk.return_value = {'errors': True, 'items': [
+            {'index': {'_index': 'arxiv-current', '_id': '1234.5678v1',
+                       'status': 503, 'error': {'type': 'unavailable'}}}
+        ]}
+
+        with self.assertRaises(index.BulkIndexingError) as context:
+            self.session.bulk_add_documents([document], skip_unchanged=True)
+
+        self.assertEqual(context.exception.failed, ['1234.5678v1'])
+        self.assertEqual(context.exception.status_codes, [503])
+        self.assertEqual(self.es.bulk.call_count, 1,
+                         'The paper index is not written')
+
+    def test_unchanged(self):
+        """Unchanged documents are not sent to either index."""
+        document = _document('1234.5678v1')
+        self.es.mget.return_value = {'docs': [
+            {'_id': '1234.5678v1', 'found': True,
+             '_source': _indexed(document)}
+        ]}
+        self.session.bulk_add_documents([document], skip_unchanged=True)
+        self.assertEqual(self.es.bulk.call_count, 0)
+
+    def test_add_document(self):
+        """A single document is also added to, or deleted from, it."""
+        document = _document('1234.5678v1')
+        self.session.add_document(document)
+        self.assertEqual(
+            [call[1]['index'] for call in self.es.index.call_args_list],
+            ['arxiv', 'arxiv-current']
+        )
+        document.is_current = False
+        self.session.add_document(document)
+        self.assertEqual(self.es.delete.call_args[1]['index'],
+                         'arxiv-current')
+
+    def test_reindex_current_only(self):
+        """The current index can be filled from the all-versions index."""
+        self.session.mapping = 'mappings/DocumentMapping.json'
+        self.es.indices.exists.return_value = False
+        self.session.reindex('arxiv', 'arxiv-current', current_only=True)
+        body = self.es.reindex.call_args[0][0]
+        self.assertEqual(body['source']['query'],
+                         {'term': {'is_current': True}})
+
+    def test_create_current_index(self):
+        """The current index is created, if only it is missing."""
+        self.session.mapping = 'mappings/DocumentMapping.json'
+        self.es.indices.exists.side_effect = \
+            lambda index: index != 'arxiv-current'
+        self.session.add_document(_document('1234.5678v1'))
+        self.session.add_document(_document('1234.5678v2'))
+        self.assertEqual(self.es.indices.create.call_count, 1,
+                         'Indexes are only checked once per session')
+        name, mapping = self.es.indices.create.call_args[0]
+        self.assertEqual(name, 'arxiv-current')
+        self.assertIn('document', mapping['mappings'])
@@ -0,0 +1,274 @@
+"""Tests for :mod:`search.services.index.passages`."""
+
+from unittest import TestCase, mock
+
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response
+
+from search.domain import Document, SimpleQuery
+from search.services import index
+from search.services.index import passages
+from search.services.index.bulk import HASH_FIELD
+
+from .test_bulk import _actions, _document, _indexed
+
+
+def _source(paper_id_v: str) -> dict:
+    return {'id': paper_id_v, 'paper_id_v': paper_id_v,
+            'paper_id': paper_id_v.split('v')[0], 'title': 'A title',
+            'abstract': 'An abstract', 'is_current': True}
+
+
+def _response(search: Search, hits: list, papers: int) -> Response:
+    return Response(search, {
+        'hits': {'total': len(hits) * 3, 'max_score': 2.0, 'hits': hits},
+        'aggregations': {'papers': {'value': papers}}
+    })
+
+
+class TestSplit(TestCase):
+    """:func:`.passages.split` cuts text into overlapping passages."""
+
+    def test_short(self):
+        """Text shorter than a passage is a single passage."""
+        self.assertEqual(passages.split('Some text'), ['Some text'])
+        self.assertEqual(passages.split(''), [])
+
+    def test_long(self):
+        """Passages are cut at spaces, and overlap."""
+        words = [f'word{i:03}' for i in range(500)]
+        split = passages.split(' '.join(words), size=100, overlap=20)
+        for passage in split:
+            self.assertLessEqual(len(passage), 100)
+            self.assertTrue(set(passage.split()) <= set(words),
+                            'Words are not split')
+        for before, after in zip(split, split[1:]):
+            self.assertEqual(before.split()[-1], after.split()[1],
+                             'Passages overlap')
+        self.assertEqual(split[0].split()[0], words[0])
+        self.assertEqual(split[-1].split()[-1], words[-1])
+
+    def test_no_spaces(self):
+        """Text without spaces is cut anyway."""
+        split = passages.split('x' * 250, size=100, overlap=20)
+        self.assertEqual(''.join(split), 'x' * 250)
+
+    def test_to_passages(self):
+        """Passages are keyed by versioned ID and position."""
+        document = Document(id='1234.56789v2', paper_id='1234.56789',
+                            fulltext='Some text', is_current=True)
+        passage, = passages.to_passages(document, 'abc')
+        self.assertEqual(passage.id, '1234.56789v2-0')
+        self.assertEqual(passage.paper_id_v, '1234.56789v2')
+        self.assertEqual(passage.document_hash, 'abc')
+        self.assertEqual(passage.text, 'Some text')
+        self.assertEqual(passages.to_passages(Document(id='1'), 'abc'), [])
+
+
+class TestPassageSearch(TestCase):
+    """Fulltext searches match passages, and collapse them to papers."""
+
+    def setUp(self):
+        """Make a fulltext query."""
+        self.query = SimpleQuery(search_field='full_text',
+                                 value='dark matter', page_start=0, size=25)
+
+    def test_passage_search(self):
+        """The best passage of each current paper is highlighted."""
+        body = passages.passage_search(Search(), self.query).to_dict()
+        self.assertEqual(body['collapse'], {'field': 'paper_id_v'})
+        self.assertEqual(body['_source'], ['paper_id_v'])
+        self.assertIn({'term': {'is_current': True}},
+                      body['query']['bool']['filter'])
+        self.assertEqual(body['aggs']['papers']['cardinality']['field'],
+                         'paper_id_v')
+        self.assertEqual(body['highlight']['encoder'], 'html')
+        self.assertIn('text.english', body['highlight']['fields'])
+
+    def test_to_documentset(self):
+        """Papers are combined with the snippets of their passages."""
+        hits = [
+            {'_id': '1234.56789v2-3', '_score': 2.0,
+             '_source': {'paper_id_v': '1234.56789v2'},
+             'highlight': {'text.english': ['about <em>dark</em> matter']}},
+            {'_id': '1234.00001v1-0', '_score': 1.0,
+             '_source': {'paper_id_v': '1234.00001v1'}},
+            {'_id': '1234.00002v1-0', '_score': 0.5,
+             '_source': {'paper_id_v': '1234.00002v1'}}
+        ]
+        sources = {'1234.56789v2': _source('1234.56789v2'),
+                   '1234.00001v1': _source('1234.00001v1')}
+        response = _response(Search(), hits, 30)
+
+        result = passages.to_documentset(self.query, response, sources)
+
+        self.assertEqual(result.metadata['total'], 30)
+        self.assertEqual(result.metadata['total_pages'], 2)
+        self.assertEqual([doc.id for doc in result.results],
+                         ['1234.56789v2', '1234.00001v1'],
+                         'Papers that are not in the index are left out')
+        first, second = result.results
+        self.assertEqual(first.score, 2.0)
+        self.assertEqual(first.highlight['fulltext'],
+                         'about <em>dark</em> matter')
+        self.assertTrue(second.match['fulltext'])
+        self.assertNotIn('fulltext', second.highlight)
+
+
+class TestSearchSession(TestCase):
+    """:class:`.SearchSession` indexes and searches passages, if enabled."""
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_full_text_search(self, mock_Elasticsearch):
+        """A fulltext query is performed on the passage index."""
+        mock_es = mock.MagicMock()
+        mock_es.search.return_value = {
+            'hits': {'total': 1, 'max_score': 1.0, 'hits': [
+                {'_id': '1234.56789v2-0', '_score': 1.0,
+                 '_source': {'paper_id_v': '1234.56789v2'}}
+            ]},
+            'aggregations': {'papers': {'value': 1}}
+        }
+        mock_es.mget.return_value = {'docs': [
+            {'_id': '1234.56789v2', 'found': True,
+             '_source': _source('1234.56789v2')}
+        ]}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv',
+                                      passage_index='arxiv-passages')
+        query = SimpleQuery(search_field='full_text', value='dark matter',
+                            page_start=0, size=25)
+
+        result = session.search(query)
+
+        self.assertEqual(mock_es.search.call_args[1]['index'],
+                         ['arxiv-passages'])
+        self.assertEqual(mock_es.mget.call_args[1]['index'], 'arxiv')
+        self.assertEqual(mock_es.mget.call_args[1]['body'],
+                         {'ids': ['1234.56789v2']})
+        self.assertEqual([doc.id for doc in result.results],
+                         ['1234.56789v2'])
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_unsupported_search(self, mock_Elasticsearch):
+        """Passages can't be searched by classification, or sorted."""
+        mock_Elasticsearch.return_value = mock.MagicMock()
+        session = index.SearchSession('localhost', 'arxiv',
+                                      passage_index='arxiv-passages')
+        query = SimpleQuery(search_field='full_text', value='dark matter',
+                            page_start=0, size=25, order='-submitted_date')
+        self.assertFalse(passages.supports(query))
+        with self.assertRaises(index.QueryError):
+            session.search(query)
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_index_passages(self, mock_Elasticsearch):
+        """Fulltext is indexed as passages, not with the document."""
+        document = _document('1234.5678v1')
+        document.fulltext = 'Some text'
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': False, 'items': []}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv',
+                                      passage_index='arxiv-passages')
+
+        session.bulk_add_documents([document])
+
+        passage_call, paper_call = mock_es.bulk.call_args_list
+        (action, source), = _actions(paper_call[1]['body'])
+        self.assertNotIn('fulltext', source)
+        (action, passage), = _actions(passage_call[1]['body'])
+        self.assertEqual(action['index']['_index'], 'arxiv-passages')
+        self.assertEqual(action['index']['_id'], '1234.5678v1-0')
+        self.assertEqual(passage['text'], 'Some text')
+        self.assertEqual(passage['document_hash'], source[HASH_FIELD])
+        query = mock_es.delete_by_query.call_args[1]['body']['query']
+        self.assertEqual(query['bool']['must_not'],
+                         {'terms': {'document_hash': [source[HASH_FIELD]]}})
+        self.assertEqual(mock_es.update_by_query.call_count, 0)
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_passage_fails(self, mock_Elasticsearch):
+        """A failed passage is a failure of its paper, which is retried."""
+        document = _document('1234.5678v1')
+        document.fulltext = 'Some text'
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': True, 'items': [
+            {'index': {'_index': 'arxiv-passages', '_id': '1234.5678v1-0',
+                       'status': 429, 'error': {'type': 'rejected'}}}
+        ]}
+        mock_es.mget.return_value = {'docs': [
+            {'_id': '1234.5678v1', 'found': False}
+        ]}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv',
+                                      passage_index='arxiv-passages')
+
+        with self.assertRaises(index.BulkIndexingError) as context:
+            session.bulk_add_documents([document], skip_unchanged=True)
+
+        self.assertEqual(context.exception.failed, ['1234.5678v1'])
+        self.assertEqual(mock_es.bulk.call_count, 1,
+                         'The paper (and its hash) is not indexed')
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_create_passage_index(self, mock_Elasticsearch):
+        """The passage index is created, even if the paper index exists."""
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': False, 'items': []}
+        mock_es.indices.exists.side_effect = \
+            lambda index: index != 'arxiv-passages'
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession(
+            'localhost', 'arxiv', mapping='mappings/DocumentMapping.json',
+            passage_index='arxiv-passages',
+            passage_mapping='mappings/PassageMapping.json'
+        )
+
+        session.bulk_add_documents([_document('1234.5678v1')])
+
+        name, mapping = mock_es.indices.create.call_args[0]
+        self.assertEqual(mock_es.indices.create.call_count, 1)
+        self.assertEqual(name, 'arxiv-passages')
+        self.assertIn('passage', mapping['mappings'])
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_version_bump(self, mock_Elasticsearch):
+        """Passages of older versions are no longer current."""
+        old = _document('1234.5678v1')
+        bumped = _document('1234.5678v1')
+        bumped.is_current = False
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': False, 'items': []}
+        mock_es.mget.return_value = {'docs': [
+            {'_id': '1234.5678v1', 'found': True, '_source': _indexed(old)}
+        ]}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv',
+                                      passage_index='arxiv-passages')
+
+        session.bulk_add_documents([bumped], skip_unchanged=True)
+
+        self.assertEqual(mock_es.delete_by_query.call_count, 0)
+        body = mock_es.update_by_query.call_args[1]['body']
+        self.assertEqual(body['query'],
+                         {'terms': {'paper_id_v': ['1234.5678v1']}})
+        self.assertEqual(body['script']['params'], {'value': False})
+
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_disabled(self, mock_Elasticsearch):
+        """Without a passage index, fulltext stays with the document."""
+        document = _document('1234.5678v1')
+        document.fulltext = 'Some text'
+        mock_es = mock.MagicMock()
+        mock_es.bulk.return_value = {'errors': False, 'items': []}
+        mock_Elasticsearch.return_value = mock_es
+        session = index.SearchSession('localhost', 'arxiv')
+
+        session.bulk_add_documents([document])
+
+        self.assertFalse(session.passages_enabled())
+        self.assertEqual(mock_es.bulk.call_count, 1)
+        (_, source), = _actions(mock_es.bulk.call_args[1]['body'])
+        self.assertEqual(source['fulltext'], 'Some text')
+        self.assertEqual(mock_es.delete_by_query.call_count, 0)
@@ -1,13 +1,21 @@
 """Tests for reindexing."""
 
+import json
 from unittest import TestCase, mock
 
 from search.services import index
 
 
-def raise_index_exists(*args, **kwargs):
-    """Raise a resource_already_exists_exception TransportError."""
-    raise index.TransportError(400, 'resource_already_exists_exception', {})
+def _mapping():
+    with open('mappings/DocumentMapping.json') as f:
+        return json.load(f)
+
+
+def _as_returned(mapping):
+    """Scalars as returned by ES, plus a default that ES fills in."""
+    mapping = json.loads(json.dumps(mapping).replace(': false', ': "false"'))
+    mapping['mappings']['document']['date_detection'] = True
+    return mapping
 
 
 class TestReindexing(TestCase):
@@ -18,6 +26,7 @@ class TestReindexing(TestCase):
         """Reindex to an index that does not exist."""
         mock_es = mock.MagicMock()
         mock_Elasticsearch.return_value = mock_es
+        mock_es.indices.exists.return_value = False
         index.reindex('barindex', 'bazindex')
         self.assertEqual(mock_es.indices.create.call_count, 1,
                          "Should attempt to create the new index")
@@ -33,15 +42,16 @@ class TestReindexing(TestCase):
 
     @mock.patch('search.services.index.Elasticsearch')
     def test_reindex_already_exists(self, mock_Elasticsearch):
-        """Reindex to an index that already exists."""
+        """Reindex to an index that already exists, with the same mapping."""
         mock_es = mock.MagicMock()
         mock_Elasticsearch.return_value = mock_es
-        mock_es.indices.create.side_effect = raise_index_exists
+        mock_es.indices.exists.return_value = True
+        mock_es.indices.get_mapping.return_value = {
+            'bazindex': _as_returned(_mapping())
+        }
         index.reindex('barindex', 'bazindex')
-        self.assertEqual(mock_es.indices.create.call_count, 1,
-                         "Should attempt to create the new index")
-        self.assertEqual(mock_es.indices.create.call_args[0][0], "bazindex",
-                         "Should attempt to create the new index")
+        self.assertEqual(mock_es.indices.create.call_count, 0,
+                         "Should not attempt to create the new index")
 
         self.assertEqual(mock_es.reindex.call_count, 1,
                          "Should proceed to request reindexing")
@@ -51,6 +61,22 @@ class TestReindexing(TestCase):
                          'bazindex')
 
 
+    @mock.patch('search.services.index.Elasticsearch')
+    def test_reindex_other_mapping(self, mock_Elasticsearch):
+        """Refuse to reindex to an index with a different mapping."""
+        mock_es = mock.MagicMock()
+        mock_Elasticsearch.return_value = mock_es
+        mock_es.indices.exists.return_value = True
+        mapping = _mapping()
+        mapping['mappings']['document']['properties']['title'] = \
+            {'type': 'keyword'}
+        mock_es.indices.get_mapping.return_value = {'bazindex': mapping}
+        with self.assertRaises(index.MappingError):
+            index.reindex('barindex', 'bazindex')
+        self.assertEqual(mock_es.reindex.call_count, 0,
+                         "Should not request reindexing")
+
+
 class TestTaskStatus(TestCase):
     """Tests for :func:`.index.get_task_status`."""
 
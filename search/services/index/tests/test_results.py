@@ -1,6 +1,10 @@
 """Tests for :mod:`search.services.index`."""
 
+from types import SimpleNamespace
 from unittest import TestCase, mock
+
+from elasticsearch_dsl import Search
+
 from search.services.index import highlighting
 
 
@@ -97,3 +101,182 @@ class TestResultsEndSafely(TestCase):
                                        start_tag=self.start_tag,
                                        end_tag=self.end_tag)
         self.assertEqual(end, 275, "Should end after the closing tag.")
+
+
+class TestStitchFragments(TestCase):
+    """Given highlighted abstract fragments, generate a TeX-safe preview."""
+
+    def setUp(self):
+        """Set a sample abstract for use in test cases."""
+        self.value = (
+            "We study the $\\alpha$ decay of heavy nuclei. Many results"
+            " $$x^2 + y^2$$ are obtained here. In the end, we conclude."
+        )
+        self.tag_o = highlighting.HIGHLIGHT_TAG_OPEN
+        self.tag_c = highlighting.HIGHLIGHT_TAG_CLOSE
+
+    def test_whole_field(self):
+        """The fragment covers the whole abstract."""
+        fragment = self.value.replace('decay',
+                                      f'{self.tag_o}decay{self.tag_c}')
+        snippet = highlighting._stitch_fragments([fragment], self.value)
+        self.assertNotIn('&hellip;', snippet, "Should not be truncated")
+        self.assertIn(f'{self.tag_o}decay{self.tag_c}', snippet)
+
+    def test_fragments_with_gap(self):
+        """Fragments are separated by a portion of the abstract."""
+        snippet = highlighting._stitch_fragments([
+            f"We study the $\\alpha$ {self.tag_o}decay{self.tag_c}",
+            f"are {self.tag_o}obtained{self.tag_c} here."
+        ], self.value)
+        self.assertTrue(snippet.startswith('We study'))
+        self.assertEqual(snippet.count('&hellip;'), 2,
+                         "Should have ellipses in the gap and at the end")
+
+    def test_fragment_starts_inside_texism(self):
+        """The fragment starts in the middle of a TeXism."""
+        snippet = highlighting._stitch_fragments(
+            [f"pha$ {self.tag_o}decay{self.tag_c} of"], self.value
+        )
+        self.assertTrue(snippet.startswith('&hellip;$\\alpha$'),
+                        "Should include the whole TeXism")
+
+    def test_fragment_ends_inside_texism(self):
+        """The fragment ends in the middle of a display-math TeXism."""
+        snippet = highlighting._stitch_fragments(
+            [f"Many {self.tag_o}results{self.tag_c} $$x^2"], self.value
+        )
+        self.assertTrue(snippet.endswith('$$x^2 + y^2$$&hellip;'),
+                        "Should include the whole TeXism")
+
+    def test_highlight_inside_texism(self):
+        """The highlighted term is inside of a TeXism."""
+        snippet = highlighting._stitch_fragments(
+            [f"$$x^2 + {self.tag_o}y{self.tag_c}^2$$ are"], self.value
+        )
+        self.assertIn(f'{self.tag_o}$$x^2 + y^2$${self.tag_c}', snippet,
+                      "Highlighting should enclose the whole TeXism")
+
+    def test_fragment_is_escaped(self):
+        """Non-highlighting HTML in fragments is escaped."""
+        value = "Is <b> a tag? No."
+        snippet = highlighting._stitch_fragments(
+            [f"Is <b> a {self.tag_o}tag{self.tag_c}?"], value
+        )
+        self.assertIn('&lt;b&gt;', snippet)
+
+
+class TestPlaceFragments(TestCase):
+    """Given highlighted abstract fragments, highlight the whole abstract."""
+
+    def setUp(self):
+        """Set a sample abstract for use in test cases."""
+        self.value = (
+            "We study the $\\alpha$ decay of heavy nuclei. Many results"
+            " $$x^2 + y^2$$ are obtained here. In the end, we conclude."
+        )
+        self.tag_o = highlighting.HIGHLIGHT_TAG_OPEN
+        self.tag_c = highlighting.HIGHLIGHT_TAG_CLOSE
+
+    def test_fragments_with_gap(self):
+        """The gaps between fragments are filled in from the abstract."""
+        highlighted = highlighting._place_fragments([
+            f"We study the $\\alpha$ {self.tag_o}decay{self.tag_c}",
+            f"are {self.tag_o}obtained{self.tag_c} here."
+        ], self.value)
+        self.assertNotIn('&hellip;', highlighted)
+        self.assertEqual(
+            highlighted.replace(self.tag_o, '').replace(self.tag_c, ''),
+            self.value
+        )
+        self.assertIn(f'{self.tag_o}decay{self.tag_c}', highlighted)
+        self.assertIn(f'{self.tag_o}obtained{self.tag_c}', highlighted)
+
+    def test_highlight_inside_texism(self):
+        """The highlighted term is inside of a TeXism."""
+        highlighted = highlighting._place_fragments(
+            [f"results $$x^2 + {self.tag_o}y{self.tag_c}^2"], self.value
+        )
+        self.assertIn(f'{self.tag_o}$$x^2 + y^2$${self.tag_c} are',
+                      highlighted,
+                      "Highlighting should enclose the whole TeXism")
+
+    def test_unplaced_fragment(self):
+        """A fragment that can't be placed is left out."""
+        value = "Is <b> a tag? No."
+        highlighted = highlighting._place_fragments(
+            [f"Not {self.tag_o}here{self.tag_c}"], value
+        )
+        self.assertEqual(highlighted, 'Is &lt;b&gt; a tag? No.')
+
+
+class TestLazyHighlighting(TestCase):
+    """Highlights are only post-processed when they are accessed."""
+
+    def setUp(self):
+        """Build a raw hit with highlighting on the title and abstract."""
+        self.abstract = 'The abstract of a paper about $\\alpha$ particles.'
+        self.raw = mock.MagicMock(meta=mock.MagicMock(
+            highlight=SimpleNamespace(
+                title=['A <span class="search-hit mathjax">paper</span>'],
+                abstract=['a <span class="search-hit mathjax">paper</span>']
+            ),
+            matched_queries=['title', 'abstract'],
+            inner_hits=None
+        ))
+        self.result = {'abstract': self.abstract, 'match': {},
+                       'truncated': {}, 'highlight': {}, 'preview': {}}
+
+    @mock.patch(f'{highlighting.__name__}._stitch_fragments')
+    @mock.patch(f'{highlighting.__name__}._highlight_tex_safe')
+    def test_deferred_until_accessed(self, mock_title, mock_stitch):
+        """Values are generated on first access, and only once."""
+        mock_title.return_value = 'title'
+        mock_stitch.return_value = 'abstract&hellip;'
+        result = highlighting.add_highlighting(self.result, self.raw)
+
+        self.assertIn('title', result['highlight'])
+        self.assertIn('abstract', result['preview'])
+        self.assertTrue(result['match']['abstract'])
+        self.assertEqual(mock_title.call_count, 0)
+        self.assertEqual(mock_stitch.call_count, 0)
+
+        self.assertEqual(result['highlight']['title'], 'title')
+        self.assertEqual(result['highlight']['title'], 'title')
+        self.assertEqual(mock_title.call_count, 1)
+        self.assertEqual(mock_stitch.call_count, 0)
+
+        self.assertTrue(result['truncated']['abstract'])
+        self.assertEqual(mock_stitch.call_count, 1)
+
+    def test_values(self):
+        """Deferred values are the same as the eager post-processing."""
+        result = highlighting.add_highlighting(self.result, self.raw)
+        self.assertEqual(result['highlight']['title'],
+                         'A <span class="search-hit mathjax">paper</span>')
+        self.assertEqual(result['preview']['abstract'],
+                         '&hellip;a <span class="search-hit mathjax">'
+                         'paper</span>&hellip;')
+        self.assertTrue(result['truncated']['abstract'])
+        self.assertEqual(result['highlight']['abstract'],
+                         'The abstract of a <span class="search-hit mathjax">'
+                         'paper</span> about $\\alpha$ particles.')
+
+
+class TestHighlightFields(TestCase):
+    """Only fields that are displayed are highlighted."""
+
+    def test_abstracts_hidden(self):
+        """Abstracts are not highlighted if they are not displayed."""
+        search = highlighting.highlight(Search(), abstracts=False)
+        fields = search.to_dict()['highlight']['fields']
+        self.assertIn('title', fields)
+        for field in highlighting.ABSTRACT_FIELDS:
+            self.assertNotIn(field, fields)
+
+    def test_abstracts_shown(self):
+        """Abstracts are highlighted as fragments."""
+        search = highlighting.highlight(Search())
+        fields = search.to_dict()['highlight']['fields']
+        self.assertEqual(fields['abstract']['number_of_fragments'],
+                         highlighting.ABSTRACT_FRAGMENTS)
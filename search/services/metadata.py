@@ -8,33 +8,78 @@ The primary entrypoint to this module is :func:`.retrieve`, which retrieves
 to the docmeta endpoint(s) for thread-safety and efficiency. The functions
 mentioned above load the appropriate instance of :class:`.DocMetaSession`
 depending on the context of the request.
+
+Each endpoint has its own pool of keep-alive connections, and requests go to
+the endpoint that has been doing best lately (see :mod:`.endpoints`). If a
+request fails for want of a (good) response, it is retried, on another
+endpoint if there is one.
+
+Metadata can be cached (see :class:`.DocMetaCache`), in memory and on disk in
+``METADATA_CACHE_DIR``, so that papers that were retrieved recently (e.g. by
+an earlier run of ``bulk_index.py``) need not be retrieved again.
+
+:class:`.AsyncDocMetaSession` has the same API for asyncio, so that a single
+thread can keep many requests in flight (see :mod:`.aio`).
 """
 
-from typing import Dict, List
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, \
+    Tuple
 
+import asyncio
+import codecs
+import itertools
 import os
+import re
+import time
 from urllib.parse import urljoin
 import json
-from itertools import cycle
 from functools import wraps
 
+import aiohttp
 import requests
-from requests.packages.urllib3.util.retry import Retry
 
 from arxiv import status
 from search.context import get_application_config, get_application_global
 from arxiv.base import logging
-from search.domain import DocMeta
+from search.domain import DocMeta, shallow_asdict
+from . import aio
+from .cache import Cache
+from .endpoints import Endpoint, EndpointPool
 
 
 logger = logging.getLogger(__name__)
 
 
-class RequestFailed(IOError):
+class MetadataError(IOError):
+    """Metadata could not be retrieved."""
+
+    retrieved: List[DocMeta]
+    """Metadata for papers in a bulk request that *were* retrieved."""
+
+    failed: List[str]
+    """IDs of the papers in a bulk request that were not retrieved."""
+
+    def __init__(self, *args: Any) -> None:
+        """Start with no papers retrieved, or known to have failed."""
+        super(MetadataError, self).__init__(*args)
+        self.retrieved = []
+        self.failed = []
+
+
+class RequestFailed(MetadataError):
     """The metadata endpoint returned an unexpected status code."""
 
+    def __init__(self, message: str = '',
+                 status_code: Optional[int] = None) -> None:
+        """Keep track of the status code, if there was a response."""
+        super(RequestFailed, self).__init__(message)
+        self.status_code = status_code
+
 
-class ConnectionFailed(IOError):
+class ConnectionFailed(MetadataError):
     """Could not connect to the metadata service."""
 
 
@@ -42,14 +87,220 @@ class SecurityException(ConnectionFailed):
     """Raised when SSL connection fails."""
 
 
-class BadResponse(IOError):
+class BadResponse(MetadataError):
     """The response from the metadata service was malformed."""
 
 
-class DocMetaSession(object):
-    """An HTTP session with the docmeta endpoint."""
+def _failed(response: Any, description: str) -> RequestFailed:
+    """Get an exception for an unexpected status code."""
+    return RequestFailed(
+        '%s: failed with %i: %s' % (
+            description, response.status_code, response.content
+        ),
+        status_code=response.status_code
+    )
+
+
+def _iter_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    Decode the elements of a JSON array, as the array is read.
+
+    Parameters
+    ----------
+    chunks : iterable
+        The UTF-8 encoded array, in pieces of any size.
+
+    Raises
+    ------
+    ValueError
+        If the pieces do not make a JSON array.
+
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    # Expect 'start' ([), 'first' (element or ]), 'element', 'next' (, or ])
+    # and then 'end' (nothing more).
+    state = 'start'
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        buffer += text.decode(chunk or b'', final=final)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position == len(buffer):
+                break
+            char = buffer[position]
+            if state == 'start':
+                if char != '[':
+                    raise ValueError('Expected a JSON array')
+                position += 1
+                state = 'first'
+            elif state in ('first', 'next') and char == ']':
+                position += 1
+                state = 'end'
+            elif state == 'next':
+                if char != ',':
+                    raise ValueError(f'Expected , or ] at {char!r}')
+                position += 1
+                state = 'element'
+            elif state == 'end':
+                raise ValueError('Extra data after the array')
+            else:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except json.decoder.JSONDecodeError:
+                    if final:
+                        raise
+                    break   # Wait for the rest of the element.
+                if end == len(buffer) and not final \
+                        and not isinstance(value, (dict, list, str)):
+                    break   # A number (say) may go on in the next chunk.
+                yield value
+                position = end
+                state = 'next'
+        buffer = buffer[position:]
+    if state != 'end':
+        raise ValueError('Incomplete JSON array')
+
+
+def _split_version(document_id: str) -> Tuple[str, Optional[int]]:
+    """Split an arXiv ID into the paper ID and the version, if there is one."""
+    match = re.match(r'^(.*\d)v(\d+)$', document_id)
+    if match is None:
+        return document_id, None
+    return match.group(1), int(match.group(2))
+
+
+def _timestamp(value: str) -> float:
+    """Parse a date from docmeta, e.g. ``2017-05-11T20:03:24-0400``."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S%z').timestamp()
+    except (TypeError, ValueError):
+        return 0.
+
+
+def _modified(docmeta: dict) -> Tuple[float, float]:
+    """Get when the metadata for a version were last changed."""
+    return (_timestamp(docmeta.get('modified_date', '')),
+            _timestamp(docmeta.get('updated_date', '')))
+
+
+class DocMetaCache:
+    """
+    Cached metadata for papers, by paper ID and version.
+
+    Metadata for a version that has been superseded rarely change, so they are
+    used for as long as they are in the cache. Metadata for the current
+    version of a paper, and which versions there are, are only used for
+    ``max_age`` seconds after they were retrieved.
+
+    Metadata are never replaced by metadata that were modified (going by
+    ``modified_date`` and ``updated_date``) less recently, e.g. metadata from
+    an endpoint that is behind the others.
+    """
+
+    def __init__(self, cache: Cache, max_age: float = 0.) -> None:
+        """Use ``cache`` to keep metadata for ``max_age`` seconds."""
+        self.cache = cache
+        self.max_age = max_age
+
+    def get(self, document_id: str) -> Optional[List[DocMeta]]:
+        """
+        Get cached metadata for a paper, if they are still good.
 
-    def __init__(self, *endpoints: str, verify_cert: bool = True) -> None:
+        Parameters
+        ----------
+        document_id : str
+            A versionless arXiv ID, for all of the versions of the paper, or
+            an arXiv ID with a version.
+
+        Returns
+        -------
+        list or None
+            Metadata for the requested version(s), or ``None`` if the cache
+            does not have all of them.
+
+        """
+        paper_id, version = _split_version(document_id)
+        now = time.time()
+        if version is None:
+            paper = self.cache.get(paper_id)
+            if paper is None or now - paper['retrieved'] >= self.max_age:
+                return None
+            versions = paper['versions']
+        else:
+            versions = [version]
+        found = []
+        for version in versions:
+            entry = self.cache.get(f'{paper_id}v{version}')
+            if entry is None:
+                return None
+            if entry['docmeta'].get('is_current', True) \
+                    and now - entry['retrieved'] >= self.max_age:
+                self.cache.stats['expired'] += 1
+                return None
+            found.append(DocMeta(**entry['docmeta']))   # type: ignore
+        return found
+
+    def put(self, docmeta: List[DocMeta], papers: Iterable[str] = ()) \
+            -> List[DocMeta]:
+        """
+        Add metadata that were just retrieved to the cache.
+
+        Parameters
+        ----------
+        docmeta : list
+            Metadata for one or more versions of papers.
+        papers : list
+            Versionless IDs of the papers for which ``docmeta`` includes all
+            of the versions.
+
+        Returns
+        -------
+        list
+            The most recently modified metadata for each version, which may
+            be from the cache rather than from ``docmeta``.
+
+        """
+        now = time.time()
+        kept = []
+        versions: Dict[str, List[int]] = defaultdict(list)
+        for this in docmeta:
+            key = f'{this.paper_id}v{this.version}'
+            data = shallow_asdict(this)
+            cached = self.cache.peek(key)
+            if cached is not None \
+                    and _modified(cached['docmeta']) > _modified(data):
+                logger.warning(f'{key}: retrieved metadata are older than'
+                               f' the cached metadata; using those')
+                self.cache.stats['outdated'] += 1
+                data = cached['docmeta']
+                this = DocMeta(**data)  # type: ignore
+            self.cache.put(key, {'retrieved': now, 'docmeta': data})
+            versions[this.paper_id].append(this.version)
+            kept.append(this)
+        for paper_id in papers:
+            if versions.get(paper_id):
+                self.put_versions(paper_id, versions[paper_id])
+        return kept
+
+    def put_versions(self, paper_id: str, versions: Iterable[int]) -> None:
+        """Note which versions of a paper there are, having just checked."""
+        self.cache.put(paper_id, {'retrieved': time.time(),
+                                  'versions': sorted(versions)})
+
+
+class _BaseDocMetaSession(object):
+    """Configuration and helpers shared by the docmeta sessions."""
+
+    def __init__(self, *endpoints: str, verify_cert: bool = True,
+                 pool_size: int = 10, retries: int = 3,
+                 backoff_factor: float = 0.5, connect_timeout: float = 3.05,
+                 read_timeout: float = 30., probe_interval: float = 30.,
+                 cache: Optional[DocMetaCache] = None, chunk_size: int = 50,
+                 max_url_length: int = 2000, concurrency: int = 4) -> None:
         """
         Initialize an HTTP session.
 
@@ -57,35 +308,232 @@ class DocMetaSession(object):
         ----------
         endpoints : str
             One or more endpoints for metadata retrieval. If more than one
-            are provided, calls to :meth:`.retrieve` will cycle through those
-            endpoints for each call.
+            are provided, each request goes to the healthy endpoint with the
+            lowest expected latency.
         verify_cert : bool
             Whether or not SSL certificate verification should enforced.
+        pool_size : int
+            Max number of connections to keep open to each endpoint.
+        retries : int
+            Number of times to retry a request that got no response, or a
+            server error.
+        backoff_factor : float
+            Retries of an endpoint that already failed the request wait for
+            ``backoff_factor * 2 ** (retries so far)`` seconds (max 10).
+        connect_timeout : float
+            Time (seconds) to wait for a connection to an endpoint.
+        read_timeout : float
+            Time (seconds) to wait for an endpoint to respond.
+        probe_interval : float
+            Time (seconds) between probes of an endpoint that has been ejected
+            because it kept failing.
+        cache : :class:`.DocMetaCache`
+            Cache for metadata. If not set, metadata are always retrieved.
+        chunk_size : int
+            Max number of papers to request at once, in bulk.
+        max_url_length : int
+            Max length of the URL for a bulk request.
+        concurrency : int
+            Max number of bulk requests at a time, for a single call. An
+            :class:`.AsyncDocMetaSession` sends them all at once, up to the
+            limits of its client.
 
         """
-        self._session = requests.Session()
+        self.cache = cache
+        self._chunk_size = chunk_size
+        self._max_url_length = max_url_length
+        self._concurrency = concurrency
         self._verify_cert = verify_cert
-        self._retry = Retry(  # type: ignore
-            total=10,
-            read=10,
-            connect=10,
-            status=10,
-            backoff_factor=0.5
-        )
-        self._adapter = requests.adapters.HTTPAdapter(max_retries=self._retry)
-        self._session.mount('https://', self._adapter)
-
-        for endpoint in endpoints:
-            if not endpoint[-1] == '/':
-                endpoint += '/'
+        self._retries = retries
+        self._backoff_factor = backoff_factor
+        self._pool = EndpointPool(endpoints, pool_size=pool_size,
+                                  probe_interval=probe_interval,
+                                  timeout=(connect_timeout, read_timeout))
         logger.debug(f'New DocMeta session with endpoints {endpoints}')
-        self._endpoints = cycle(endpoints)
 
     @property
     def endpoint(self) -> str:
-        """Get a metadata endpoint."""
-        logger.debug('get next endpoint')
-        return self._endpoints.__next__()
+        """Get the metadata endpoint that would be used for a request."""
+        return self._pool.pick().url
+
+    def _lookup(self, document_ids: List[str]) \
+            -> Tuple[List[DocMeta], List[str]]:
+        """Get cached metadata, and the IDs that need to be retrieved."""
+        if self.cache is None:
+            return [], document_ids
+        data: List[DocMeta] = []
+        missing = []
+        for document_id in document_ids:
+            found = self.cache.get(document_id)
+            if found is None:
+                missing.append(document_id)
+            else:
+                data += found
+        if not missing:
+            logger.debug(f'{document_ids}: metadata are cached')
+        return data, missing
+
+    @staticmethod
+    def _in_order(document_ids: List[str], data: List[DocMeta]) \
+            -> List[DocMeta]:
+        """Put metadata in the order that the papers were requested."""
+        position: Dict[str, int] = {}
+        for i, document_id in enumerate(document_ids):
+            position.setdefault(_split_version(document_id)[0], i)
+        return sorted(data, key=lambda docmeta: position.get(
+            docmeta.paper_id, len(position)
+        ))
+
+    def _chunk(self, document_ids: List[str]) -> List[List[str]]:
+        """Split IDs into chunks that can be requested at once."""
+        longest = max(len(endpoint.url) for endpoint in self._pool.endpoints)
+        budget = self._max_url_length - longest - len('docmeta_bulk?')
+        chunks: List[List[str]] = []
+        length = 0
+        for document_id in document_ids:
+            size = len(f'id={document_id}&')
+            if not chunks or len(chunks[-1]) >= self._chunk_size \
+                    or length + size > budget:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(document_id)
+            length += size
+        return chunks
+
+    @staticmethod
+    def _merge(chunks: List[List[str]],
+               results: List[Tuple[List[DocMeta], Optional[MetadataError]]]) \
+            -> List[DocMeta]:
+        """Combine the results for chunks, raising the first error if any."""
+        data = [docmeta for retrieved, _ in results for docmeta in retrieved]
+        failed = [(chunk, error) for chunk, (_, error) in zip(chunks, results)
+                  if error is not None]
+        if failed:
+            _, error = failed[0]
+            error.retrieved = data
+            error.failed = [document_id for chunk, _ in failed
+                            for document_id in chunk]
+            raise error
+        return data
+
+    def _decode(self, response: Any, document_id: str) -> DocMeta:
+        """Get the metadata in a response for a single paper."""
+        if response.status_code not in \
+                [status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT]:
+            logger.error('Request failed: %s', response.content)
+            raise _failed(response, document_id)
+        logger.debug(f'{document_id}: response OK')
+        try:
+            data = DocMeta(**response.json())   # type: ignore
+            # See https://github.com/python/mypy/issues/3937
+        except json.decoder.JSONDecodeError as e:
+            logger.error('JSONDecodeError: %s', e)
+            raise BadResponse(
+                '%s: could not decode response: %s' % (document_id, e)
+            ) from e
+        logger.debug(f'{document_id}: response decoded; done!')
+        if self.cache is not None:
+            data = self.cache.put([data])[0]
+        return data
+
+    def _decode_bulk(self, response: Any, document_ids: List[str]) \
+            -> List[DocMeta]:
+        """Get the metadata in a response for several papers."""
+        if response.status_code not in \
+                [status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT]:
+            logger.error('Request failed: %s', response.content)
+            raise _failed(response, str(document_ids))
+        logger.debug(f'{document_ids}: response OK')
+        try:
+            resp = response.json()  # A list with metadata for each paper.
+            data: List[DocMeta]
+            data = [DocMeta(**value) for value in resp]     # type: ignore
+        except json.decoder.JSONDecodeError as e:
+            logger.error('JSONDecodeError: %s', e)
+            raise BadResponse(
+                '%s: could not decode response: %s' % (document_ids, e)
+            ) from e
+        logger.debug(f'{document_ids}: response decoded; done!')
+        if self.cache is not None:
+            data = self.cache.put(data, papers=[
+                document_id for document_id in document_ids
+                if _split_version(document_id)[1] is None
+            ])
+        return data
+
+
+class DocMetaSession(_BaseDocMetaSession):
+    """An HTTP session with the docmeta endpoint."""
+
+    READ_SIZE = 64 * 1024
+    """Number of bytes to read from a response at a time, when streaming."""
+
+    def _get(self, path: str, description: str,
+             stream: bool = False) -> requests.Response:
+        """
+        Get a resource from the best available endpoint.
+
+        Parameters
+        ----------
+        path : str
+            Path (and query) of the resource, e.g. ``/docmeta/1234.56789``.
+        description : str
+            What is being retrieved, for logs and exceptions.
+        stream : bool
+            If ``True``, the body of the response is read as it is used, and
+            the caller should close the response.
+
+        Returns
+        -------
+        :class:`requests.Response`
+            The response, which may not have been successful (e.g. 404).
+
+        Raises
+        ------
+        :class:`.SecurityException`
+            If the SSL connection failed.
+        :class:`.ConnectionFailed`
+            If there was no response after all of the retries.
+        :class:`.RequestFailed`
+            If there was still a server error after all of the retries.
+
+        """
+        tried: Set[str] = set()
+        error: MetadataError = ConnectionFailed(description)
+        for attempt in range(self._retries + 1):
+            if len(tried) >= len(self._pool.endpoints):
+                time.sleep(min(10., self._backoff_factor * 2 ** (attempt - 1)))
+            endpoint = self._pool.pick(exclude=tried)
+            target = urljoin(endpoint.url, path)
+            logger.debug(f'{description}: retrieve metadata from {target}'
+                         f' with SSL verify {self._verify_cert}')
+            try:
+                with self._pool.request(endpoint):
+                    response = endpoint.session.get(
+                        target, verify=self._verify_cert,
+                        headers={'User-Agent': 'arXiv/system'},
+                        timeout=self._pool.timeout, stream=stream
+                    )
+                    if response.status_code >= 500:
+                        raise _failed(response, description)
+                return response
+            except requests.exceptions.SSLError as e:
+                logger.error('SSLError: %s', e)
+                raise SecurityException('SSL failed: %s' % e) from e
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                logger.warning(f'{description}: {endpoint.url} failed: {e}')
+                error = ConnectionFailed(
+                    'Could not connect to metadata service: %s' % e
+                )
+                error.__cause__ = e
+            except RequestFailed as e:
+                logger.warning(f'{description}: {endpoint.url} failed: {e}')
+                error = e
+            tried.add(endpoint.url)
+        logger.error(f'{description}: giving up after {self._retries + 1}'
+                     f' attempts: {error}')
+        raise error
 
     def retrieve(self, document_id: str) -> DocMeta:
         """
@@ -107,47 +555,18 @@ class DocMetaSession(object):
         if not document_id:    # This could use further elaboration.
             raise ValueError('Invalid value for document_id')
 
-        try:
-            target = urljoin(self.endpoint, '/docmeta/')
-            target = urljoin(target, document_id)
-            logger.debug(
-                f'{document_id}: retrieve metadata from {target} with SSL'
-                f' verify {self._verify_cert}'
-            )
-            response = requests.get(target, verify=self._verify_cert,
-                                    headers={'User-Agent': 'arXiv/system'})
-        except requests.exceptions.SSLError as e:
-            logger.error('SSLError: %s', e)
-            raise SecurityException('SSL failed: %s' % e) from e
-        except requests.exceptions.ConnectionError as e:
-            logger.error('ConnectionError: %s', e)
-            raise ConnectionFailed(
-                'Could not connect to metadata service: %s' % e
-            ) from e
-
-        if response.status_code not in \
-                [status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT]:
-            logger.error('Request failed: %s', response.content)
-            raise RequestFailed(
-                '%s: failed with %i: %s' % (
-                    document_id, response.status_code, response.content
-                )
-            )
-        logger.debug(f'{document_id}: response OK')
-        try:
-            data = DocMeta(**response.json())   # type: ignore
-            # See https://github.com/python/mypy/issues/3937
-        except json.decoder.JSONDecodeError as e:
-            logger.error('JSONDecodeError: %s', e)
-            raise BadResponse(
-                '%s: could not decode response: %s' % (document_id, e)
-            ) from e
-        logger.debug(f'{document_id}: response decoded; done!')
-        return data
+        cached, _ = self._lookup([document_id])
+        if cached:
+            return max(cached, key=lambda docmeta: docmeta.version)
+        response = self._get(f'/docmeta/{document_id}', document_id)
+        return self._decode(response, document_id)
 
     def bulk_retrieve(self, document_ids: List[str]) -> List[DocMeta]:
         """
-        Retrieve metadata for an arXiv paper.
+        Retrieve metadata for arXiv papers.
+
+        The papers are requested in chunks small enough for a URL, several
+        at a time (on different endpoints, if there is more than one).
 
         Parameters
         ----------
@@ -155,56 +574,276 @@ class DocMetaSession(object):
 
         Returns
         -------
-        dict
+        list
+            Metadata for each of the papers, in the order that they were
+            requested.
 
         Raises
         ------
         IOError
+            If any of the chunks failed, the error from the first one that
+            did. Its ``retrieved`` attribute has the metadata from the other
+            chunks, and its ``failed`` attribute has the IDs that were in
+            chunks that failed.
         ValueError
         """
         if not document_ids:    # This could use further elaboration.
             raise ValueError('Invalid value for document_ids')
 
+        data, missing = self._lookup(document_ids)
+        if missing:
+            try:
+                data += self._retrieve_chunks(self._chunk(missing))
+            except MetadataError as e:
+                e.retrieved = self._in_order(document_ids,
+                                             data + e.retrieved)
+                raise
+        return self._in_order(document_ids, data)
+
+    def _retrieve_chunks(self, chunks: List[List[str]]) -> List[DocMeta]:
+        """Retrieve chunks of papers, without letting one spoil the rest."""
+        def retrieve(chunk: List[str]) \
+                -> Tuple[List[DocMeta], Optional[MetadataError]]:
+            try:
+                return self._retrieve_chunk(chunk), None
+            except MetadataError as e:
+                return [], e
+
+        if len(chunks) == 1:
+            results = [retrieve(chunks[0])]
+        else:
+            logger.debug(f'Retrieving {len(chunks)} chunks of papers')
+            workers = min(self._concurrency, len(chunks))
+            with ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(retrieve, chunks))
+        return self._merge(chunks, results)
+
+    def _retrieve_chunk(self, document_ids: List[str]) -> List[DocMeta]:
+        """Retrieve metadata for papers in a single request."""
         query_string = '/docmeta_bulk?' + '&'.join(
             f'id={document_id}' for document_id in document_ids
         )
+        response = self._get(query_string, str(document_ids))
+        return self._decode_bulk(response, document_ids)
 
+    def iter_bulk_retrieve(self, document_ids: List[str]) \
+            -> Iterator[DocMeta]:
+        """
+        Retrieve metadata for arXiv papers, one paper at a time.
+
+        Like :meth:`bulk_retrieve`, except that the metadata for each paper
+        are decoded from the response as it is read, and generated as soon
+        as they are decoded. Only the metadata for the current paper (and a
+        buffer) are held in memory, however many papers are requested.
+
+        The chunks of the request are retrieved one after another. Papers
+        that are cached come first, and the rest are in the order that the
+        metadata service sends them.
+
+        Raises
+        ------
+        IOError
+            Once every chunk has been tried, if any of them failed, the error
+            from the first one that did. Its ``failed`` attribute has the IDs
+            in chunks that failed, some of which may have been generated
+            before the failure.
+        ValueError
+        """
+        if not document_ids:    # This could use further elaboration.
+            raise ValueError('Invalid value for document_ids')
+
+        cached, missing = self._lookup(document_ids)
+        yield from cached
+        failed: List[Tuple[List[str], MetadataError]] = []
+        for chunk in self._chunk(missing) if missing else []:
+            try:
+                yield from self._stream_chunk(chunk)
+            except MetadataError as e:
+                failed.append((chunk, e))
+        if failed:
+            _, error = failed[0]
+            error.failed = [document_id for chunk, _ in failed
+                            for document_id in chunk]
+            raise error
+
+    def _stream_chunk(self, document_ids: List[str]) -> Iterator[DocMeta]:
+        """Generate metadata for papers as a response is read."""
+        query_string = '/docmeta_bulk?' + '&'.join(
+            f'id={document_id}' for document_id in document_ids
+        )
+        response = self._get(query_string, str(document_ids), stream=True)
         try:
-            target = urljoin(self.endpoint, query_string)
-            logger.debug(
-                f'{document_ids}: retrieve metadata from {target} with SSL'
-                f' verify {self._verify_cert}'
-            )
-            response = self._session.get(target, verify=self._verify_cert)
-        except requests.exceptions.SSLError as e:
-            logger.error('SSLError: %s', e)
-            raise SecurityException('SSL failed: %s' % e) from e
-        except requests.exceptions.ConnectionError as e:
-            logger.error('ConnectionError: %s', e)
-            raise ConnectionFailed(
-                'Could not connect to metadata service: %s' % e
-            ) from e
+            if response.status_code not in \
+                    [status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT]:
+                logger.error('Request failed: %s', response.content)
+                raise _failed(response, str(document_ids))
+            versions: Dict[str, List[int]] = defaultdict(list)
+            try:
+                for value in _iter_array(
+                        response.iter_content(chunk_size=self.READ_SIZE)):
+                    docmeta = DocMeta(**value)     # type: ignore
+                    if self.cache is not None:
+                        docmeta = self.cache.put([docmeta])[0]
+                    versions[docmeta.paper_id].append(docmeta.version)
+                    yield docmeta
+            except ValueError as e:
+                logger.error('JSONDecodeError: %s', e)
+                raise BadResponse(
+                    '%s: could not decode response: %s' % (document_ids, e)
+                ) from e
+            except requests.exceptions.RequestException as e:
+                logger.error(f'{document_ids}: response interrupted: {e}')
+                raise ConnectionFailed(
+                    'Lost connection to metadata service: %s' % e
+                ) from e
+            if self.cache is not None:
+                for document_id in document_ids:
+                    if document_id in versions:     # i.e. versionless.
+                        self.cache.put_versions(document_id,
+                                                versions[document_id])
+        finally:
+            response.close()
+
+
+class AsyncDocMetaSession(_BaseDocMetaSession):
+    """
+    An asyncio session with the docmeta endpoint.
+
+    Has the same API as :class:`.DocMetaSession`, except that
+    :meth:`retrieve` and :meth:`bulk_retrieve` are coroutines, and that all of
+    the chunks of a bulk request are requested at once (up to the limits of
+    the client).
+    """
+
+    def __init__(self, *endpoints: str,
+                 client: Optional[aiohttp.ClientSession] = None,
+                 **kwargs: Any) -> None:
+        """
+        Initialize a session.
 
-        if response.status_code not in \
-                [status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT]:
-            logger.error('Request failed: %s', response.content)
-            raise RequestFailed(
-                '%s: failed with %i: %s' % (
-                    document_ids, response.status_code, response.content
+        Parameters
+        ----------
+        endpoints : str
+            One or more endpoints for metadata retrieval.
+        client : :class:`aiohttp.ClientSession`
+            Client for the requests (see :func:`.aio.connect`), which may be
+            shared with other sessions so that they share its limit on
+            requests in flight. If not set, the session opens its own client
+            (see :func:`.aio.get_client`) when it first needs one.
+        kwargs
+            See :class:`.DocMetaSession`.
+
+        """
+        super(AsyncDocMetaSession, self).__init__(*endpoints, **kwargs)
+        self.client = client
+        self._own_client = client is None
+
+    async def _client(self) -> aiohttp.ClientSession:
+        """Get the client, opening one if there is none yet."""
+        if self.client is None:
+            self.client = await aio.get_client()
+        return self.client
+
+    async def close(self) -> None:
+        """Close the client, if the session opened it."""
+        if self._own_client and self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def _get(self, path: str, description: str) -> aio.Response:
+        """Get a resource from the best available endpoint (see above)."""
+        tried: Set[str] = set()
+        error: MetadataError = ConnectionFailed(description)
+        for attempt in range(self._retries + 1):
+            if len(tried) >= len(self._pool.endpoints):
+                await asyncio.sleep(
+                    min(10., self._backoff_factor * 2 ** (attempt - 1))
                 )
-            )
-        logger.debug(f'{document_ids}: response OK')
+            for ejected in self._pool.due():
+                await self._probe(ejected)
+            endpoint = self._pool.pick(exclude=tried, probe=False)
+            target = urljoin(endpoint.url, path)
+            logger.debug(f'{description}: retrieve metadata from {target}'
+                         f' with SSL verify {self._verify_cert}')
+            try:
+                with self._pool.request(endpoint):
+                    response = await aio.get(
+                        await self._client(), target,
+                        verify=self._verify_cert,
+                        headers={'User-Agent': 'arXiv/system'},
+                        timeout=self._pool.timeout
+                    )
+                    if response.status_code >= 500:
+                        raise _failed(response, description)
+                return response
+            except aio.SSLError as e:
+                logger.error('SSLError: %s', e)
+                raise SecurityException('SSL failed: %s' % e) from e
+            except aio.ClientError as e:
+                logger.warning(f'{description}: {endpoint.url} failed: {e}')
+                error = ConnectionFailed(
+                    'Could not connect to metadata service: %s' % e
+                )
+                error.__cause__ = e
+            except RequestFailed as e:
+                logger.warning(f'{description}: {endpoint.url} failed: {e}')
+                error = e
+            tried.add(endpoint.url)
+        logger.error(f'{description}: giving up after {self._retries + 1}'
+                     f' attempts: {error}')
+        raise error
+
+    async def _probe(self, endpoint: Endpoint) -> bool:
+        """Check whether an ejected endpoint is responding again."""
         try:
-            resp = response.json()  # A list with metadata for each paper.
-            data: List[DocMeta]
-            data = [DocMeta(**value) for value in resp]     # type: ignore
-        except json.decoder.JSONDecodeError as e:
-            logger.error('JSONDecodeError: %s', e)
-            raise BadResponse(
-                '%s: could not decode response: %s' % (document_ids, e)
-            ) from e
-        logger.debug(f'{document_ids}: response decoded; done!')
-        return data
+            response = await aio.head(await self._client(), endpoint.url,
+                                      timeout=self._pool.timeout,
+                                      verify=self._verify_cert)
+        except aio.ClientError as e:
+            logger.debug(f'Probe of {endpoint.url} failed: {e}')
+            return False
+        return self._pool.restore(endpoint, response.status_code)
+
+    async def retrieve(self, document_id: str) -> DocMeta:
+        """Retrieve metadata for an arXiv paper."""
+        if not document_id:    # This could use further elaboration.
+            raise ValueError('Invalid value for document_id')
+
+        cached, _ = self._lookup([document_id])
+        if cached:
+            return max(cached, key=lambda docmeta: docmeta.version)
+        response = await self._get(f'/docmeta/{document_id}', document_id)
+        return self._decode(response, document_id)
+
+    async def bulk_retrieve(self, document_ids: List[str]) -> List[DocMeta]:
+        """Retrieve metadata for arXiv papers, in the order requested."""
+        if not document_ids:    # This could use further elaboration.
+            raise ValueError('Invalid value for document_ids')
+
+        data, missing = self._lookup(document_ids)
+        if missing:
+            chunks = self._chunk(missing)
+            results = await asyncio.gather(*[self._retrieve_chunk(chunk)
+                                             for chunk in chunks])
+            try:
+                data += self._merge(chunks, results)
+            except MetadataError as e:
+                e.retrieved = self._in_order(document_ids,
+                                             data + e.retrieved)
+                raise
+        return self._in_order(document_ids, data)
+
+    async def _retrieve_chunk(self, document_ids: List[str]) \
+            -> Tuple[List[DocMeta], Optional[MetadataError]]:
+        """Retrieve metadata for papers in a single request, or the error."""
+        query_string = '/docmeta_bulk?' + '&'.join(
+            f'id={document_id}' for document_id in document_ids
+        )
+        try:
+            response = await self._get(query_string, str(document_ids))
+            return self._decode_bulk(response, document_ids), None
+        except MetadataError as e:
+            return [], e
 
 
 def init_app(app: object = None) -> None:
@@ -214,14 +853,56 @@ def init_app(app: object = None) -> None:
     config.setdefault('METADATA_VERIFY_CERT', 'True')
 
 
-def get_session(app: object = None) -> DocMetaSession:
-    """Get a new session with the docmeta endpoint."""
+def _session_kwargs(app: object = None) -> Tuple[List[str], Dict[str, Any]]:
+    """Get the endpoints and other parameters for a session from config."""
     config = get_application_config(app)
     endpoint = config.get('METADATA_ENDPOINT', 'https://arxiv.org/')
     verify_cert = bool(eval(config.get('METADATA_VERIFY_CERT', 'True')))
-    if ',' in endpoint:
-        return DocMetaSession(*(endpoint.split(',')), verify_cert=verify_cert)
-    return DocMetaSession(endpoint, verify_cert=verify_cert)
+    cache = Cache(
+        max_items=int(config.get('METADATA_CACHE_SIZE', 10000)),
+        directory=config.get('METADATA_CACHE_DIR') or None,
+        max_bytes=int(config.get('METADATA_CACHE_MAX_MB', 1024)) * 2 ** 20
+    )
+    return endpoint.split(','), dict(
+        verify_cert=verify_cert,
+        pool_size=int(config.get('METADATA_POOL_SIZE', 10)),
+        retries=int(config.get('METADATA_RETRIES', 3)),
+        connect_timeout=float(config.get('METADATA_CONNECT_TIMEOUT', 3.05)),
+        read_timeout=float(config.get('METADATA_READ_TIMEOUT', 30)),
+        probe_interval=float(config.get('METADATA_PROBE_INTERVAL', 30)),
+        chunk_size=int(config.get('METADATA_BULK_CHUNK_SIZE', 50)),
+        max_url_length=int(config.get('METADATA_BULK_MAX_URL_LENGTH', 2000)),
+        concurrency=int(config.get('METADATA_BULK_CONCURRENCY', 4)),
+        cache=DocMetaCache(
+            cache, max_age=float(config.get('METADATA_CACHE_MAX_AGE', 0))
+        )
+    )
+
+
+def get_session(app: object = None) -> DocMetaSession:
+    """Get a new session with the docmeta endpoint."""
+    endpoints, kwargs = _session_kwargs(app)
+    return DocMetaSession(*endpoints, **kwargs)
+
+
+def get_async_session(app: object = None,
+                      client: Optional[aiohttp.ClientSession] = None) \
+        -> AsyncDocMetaSession:
+    """
+    Get a new asyncio session with the docmeta endpoint.
+
+    Parameters
+    ----------
+    app : :class:`flask.Flask`
+        Application with the configuration for the session.
+    client : :class:`aiohttp.ClientSession`
+        Client to share with other sessions (e.g. for fulltext), so that
+        they share its limits. If not set, the session opens one from the
+        config (see :func:`.aio.get_client`).
+
+    """
+    endpoints, kwargs = _session_kwargs(app)
+    return AsyncDocMetaSession(*endpoints, client=client, **kwargs)
 
 
 def current_session() -> DocMetaSession:
@@ -244,3 +925,9 @@ def retrieve(document_id: str) -> DocMeta:
 def bulk_retrieve(document_ids: List[str]) -> List[DocMeta]:
     """Retrieve an arxiv document by id."""
     return current_session().bulk_retrieve(document_ids)
+
+
+@wraps(DocMetaSession.iter_bulk_retrieve)
+def iter_bulk_retrieve(document_ids: List[str]) -> Iterator[DocMeta]:
+    """Retrieve arxiv documents by id, one at a time."""
+    return current_session().iter_bulk_retrieve(document_ids)
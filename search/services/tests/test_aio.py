@@ -0,0 +1,228 @@
+"""Tests for :mod:`search.services.aio`, against local stub servers."""
+
+import asyncio
+import json
+from unittest import TestCase, mock
+from urllib.parse import parse_qs, urlsplit
+
+from search.services import aio, fulltext, metadata
+
+
+class StubServer:
+    """An HTTP server on a local port, with canned responses."""
+
+    def __init__(self, respond, keep_alive=True, delay=0.):
+        """Respond to each request with ``respond(target)``."""
+        self.respond = respond
+        self.keep_alive = keep_alive
+        self.delay = delay
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def start(self):
+        """Start listening; get the base URL of the server."""
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}/'
+
+    def stop(self):
+        """Stop listening."""
+        self.server.close()
+
+    async def handle(self, reader, writer):
+        """Respond to requests on a connection, until it is closed."""
+        self.connections += 1
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(self.delay)
+            self.in_flight -= 1
+            method, target, _ = request_line.decode('latin-1').split()
+            response = self.respond(target)
+            if method == 'HEAD':    # Headers only.
+                response = response.split(b'\r\n\r\n')[0] + b'\r\n\r\n'
+            if not self.keep_alive:
+                response = response.replace(b'\r\n',
+                                            b'\r\nConnection: close\r\n', 1)
+            writer.write(response)
+            await writer.drain()
+            if not self.keep_alive:
+                break
+        writer.close()
+
+
+def _response(body, status='200 OK', **headers):
+    if 'Transfer_Encoding' not in headers:
+        headers['Content_Length'] = str(len(body))
+    return (f'HTTP/1.1 {status}\r\n'
+            + ''.join(f'{name.replace("_", "-")}: {value}\r\n'
+                      for name, value in headers.items())
+            + '\r\n').encode('latin-1') + body
+
+
+def _run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class TestRequest(TestCase):
+    """:func:`.aio.request` sends requests over pooled connections."""
+
+    def test_keep_alive(self):
+        """Connections are reused, and the body can be chunked."""
+        def respond(target):
+            if target == '/chunked':
+                return _response(b'5\r\n{"a":\r\n3\r\n 1}\r\n0\r\n\r\n',
+                                 Transfer_Encoding='chunked')
+            return _response(b'{"target": "%s"}' % target.encode('ascii'))
+
+        async def go():
+            stub = StubServer(respond)
+            base = await stub.start()
+            client = await aio.connect()
+            first = await aio.get(client, f'{base}one?x=1')
+            second = await aio.get(client, f'{base}chunked')
+            head = await aio.head(client, base)
+            await client.close()
+            stub.stop()
+            return stub, first, second, head
+
+        stub, first, second, head = _run(go())
+        self.assertEqual(first.json(), {'target': '/one?x=1'})
+        self.assertEqual(second.json(), {'a': 1})
+        self.assertEqual(head.content, b'')
+        self.assertEqual(first.headers.get('content-length'), '22')
+        self.assertEqual(stub.connections, 1)
+
+    def test_closed(self):
+        """A server that closes connections gets a new one each time."""
+        async def go():
+            stub = StubServer(lambda target: _response(b'{}'),
+                              keep_alive=False)
+            base = await stub.start()
+            client = await aio.connect()
+            for _ in range(3):
+                response = await aio.get(client, base)
+                self.assertEqual(response.status_code, 200)
+            await client.close()
+            stub.stop()
+            return stub
+
+        self.assertEqual(_run(go()).connections, 3)
+
+    def test_limit(self):
+        """Requests wait for a connection when the limit is reached."""
+        async def go():
+            stub = StubServer(lambda target: _response(b'{}'), delay=.01)
+            base = await stub.start()
+            client = await aio.connect(limit=3)
+            await asyncio.gather(*[aio.get(client, base) for _ in range(20)])
+            await client.close()
+            stub.stop()
+            return stub
+
+        stub = _run(go())
+        self.assertEqual(stub.max_in_flight, 3)
+        self.assertEqual(stub.connections, 3)
+
+    def test_no_connection(self):
+        """A failure to connect is a :class:`.aio.ClientError`."""
+        async def go():
+            stub = StubServer(None)
+            base = await stub.start()
+            stub.stop()
+            await stub.server.wait_closed()
+            client = await aio.connect()
+            try:
+                await aio.get(client, base)
+            finally:
+                await client.close()
+
+        with self.assertRaises(aio.ClientError):
+            _run(go())
+
+    def test_timeout(self):
+        """A slow response is a :class:`.aio.Timeout`."""
+        async def go():
+            stub = StubServer(lambda target: _response(b'{}'), delay=1)
+            base = await stub.start()
+            client = await aio.connect()
+            try:
+                await aio.get(client, base, timeout=(1, .01))
+            finally:
+                await client.close()
+                stub.stop()
+
+        with self.assertRaises(aio.Timeout):
+            _run(go())
+
+
+class TestAsyncSessions(TestCase):
+    """The asyncio sessions have the same API as the synchronous ones."""
+
+    @staticmethod
+    def _docmeta(target):
+        parts = urlsplit(target)
+        if parts.path == '/docmeta_bulk':
+            ids = parse_qs(parts.query)['id']
+            if '0000.00000' in ids:
+                return _response(b'oops', status='500 Internal Server Error')
+            body = [{'paper_id': paper_id} for paper_id in ids]
+        elif parts.path.startswith('/fulltext/'):
+            body = {'content': 'Some text', 'version': '0.3',
+                    'created': '2017-08-30T08:24:58.525923'}
+        else:
+            body = {'paper_id': parts.path.split('/')[-1]}
+        return _response(json.dumps(body).encode('utf-8'))
+
+    @mock.patch('search.services.metadata.asyncio.sleep')
+    def test_metadata(self, mock_sleep):
+        """Chunks are requested at once, and fail over between endpoints."""
+        async def no_wait(seconds):
+            pass
+        mock_sleep.side_effect = no_wait
+
+        async def go():
+            stub = StubServer(self._docmeta)
+            base = await stub.start()
+            down = StubServer(None)
+            down_base = await down.start()
+            down.stop()
+            await down.server.wait_closed()
+
+            client = await aio.connect(limit=10)
+            session = metadata.AsyncDocMetaSession(base, down_base,
+                                                   client=client, chunk_size=2)
+            paper_ids = [f'1234.{i:05}' for i in range(7)]
+            docmeta = await session.bulk_retrieve(paper_ids)
+            self.assertEqual([d.paper_id for d in docmeta], paper_ids)
+            one = await session.retrieve('1234.56789v2')
+            self.assertEqual(one.paper_id, '1234.56789v2')
+
+            with self.assertRaises(metadata.RequestFailed) as context:
+                await session.bulk_retrieve(['1234.00001', '0000.00000',
+                                             '1234.00002'])
+            self.assertEqual(context.exception.failed,
+                             ['1234.00001', '0000.00000'])
+            self.assertEqual(
+                [d.paper_id for d in context.exception.retrieved],
+                ['1234.00002']
+            )
+
+            text = await fulltext.AsyncFulltextSession(
+                f'{base}fulltext', client=client
+            ).retrieve('1234.56789v2')
+            self.assertEqual(text.content, 'Some text')
+            await client.close()
+            stub.stop()
+            return stub, session
+
+        stub, session = _run(go())
+        self.assertFalse(session._pool.endpoints[1].healthy,
+                         'The endpoint that is down was ejected')
+        self.assertLessEqual(stub.connections, 10)
@@ -0,0 +1,73 @@
+"""Tests for :mod:`search.services.cache`."""
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from search.services.cache import Cache
+
+
+class TestMemory(TestCase):
+    """Entries are kept in memory, up to a limit."""
+
+    def test_lru(self):
+        """The least recently used entry is evicted first."""
+        cache = Cache(max_items=2)
+        cache.put('a', {'n': 1})
+        cache.put('b', {'n': 2})
+        self.assertEqual(cache.get('a'), {'n': 1})
+        cache.put('c', {'n': 3})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'n': 1})
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats['memory_hits'], 2)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertIn('3 lookups, 67% hits', cache.summary())
+
+
+class TestDisk(TestCase):
+    """Entries are kept on disk, up to a size."""
+
+    def setUp(self):
+        """Create a directory for the cache."""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the cache."""
+        shutil.rmtree(self.directory)
+
+    def test_shared(self):
+        """Entries on disk survive the process, and are promoted to memory."""
+        Cache(directory=self.directory).put('hep-th/9901001v2', {'n': 1})
+        cache = Cache(directory=self.directory)
+        self.assertEqual(cache.get('hep-th/9901001v2'), {'n': 1})
+        self.assertEqual(cache.get('hep-th/9901001v2'), {'n': 1})
+        self.assertEqual(cache.stats['disk_hits'], 1)
+        self.assertEqual(cache.stats['memory_hits'], 1)
+
+    def test_unreadable(self):
+        """An entry that cannot be read is a miss, and is removed."""
+        cache = Cache(directory=self.directory)
+        cache.put('a', {'n': 1})
+        path = cache._path('a')
+        with open(path, 'w') as f:
+            f.write('{"n": ')
+        self.assertIsNone(Cache(directory=self.directory).get('a'))
+        self.assertFalse(os.path.exists(path))
+
+    def test_evict(self):
+        """The least recently used files are removed when the store is full."""
+        cache = Cache(max_items=0, directory=self.directory, max_bytes=100)
+        past = time.time() - 100
+        for key in ('a', 'b', 'c'):
+            cache.put(key, {'value': 'x' * 20})    # About 30 bytes each.
+            os.utime(cache._path(key), (past, past))
+        self.assertIsNotNone(cache.get('a'))    # Now the most recently used.
+        cache.put('d', {'value': 'x' * 20})
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('d'))
+        self.assertEqual(cache.stats['evictions'], 2)
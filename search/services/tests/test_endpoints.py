@@ -0,0 +1,101 @@
+"""Tests for :mod:`search.services.endpoints`."""
+
+from unittest import TestCase, mock
+
+import requests
+
+from search.services import metadata
+from search.services.endpoints import EndpointPool
+
+
+class TestEndpointPool(TestCase):
+    """:class:`.EndpointPool` picks endpoints by latency and health."""
+
+    def setUp(self):
+        """Create a pool with two endpoints."""
+        self.pool = EndpointPool(['http://one', 'http://two/'], pool_size=4,
+                                 max_failures=2, probe_interval=60)
+        self.one, self.two = self.pool.endpoints
+
+    def _fail(self, endpoint):
+        with self.assertRaises(IOError):
+            with self.pool.request(endpoint):
+                raise IOError('nope')
+
+    def test_pools(self):
+        """Each endpoint has its own pool of connections."""
+        self.assertEqual(self.one.url, 'http://one/')
+        self.assertIsNot(self.one.session, self.two.session)
+        for scheme in ('http://', 'https://'):
+            adapter = self.one.session.get_adapter(f'{scheme}one/')
+            self.assertEqual(adapter._pool_maxsize, 4)
+
+    def test_pick_by_latency(self):
+        """Requests go where they are likely to be answered soonest."""
+        self.one.latency, self.two.latency = .2, .1
+        self.assertIs(self.pool.pick(), self.two)
+        self.two.in_flight = 2
+        self.assertIs(self.pool.pick(), self.one)
+        self.assertIs(self.pool.pick(exclude={self.one.url}), self.two)
+
+    def test_eject_and_probe(self):
+        """An endpoint that keeps failing is ejected until a probe works."""
+        self._fail(self.one)
+        self.assertTrue(self.one.healthy)
+        self._fail(self.one)
+        self.assertFalse(self.one.healthy)
+        self.assertIs(self.pool.pick(), self.two)
+
+        self.one.ejected_until = 0      # Time for a probe.
+        with mock.patch.object(self.one.session, 'head') as mock_head:
+            mock_head.return_value = mock.MagicMock(status_code=503)
+            self.pool.pick()
+            self.assertFalse(self.one.healthy)
+            self.assertEqual(mock_head.call_count, 1)
+            self.pool.pick()
+            self.assertEqual(mock_head.call_count, 1, 'Not due yet')
+
+            self.one.ejected_until = 0
+            mock_head.return_value = mock.MagicMock(status_code=200)
+            self.pool.pick()
+            self.assertTrue(self.one.healthy)
+
+    def test_last_endpoint_is_not_ejected(self):
+        """There is always an endpoint in service."""
+        for _ in range(2):
+            self._fail(self.one)
+        for _ in range(5):
+            self._fail(self.two)
+        self.assertTrue(self.two.healthy)
+        self.assertIs(self.pool.pick(), self.two)
+
+
+class TestFailover(TestCase):
+    """:class:`.DocMetaSession` retries requests on another endpoint."""
+
+    @mock.patch('requests.Session.get')
+    def test_failover(self, mock_get):
+        """A request that gets no response goes to the next endpoint."""
+        response = mock.MagicMock(status_code=200)
+        response.json.return_value = []
+        mock_get.side_effect = [requests.exceptions.ConnectionError('nope'),
+                                response]
+        session = metadata.DocMetaSession('http://one', 'http://two',
+                                          connect_timeout=1, read_timeout=5)
+        self.assertEqual(session.bulk_retrieve(['1234.56789']), [])
+        targets = [call[0][0] for call in mock_get.call_args_list]
+        self.assertEqual(targets, ['http://one/docmeta_bulk?id=1234.56789',
+                                   'http://two/docmeta_bulk?id=1234.56789'])
+        self.assertEqual(mock_get.call_args[1]['timeout'], (1, 5))
+
+    @mock.patch('search.services.metadata.time.sleep')
+    @mock.patch('requests.Session.get')
+    def test_give_up(self, mock_get, mock_sleep):
+        """Requests are retried with backoff, and then fail."""
+        mock_get.side_effect = requests.exceptions.ReadTimeout('slow')
+        session = metadata.DocMetaSession('http://one', retries=2)
+        with self.assertRaises(metadata.ConnectionFailed):
+            session.retrieve('1234.56789')
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual([call[0][0] for call in mock_sleep.call_args_list],
+                         [.5, 1.])
@@ -1,14 +1,17 @@
 """Tests for :mod:`search.services.fulltext`."""
 
+import shutil
+import tempfile
 import unittest
 from unittest import mock
 from search.services import fulltext
+from search.services.cache import Cache
 
 
 class TestRetrieveExistantContent(unittest.TestCase):
     """Fulltext content is available for a paper."""
 
-    @mock.patch('search.services.fulltext.requests.get')
+    @mock.patch('requests.Session.get')
     def test_calls_fulltext_endpoint(self, mock_get):
         """:func:`.fulltext.retrieve` calls passed endpoint with GET."""
         base = 'https://asdf.com/'
@@ -35,7 +38,7 @@ class TestRetrieveExistantContent(unittest.TestCase):
 class TestRetrieveNonexistantRecord(unittest.TestCase):
     """Fulltext content is not available for a paper."""
 
-    @mock.patch('search.services.fulltext.requests.get')
+    @mock.patch('requests.Session.get')
     def test_raise_ioerror_on_404(self, mock_get):
         """:func:`.fulltext.retrieve` raises IOError when text unvailable."""
         response = mock.MagicMock()
@@ -45,7 +48,7 @@ class TestRetrieveNonexistantRecord(unittest.TestCase):
         with self.assertRaises(IOError):
             fulltext.retrieve('1234.5678v3')
 
-    @mock.patch('search.services.fulltext.requests.get')
+    @mock.patch('requests.Session.get')
     def test_raise_ioerror_on_503(self, mock_get):
         """:func:`.fulltext.retrieve` raises IOError when text unvailable."""
         response = mock.MagicMock()
@@ -55,7 +58,7 @@ class TestRetrieveNonexistantRecord(unittest.TestCase):
         with self.assertRaises(IOError):
             fulltext.retrieve('1234.5678v3')
 
-    @mock.patch('search.services.fulltext.requests.get')
+    @mock.patch('requests.Session.get')
     def test_raise_ioerror_on_sslerror(self, mock_get):
         """:func:`.fulltext.retrieve` raises IOError when SSL fails."""
         from requests.exceptions import SSLError
@@ -72,7 +75,7 @@ class TestRetrieveNonexistantRecord(unittest.TestCase):
 class TestRetrieveMalformedRecord(unittest.TestCase):
     """Fulltext endpoint returns non-JSON response."""
 
-    @mock.patch('search.services.fulltext.requests.get')
+    @mock.patch('requests.Session.get')
     def test_response_is_not_json(self, mock_get):
         """:func:`.fulltext.retrieve` raises IOError when not valid JSON."""
         from json.decoder import JSONDecodeError
@@ -88,3 +91,72 @@ class TestRetrieveMalformedRecord(unittest.TestCase):
         mock_get.return_value = response
         with self.assertRaises(IOError):
             fulltext.retrieve('1234.5678v3')
+
+
+class TestConditionalRetrieve(unittest.TestCase):
+    """Cached fulltext is only downloaded again if it has changed."""
+
+    def setUp(self):
+        """Create a session with a cache on disk."""
+        self.directory = tempfile.mkdtemp()
+        self.data = {'content': 'The whole story', 'version': '0.3',
+                     'created': '2017-08-30T08:24:58.525923'}
+
+    def tearDown(self):
+        """Remove the cache."""
+        shutil.rmtree(self.directory)
+
+    def _session(self, **kwargs):
+        return fulltext.FulltextSession(
+            'https://asdf.com/', cache=Cache(directory=self.directory),
+            **kwargs
+        )
+
+    def _respond(self, status_code, **headers):
+        response = mock.MagicMock(status_code=status_code, headers=headers)
+        response.json.side_effect = lambda: dict(self.data)
+        return response
+
+    @mock.patch('requests.Session.get')
+    def test_etag(self, mock_get):
+        """The ETag of the response is used to revalidate it."""
+        mock_get.return_value = self._respond(200, etag='"abc"')
+        self._session().retrieve('1234.56789v2')
+
+        mock_get.return_value = self._respond(304)
+        session = self._session()   # e.g. the next run of bulk_index.py.
+        text = session.retrieve('1234.56789v2')
+        self.assertEqual(text.content, 'The whole story')
+        headers = mock_get.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"abc"')
+        self.assertEqual(headers['If-Modified-Since'],
+                         'Wed, 30 Aug 2017 08:24:58 GMT',
+                         'Falls back to the date of the extraction')
+        self.assertEqual(session.stats['not_modified'], 1)
+
+    @mock.patch('requests.Session.get')
+    def test_changed(self, mock_get):
+        """Fulltext that has changed is downloaded again."""
+        mock_get.return_value = self._respond(
+            200, **{'last-modified': 'Thu, 31 Aug 2017 00:00:00 GMT'}
+        )
+        session = self._session()
+        session.retrieve('1234.56789v2')
+        self.data['content'] = 'A new story'
+        self.assertEqual(session.retrieve('1234.56789v2').content,
+                         'A new story')
+        self.assertEqual(
+            mock_get.call_args[1]['headers']['If-Modified-Since'],
+            'Thu, 31 Aug 2017 00:00:00 GMT'
+        )
+        self.assertEqual(session.stats['downloaded'], 2)
+
+    @mock.patch('requests.Session.get')
+    def test_max_age(self, mock_get):
+        """Fulltext is used without checking, for a while."""
+        mock_get.return_value = self._respond(200)
+        session = self._session(max_age=60)
+        session.retrieve('1234.56789v2')
+        session.retrieve('1234.56789v2')
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(session.stats['cached'], 1)
@@ -2,18 +2,22 @@
 
 import unittest
 from unittest import mock
+import copy
 import json
 import os
+import shutil
+import tempfile
 from itertools import cycle
 
 from search.services import metadata
+from search.services.cache import Cache
 from search.factory import create_ui_web_app
 
 
 class TestRetrieveExistantMetadata(unittest.TestCase):
     """Metadata is available for a paper."""
 
-    @mock.patch('search.services.metadata.requests.get')
+    @mock.patch('requests.Session.get')
     def test_calls_metadata_endpoint(self, mock_get):
         """:func:`.metadata.retrieve` calls passed endpoint with GET."""
         base = 'https://asdf.com/'
@@ -39,11 +43,11 @@ class TestRetrieveExistantMetadata(unittest.TestCase):
             try:
                 args, _ = mock_get.call_args
             except Exception as e:
-                self.fail('Did not call requests.get as expected: %s' % e)
+                self.fail('Did not call the endpoint as expected: %s' % e)
 
         self.assertTrue(args[0].startswith(base))
 
-    @mock.patch('search.services.metadata.requests.get')
+    @mock.patch('requests.Session.get')
     def test_calls_metadata_endpoint_roundrobin(self, mock_get):
         """:func:`.metadata.retrieve` calls passed endpoint with GET."""
         base = ['https://asdf.com/', 'https://asdf2.com/']
@@ -69,7 +73,7 @@ class TestRetrieveExistantMetadata(unittest.TestCase):
             try:
                 args, _ = mock_get.call_args
             except Exception as e:
-                self.fail('Did not call requests.get as expected: %s' % e)
+                self.fail('Did not call the endpoint as expected: %s' % e)
             self.assertTrue(
                 args[0].startswith(base[0]), "Expected call to %s" % base[0]
             )
@@ -81,7 +85,7 @@ class TestRetrieveExistantMetadata(unittest.TestCase):
             try:
                 args, _ = mock_get.call_args
             except Exception as e:
-                self.fail('Did not call requests.get as expected: %s' % e)
+                self.fail('Did not call the endpoint as expected: %s' % e)
             self.assertTrue(
                 args[0].startswith(base[1]), "Expected call to %s" % base[1]
             )
@@ -90,7 +94,7 @@ class TestRetrieveExistantMetadata(unittest.TestCase):
 class TestRetrieveNonexistantRecord(unittest.TestCase):
     """Metadata is not available for a paper."""
 
-    @mock.patch('search.services.metadata.requests.get')
+    @mock.patch('requests.Session.get')
     def test_raise_ioerror_on_404(self, mock_get):
         """:func:`.metadata.retrieve` raises IOError when unvailable."""
         response = mock.MagicMock()
@@ -100,8 +104,9 @@ class TestRetrieveNonexistantRecord(unittest.TestCase):
         with self.assertRaises(IOError):
             metadata.retrieve('1234.5678v3')
 
-    @mock.patch('search.services.metadata.requests.get')
-    def test_raise_ioerror_on_503(self, mock_get):
+    @mock.patch('search.services.metadata.time.sleep')
+    @mock.patch('requests.Session.get')
+    def test_raise_ioerror_on_503(self, mock_get, mock_sleep):
         """:func:`.metadata.retrieve` raises IOError when unvailable."""
         response = mock.MagicMock()
         type(response).json = mock.MagicMock(return_value=None)
@@ -109,8 +114,9 @@ class TestRetrieveNonexistantRecord(unittest.TestCase):
         mock_get.return_value = response
         with self.assertRaises(IOError):
             metadata.retrieve('1234.5678v3')
+        self.assertEqual(mock_get.call_count, 4, 'Server errors are retried')
 
-    @mock.patch('search.services.metadata.requests.get')
+    @mock.patch('requests.Session.get')
     def test_raise_ioerror_on_sslerror(self, mock_get):
         """:func:`.metadata.retrieve` raises IOError when SSL fails."""
         from requests.exceptions import SSLError
@@ -127,7 +133,7 @@ class TestRetrieveNonexistantRecord(unittest.TestCase):
 class TestRetrieveMalformedRecord(unittest.TestCase):
     """Metadata endpoint returns non-JSON response."""
 
-    @mock.patch('search.services.metadata.requests.get')
+    @mock.patch('requests.Session.get')
     def test_response_is_not_json(self, mock_get):
         """:func:`.metadata.retrieve` raises IOError when not valid JSON."""
         from json.decoder import JSONDecodeError
@@ -143,3 +149,214 @@ class TestRetrieveMalformedRecord(unittest.TestCase):
         mock_get.return_value = response
         with self.assertRaises(IOError):
             metadata.retrieve('1234.5678v3')
+
+
+class TestCachedMetadata(unittest.TestCase):
+    """Metadata are cached by paper ID and version."""
+
+    def setUp(self):
+        """Create a session with a cache, and a bulk response."""
+        self.directory = tempfile.mkdtemp()
+        self.session = metadata.DocMetaSession(
+            'https://asdf.com/',
+            cache=metadata.DocMetaCache(Cache(directory=self.directory),
+                                        max_age=60)
+        )
+        with open('tests/data/docmeta_bulk.json') as f:
+            self.content = json.load(f)     # Versions 1 and 2 of 1601.00123.
+        self.response = mock.MagicMock(status_code=200)
+        self.response.json.side_effect = lambda: copy.deepcopy(self.content)
+
+    def tearDown(self):
+        """Remove the cache."""
+        shutil.rmtree(self.directory)
+
+    @mock.patch('requests.Session.get')
+    def test_bulk_retrieve(self, mock_get):
+        """Papers that are cached are not requested again."""
+        mock_get.return_value = self.response
+        self.session.bulk_retrieve(['1601.00123'])
+        self.session.bulk_retrieve(['1601.00123', '1601.00456'])
+        self.assertEqual(mock_get.call_args[0][0],
+                         'https://asdf.com/docmeta_bulk?id=1601.00456')
+
+        mock_get.reset_mock()
+        self.session.cache.max_age = 0
+        docmeta = self.session.retrieve('1601.00123v1')
+        self.assertEqual(docmeta.version, 1)
+        self.assertEqual(mock_get.call_count, 0,
+                         'Superseded versions are cached for good')
+        self.session.bulk_retrieve(['1601.00123'])
+        self.assertEqual(mock_get.call_count, 1,
+                         'Current versions are not used after max_age')
+
+    @mock.patch('requests.Session.get')
+    def test_shared_on_disk(self, mock_get):
+        """Another session with the same cache directory uses the metadata."""
+        mock_get.return_value = self.response
+        self.session.bulk_retrieve(['1601.00123'])
+        session = metadata.DocMetaSession(
+            'https://asdf.com/',
+            cache=metadata.DocMetaCache(Cache(directory=self.directory),
+                                        max_age=60)
+        )
+        docmeta = session.bulk_retrieve(['1601.00123'])
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual([d.version for d in docmeta], [1, 2])
+        self.assertEqual(session.cache.cache.stats['disk_hits'], 3)
+
+    @mock.patch('requests.Session.get')
+    def test_outdated(self, mock_get):
+        """Metadata that were modified less recently don't replace others."""
+        mock_get.return_value = self.response
+        self.session.cache.max_age = 0
+        self.session.bulk_retrieve(['1601.00123'])
+        current = self.content[1]
+        current['title'] = 'An older title'
+        current['modified_date'] = '2000-01-01T00:00:00-0500'
+        docmeta = self.session.bulk_retrieve(['1601.00123'])
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertNotEqual(docmeta[1].title, 'An older title')
+        self.assertEqual(self.session.cache.cache.stats['outdated'], 1)
+
+        current['title'] = 'A newer title'
+        current['modified_date'] = '2030-01-01T00:00:00-0500'
+        docmeta = self.session.bulk_retrieve(['1601.00123'])
+        self.assertEqual(docmeta[1].title, 'A newer title')
+
+
+class TestChunkedBulkRetrieve(unittest.TestCase):
+    """Large lists of papers are requested in chunks."""
+
+    def setUp(self):
+        """Create a session that sends small chunks."""
+        self.session = metadata.DocMetaSession(
+            'https://asdf.com/', 'https://qwer.com/', chunk_size=3,
+            max_url_length=80, concurrency=2
+        )
+
+    @staticmethod
+    def _respond(url, **kwargs):
+        """Return metadata for each ID in the bulk request."""
+        paper_ids = [param[3:] for param in url.split('?')[1].split('&')]
+        if '0000.00004' in paper_ids:
+            return mock.MagicMock(status_code=500, content=b'oops')
+        response = mock.MagicMock(status_code=200)
+        response.json.return_value = [
+            {'paper_id': paper_id} for paper_id in reversed(paper_ids)
+        ]
+        return response
+
+    def test_chunks(self):
+        """IDs are split by number, and by the length of the URL."""
+        self.assertEqual(self.session._chunk(['1', '2', '3', '4']),
+                         [['1', '2', '3'], ['4']])
+        long_ids = [f'hep-th/99010{i:02}v1' for i in range(4)]
+        self.assertEqual(self.session._chunk(long_ids),
+                         [long_ids[:2], long_ids[2:]],
+                         'Each URL is within 80 characters')
+
+    @mock.patch('requests.Session.get')
+    def test_in_order(self, mock_get):
+        """Chunks are requested separately, and the results are in order."""
+        mock_get.side_effect = self._respond
+        paper_ids = [f'1234.{i:05}' for i in range(7)]
+        docmeta = self.session.bulk_retrieve(paper_ids)
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual([d.paper_id for d in docmeta], paper_ids)
+
+    @mock.patch('search.services.metadata.time.sleep')
+    @mock.patch('requests.Session.get')
+    def test_chunk_fails(self, mock_get, mock_sleep):
+        """A chunk that fails does not spoil the others."""
+        mock_get.side_effect = self._respond
+        paper_ids = [f'0000.{i:05}' for i in range(7)]
+        with self.assertRaises(metadata.RequestFailed) as context:
+            self.session.bulk_retrieve(paper_ids)
+        self.assertEqual(context.exception.failed, paper_ids[3:6])
+        self.assertEqual([d.paper_id for d in context.exception.retrieved],
+                         paper_ids[:3] + paper_ids[6:])
+
+    def test_errors_do_not_share_lists(self):
+        """Each error has its own lists of retrieved and failed papers."""
+        first = metadata.ConnectionFailed('oops')
+        first.failed.append('1234.00001')
+        first.retrieved.append(metadata.DocMeta(paper_id='1234.00002'))
+        second = metadata.RequestFailed('oops', status_code=500)
+        self.assertEqual(second.failed, [])
+        self.assertEqual(second.retrieved, [])
+
+
+class TestStreamingBulkRetrieve(unittest.TestCase):
+    """Metadata can be decoded from a bulk response as it is read."""
+
+    @staticmethod
+    def _pieces(data, size):
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def test_iter_array(self):
+        """Elements are decoded however the array is split up."""
+        values = [{'paper_id': '1234.56789', 'title': 'Ünïcödé'}, [1, 2],
+                  'text', 12345, None]
+        data = json.dumps(values, ensure_ascii=False).encode('utf-8')
+        for size in (1, 2, 7, len(data)):
+            self.assertEqual(
+                list(metadata._iter_array(self._pieces(data, size))), values
+            )
+        self.assertEqual(list(metadata._iter_array([b' [ ] '])), [])
+
+    def test_iter_array_invalid(self):
+        """Anything but a complete JSON array is a ValueError."""
+        for data in (b'{"paper_id": "1"}', b'[{"paper_id": "1"}',
+                     b'[1 2]', b'[1] 2', b'[{"paper_id": }]', b''):
+            with self.assertRaises(ValueError):
+                list(metadata._iter_array(self._pieces(data, 3)))
+
+    @staticmethod
+    def _respond(url, **kwargs):
+        """Stream metadata for each ID in the bulk request."""
+        paper_ids = [param[3:] for param in url.split('?')[1].split('&')]
+        if '0000.00004' in paper_ids:
+            return mock.MagicMock(status_code=500, content=b'oops')
+        data = json.dumps([{'paper_id': paper_id, 'version': 1}
+                           for paper_id in paper_ids]).encode('utf-8')
+        response = mock.MagicMock(status_code=200)
+        response.iter_content.return_value = iter(
+            TestStreamingBulkRetrieve._pieces(data, 10)
+        )
+        response.json.side_effect = AssertionError('Not streamed')
+        return response
+
+    @mock.patch('requests.Session.get')
+    def test_iter_bulk_retrieve(self, mock_get):
+        """Metadata are generated as each chunk is read, then cached."""
+        mock_get.side_effect = self._respond
+        session = metadata.DocMetaSession(
+            'https://asdf.com/', chunk_size=3,
+            cache=metadata.DocMetaCache(Cache(), max_age=60)
+        )
+        paper_ids = [f'1234.{i:05}' for i in range(7)]
+        docmeta = session.iter_bulk_retrieve(paper_ids)
+        self.assertEqual(next(docmeta).paper_id, paper_ids[0])
+        self.assertEqual(mock_get.call_count, 1, 'Only the first chunk')
+        self.assertTrue(mock_get.call_args[1]['stream'])
+        self.assertEqual([d.paper_id for d in docmeta], paper_ids[1:])
+        self.assertEqual(mock_get.call_count, 3)
+
+        docmeta = list(session.iter_bulk_retrieve(paper_ids[:2]))
+        self.assertEqual([d.paper_id for d in docmeta], paper_ids[:2])
+        self.assertEqual(mock_get.call_count, 3, 'Cached')
+
+    @mock.patch('search.services.metadata.time.sleep')
+    @mock.patch('requests.Session.get')
+    def test_chunk_fails(self, mock_get, mock_sleep):
+        """The other chunks are generated before the failure is raised."""
+        mock_get.side_effect = self._respond
+        session = metadata.DocMetaSession('https://asdf.com/', chunk_size=3)
+        paper_ids = [f'0000.{i:05}' for i in range(7)]
+        retrieved = []
+        with self.assertRaises(metadata.RequestFailed) as context:
+            for docmeta in session.iter_bulk_retrieve(paper_ids):
+                retrieved.append(docmeta.paper_id)
+        self.assertEqual(context.exception.failed, paper_ids[3:6])
+        self.assertEqual(retrieved, paper_ids[:3] + paper_ids[6:])
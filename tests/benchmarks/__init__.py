@@ -0,0 +1,6 @@
+"""
+Benchmarks for performance-sensitive parts of the search service.
+
+These are not run as part of the test suite. Run them individually, e.g.
+``python -m tests.benchmarks.bench_serialization``.
+"""
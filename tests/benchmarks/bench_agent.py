@@ -0,0 +1,221 @@
+"""
+Measure the end-to-end throughput and latency of the indexing agent, offline.
+
+Replays ``MetadataIsAvailable`` records from a local file (see
+:mod:`search.agent.stream`) through :class:`.MetadataRecordProcessor`, which
+retrieves metadata from the docmeta stub (``tests/stubs/docmeta.py``, with
+metadata generated from ``tests/data/docmeta_bulk.json``) and indexes the
+documents in the Elasticsearch stub (``tests/stubs/index.py``). Both stubs
+are served over HTTP on local ports, so the clients do the same work as they
+would against the real services.
+
+Latency is measured for each record, from its arrival on the stream until the
+agent has finished processing the batch that contains it. Set ``LOGLEVEL=40``
+to keep the agent's logs out of the report. For example::
+
+    python -m tests.benchmarks.bench_agent -n 20000 --pipeline-depth 2
+    python -m tests.benchmarks.bench_agent -n 5000 --rate 500
+    python -m tests.benchmarks.bench_agent -n 20000 --backfill .9
+"""
+
+import copy
+import json
+import random
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import click
+from werkzeug.serving import make_server, BaseWSGIServer
+
+from search.agent import MetadataRecordProcessor
+from search.agent.batch import RecordBatch
+from search.agent.lanes import LANES, NEW
+from search.agent.stream import FileStream
+from search.factory import create_ui_web_app
+
+from ..stubs import docmeta, index as index_stub
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+
+
+class _Consumer(MetadataRecordProcessor):
+    """Keeps track of the latency of each record, by lane."""
+
+    def __init__(self, *args, **kwargs) -> None:    # type: ignore
+        super(_Consumer, self).__init__(*args, **kwargs)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    def _finish_batch(self, batch: RecordBatch) -> None:
+        super(_Consumer, self)._finish_batch(batch)
+        now = time.time()
+        self.latencies[batch.lane or NEW] += [
+            now - record['ApproximateArrivalTimestamp']
+            for record in batch.records
+        ]
+
+
+def _paper_id(i: int) -> str:
+    return f'{1801 + (i // 99999) % 12:04d}.{i % 99999 + 1:05d}'
+
+
+def _write_stream(path: str, records: int, papers: int,
+                  backfill: float = 0.) -> None:
+    """
+    Write records for ``papers`` papers, cycling through them.
+
+    A random ``backfill`` fraction of the records are marked as backfill.
+    """
+    with open(path, 'w') as f:
+        for i in range(records):
+            payload = {'document_id': _paper_id(i % papers)}
+            if random.random() < backfill:
+                payload['lane'] = 'backfill'
+            f.write(json.dumps(payload) + '\n')
+
+
+def _write_metadata(directory: str, stream_path: str) -> int:
+    """Generate metadata for each of the papers in the stream file."""
+    with open(os.path.join(DATA, 'docmeta_bulk.json')) as f:
+        templates = json.load(f)
+    with open(stream_path) as f:
+        paper_ids = {json.loads(line)['document_id'] for line in f
+                     if line.strip()}
+    for i, paper_id in enumerate(sorted(paper_ids)):
+        data: Dict = copy.deepcopy(templates[i % len(templates)])
+        data.update(paper_id=paper_id, version=1, latest=f'{paper_id}v1',
+                    latest_version=1, is_current=True,
+                    title=f"{data['title']} ({i})")
+        with open(os.path.join(directory, f'{paper_id}.json'), 'w') as f:
+            json.dump(data, f)
+    return len(paper_ids)
+
+
+def _serve(app: object) -> BaseWSGIServer:
+    """Serve a WSGI application on a free local port, in the background."""
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Get the ``q`` percentile (nearest rank) of sorted ``values``."""
+    if not values:
+        return 0.
+    return values[min(len(values) - 1, max(0, int(q * len(values)) - 1))]
+
+
+@click.command()
+@click.option('--records', '-n', default=10_000,
+              help='Number of records to replay.')
+@click.option('--papers', '-p', type=int,
+              help='Number of distinct papers. Defaults to one per record.')
+@click.option('--stream', '-s', 'stream_path',
+              help='NDJSON file of records to replay, instead of generating'
+                   ' them.')
+@click.option('--rate', '-r', type=float,
+              help='Records arriving per second. By default, all of the'
+                   ' records are waiting when the agent starts.')
+@click.option('--backfill', default=0.,
+              help='Fraction of the generated records that are backfill.')
+@click.option('--batch-size', '-b', default=100,
+              help='Max number of records in each batch.')
+@click.option('--batch-latency', default=1.,
+              help='Max time (seconds) a record waits for its batch.')
+@click.option('--pipeline-depth', '-d', default=2,
+              help='Depth of the agent pipeline; 0 to process batches'
+                   ' synchronously.')
+@click.option('--metadata-latency', default=0.,
+              help='Time (seconds) the docmeta stub takes per request.')
+@click.option('--index-latency', default=0.,
+              help='Time (seconds) the index stub takes per bulk request.')
+def main(records: int, papers: Optional[int], stream_path: Optional[str],
+         rate: Optional[float], backfill: float, batch_size: int,
+         batch_latency: float,
+         pipeline_depth: int, metadata_latency: float,
+         index_latency: float) -> None:
+    """Run the benchmark and print a report."""
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    workdir = tempfile.mkdtemp()
+    try:
+        if not stream_path:
+            stream_path = os.path.join(workdir, 'stream.ndjson')
+            _write_stream(stream_path, records, papers or records, backfill)
+        metadata_dir = os.path.join(workdir, 'metadata')
+        os.makedirs(metadata_dir)
+        n_papers = _write_metadata(metadata_dir, stream_path)
+
+        docmeta.app.config.update(METADATA_DIR=metadata_dir,
+                                  METADATA_LATENCY=metadata_latency)
+        index_stub.app.config['INDEX_LATENCY'] = index_latency
+        metadata_server = _serve(docmeta.app)
+        index_server = _serve(index_stub.app)
+
+        app = create_ui_web_app()
+        app.config.update(
+            METADATA_ENDPOINT=f'http://127.0.0.1:{metadata_server.port}/',
+            ELASTICSEARCH_HOST='127.0.0.1',
+            ELASTICSEARCH_PORT=str(index_server.port),
+            ELASTICSEARCH_SCHEME='http'
+        )
+        stream = FileStream(stream_path, rate=rate)
+        print(f'Replaying {len(stream)} records for {n_papers} papers'
+              f' (batches of {batch_size}, pipeline depth {pipeline_depth}'
+              f', {f"{rate:.0f} records/s" if rate else "all at once"})')
+
+        with app.app_context():
+            consumer = _Consumer(
+                client=stream, start_type='TRIM_HORIZON', batch_size=10_000,
+                sleep=0., max_batch_size=batch_size,
+                max_batch_latency=batch_latency,
+                pipeline_depth=pipeline_depth,
+                dead_letter_path=os.path.join(workdir, 'dead.ndjson')
+            )
+            consumer.sleep_time = 0.01
+            started = time.time()
+            start = consumer._get_iterator()
+            while not stream.exhausted:
+                start, _ = consumer.process_records(start)
+            consumer.drain()
+            elapsed = time.time() - started
+        metadata_server.shutdown()
+        index_server.shutdown()
+    finally:
+        shutil.rmtree(workdir)
+
+    latencies = sorted(latency for lane in consumer.latencies.values()
+                       for latency in lane)
+    documents = consumer.metrics.documents
+    indexed = documents.value(outcome='indexed')
+    print(f'  {len(latencies)} records in {elapsed:.2f}s:'
+          f' {len(latencies) / elapsed:10.0f} records/sec')
+    print(f'  {indexed:.0f} documents indexed'
+          f' ({documents.value(outcome="skipped"):.0f} skipped):'
+          f' {indexed / elapsed:10.0f} docs/sec')
+    print('  latency: ' + ', '.join(
+        f'p{q * 100:.0f} {_percentile(latencies, q) * 1000:.0f}ms'
+        for q in (.5, .9, .95, .99, 1.)
+    ))
+    if len(consumer.latencies) > 1:
+        for lane in LANES:
+            lane_latencies = sorted(consumer.latencies[lane])
+            print(f'  {lane} ({len(lane_latencies)} records): ' + ', '.join(
+                f'p{q * 100:.0f} {_percentile(lane_latencies, q) * 1000:.0f}ms'
+                for q in (.5, .95, 1.)
+            ))
+    print(f'  index stub: {index_stub.stats["requests"]} bulk requests,'
+          f' {index_stub.stats["bytes"] / 1e6:.1f} MB')
+    stages = consumer.metrics.stage_seconds
+    print('  mean time per batch: ' + ', '.join(
+        f'{stage} {stages.mean(stage=stage) * 1000:.0f}ms'
+        for stage in ('fetch', 'transform', 'index')
+    ))
+
+
+if __name__ == '__main__':
+    main()
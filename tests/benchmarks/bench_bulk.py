@@ -0,0 +1,51 @@
+"""
+Measure the throughput of bulk request encoding, in documents per second.
+
+Compares :class:`.BulkEncoder` with the previous approach of converting each
+:class:`.Document` to a dict and letting the Elasticsearch client serialize
+the action and source.
+"""
+
+import timeit
+from typing import Callable, List
+
+from elasticsearch.serializer import JSONSerializer
+
+from search.domain import Document, shallow_asdict
+from search.services.index.bulk import BulkEncoder
+
+from .bench_serialization import _load_documents
+
+DOCUMENTS = 10_000
+
+
+def _via_dicts(documents: List[Document]) -> List[str]:
+    serializer = JSONSerializer()
+    body = []
+    for document in documents:
+        body.append(serializer.dumps({'index': {'_index': 'arxiv',
+                                                '_type': 'document',
+                                                '_id': document.id}}))
+        body.append(serializer.dumps(shallow_asdict(document)))
+    return body
+
+
+def _rate(func: Callable[[], object], count: int) -> float:
+    """Get the best throughput, in documents per second."""
+    return count / min(timeit.repeat(func, number=1, repeat=3))
+
+
+def main() -> None:
+    """Run the benchmark and print a report."""
+    documents = _load_documents(DOCUMENTS)
+    encoder = BulkEncoder('arxiv', 'document')
+    print(f'Encoding {DOCUMENTS} documents for the bulk API')
+    print(f'  dicts + ES serializer: '
+          f'{_rate(lambda: _via_dicts(documents), DOCUMENTS):10.0f} docs/sec')
+    print(f'  BulkEncoder:           '
+          f'{_rate(lambda: list(encoder.chunks(documents)), DOCUMENTS):10.0f}'
+          ' docs/sec')
+
+
+if __name__ == '__main__':
+    main()
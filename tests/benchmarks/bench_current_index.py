@@ -0,0 +1,105 @@
+"""
+Compare searches on the index of current versions with the all-versions index.
+
+Unlike the other benchmarks, this needs a real Elasticsearch cluster (as
+configured by ``ELASTICSEARCH_*`` in the environment), with the all-versions
+index and the index of current versions both filled, e.g. with::
+
+    python reindex.py arxiv arxiv-current --current-only
+
+Runs the same simple and advanced searches (which are all for current
+versions) on each index in turn, and reports their latency, and the size of
+each index. For example::
+
+    python -m tests.benchmarks.bench_current_index -n 200
+    python -m tests.benchmarks.bench_current_index --current-index arxiv-cur
+"""
+
+import time
+from itertools import cycle
+from typing import List
+
+import click
+
+from search.domain import AdvancedQuery, FieldedSearchList, \
+    FieldedSearchTerm, Query, SimpleQuery
+from search.factory import create_ui_web_app
+from search.services import index
+
+from .bench_agent import _percentile
+
+TERMS = ['quantum', 'neural network', 'dark matter', 'graph', 'black hole',
+         'convex optimization', 'Higgs boson', 'galaxy cluster',
+         'reinforcement learning', 'topological insulator', 'entropy',
+         'gravitational waves', 'Riemann hypothesis', 'superconductivity']
+"""Search terms, used in turn."""
+
+
+def _queries(count: int) -> List[Query]:
+    """Get ``count`` queries, alternating simple and advanced searches."""
+    terms = cycle(TERMS)
+    queries: List[Query] = []
+    for i in range(count):
+        term = next(terms)
+        if i % 2:
+            queries.append(AdvancedQuery(terms=FieldedSearchList([
+                FieldedSearchTerm(operator='AND', field='title', term=term)
+            ]), size=50))
+        else:
+            queries.append(SimpleQuery(search_field='all', value=term,
+                                       size=50))
+    return queries
+
+
+def _run(session: index.SearchSession, queries: List[Query]) -> List[float]:
+    """Perform each query; get the sorted latencies."""
+    latencies = []
+    for query in queries:
+        started = time.monotonic()
+        session.search(query)
+        latencies.append(time.monotonic() - started)
+    return sorted(latencies)
+
+
+def _report_index(session: index.SearchSession, name: str) -> None:
+    stats = session.es.indices.stats(index=name, metric='docs,store')
+    total = stats['_all']['primaries']
+    print(f'  {name}: {total["docs"]["count"]} documents,'
+          f' {total["store"]["size_in_bytes"] / 2 ** 20:.1f} MB (primaries)')
+
+
+@click.command()
+@click.option('--queries', '-n', 'count', default=200,
+              help='Number of searches on each index.')
+@click.option('--current-index', default='arxiv-current',
+              help='Name of the index of current versions.')
+@click.option('--warmup', default=20,
+              help='Number of searches to run first, on each index.')
+def main(count: int, current_index: str, warmup: int) -> None:
+    """Run the benchmark and print a report."""
+    app = create_ui_web_app()
+    with app.app_context():
+        all_versions = index.get_session()
+        current = index.get_session()
+        current.current_index = current_index
+        all_versions.current_index = None
+        queries = _queries(count)
+
+        print('Index size')
+        _report_index(all_versions, all_versions.index)
+        _report_index(current, current_index)
+
+        print(f'Latency of {count} searches for current versions')
+        for label, session in (('all', all_versions),
+                               ('current', current)):
+            _run(session, _queries(warmup))
+            latencies = _run(session, queries)
+            print(f'  {label:>8}: mean'
+                  f' {sum(latencies) / len(latencies) * 1000:.1f}ms, '
+                  + ', '.join(f'p{q * 100:.0f}'
+                              f' {_percentile(latencies, q) * 1000:.1f}ms'
+                              for q in (.5, .95, .99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Measure the throughput and latency of the docmeta client, offline.
+
+Serves the docmeta stub (``tests/stubs/docmeta.py``) on two local ports, each
+from its own process so that the stub does not compete with the client for
+the interpreter, and retrieves metadata for single papers from several threads
+at once. Compares :class:`.DocMetaSession` with the previous approach of a new
+connection for each request (``requests.get``), with the endpoints taken in
+turn, and with :class:`.AsyncDocMetaSession`, which keeps many more requests
+in flight (``--in-flight``) from a single thread. One of the endpoints can be
+made slower than the other (``--slow``), or unavailable (``--down``), to see
+how requests are balanced. For example::
+
+    python -m tests.benchmarks.bench_metadata -n 2000 -c 8
+    python -m tests.benchmarks.bench_metadata -n 2000 -c 8 --slow .05
+    python -m tests.benchmarks.bench_metadata -n 2000 -c 8 --down
+    python -m tests.benchmarks.bench_metadata -n 2000 --in-flight 200
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from typing import Callable, Iterator, List, Tuple
+
+import click
+import requests
+from werkzeug.serving import make_server
+
+from search.services import aio
+from search.services.metadata import AsyncDocMetaSession, DocMetaSession
+
+from ..stubs import docmeta
+from .bench_agent import _paper_id, _percentile, _write_metadata
+
+
+def _delayed(app: Callable, delay: float) -> Callable:
+    """Wrap a WSGI application so that it takes ``delay`` seconds longer."""
+    def application(environ: dict, start_response: Callable) -> Iterator:
+        time.sleep(delay)
+        return app(environ, start_response)
+    return application
+
+
+def _serve_forever(app: Callable, port: int) -> None:
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def _serve(app: Callable, port: int) -> multiprocessing.Process:
+    """Serve a WSGI application on a local port, from another process."""
+    process = multiprocessing.Process(target=_serve_forever,
+                                      args=(app, port), daemon=True)
+    process.start()
+    for _ in range(100):    # Wait for it to start listening.
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            time.sleep(.05)
+    return process
+
+
+def _closed_port() -> int:
+    """Get a local port on which nothing is listening."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = int(sock.getsockname()[1])
+    sock.close()
+    return port
+
+
+def _run(get: Callable[[str], object], paper_ids: List[str],
+         concurrency: int) -> Tuple[float, List[float], int]:
+    """Retrieve each paper; get the elapsed time, latencies and failures."""
+    def timed(paper_id: str) -> Tuple[float, bool]:
+        started = time.monotonic()
+        try:
+            get(paper_id)
+            failed = False
+        except IOError:
+            failed = True
+        return time.monotonic() - started, failed
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed, paper_ids))
+    return (time.monotonic() - started,
+            sorted(latency for latency, _ in results),
+            sum(failed for _, failed in results))
+
+
+def _run_async(session: AsyncDocMetaSession,
+               paper_ids: List[str]) -> Tuple[float, List[float], int]:
+    """Like :func:`_run`, with every request in flight at once."""
+    async def timed(paper_id: str) -> Tuple[float, bool]:
+        started = time.monotonic()
+        try:
+            await session.retrieve(paper_id)
+            failed = False
+        except IOError:
+            failed = True
+        return time.monotonic() - started, failed
+
+    started = time.monotonic()
+    results = asyncio.get_event_loop().run_until_complete(
+        asyncio.gather(*[timed(paper_id) for paper_id in paper_ids])
+    )
+    return (time.monotonic() - started,
+            sorted(latency for latency, _ in results),
+            sum(failed for _, failed in results))
+
+
+def _report(label: str, elapsed: float, latencies: List[float],
+            failures: int) -> None:
+    print(f'  {label:>10}: {len(latencies) / elapsed:8.0f} requests/sec; '
+          + ', '.join(f'p{q * 100:.0f} {_percentile(latencies, q) * 1000:.1f}'
+                      f'ms' for q in (.5, .95, .99))
+          + f'; {failures} failed')
+
+
+def _report_endpoints(session: object) -> None:
+    for endpoint in session._pool.endpoints:     # type: ignore
+        print(f'    {endpoint.url}: mean latency'
+              f' {endpoint.latency * 1000:.1f}ms'
+              f'{"" if endpoint.healthy else ", ejected"}')
+
+
+@click.command()
+@click.option('--requests', '-n', 'count', default=2000,
+              help='Number of papers to retrieve.')
+@click.option('--concurrency', '-c', default=8,
+              help='Number of requests at a time.')
+@click.option('--slow', default=0.,
+              help='Extra time (seconds) that the second endpoint takes.')
+@click.option('--down', is_flag=True,
+              help='Make the second endpoint unavailable.')
+@click.option('--in-flight', default=200,
+              help='Number of requests at a time, with asyncio.')
+def main(count: int, concurrency: int, slow: float, down: bool,
+         in_flight: int) -> None:
+    """Run the benchmark and print a report."""
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    workdir = tempfile.mkdtemp()
+    try:
+        stream_path = os.path.join(workdir, 'stream.ndjson')
+        paper_ids = [_paper_id(i) for i in range(count)]
+        with open(stream_path, 'w') as f:
+            f.write(''.join(f'{{"document_id": "{paper_id}"}}\n'
+                            for paper_id in paper_ids))
+        metadata_dir = os.path.join(workdir, 'metadata')
+        os.makedirs(metadata_dir)
+        _write_metadata(metadata_dir, stream_path)
+        docmeta.app.config.update(METADATA_DIR=metadata_dir)
+
+        ports = [_closed_port(), _closed_port()]
+        servers = [_serve(docmeta.app, ports[0])]
+        if not down:
+            servers.append(_serve(_delayed(docmeta.app, slow), ports[1]))
+        endpoints = [f'http://127.0.0.1:{port}/' for port in ports]
+        print(f'Retrieving {count} papers, {concurrency} at a time, from'
+              f' {len(endpoints)} endpoints'
+              f'{" (one down)" if down else ""}'
+              f'{f" (one {slow * 1000:.0f}ms slower)" if slow else ""}')
+
+        turns = cycle(endpoints)
+        lock = threading.Lock()
+
+        def unpooled(paper_id: str) -> object:
+            with lock:
+                endpoint = next(turns)
+            response = requests.get(f'{endpoint}docmeta/{paper_id}',
+                                    headers={'User-Agent': 'arXiv/system'})
+            response.raise_for_status()
+            return response.json()
+
+        _report('unpooled', *_run(unpooled, paper_ids, concurrency))
+        session = DocMetaSession(*endpoints, pool_size=concurrency,
+                                 connect_timeout=1, read_timeout=5)
+        _report('pooled', *_run(session.retrieve, paper_ids, concurrency))
+        _report_endpoints(session)
+        loop = asyncio.get_event_loop()
+        client = loop.run_until_complete(aio.connect(limit=in_flight))
+        async_session = AsyncDocMetaSession(
+            *endpoints, client=client, connect_timeout=1, read_timeout=5
+        )
+        _report('asyncio', *_run_async(async_session, paper_ids))
+        loop.run_until_complete(client.close())
+        _report_endpoints(async_session)
+        for server in servers:
+            server.terminate()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare deep and shallow serialization of domain objects.
+
+Measures the time to serialize a 500-result page of search results (as the
+UI controllers do) and a 10,000-document bulk indexing batch (as
+:meth:`.SearchSession.bulk_add_documents` does), and the memory used by
+slotted versus unslotted :class:`.Document` instances.
+"""
+
+import json
+import os
+import timeit
+import tracemalloc
+from dataclasses import fields, field, make_dataclass
+from typing import Any, Callable, List
+
+from search.domain import Document, DocumentSet, DocMeta, asdict, \
+    shallow_asdict
+from search.process import transform
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+
+
+def _load_documents(count: int) -> List[Document]:
+    with open(os.path.join(DATA, 'docmeta_bulk.json')) as f:
+        raw = json.load(f)
+    documents = [transform.to_search_document(DocMeta(**data))
+                 for data in raw]
+    return [documents[i % len(documents)] for i in range(count)]
+
+
+def _unslotted(cls: type) -> type:
+    """Build an equivalent dataclass that stores fields in ``__dict__``."""
+    return make_dataclass(f'Unslotted{cls.__name__}', [
+        (f.name, f.type, field(default=f.default,
+                               default_factory=f.default_factory))
+        for f in fields(cls)
+    ])
+
+
+def _measure(func: Callable[[], Any], number: int = 5) -> float:
+    """Get the best time per call, in milliseconds."""
+    return min(timeit.repeat(func, number=1, repeat=number)) * 1000.
+
+
+def _memory(func: Callable[[], Any]) -> int:
+    """Get the peak memory allocated by ``func``, in bytes."""
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def main() -> None:
+    """Run the benchmarks and print a report."""
+    page = DocumentSet(metadata={'total': 500}, results=_load_documents(500))
+    batch = _load_documents(10_000)
+
+    print('500-result page (controller)')
+    print(f'  asdict:          {_measure(lambda: asdict(page)):8.2f} ms')
+    print(f'  shallow_asdict:  '
+          f'{_measure(lambda: shallow_asdict(page)):8.2f} ms')
+
+    print('10,000-document batch (bulk indexer)')
+    print(f'  asdict:          '
+          f'{_measure(lambda: [asdict(d) for d in batch], 3):8.2f} ms')
+    print(f'  shallow_asdict:  '
+          f'{_measure(lambda: [shallow_asdict(d) for d in batch], 3):8.2f} ms')
+
+    data = [{f.name: getattr(d, f.name) for f in fields(Document)}
+            for d in batch]
+    Unslotted = _unslotted(Document)
+    slotted = _memory(lambda: [Document(**d) for d in data])
+    unslotted = _memory(lambda: [Unslotted(**d) for d in data])
+    print('10,000 documents (memory)')
+    print(f'  unslotted:       {unslotted / 1024:8.0f} KiB')
+    print(f'  slotted:         {slotted / 1024:8.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Measure the throughput of transforming :class:`.DocMeta` to :class:`.Document`.
+
+Uses ``tests/data/docmeta_bulk.json``, scaled up to :data:`RECORDS` records.
+"""
+
+import json
+import os
+import timeit
+from typing import Callable, List
+
+from search.domain import DocMeta, Document
+from search.process import transform
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+RECORDS = 20_000
+
+
+def _load_docmeta(count: int) -> List[DocMeta]:
+    with open(os.path.join(DATA, 'docmeta_bulk.json')) as f:
+        raw = json.load(f)
+    return [DocMeta(**raw[i % len(raw)]) for i in range(count)]
+
+
+def _interpreted(metadata: List[DocMeta]) -> List[Document]:
+    """Walk the transformation table for each record, as we used to."""
+    documents = []
+    for meta in metadata:
+        data = {}
+        for key, source, is_required in transform._transformations:
+            if isinstance(source, str):
+                value = getattr(meta, source, None)
+            elif hasattr(source, '__call__'):
+                value = source(meta)
+            if value is None and not is_required:
+                continue
+            data[key] = value
+        documents.append(Document(**data))  # type: ignore
+    return documents
+
+
+def _rate(func: Callable[[], object], count: int) -> float:
+    """Get the best throughput, in records per second."""
+    return count / min(timeit.repeat(func, number=1, repeat=3))
+
+
+def main() -> None:
+    """Run the benchmark and print a report."""
+    metadata = _load_docmeta(RECORDS)
+    print(f'Transforming {RECORDS} records')
+    rate = _rate(lambda: _interpreted(metadata), RECORDS)
+    print(f'  interpreted table:     {rate:10.0f} records/sec')
+    rate = _rate(lambda: transform.to_search_documents(metadata), RECORDS)
+    print(f'  to_search_documents:   {rate:10.0f} records/sec')
+    for processes in (2, 4):
+        rate = _rate(lambda: transform.to_search_documents(
+            metadata, processes=processes, chunksize=500
+        ), RECORDS)
+        print(f'  ... with {processes} processes:  {rate:10.0f} records/sec')
+
+
+if __name__ == '__main__':
+    main()
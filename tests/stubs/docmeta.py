@@ -1,7 +1,8 @@
 """Stub for the docmeta service."""
 import os
 import json
-from flask import Flask
+import time
+from flask import Flask, request
 from flask.json import jsonify
 from werkzeug.exceptions import NotFound, InternalServerError
 
@@ -20,19 +21,46 @@ Base(app)
 app.url_map.converters['arxiv'] = ArXivConverter
 
 
+def _load(document_id):
+    """Load metadata for a document from the metadata directory."""
+    metadata_dir = app.config.get('METADATA_DIR') or METADATA_DIR
+    logger.debug(f'Metadata base is {metadata_dir}')
+    if not metadata_dir:
+        raise InternalServerError('Metadata directory not set')
+    metadata_path = os.path.join(metadata_dir, f"{document_id}.json")
+    logger.debug(f'Metadata path is {metadata_path}')
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path) as f:
+        return json.load(f)
+
+
+def _wait():
+    """Simulate the time taken by the real service, if configured."""
+    latency = float(app.config.get('METADATA_LATENCY', 0))
+    if latency:
+        time.sleep(latency)
+
+
 @app.route('/docmeta/<arxiv:document_id>', methods=["GET"])
 def docmeta(document_id):
     """Retrieve document metadata."""
     logger.debug(f'Get metadata for {document_id}')
-    logger.debug(f'Metadata base is {METADATA_DIR}')
-    if not METADATA_DIR:
-        raise InternalServerError('Metadata directory not set')
-    metadata_path = os.path.join(METADATA_DIR, f"{document_id}.json")
-    logger.debug(f'Metadata path is {metadata_path}')
-    if not os.path.exists(metadata_path):
+    _wait()
+    data = _load(document_id)
+    if data is None:
         raise NotFound('No such document')
-    with open(metadata_path) as f:
-        return jsonify(json.load(f))
+    return jsonify(data)
+
+
+@app.route('/docmeta_bulk', methods=["GET"])
+def docmeta_bulk():
+    """Retrieve metadata for the documents in the ``id`` parameters."""
+    document_ids = request.args.getlist('id')
+    logger.debug(f'Get metadata for {len(document_ids)} documents')
+    _wait()
+    found = [_load(document_id) for document_id in document_ids]
+    return jsonify([data for data in found if data is not None])
 
 
 def application(environ, start_response):
@@ -0,0 +1,92 @@
+"""
+Stub for the parts of the Elasticsearch API that the indexing agent uses.
+
+Acts as a sink for bulk requests: documents are kept in memory (so that
+unchanged documents are skipped on the next request, as they would be by a
+real index), and every action succeeds.
+"""
+import json
+import threading
+import time
+
+from flask import Flask, Response, request
+from flask.json import jsonify
+
+from arxiv.base import logging
+
+logger = logging.getLogger(__name__)
+
+app = Flask('index')
+app.config['INDEX_LATENCY'] = 0.
+"""Time (seconds) to wait before responding to each bulk request."""
+
+documents = {}
+"""Indexed documents, by index and ID."""
+
+_lock = threading.Lock()
+stats = {'requests': 0, 'indexed': 0, 'updated': 0, 'deleted': 0, 'bytes': 0}
+"""Totals for the bulk requests that have been received."""
+
+
+@app.route('/<index>', methods=['HEAD'])
+def exists(index):
+    """Every index exists."""
+    return Response(status=200)
+
+
+@app.route('/<index>/<doc_type>/_mget', methods=['GET', 'POST'])
+def mget(index, doc_type):
+    """Get indexed documents, with only the requested fields."""
+    fields = [field for field in request.args.get('_source', '').split(',')
+              if field]
+    docs = []
+    for document_id in request.get_json(force=True)['ids']:
+        source = documents.get((index, document_id))
+        if source is None:
+            docs.append({'_index': index, '_type': doc_type,
+                         '_id': document_id, 'found': False})
+            continue
+        if fields:
+            source = {key: value for key, value in source.items()
+                      if key in fields}
+        docs.append({'_index': index, '_type': doc_type, '_id': document_id,
+                     'found': True, '_source': source})
+    return jsonify({'docs': docs})
+
+
+@app.route('/_bulk', methods=['POST'])
+def bulk():
+    """Index documents, update them in place, or delete them."""
+    latency = float(app.config.get('INDEX_LATENCY', 0))
+    if latency:
+        time.sleep(latency)
+    body = request.get_data()
+    lines = iter([json.loads(line) for line in body.split(b'\n') if line])
+    items = []
+    with _lock:
+        for action in lines:
+            (kind, target), = action.items()
+            key = (target['_index'], target['_id'])
+            if kind == 'delete':    # The only action without a source.
+                documents.pop(key, None)
+                stats['deleted'] += 1
+            elif kind == 'update':
+                source = next(lines)
+                documents.setdefault(key, {}).update(source['doc'])
+                stats['updated'] += 1
+            else:
+                source = next(lines)
+                documents[key] = source
+                stats['indexed'] += 1
+            items.append({kind: {'_index': target['_index'],
+                                 '_type': target.get('_type'),
+                                 '_id': target['_id'], 'status': 200}})
+        stats['requests'] += 1
+        stats['bytes'] += len(body)
+    return jsonify({'took': int(latency * 1000), 'errors': False,
+                    'items': items})
+
+
+def application(environ, start_response):
+    """WSGI application factory."""
+    return app(environ, start_response)